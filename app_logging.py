@@ -0,0 +1,165 @@
+"""
+結構化、非阻塞的 log。
+
+原本 callback 印出整個 webhook body、google_search 印出整份回應、天氣預報印出完整 JSON、
+ask_groq 印出整個 OpenAI 回應物件，全部同步寫到 stdout：每個 request 都在等 log I/O，
+也把使用者的訊息內容整份留在 log 裡。改為：
+
+  - 有等級（LOG_LEVEL），DEBUG 依 LOG_DEBUG_SAMPLE 抽樣
+  - 每筆 log 一行 JSON（LOG_FORMAT=text 時為單行文字），帶結構化欄位；
+    log_context() 綁定的 event_id / chat_id / command 會自動附上
+  - 欄位值超過 LOG_MAX_FIELD_CHARS 字就截斷
+  - request thread 只把紀錄放進有界佇列（QueueHandler），由背景執行緒寫出；
+    佇列滿時直接丟棄並計數，不會阻塞
+
+    logger = get_logger(__name__)
+    with log_context(event_id=event.webhook_event_id, chat_id=chat_key):
+        logger.info("指令完成", command="search", latency_ms=1234)
+"""
+import os, sys, json, time, queue, random, atexit, logging, threading, contextvars
+from contextlib import contextmanager
+from logging.handlers import QueueHandler, QueueListener
+
+LOG_LEVEL = os.getenv("LOG_LEVEL", "INFO").upper()
+LOG_FORMAT = os.getenv("LOG_FORMAT", "json").lower()
+LOG_DEBUG_SAMPLE = float(os.getenv("LOG_DEBUG_SAMPLE", "0.1"))
+LOG_MAX_FIELD_CHARS = int(os.getenv("LOG_MAX_FIELD_CHARS", "200"))
+LOG_QUEUE_SIZE = int(os.getenv("LOG_QUEUE_SIZE", "10000"))
+
+_context = contextvars.ContextVar("log_context", default={})
+
+
+def truncate(value, max_chars=None):
+    """把欄位值轉成可 JSON 化的短值；字串超過 max_chars 時截斷並註明原長度"""
+    max_chars = LOG_MAX_FIELD_CHARS if max_chars is None else max_chars
+    if value is None or isinstance(value, (bool, int, float)):
+        return value
+    text = value if isinstance(value, str) else str(value)
+    if len(text) <= max_chars:
+        return text
+    return f"{text[:max_chars]}…(+{len(text) - max_chars})"
+
+
+@contextmanager
+def log_context(**fields):
+    """在 with 區塊內的 log 都附上 fields（執行緒 / asyncio task 各自獨立）"""
+    token = _context.set({**_context.get(), **{k: v for k, v in fields.items() if v is not None}})
+    try:
+        yield
+    finally:
+        _context.reset(token)
+
+
+def bind(**fields):
+    """在目前的 context 追加欄位（例如 handle_message 判斷出指令後補上 command）"""
+    _context.set({**_context.get(), **{k: v for k, v in fields.items() if v is not None}})
+
+
+class StructuredFormatter(logging.Formatter):
+    def __init__(self, fmt="json"):
+        super().__init__()
+        self.fmt = fmt
+
+    def format(self, record):
+        fields = getattr(record, "fields", {})
+        if self.fmt == "json":
+            entry = {
+                "ts": round(record.created, 3),
+                "level": record.levelname,
+                "logger": record.name,
+                "msg": record.getMessage(),
+                **fields,
+            }
+            if record.exc_info:
+                entry["exc"] = truncate(self.formatException(record.exc_info), 2000)
+            return json.dumps(entry, ensure_ascii=False, default=str)
+        parts = " ".join(f"{k}={v}" for k, v in fields.items())
+        line = f"{time.strftime('%H:%M:%S', time.localtime(record.created))} {record.levelname:<7} {record.getMessage()}"
+        return f"{line} {parts}" if parts else line
+
+
+class DroppingQueueHandler(QueueHandler):
+    """佇列滿時丟棄紀錄並計數，request thread 永遠不等待"""
+
+    def __init__(self, log_queue):
+        super().__init__(log_queue)
+        self.dropped = 0
+
+    def enqueue(self, record):
+        try:
+            self.queue.put_nowait(record)
+        except queue.Full:
+            self.dropped += 1
+
+    def prepare(self, record):
+        # 格式化留給背景執行緒；這裡只把訊息參數先合併，避免跨執行緒引用可變物件
+        record.msg = record.getMessage()
+        record.args = None
+        return record
+
+
+class StructuredLogger:
+    """logging.Logger 的薄包裝：關鍵字參數即結構化欄位，DEBUG 依比例抽樣"""
+
+    def __init__(self, logger, debug_sample):
+        self._logger = logger
+        self.debug_sample = debug_sample
+
+    def debug(self, msg, **fields):
+        if not self._logger.isEnabledFor(logging.DEBUG):
+            return
+        if self.debug_sample < 1.0 and random.random() >= self.debug_sample:
+            return
+        self._log(logging.DEBUG, msg, fields)
+
+    def info(self, msg, **fields):
+        self._log(logging.INFO, msg, fields)
+
+    def warning(self, msg, **fields):
+        self._log(logging.WARNING, msg, fields)
+
+    def error(self, msg, exc_info=False, **fields):
+        self._log(logging.ERROR, msg, fields, exc_info)
+
+    def _log(self, level, msg, fields, exc_info=False):
+        if not self._logger.isEnabledFor(level):
+            return
+        merged = {k: truncate(v) for k, v in {**_context.get(), **fields}.items()}
+        self._logger.log(level, msg, extra={"fields": merged}, exc_info=exc_info)
+
+
+_setup_lock = threading.Lock()
+_handler = None
+_listener = None
+
+
+def setup_logging(level=LOG_LEVEL, fmt=LOG_FORMAT, queue_size=LOG_QUEUE_SIZE, stream=None):
+    """建立 root logger 的佇列 handler 與背景寫出執行緒（可重複呼叫）"""
+    global _handler, _listener
+    with _setup_lock:
+        if _handler is not None:
+            return
+        output = logging.StreamHandler(stream or sys.stdout)
+        output.setFormatter(StructuredFormatter(fmt))
+        _handler = DroppingQueueHandler(queue.Queue(maxsize=queue_size))
+        _listener = QueueListener(_handler.queue, output, respect_handler_level=False)
+        _listener.start()
+        atexit.register(_listener.stop)
+
+        root = logging.getLogger("app")
+        root.setLevel(level)
+        root.addHandler(_handler)
+        root.propagate = False
+
+
+def get_logger(name="app", debug_sample=None):
+    setup_logging()
+    if name != "app" and not name.startswith("app."):
+        name = f"app.{name}"
+    return StructuredLogger(logging.getLogger(name), LOG_DEBUG_SAMPLE if debug_sample is None else debug_sample)
+
+
+def log_stats():
+    return {"queued": _handler.queue.qsize() if _handler else 0,
+            "dropped": _handler.dropped if _handler else 0,
+            "level": logging.getLevelName(logging.getLogger("app").level), "debug_sample": LOG_DEBUG_SAMPLE}
@@ -0,0 +1,408 @@
+"""
+非同步 (ASGI) 入口：以 uvicorn 啟動，提供與 main.py 相同的 /、監控端點（main.MONITORING_ENDPOINTS）、/metrics、/static、/callback 路由。
+
+指令邏輯與 main.py 共用 commands.py，這裡只是非同步的 adapter：
+  - 回覆 / AI 對話使用 AsyncMessagingApi、AsyncGroq 與 OpenAI acreate，一個 process 即可同時處理大量等待中的對話
+  - 慢指令（搜尋、天氣、圖片、爬蟲、唱歌）排入 main.job_queue，與 Flask 入口共用同一個佇列、各 pool 的同時執行上限與重啟後恢復
+  - 語音（下載 + Whisper）直接在 thread pool 執行 main.handle_audio_message
+
+啟動方式：
+    uvicorn asgi:app --host 0.0.0.0 --port $PORT
+"""
+import os, json, time, uuid, asyncio, mimetypes
+from urllib.parse import parse_qs
+import openai
+import uvicorn
+from groq import AsyncGroq
+from linebot.v3.exceptions import InvalidSignatureError
+from linebot.v3.messaging import AsyncApiClient, AsyncMessagingApi
+from linebot.v3.messaging.models import ReplyMessageRequest, PushMessageRequest, TextMessage
+from linebot.v3.webhooks import MessageEvent, PostbackEvent, FollowEvent
+from linebot.v3.webhooks.models import AudioMessageContent
+
+import main
+import commands
+from commands import Reply, Job, Chat, SelectionMenu, LeaveGroup
+from streaming import astream_chat
+from resilience import resilience
+from line_delivery import QuotaExceededError, KIND_REPLY, KIND_PUSH
+from deadline import attach_deadline, mark_acked, command_latency
+from metrics import metrics, CONTENT_TYPE as METRICS_CONTENT_TYPE
+import tracing
+from tracing import tracer, attach_trace, trace_of
+from app_logging import get_logger, log_context
+from capture import traffic_capture
+
+STATIC_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "static")
+ASYNC_MAX_CONCURRENCY = int(os.getenv("ASYNC_MAX_CONCURRENCY", "200"))
+
+# 在 lifespan startup 時建立（需要在 event loop 內）
+line_api_client = None
+line_api = None
+groq_client = None
+event_runner = None
+
+logger = get_logger("asgi")
+
+
+class ChatOrderedRunner:
+    """同一聊天室的事件依序執行、不同聊天室平行執行，並限制同時執行的事件數"""
+
+    def __init__(self, limit):
+        self.limit = limit
+        self._tails = {}
+        self._semaphore = asyncio.Semaphore(limit)
+        self._waiting = 0
+        self._running = 0
+
+    def submit(self, chat_key, coro_func, *args):
+        previous = self._tails.get(chat_key)
+        task = asyncio.create_task(self._run(previous, chat_key, coro_func, args))
+        self._tails[chat_key] = task
+
+        def _cleanup(t):
+            if self._tails.get(chat_key) is t:
+                del self._tails[chat_key]
+        task.add_done_callback(_cleanup)
+
+    async def _run(self, previous, chat_key, coro_func, args):
+        self._waiting += 1
+        try:
+            if previous is not None:
+                await asyncio.wait([previous])
+            await self._semaphore.acquire()
+        finally:
+            self._waiting -= 1
+        self._running += 1
+        try:
+            await coro_func(*args)
+        except Exception as e:
+            logger.error("背景事件處理錯誤", exc_info=True, chat_id=chat_key, error=e)
+        finally:
+            self._running -= 1
+            self._semaphore.release()
+
+    def stats(self):
+        return {"limit": self.limit, "running": self._running, "waiting": self._waiting, "chats": len(self._tails)}
+
+    async def drain(self):
+        tasks = list(self._tails.values())
+        if tasks:
+            await asyncio.wait(tasks)
+
+
+# ----------------------------------
+# ASGI App
+# ----------------------------------
+async def app(scope, receive, send):
+    if scope["type"] == "lifespan":
+        await _lifespan(receive, send)
+        return
+    if scope["type"] != "http":
+        return
+
+    method = scope["method"]
+    path = scope["path"]
+
+    if path == "/" and method == "GET":
+        await _send_response(send, 200, "狗蛋 啟動！")
+    elif (path in MONITORING_ENDPOINTS or path == "/metrics") and method == "GET":
+        query = {k: v[0] for k, v in parse_qs(scope.get("query_string", b"").decode()).items()}
+        authorization = dict(scope["headers"]).get(b"authorization", b"").decode()
+        status = main.monitoring_status(authorization, query)
+        if status != 200:
+            await _send_response(send, status, "Not Found" if status == 404 else "Unauthorized")
+        elif path == "/metrics":
+            await _send_response(send, 200, metrics.render(), METRICS_CONTENT_TYPE)
+        else:
+            body = MONITORING_ENDPOINTS[path](query)
+            await _send_response(send, 200, json.dumps(body, ensure_ascii=False), "application/json")
+    elif path.startswith("/static/") and method == "GET":
+        await _serve_static(send, path[len("/static/"):])
+    elif path == "/callback" and method == "POST":
+        arrived = time.time()
+        body = await _read_body(receive)
+        headers = dict(scope["headers"])
+        signature = headers.get(b"x-line-signature", b"").decode()
+        status, text = await callback(body.decode("utf-8"), signature, arrived)
+        await _send_response(send, status, text)
+    else:
+        await _send_response(send, 404, "Not Found")
+
+# 事件由 event_runner 處理（取代 main.event_dispatcher），其餘與 main 相同
+MONITORING_ENDPOINTS = dict(main.MONITORING_ENDPOINTS, **{
+    "/workers": lambda query: {"dispatcher": event_runner.stats() if event_runner else None,
+                               "jobs": main.job_queue.stats()},
+})
+
+async def _lifespan(receive, send):
+    global line_api_client, line_api, groq_client, event_runner
+    while True:
+        message = await receive()
+        if message["type"] == "lifespan.startup":
+            line_api_client = AsyncApiClient(main.config)
+            line_api = AsyncMessagingApi(line_api_client)
+            groq_client = AsyncGroq(api_key=main.GROQ_API_KEY, base_url=main.GROQ_BASE_URL)
+            event_runner = ChatOrderedRunner(ASYNC_MAX_CONCURRENCY)
+            logger.info("狗蛋 (ASGI) 啟動", max_concurrency=ASYNC_MAX_CONCURRENCY)
+            await send({"type": "lifespan.startup.complete"})
+        elif message["type"] == "lifespan.shutdown":
+            # 等待處理中的事件完成再關閉連線
+            await event_runner.drain()
+            await line_api_client.close()
+            await groq_client.close()
+            await send({"type": "lifespan.shutdown.complete"})
+            return
+
+async def _read_body(receive):
+    chunks = []
+    while True:
+        message = await receive()
+        chunks.append(message.get("body", b""))
+        if not message.get("more_body", False):
+            return b"".join(chunks)
+
+async def _send_response(send, status, body, content_type="text/plain; charset=utf-8"):
+    if isinstance(body, str):
+        body = body.encode("utf-8")
+    await send({
+        "type": "http.response.start",
+        "status": status,
+        "headers": [(b"content-type", content_type.encode()), (b"content-length", str(len(body)).encode())],
+    })
+    await send({"type": "http.response.body", "body": body})
+
+async def _serve_static(send, filename):
+    path = os.path.realpath(os.path.join(STATIC_DIR, filename))
+    # 避免 ../ 跳出 static 目錄
+    if not path.startswith(STATIC_DIR + os.sep) or not os.path.isfile(path):
+        await _send_response(send, 404, "Not Found")
+        return
+    with open(path, "rb") as f:
+        data = await asyncio.to_thread(f.read)
+    content_type = mimetypes.guess_type(path)[0] or "application/octet-stream"
+    await _send_response(send, 200, data, content_type)
+
+async def callback(body, signature, arrived=None):
+    """驗證簽名後把事件交給背景 task，立即回 200 給 LINE"""
+    webhook_trace = tracer.begin("webhook", bytes=len(body))
+    try:
+        with tracing.scope(webhook_trace):
+            events = main.webhook_filter.parse(body, signature)
+    except InvalidSignatureError:
+        logger.warning("Webhook Signature 驗證失敗")
+        return 400, "Invalid signature"
+    except Exception as e:
+        logger.error("Webhook 處理錯誤", exc_info=True, error=e)
+        return 200, "OK"
+
+    traffic_capture.record(body, arrived)
+    logger.debug("Webhook Received", bytes=len(body), events=len(events))
+    # 去重會寫 SQLite（持有執行緒 lock），整個 webhook 的事件一起丟到 thread pool，不阻塞 event loop
+    duplicates = await asyncio.to_thread(lambda: [main.webhook_dedupe.is_duplicate(e) for e in events])
+    for event, duplicate in zip(events, duplicates):
+        if duplicate:
+            continue
+        attach_deadline(event)
+        if webhook_trace is not None:
+            attach_trace(event, webhook_trace.fork("event", event_id=getattr(event, "webhook_event_id", None),
+                                                   chat_id=main.get_chat_key(event), event_type=event.__class__.__name__))
+        event_runner.submit(main.get_chat_key(event), dispatch_event, event)
+    return 200, "OK"
+
+async def dispatch_event(event):
+    """與 main.dispatch_event 相同的對應規則，改呼叫 coroutine 版本的 handler"""
+    with log_context(event_id=getattr(event, "webhook_event_id", None), chat_id=main.get_chat_key(event)), \
+            tracing.activate(trace_of(event)) as trace:
+        if trace is not None:
+            tracing.record("queue_wait", trace.queued_at)
+        started = time.monotonic()
+        try:
+            await _dispatch(event)
+        except Exception:
+            await asyncio.to_thread(main.webhook_dedupe.release, event)
+            raise
+        await asyncio.to_thread(main.webhook_dedupe.done, event)
+        logger.info("事件處理完成", event_type=event.__class__.__name__,
+                    latency_ms=round((time.monotonic() - started) * 1000, 1))
+
+async def _dispatch(event):
+    if isinstance(event, MessageEvent):
+        if isinstance(event.message, AudioMessageContent):
+            # 下載與 Whisper 都是同步 I/O，直接沿用 main 的 handler（指標也由它記錄）
+            await asyncio.to_thread(main.handle_audio_message, event)
+        else:
+            await handle_message(event)
+    elif isinstance(event, PostbackEvent):
+        await handle_postback(event)
+    elif isinstance(event, FollowEvent):
+        await run_actions(event, commands.plan_follow())
+    else:
+        logger.debug("沒有對應的 handler", event_type=event.__class__.__name__)
+
+# ----------------------------------
+# Support Function
+# ----------------------------------
+def _target_id(event):
+    return event.source.group_id if event.source.type == "group" else event.source.user_id
+
+async def _paced(kind, upstream, api_func, request, **kwargs):
+    """
+    與 main.line_delivery 共用 token bucket、送出統計與 push 額度。
+    聊天室之間的公平性由 ChatOrderedRunner 保證（每個聊天室同時只處理一個事件），這裡只負責限速與記帳。
+    """
+    if kind == KIND_PUSH and not main.push_quota.allow():
+        raise QuotaExceededError("push 額度不足，已降級為只用 reply")
+    wait = main.line_delivery.bucket(kind).reserve()
+    if wait > 0:
+        await asyncio.sleep(wait)
+    try:
+        result = await resilience.acall(upstream, api_func, request, **kwargs)
+    except Exception as e:
+        main.line_delivery.record_failure(kind, e)
+        raise
+    main.line_delivery.record_sent(kind)
+    return result
+
+async def line_reply(reply_request):
+    """reply token 只能用一次，失敗不重試"""
+    return await _paced(KIND_REPLY, "line_reply", line_api.reply_message, reply_request, retries=0)
+
+async def line_push(push_request):
+    """push 帶 X-Line-Retry-Key，重試時 LINE 不會重複送出"""
+    return await _paced(KIND_PUSH, "line_push", line_api.push_message, push_request,
+                        x_line_retry_key=str(uuid.uuid4()), retries=1)
+
+async def send_response(event, messages):
+    """非同步版 main.send_response：reply / push 的判斷與錯誤處理沿用 main 的規則"""
+    try:
+        with tracing.span("send_response") as s:
+            if main.use_push(event, s):
+                await line_push(PushMessageRequest(to=_target_id(event), messages=messages))
+            else:
+                try:
+                    await line_reply(ReplyMessageRequest(replyToken=event.reply_token, messages=messages))
+                except Exception as e:
+                    if not main.reply_token_rejected(e, s):
+                        raise
+                    await line_push(PushMessageRequest(to=_target_id(event), messages=messages))
+    except Exception as e:
+        if main.send_failed(e):
+            await send_limit_message(event)
+
+async def ack_if_slow(event, name):
+    """與 main.ack_if_slow 相同：預估來不及時先回「處理中」，之後改用 push"""
+    if not main.should_ack(event, name):
+        return
+    try:
+        await line_reply(ReplyMessageRequest(
+            replyToken=event.reply_token, messages=[TextMessage(text=main.WORKING_ACK_MESSAGE)]))
+        logger.info("預估耗時超過 reply token 期限，先回覆處理中", command=name, estimate_s=round(command_latency.estimate(name), 1))
+    except Exception as e:
+        logger.warning("處理中訊息發送失敗", error=e)
+    mark_acked(event)
+
+async def send_limit_message(event):
+    """月額度用完或 LINE 熔斷中時直接放棄，不再阻塞重試"""
+    push_req = PushMessageRequest(to=_target_id(event), messages=[TextMessage(text="很抱歉，使用已達上限")])
+    try:
+        await line_push(push_req)
+        logger.info("成功發送使用已達上限訊息給使用者")
+    except Exception as err:
+        logger.warning("最終無法發送使用已達上限訊息給使用者", error=err)
+
+# ----------------------------------
+# Event Handler（指令邏輯見 commands.py）
+# ----------------------------------
+async def handle_postback(event):
+    group_id = event.source.group_id if event.source.type == "group" else None
+    await run_actions(event, commands.plan_postback(event.postback.data, event.source.user_id, group_id,
+                                                    main.user_ai_choice))
+
+async def handle_message(event):
+    """非同步版 main.handle_message"""
+    command, ctx = commands.route_message(event)
+    if command is None:
+        return
+
+    await ack_if_slow(event, command)
+    actions = commands.plan(command, ctx, main.user_ai_choice)
+    if commands.queued(actions):
+        # 只負責排入背景工作，耗時由 job_queue 執行時統計
+        with tracing.span("command", command=command, queued=True):
+            await run_actions(event, actions)
+        return
+    with command_latency.measure(command), metrics.time_command(command), tracing.span("command", command=command):
+        await run_actions(event, actions)
+
+async def run_actions(event, actions):
+    """非同步版 main.run_actions"""
+    for action in actions:
+        if isinstance(action, Reply):
+            await send_response(event, action.messages)
+        elif isinstance(action, Job):
+            # 寫入 SQLite 的 job 表是同步 I/O；結果由 job worker 以 main.send_response 送出
+            await asyncio.to_thread(main.submit_job, event, action.name, action.payload, action.priority)
+        elif isinstance(action, Chat):
+            logger.debug("AI 對話", model=action.model)
+            await send_response(event, [TextMessage(text=await ask_groq(action.prompt, action.model))])
+        elif isinstance(action, SelectionMenu):
+            try:
+                await send_response(event, main.build_ai_selection_messages())
+            except Exception as e:
+                logger.error("FlexMessage Error", error=e)
+        elif isinstance(action, LeaveGroup):
+            try:
+                await line_api.leave_group(action.group_id)
+                logger.info("狗蛋已離開群組")
+            except Exception as e:
+                logger.error("無法離開群組", error=e)
+
+# ----------------------------------
+# Upstream (async)
+# ----------------------------------
+async def ask_groq(user_message, model, retries=1):
+    """非同步版 ask_groq，與 main.ask_groq 共用回應快取（含上游失敗時的過期快取）"""
+    cache_key, cached = main.ask_cache_lookup(user_message, model)
+    if cached is not None:
+        return cached
+
+    with tracing.span("ask_groq", model=model):
+        reply = await ask_groq_upstream(user_message, model, retries)
+    return main.ask_cache_store(cache_key, model, reply)
+
+async def ask_groq_upstream(user_message, model, retries=1):
+    """非同步版 ask_groq_upstream，模型分流（main.chat_route）與錯誤訊息與同步版相同"""
+    logger.debug("ask_groq", model=model)
+    try:
+        backend, backup, messages, op = main.chat_route(user_message, model)
+        if backend.startswith("openai:"):
+            return await call_chat_backend(backend, messages, retries=retries, op=op)
+        max_chars = main.chat_reply_limit(user_message)
+        reply = await main.provider_router.acomplete(
+            backend, backup, lambda b: call_chat_backend(b, messages, max_chars))
+        return reply or main.NO_REPLY_MESSAGE
+    except Exception as e:
+        return main.chat_error_reply(e)
+
+async def call_chat_backend(backend, messages, max_chars=None, retries=0, op="chat"):
+    """main.call_chat_backend 的非同步版本；hedge 輸掉時整個 task 會被 cancel"""
+    provider, model = backend.split(":", 1)
+    if provider == "openai":
+        response = await resilience.acall("openai", openai.ChatCompletion.acreate,
+                                          model=model, messages=messages, retries=retries, op=op)
+        return response.choices[0].message.content.strip()
+
+    if main.STREAM_COMPLETIONS:
+        return await resilience.acall("groq", astream_chat, groq_client, messages, model,
+                                      max_chars=max_chars, retries=retries, op=model)
+    chat_completion = await resilience.acall("groq", groq_client.chat.completions.create,
+                                             messages=messages, model=model, retries=retries, op=model)
+    if not chat_completion.choices:
+        return ""
+    return main.strip_think(chat_completion.choices[0].message.content)
+
+
+if __name__ == "__main__":
+    PORT = int(os.environ.get("PORT", 5000))
+    uvicorn.run("asgi:app", host="0.0.0.0", port=PORT)
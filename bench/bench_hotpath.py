@@ -0,0 +1,257 @@
+"""
+回覆路徑上純 CPU 函式的 microbenchmark：以固定的 fixture 量測每個函式的 ops/sec 與每次呼叫的記憶體配置，
+並與存下的 baseline 比較；變慢或配置變多超過門檻時 exit code 為 1，可放進 CI 擋下退步。
+
+  route                      handle_message 的判斷：strip().lower() + router.route（語料同 bench_router.py，每則訊息算一次）
+  create_flex_message        狗蛋搜圖的 Flex bubble（dict → json.dumps → FlexContainer.from_json）
+  create_flex_jable_message  狗蛋開車的 3 部影片 carousel（影片取自 fixtures/jable_listing.html）
+  ai_selection_menu          「換模型」選單送出前的部分：選單 carousel 的 JSON 往返 + ReplyMessageRequest
+  strip_think_deepseek       移除 fixtures/deepseek_reply.txt 的 <think> 區塊
+  strip_think_plain          沒有 <think> 的一般回答（gpt / llama 走的路徑）
+  format_forecast            get_weather_forecast 的每日彙整（fixtures/openweather_forecast.json，40 筆 3 小時預報）
+
+ops/sec 取 --repeat 次量測中最快的一次，每次至少跑 --min-time 秒，量測期間與 timeit 一樣暫停 GC。
+配置以 tracemalloc 量測：peak 是單次呼叫期間記憶體最高點比呼叫前多出的位元組
+（CPython 沒有逐次呼叫的配置計數，以此代表），retained 是每次呼叫後沒有釋放的位元組（應為 0，否則是快取或洩漏）。
+
+baseline 與機器、Python 版本有關：請在要比較的機器上先以 --save 產生，之後的執行預設與它比較。
+
+執行方式（在專案根目錄）：
+    python bench/bench_hotpath.py                     # 量測並與 bench/baselines/hotpath.json 比較
+    python bench/bench_hotpath.py --save              # 更新 baseline
+    python bench/bench_hotpath.py --case flex --case route --threshold 0.15
+"""
+import os, sys, gc, json, time, random, argparse, platform, tempfile, tracemalloc
+
+BENCH_DIR = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.dirname(BENCH_DIR))
+
+import load_test
+from bench_router import build_corpus
+
+FIXTURE_DIR = os.path.join(BENCH_DIR, "fixtures")
+DEFAULT_BASELINE = os.path.join(BENCH_DIR, "baselines", "hotpath.json")
+
+# 以壓測用的環境載入 main：假的 API key、獨立的 SQLite；這裡的函式都不會連線
+os.environ.update(load_test.bot_env("http://127.0.0.1:9", tempfile.mkdtemp(prefix="linebot-hotpath-"),
+                                    {"LOG_LEVEL": os.getenv("LOG_LEVEL", "WARNING")}))
+
+import main as bot
+from linebot.v3.messaging import FlexMessage, ReplyMessageRequest
+from command_router import router
+from scraper import parse_listing_html, JABLE_HOT
+
+REPLY_TOKEN = "0" * 32
+IMAGE_URL = "https://images.example.com/shiba/1200x1200.jpg"
+
+
+def load_fixture(name):
+    with open(os.path.join(FIXTURE_DIR, name), encoding="utf-8") as f:
+        return f.read()
+
+
+def route_message(text, is_group):
+    """handle_message 判斷指令的部分（不含 SDK 事件的屬性存取）"""
+    return router.route(text.strip().lower(), is_group=is_group)
+
+
+def build_ai_selection_request():
+    return ReplyMessageRequest(replyToken=REPLY_TOKEN, messages=bot.build_ai_selection_messages())
+
+
+def build_cases():
+    """name → (func, 每次量測的參數列表, 檢查結果的函式)"""
+    # build_corpus 已經 strip().lower()；加回前後空白、部分轉大寫，讓 strip / lower 有事可做
+    rng = random.Random(25)
+    corpus = [(f" {text.upper() if rng.random() < 0.2 else text}\n", is_group)
+              for text, is_group in build_corpus(200, 0.1, seed=25)]
+    listing_html = load_fixture("jable_listing.html").replace("{{ASSET_HOST}}", "https://assets-cdn.jable.tv")
+    videos = parse_listing_html(JABLE_HOT, listing_html)
+    deepseek_reply = load_fixture("deepseek_reply.txt")
+    plain_reply = deepseek_reply.split("</think>")[1].strip()
+    forecast = json.loads(load_fixture("openweather_forecast.json"))
+
+    command_names = {command.name for command in router.commands} | {router.default}
+
+    def is_flex(result):
+        return isinstance(result, FlexMessage)
+
+    return {
+        "route": (route_message, corpus, lambda result: result is None or result in command_names),
+        "create_flex_message": (bot.create_flex_message, [("狗蛋搜圖 柴犬", IMAGE_URL)], is_flex),
+        "create_flex_jable_message": (bot.create_flex_jable_message, [(videos,)],
+                                      lambda result: is_flex(result) and len(result.contents.contents) == len(videos)),
+        "ai_selection_menu": (build_ai_selection_request, [()],
+                              lambda result: len(result.messages) == 2 and is_flex(result.messages[1])),
+        "strip_think_deepseek": (bot.strip_think, [(deepseek_reply,)], lambda result: result == plain_reply),
+        "strip_think_plain": (bot.strip_think, [(plain_reply,)], lambda result: result == plain_reply),
+        "format_forecast": (bot.format_forecast, [("Taipei", forecast)],
+                            lambda result: result[0].count("📅") == 3 and len(result[1]) == 4),
+    }
+
+
+# ------------------------------
+# 量測
+# ------------------------------
+def run_loops(func, items, loops):
+    start = time.perf_counter()
+    for _ in range(loops):
+        for args in items:
+            func(*args)
+    return time.perf_counter() - start
+
+
+def measure_speed(func, items, min_time, repeat):
+    """回傳每次呼叫的最短秒數"""
+    loops = 1
+    while run_loops(func, items, loops) < min_time:
+        loops *= 2
+    gc_was_enabled = gc.isenabled()
+    gc.disable()
+    try:
+        best = min(run_loops(func, items, loops) for _ in range(repeat))
+    finally:
+        if gc_was_enabled:
+            gc.enable()
+    return best / (loops * len(items))
+
+
+def measure_allocations(func, items, calls):
+    """回傳 (每次呼叫的平均 peak 位元組, 每次呼叫留下的位元組)"""
+    gc.collect()
+    tracemalloc.start()
+    try:
+        peak_total = 0
+        retained_before = tracemalloc.get_traced_memory()[0]
+        for _ in range(calls):
+            for args in items:
+                tracemalloc.reset_peak()
+                before = tracemalloc.get_traced_memory()[0]
+                func(*args)
+                peak_total += tracemalloc.get_traced_memory()[1] - before
+        gc.collect()
+        retained = tracemalloc.get_traced_memory()[0] - retained_before
+    finally:
+        tracemalloc.stop()
+    return peak_total / (calls * len(items)), max(retained, 0) / (calls * len(items))
+
+
+def run_case(name, func, items, check, args):
+    # 暖身兼檢查結果：fixture 或函式改壞時直接失敗，不要量到錯的東西
+    for call_args in items:
+        result = func(*call_args)
+        if not check(result):
+            raise SystemExit(f"❌ {name} 的結果不符預期: {result!r:.200}")
+    per_call = measure_speed(func, items, args.min_time, args.repeat)
+    peak, retained = measure_allocations(func, items, args.alloc_calls)
+    return {"ops_per_sec": round(1 / per_call, 1), "us_per_op": round(per_call * 1e6, 3),
+            "peak_bytes": round(peak), "retained_bytes": round(retained, 1)}
+
+
+# ------------------------------
+# baseline
+# ------------------------------
+def environment():
+    return {"python": platform.python_version(), "implementation": platform.python_implementation(),
+            "machine": platform.machine(), "system": platform.system()}
+
+
+def load_baseline(path):
+    if not os.path.exists(path):
+        return None
+    with open(path, encoding="utf-8") as f:
+        return json.load(f)
+
+
+def save_baseline(path, results, previous=None):
+    """只覆寫這次有量的 case，其他 case 保留原本的 baseline"""
+    cases = dict(previous["cases"]) if previous else {}
+    cases.update(results)
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    with open(path, "w", encoding="utf-8") as f:
+        json.dump({"environment": environment(), "saved_at": time.strftime("%Y-%m-%dT%H:%M:%S"),
+                   "cases": cases}, f, ensure_ascii=False, indent=2)
+        f.write("\n")
+
+
+def compare(results, baseline, threshold, alloc_threshold):
+    """回傳 {case: [退步說明, ...]}；baseline 沒有的 case 不比較"""
+    regressions = {}
+    for name, result in results.items():
+        base = baseline["cases"].get(name)
+        if not base:
+            continue
+        problems = []
+        if result["ops_per_sec"] < base["ops_per_sec"] * (1 - threshold):
+            problems.append(f"ops/sec {base['ops_per_sec']:,.0f} → {result['ops_per_sec']:,.0f}")
+        # 配置量是確定的，只留一點給直譯器內部的雜訊
+        if result["peak_bytes"] > base["peak_bytes"] * (1 + alloc_threshold) + 64:
+            problems.append(f"peak {base['peak_bytes']:,} B → {result['peak_bytes']:,} B")
+        if result["retained_bytes"] > base["retained_bytes"] + 64:
+            problems.append(f"retained {base['retained_bytes']:,} B → {result['retained_bytes']:,} B")
+        if problems:
+            regressions[name] = problems
+    return regressions
+
+
+def print_results(results, baseline):
+    print(f"{'case':<27}{'ops/sec':>13}{'µs/op':>11}{'peak B/op':>12}{'retained':>10}{'vs baseline':>14}")
+    for name, result in results.items():
+        base = baseline["cases"].get(name) if baseline else None
+        delta = f"{result['ops_per_sec'] / base['ops_per_sec'] - 1:+.1%}" if base else "-"
+        print(f"{name:<27}{result['ops_per_sec']:>13,.0f}{result['us_per_op']:>11.2f}"
+              f"{result['peak_bytes']:>12,}{result['retained_bytes']:>10,.0f}{delta:>14}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--case", action="append", default=[], help="只跑名稱包含此字串的 case，可重複指定")
+    parser.add_argument("--min-time", type=float, default=0.2, help="每次量測至少跑幾秒")
+    parser.add_argument("--repeat", type=int, default=5, help="量測次數（取最快的一次）")
+    parser.add_argument("--alloc-calls", type=int, default=50, help="量測配置時每個參數呼叫幾次")
+    parser.add_argument("--baseline", default=DEFAULT_BASELINE, help="baseline 檔案路徑")
+    parser.add_argument("--save", action="store_true", help="把這次的結果存成 baseline（不做比較）")
+    parser.add_argument("--threshold", type=float, default=0.25, help="ops/sec 比 baseline 低超過此比例視為退步")
+    parser.add_argument("--alloc-threshold", type=float, default=0.1, help="peak 比 baseline 多超過此比例視為退步")
+    parser.add_argument("--json", metavar="PATH", help="另外把結果寫成 JSON")
+    args = parser.parse_args()
+
+    cases = build_cases()
+    selected = [name for name in cases if not args.case or any(pattern in name for pattern in args.case)]
+    if not selected:
+        raise SystemExit(f"❌ 沒有符合的 case，可用的有: {', '.join(cases)}")
+
+    results = {}
+    for name in selected:
+        func, items, check = cases[name]
+        results[name] = run_case(name, func, items, check, args)
+
+    baseline = load_baseline(args.baseline)
+    if args.json:
+        with open(args.json, "w", encoding="utf-8") as f:
+            json.dump({"environment": environment(), "cases": results}, f, ensure_ascii=False, indent=2)
+
+    if args.save:
+        print_results(results, None)
+        save_baseline(args.baseline, results, baseline)
+        print(f"\n💾 已存成 baseline: {args.baseline}")
+        return
+
+    print_results(results, baseline)
+    if baseline is None:
+        print(f"\n（沒有 baseline，可用 --save 產生 {args.baseline}）")
+        return
+    if baseline.get("environment", {}).get("python") != platform.python_version():
+        print(f"\n⚠️ baseline 是在 Python {baseline.get('environment', {}).get('python')} 量的，"
+              f"目前為 {platform.python_version()}，比較結果僅供參考")
+    regressions = compare(results, baseline, args.threshold, args.alloc_threshold)
+    if regressions:
+        print("\n❌ 與 baseline 相比退步：")
+        for name, problems in regressions.items():
+            print(f"  {name}: {'; '.join(problems)}")
+        sys.exit(1)
+    print(f"\n✅ 沒有超過門檻的退步（ops/sec -{args.threshold:.0%}、peak +{args.alloc_threshold:.0%}）")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,118 @@
+"""
+指令路由 microbenchmark：比較原本 handle_message 的 if 判斷鏈與 CommandRouter 的單次掃描。
+
+執行方式（在專案根目錄）：
+    python bench/bench_router.py [--rounds 200]
+"""
+import os, sys, time, argparse, random
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from command_router import router
+
+# 模擬群組聊天：大多數是閒聊（不含「狗蛋」），少數是指令或呼喚狗蛋
+CHATTER = [
+    "今天晚餐吃什麼", "哈哈哈哈哈", "好喔", "有人要去看電影嗎", "我快到了等我一下",
+    "這週末要不要去爬山", "剛剛那個影片超好笑 https://youtu.be/dQw4w9WgXcQ", "明天幾點集合？",
+    "收到", "+1", "笑死", "老闆又在開會了...", "欸你們看新聞了嗎 股市又跌了",
+    "下雨了記得帶傘", "好累喔今天加班到十點", "晚安", "早安～", "生日快樂🎂🎉",
+    "我覺得這家店普普通通，下次換一家吧，聽說巷口那間拉麵很不錯而且不用排隊",
+    "ok", "誰有充電線", "我在捷運上", "這個 id 是什麼意思", "群組照片我晚點傳",
+]
+COMMAND_MESSAGES = [
+    "狗蛋 你覺得今天會下雨嗎", "狗蛋情勒", "狗蛋指令", "給我id", "群組id", "當前模型",
+    "換模型", "狗蛋生成 一隻在海邊的柴犬", "狗蛋搜尋 台積電 股價", "狗蛋介紹 川普",
+    "狗蛋搜圖 貓咪", "狗蛋唱歌 晴天", "狗蛋氣象 台北", "狗蛋預報 東京", "狗蛋開車 三上",
+    "狗蛋開車最熱", "狗蛋開車最新", "狗蛋出去",
+]
+
+
+def build_corpus(size, command_ratio, seed=42):
+    rng = random.Random(seed)
+    corpus = []
+    for _ in range(size):
+        pool = COMMAND_MESSAGES if rng.random() < command_ratio else CHATTER
+        corpus.append((rng.choice(pool).strip().lower(), rng.random() < 0.8))
+    return corpus
+
+
+def legacy_route(user_message, is_group):
+    """原本 handle_message 的判斷順序（只判斷，不執行）"""
+    if "給我" in user_message and "id" in user_message:
+        return "give_id"
+    if is_group and "群組" in user_message and "id" in user_message:
+        return "group_id"
+    if not is_group and "群組" in user_message and "id" in user_message:
+        return "group_id_private"
+    if "狗蛋" in user_message and "情勒" in user_message:
+        return "guilt_trip"
+    if "指令" in user_message and "狗蛋" in user_message:
+        return "help"
+    if is_group and "狗蛋" in user_message and "出去" in user_message:
+        return "leave_group"
+    if "狗蛋生成" in user_message:
+        return "generate_image"
+    if "模型" in user_message and "當前" in user_message:
+        return "current_model"
+    if "換" in user_message and "模型" in user_message:
+        return "switch_model"
+    if user_message.startswith("狗蛋搜尋"):
+        return "search"
+    if user_message.startswith("狗蛋介紹"):
+        return "person_intro"
+    if user_message.startswith("狗蛋搜圖"):
+        return "image_search"
+    if user_message.startswith("狗蛋唱歌"):
+        return "sing"
+    if "氣象" in user_message and "狗蛋" in user_message:
+        return "weather"
+    if "狗蛋" in user_message and "預報" in user_message:
+        return "forecast"
+    if "狗蛋開車" in user_message and "最熱" not in user_message and "最新" not in user_message:
+        return "video_search"
+    if "狗蛋開車" in user_message and "最熱" in user_message:
+        return "video_hot"
+    if "狗蛋開車" in user_message and "最新" in user_message:
+        return "video_new"
+    if is_group and "狗蛋" not in user_message:
+        return None
+    return "ai_chat"
+
+
+def run(func, corpus, rounds):
+    best = float("inf")
+    for _ in range(5):
+        start = time.perf_counter()
+        for _ in range(rounds):
+            for text, is_group in corpus:
+                func(text, is_group)
+        best = min(best, time.perf_counter() - start)
+    return best / (rounds * len(corpus))
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--size", type=int, default=1000, help="語料訊息數")
+    parser.add_argument("--rounds", type=int, default=50, help="每次量測重複次數")
+    parser.add_argument("--command-ratio", type=float, default=0.1, help="指令訊息佔比")
+    args = parser.parse_args()
+
+    corpus = build_corpus(args.size, args.command_ratio)
+
+    # 先確認兩者判斷結果一致
+    mismatches = [(t, g) for t, g in corpus if legacy_route(t, g) != router.route(t, g)]
+    if mismatches:
+        print(f"❌ 路由結果不一致: {mismatches[:5]}")
+        sys.exit(1)
+
+    legacy = run(legacy_route, corpus, args.rounds)
+    routed = run(router.route, corpus, args.rounds)
+    ignored = sum(1 for t, g in corpus if router.route(t, g) is None)
+
+    print(f"語料: {len(corpus)} 則訊息（指令佔比 {args.command_ratio:.0%}，群組略過 {ignored} 則）")
+    print(f"legacy if-chain : {legacy * 1e6:8.2f} µs/msg")
+    print(f"CommandRouter   : {routed * 1e6:8.2f} µs/msg")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,160 @@
+"""
+列表爬蟲 benchmark：以本機 HTTP server 提供存好的 HTML fixture，
+比較原本「每張卡片 query_selector / text_content / get_attribute」的寫法
+與 scraper.scrape_listing_page（一次 page.evaluate + 網路層擋資源）的 CDP 來回次數與耗時，
+以及不開瀏覽器的 HTTP 層（fetcher + parse_listing_html）。
+
+fixture 內的圖片、字型、影片與第三方 script 都由同一個 server 以 --asset-delay 延遲回應，
+模擬真實網站上這些資源的載入成本。
+
+執行方式（需安裝 Playwright Chromium）：
+    python bench/bench_scraper.py [--runs 10] [--limit 3] [--asset-delay 0.2]
+"""
+import os, sys, time, asyncio, argparse, threading, statistics
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from playwright.async_api import async_playwright
+from scraper import ListingSpec, JABLE_HOT, scrape_listing_page, parse_listing_html
+from fetcher import TieredFetcher
+
+FIXTURE_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "fixtures")
+
+
+def start_fixture_server(asset_delay):
+    """fixture server：/listing、/challenge 回傳 HTML，其他路徑一律延遲後回傳空內容"""
+    with open(os.path.join(FIXTURE_DIR, "jable_listing.html"), encoding="utf-8") as f:
+        listing_template = f.read()
+    with open(os.path.join(FIXTURE_DIR, "cloudflare_challenge.html"), encoding="utf-8") as f:
+        challenge_html = f.read()
+
+    class Handler(BaseHTTPRequestHandler):
+        def do_GET(self):
+            port = self.server.server_address[1]
+            if self.path.startswith("/listing"):
+                body = (listing_template
+                        .replace("{{ASSET_HOST}}", f"http://127.0.0.1:{port}")
+                        .replace("{{THIRD_PARTY_HOST}}", f"http://localhost:{port}"))
+                self._send(200, body.encode("utf-8"), "text/html; charset=utf-8")
+            elif self.path.startswith("/challenge"):
+                self._send(503, challenge_html.encode("utf-8"), "text/html; charset=utf-8")
+            else:
+                time.sleep(asset_delay)
+                self._send(200, b"", "application/octet-stream")
+
+        def _send(self, status, body, content_type):
+            self.send_response(status)
+            self.send_header("Content-Type", content_type)
+            self.send_header("Content-Length", str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def log_message(self, *args):
+            pass
+
+    server = ThreadingHTTPServer(("127.0.0.1", 0), Handler)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server
+
+
+async def legacy_scrape(page, url, limit, counter):
+    """原本 get_video_data_hotest 的寫法（每個動作都是一趟 CDP 來回）"""
+    await page.goto(url, timeout=20000); counter[0] += 1
+    await page.wait_for_selector(".video-img-box", timeout=5000); counter[0] += 1
+    videos = await page.query_selector_all('.video-img-box'); counter[0] += 1
+
+    video_list = []
+    for video in videos[:limit]:
+        title_elem = await video.query_selector('.title a'); counter[0] += 1
+        img_elem = await video.query_selector('.img-box img'); counter[0] += 1
+
+        title = (await title_elem.text_content()).strip() if title_elem else "N/A"; counter[0] += 1
+        link = await title_elem.get_attribute('href') if title_elem else "N/A"; counter[0] += 1
+        thumbnail = await img_elem.get_attribute('data-src'); counter[0] += 1
+        if not thumbnail:
+            thumbnail = await img_elem.get_attribute('src'); counter[0] += 1
+
+        video_list.append({"title": title, "link": link, "thumbnail": thumbnail})
+    return video_list
+
+
+async def measure(browser, runs, scrape):
+    timings = []
+    result = None
+    for _ in range(runs):
+        context = await browser.new_context()
+        page = await context.new_page()
+        start = time.perf_counter()
+        result = await scrape(page)
+        timings.append(time.perf_counter() - start)
+        await context.close()
+    return timings, result
+
+
+async def run_bench(args):
+    server = start_fixture_server(args.asset_delay)
+    base = f"http://127.0.0.1:{server.server_address[1]}"
+    spec = ListingSpec("bench", base + "/listing", JABLE_HOT.card_selector, JABLE_HOT.fields, limit=args.limit)
+
+    async with async_playwright() as p:
+        browser = await p.chromium.launch(headless=True, args=["--no-sandbox", "--disable-dev-shm-usage"])
+
+        legacy_counter = [0]
+        legacy_times, legacy_result = await measure(
+            browser, args.runs, lambda page: legacy_scrape(page, spec.url_template, args.limit, legacy_counter))
+
+        # 引擎固定為 route + goto + wait_for_selector + evaluate
+        engine_times, engine_result = await measure(
+            browser, args.runs, lambda page: scrape_listing_page(page, spec, spec.url_template))
+
+        challenge_spec = ListingSpec("bench_challenge", base + "/challenge", spec.card_selector, spec.fields,
+                                     limit=args.limit, selector_timeout=500)
+        _, challenge_result = await measure(
+            browser, 1, lambda page: scrape_listing_page(page, challenge_spec, challenge_spec.url_template))
+
+        await browser.close()
+
+    # HTTP 層：不開瀏覽器，直接抓 HTML 用 BeautifulSoup 解析
+    http_fetcher = TieredFetcher()
+    http_times = []
+    for _ in range(args.runs):
+        start = time.perf_counter()
+        fetched = http_fetcher.fetch(spec.url_template, browser=False)
+        http_result = parse_listing_html(spec, fetched.text)
+        http_times.append(time.perf_counter() - start)
+    server.shutdown()
+
+    if legacy_result != engine_result:
+        print("❌ 兩種寫法結果不一致")
+        print(legacy_result)
+        print(engine_result)
+        sys.exit(1)
+    if http_result != engine_result:
+        print("❌ HTTP 層解析結果與瀏覽器不一致")
+        print(http_result)
+        sys.exit(1)
+    if challenge_result != []:
+        print("❌ 防護頁未被辨識")
+        sys.exit(1)
+
+    def summary(name, timings, round_trips):
+        print(f"{name:<16} round-trips/run: {round_trips:>4}   "
+              f"median {statistics.median(timings) * 1000:8.1f} ms   min {min(timings) * 1000:8.1f} ms")
+
+    print(f"fixture: {args.limit} 張卡片 / 資源延遲 {args.asset_delay * 1000:.0f} ms / {args.runs} 次")
+    summary("legacy per-card", legacy_times, legacy_counter[0] // args.runs)
+    summary("scrape_listing", engine_times, 4)
+    summary("http tier", http_times, 0)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--runs", type=int, default=10)
+    parser.add_argument("--limit", type=int, default=3, help="擷取的卡片數")
+    parser.add_argument("--asset-delay", type=float, default=0.2, help="圖片 / 字型 / script 的回應延遲（秒）")
+    asyncio.run(run_bench(parser.parse_args()))
+
+
+if __name__ == "__main__":
+    main()
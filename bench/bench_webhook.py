@@ -0,0 +1,118 @@
+"""
+Webhook 解析 benchmark：比較原本「所有事件都建立 SDK model 再於 handle_message 判斷」
+與 webhook_filter（先看原始 JSON，只替會處理的事件建立 model）每個 webhook 花費的 CPU 時間。
+
+模擬忙碌群組：每個 webhook 帶多個事件，大多是不含「狗蛋」的閒聊，夾雜貼圖、圖片與少數指令。
+
+執行方式（在專案根目錄）：
+    python bench/bench_webhook.py [--webhooks 2000] [--events 5] [--command-ratio 0.05]
+"""
+import os, sys, time, json, hmac, base64, random, hashlib, argparse
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from linebot.v3.webhook import WebhookParser
+from linebot.v3.webhooks import MessageEvent, TextMessageContent
+from command_router import router
+from webhook_filter import WebhookFilter
+from bench_router import CHATTER, COMMAND_MESSAGES
+
+CHANNEL_SECRET = "bench-secret"
+
+
+def make_event(rng, command_ratio, group_id):
+    """產生一個 LINE webhook 事件（dict），格式與實際送達的相同"""
+    source = {"type": "group", "groupId": group_id, "userId": f"U{rng.randrange(16 ** 8):08x}"}
+    base = {
+        "mode": "active",
+        "timestamp": int(time.time() * 1000),
+        "source": source,
+        "webhookEventId": f"01H{rng.randrange(16 ** 20):020X}",
+        "deliveryContext": {"isRedelivery": False},
+        "replyToken": f"{rng.randrange(16 ** 32):032x}",
+    }
+    kind = rng.random()
+    if kind < 0.08:
+        base["type"] = "message"
+        base["message"] = {"type": "sticker", "id": str(rng.randrange(10 ** 12)), "quoteToken": "q",
+                           "stickerId": "52002734", "packageId": "11537", "stickerResourceType": "STATIC"}
+    elif kind < 0.12:
+        base["type"] = "message"
+        base["message"] = {"type": "image", "id": str(rng.randrange(10 ** 12)), "quoteToken": "q",
+                           "contentProvider": {"type": "line"}}
+    else:
+        pool = COMMAND_MESSAGES if rng.random() < command_ratio else CHATTER
+        base["type"] = "message"
+        base["message"] = {"type": "text", "id": str(rng.randrange(10 ** 12)), "quoteToken": "q",
+                           "text": rng.choice(pool)}
+    return base
+
+
+def build_webhooks(count, events_per_webhook, command_ratio, seed=42):
+    rng = random.Random(seed)
+    webhooks = []
+    for _ in range(count):
+        group_id = f"C{rng.randrange(16 ** 32):032x}"
+        body = json.dumps({"destination": "Ubench",
+                           "events": [make_event(rng, command_ratio, group_id) for _ in range(events_per_webhook)]},
+                          ensure_ascii=False)
+        signature = base64.b64encode(hmac.new(CHANNEL_SECRET.encode(), body.encode(), hashlib.sha256).digest()).decode()
+        webhooks.append((body, signature))
+    return webhooks
+
+
+def legacy_parse(parser, body, signature):
+    """原本的流程：全部建立 SDK model，再依 handle_message 的規則判斷要不要處理"""
+    kept = []
+    for event in parser.parse(body, signature, as_payload=True).events:
+        if isinstance(event, MessageEvent):
+            if not isinstance(event.message, TextMessageContent):
+                continue
+            is_group = event.source.type == "group"
+            if router.route(event.message.text.strip().lower(), is_group=is_group) is None:
+                continue
+        kept.append(event)
+    return kept
+
+
+def measure(func, webhooks, rounds):
+    best = float("inf")
+    for _ in range(rounds):
+        start = time.process_time()
+        for body, signature in webhooks:
+            func(body, signature)
+        best = min(best, time.process_time() - start)
+    return best / len(webhooks)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--webhooks", type=int, default=2000, help="webhook 數")
+    parser.add_argument("--events", type=int, default=5, help="每個 webhook 的事件數")
+    parser.add_argument("--command-ratio", type=float, default=0.05, help="文字訊息中指令的比例")
+    parser.add_argument("--rounds", type=int, default=5, help="量測次數（取最佳）")
+    args = parser.parse_args()
+
+    webhooks = build_webhooks(args.webhooks, args.events, args.command_ratio)
+    line_parser = WebhookParser(CHANNEL_SECRET)
+    webhook_filter = WebhookFilter(line_parser, router)
+
+    # 先確認兩者保留的事件一致
+    for body, signature in webhooks:
+        legacy_ids = [e.webhook_event_id for e in legacy_parse(line_parser, body, signature)]
+        filtered_ids = [e.webhook_event_id for e in webhook_filter.parse(body, signature)]
+        if legacy_ids != filtered_ids:
+            print(f"❌ 保留的事件不一致: {legacy_ids} != {filtered_ids}")
+            sys.exit(1)
+
+    legacy = measure(lambda b, s: legacy_parse(line_parser, b, s), webhooks, args.rounds)
+    filtered = measure(webhook_filter.parse, webhooks, args.rounds)
+    stats = webhook_filter.stats()
+
+    print(f"webhooks: {args.webhooks}（每個 {args.events} 個事件，丟棄率 {stats['drop_rate']:.0%}）")
+    print(f"全部建立 SDK model : {legacy * 1e6:9.1f} µs CPU / webhook")
+    print(f"webhook_filter     : {filtered * 1e6:9.1f} µs CPU / webhook  ({legacy / filtered:.1f}x)")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,404 @@
+"""
+壓測用的本機上游替身：一個 HTTP server 同時扮演 LINE Messaging API、Groq、OpenAI、OpenWeather、
+Google（Custom Search 與圖片搜尋頁）與 Spotify，回應格式與實際 API 相同（只含 bot 會讀的欄位）。
+
+  - 每個上游的延遲為對數常態分布（給定中位數與 p99），可另外設定錯誤率與錯誤狀態碼
+  - Groq 的 stream=true 以 SSE 逐段送出，第一段之前先等延遲的 30%
+  - LINE reply / push 都會被記錄（load_test.py 據此計算端到端延遲）；
+    load_test.py 產生的 reply token 前 13 碼是發出時間（毫秒，16 進位），
+    超過 --reply-token-ttl 的 reply 會收到與 LINE 相同的「Invalid reply token」
+
+bot 端以 env() 的環境變數把所有上游指到這裡（見 main.py 的 LINE_API_BASE 等設定）。
+
+單獨啟動（bot 另外以印出的環境變數啟動）：
+    python bench/fake_upstream.py --port 8090 --latency groq=0.8:4 --errors openai=0.05:503
+"""
+import sys, json, math, time, random, argparse, threading
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+from urllib.parse import urlsplit, parse_qs
+
+# 上游名稱 -> (中位數秒數, p99 秒數)
+DEFAULT_LATENCY = {
+    "line_reply": (0.08, 0.4),
+    "line_push": (0.1, 0.5),
+    "line_data": (0.1, 0.6),
+    "groq": (0.6, 3.0),
+    "openai": (1.0, 5.0),
+    "openai_image": (6.0, 15.0),
+    "whisper": (1.5, 6.0),
+    "openweather": (0.15, 0.8),
+    "google_cse": (0.3, 1.5),
+    "google_search": (0.4, 2.0),
+    "spotify": (0.15, 0.8),
+}
+Z_99 = 2.326
+
+REPLY_TEXTS = ["好啊，交給狗蛋！", "這個問題很有趣，狗蛋覺得應該不會下雨啦，出門還是帶把傘比較保險。",
+               "哈哈，你說得對！", "狗蛋查了一下，大概是這樣：先冷靜，再喝杯水，事情總會解決的。"]
+CITIES_WEATHER = ["晴", "多雲", "短暫陣雨", "陰"]
+
+
+def parse_spec(specs, defaults=None, value_type=float):
+    """把 ["groq=0.8:4", ...] 解析成 {"groq": (0.8, 4.0)}；省略冒號後的值時沿用預設值"""
+    result = dict(defaults or {})
+    for spec in specs or ():
+        name, _, value = spec.partition("=")
+        first, _, second = value.partition(":")
+        previous = result.get(name)
+        result[name] = (float(first), value_type(second) if second else (previous[1] if previous else None))
+    return result
+
+
+class Upstreams:
+    """
+    latency        : {上游: (中位數, p99)}
+    errors         : {上游: (錯誤率, 狀態碼)}
+    reply_token_ttl: reply token 有效秒數（None 代表不檢查）
+    """
+
+    def __init__(self, latency=None, errors=None, reply_token_ttl=None, seed=None):
+        self.latency = {**DEFAULT_LATENCY, **(latency or {})}
+        self.errors = errors or {}
+        self.reply_token_ttl = reply_token_ttl
+        self._rng = random.Random(seed)
+        self._rng_lock = threading.Lock()
+        self._lock = threading.Lock()
+        self.deliveries = []
+        self.requests = {}
+        self.injected_errors = {}
+
+    def delay(self, upstream):
+        median, p99 = self.latency.get(upstream, (0.0, None))
+        if median <= 0:
+            return 0.0
+        sigma = math.log(p99 / median) / Z_99 if p99 and p99 > median else 0.0
+        with self._rng_lock:
+            return median * math.exp(sigma * self._rng.gauss(0, 1))
+
+    def should_fail(self, upstream):
+        """依錯誤率決定這次是否回錯誤；回傳狀態碼或 None"""
+        rate, status = self.errors.get(upstream, (0.0, None))
+        with self._rng_lock:
+            failed = rate > 0 and self._rng.random() < rate
+        with self._lock:
+            self.requests[upstream] = self.requests.get(upstream, 0) + 1
+            if failed:
+                self.injected_errors[upstream] = self.injected_errors.get(upstream, 0) + 1
+        return (status or 503) if failed else None
+
+    def record_delivery(self, kind, key, messages, status):
+        texts = [m.get("text") or m.get("altText") or m.get("type") for m in messages]
+        with self._lock:
+            self.deliveries.append({"kind": kind, "key": key, "texts": texts, "status": status, "t": time.time()})
+
+    def deliveries_since(self, index):
+        with self._lock:
+            return self.deliveries[index:]
+
+    def stats(self):
+        with self._lock:
+            return {"requests": dict(self.requests), "injected_errors": dict(self.injected_errors),
+                    "deliveries": len(self.deliveries)}
+
+
+def token_age(reply_token):
+    """load_test.py 產生的 reply token 前 13 碼為發出時間；其他格式回傳 None"""
+    try:
+        return time.time() - int(reply_token[:13], 16) / 1000
+    except (TypeError, ValueError):
+        return None
+
+
+def make_handler(upstreams):
+    class Handler(BaseHTTPRequestHandler):
+        protocol_version = "HTTP/1.1"
+
+        # ------------------------------
+        # 路由
+        # ------------------------------
+        def do_GET(self):
+            url = urlsplit(self.path)
+            path, query = url.path, parse_qs(url.query)
+            if path == "/v2/bot/message/quota":
+                self._respond("line_push", lambda: {"type": "none"})
+            elif path == "/v2/bot/message/quota/consumption":
+                self._respond("line_push", lambda: {"totalUsage": 0})
+            elif path.startswith("/v2/bot/message/") and path.endswith("/content"):
+                self._respond("line_data", lambda: b"\x00" * 16384, "audio/m4a")
+            elif path == "/data/2.5/weather":
+                self._respond("openweather", lambda: current_weather(query.get("q", ["台北"])[0]))
+            elif path == "/data/2.5/forecast":
+                self._respond("openweather", lambda: forecast(query.get("q", ["台北"])[0]))
+            elif path == "/customsearch/v1":
+                self._respond("google_cse", lambda: search_results(query.get("q", [""])[0]))
+            elif path == "/search":
+                self._respond("google_search", lambda: image_search_html(self._base_url()), "text/html; charset=utf-8")
+            elif path == "/spotify/v1/search":
+                self._respond("spotify", lambda: spotify_search(query.get("q", [""])[0]))
+            elif path == "/_bench/deliveries":
+                since = int(query.get("since", ["0"])[0])
+                self._send_json(200, {"deliveries": upstreams.deliveries_since(since)})
+            elif path == "/_bench/stats":
+                self._send_json(200, upstreams.stats())
+            elif path.startswith("/_bench/image"):
+                self._send(200, b"\x89PNG\r\n\x1a\n", "image/png")
+            else:
+                self._send_json(404, {"message": "Not found"})
+
+        def do_POST(self):
+            path = urlsplit(self.path).path
+            body = self._read_body()
+            if path == "/v2/bot/message/reply":
+                self._line_send("reply", body)
+            elif path == "/v2/bot/message/push":
+                self._line_send("push", body)
+            elif path.startswith("/v2/bot/group/") and path.endswith("/leave"):
+                self._respond("line_reply", lambda: {})
+            elif path == "/openai/v1/chat/completions":
+                request = json.loads(body or b"{}")
+                if request.get("stream"):
+                    self._stream_completion("groq", request.get("model", ""))
+                else:
+                    self._respond("groq", lambda: chat_completion(request.get("model", "")))
+            elif path == "/v1/chat/completions":
+                request = json.loads(body or b"{}")
+                self._respond("openai", lambda: chat_completion(request.get("model", "")))
+            elif path == "/v1/images/generations":
+                self._respond("openai_image", lambda: {"created": int(time.time()),
+                                                       "data": [{"url": f"{self._base_url()}/_bench/image.png"}]})
+            elif path == "/v1/audio/transcriptions":
+                self._respond("whisper", lambda: {"text": "狗蛋 今天天氣怎麼樣"})
+            elif path == "/spotify/api/token":
+                self._respond("spotify", lambda: {"access_token": "bench", "token_type": "Bearer", "expires_in": 3600})
+            else:
+                self._send_json(404, {"message": "Not found"})
+
+        # ------------------------------
+        # LINE
+        # ------------------------------
+        def _line_send(self, kind, body):
+            request = json.loads(body or b"{}")
+            upstream = f"line_{kind}"
+            time.sleep(upstreams.delay(upstream))
+            key = request.get("replyToken") if kind == "reply" else request.get("to")
+            messages = request.get("messages", [])
+            status = upstreams.should_fail(upstream)
+            if status:
+                upstreams.record_delivery(kind, key, messages, status)
+                self._send_json(status, {"message": "Internal server error"})
+                return
+            if kind == "reply" and upstreams.reply_token_ttl is not None:
+                age = token_age(key)
+                if age is not None and age > upstreams.reply_token_ttl:
+                    upstreams.record_delivery(kind, key, messages, 400)
+                    self._send_json(400, {"message": "Invalid reply token"})
+                    return
+            upstreams.record_delivery(kind, key, messages, 200)
+            self._send_json(200, {"sentMessages": [{"id": str(random.randrange(10 ** 17)), "quoteToken": "q"}
+                                                   for _ in messages]})
+
+        # ------------------------------
+        # 共用
+        # ------------------------------
+        def _respond(self, upstream, build, content_type="application/json"):
+            time.sleep(upstreams.delay(upstream))
+            status = upstreams.should_fail(upstream)
+            if status:
+                self._send_json(status, {"error": {"message": "injected error", "type": "server_error"}})
+                return
+            payload = build()
+            if isinstance(payload, (bytes, str)):
+                self._send(200, payload.encode("utf-8") if isinstance(payload, str) else payload, content_type)
+            else:
+                self._send_json(200, payload)
+
+        def _stream_completion(self, upstream, model):
+            """Groq / OpenAI 相容的 SSE 串流：第一段前等延遲的 30%，其餘平均分散在各段之間"""
+            total = upstreams.delay(upstream)
+            status = upstreams.should_fail(upstream)
+            if status:
+                time.sleep(total)
+                self._send_json(status, {"error": {"message": "injected error", "type": "server_error"}})
+                return
+            text = completion_text(model)
+            chunks = split_chunks(text)
+            time.sleep(total * 0.3)
+            self.send_response(200)
+            self.send_header("Content-Type", "text/event-stream")
+            self.send_header("Connection", "close")
+            self.end_headers()
+            self.close_connection = True
+            completion_id = f"chatcmpl-{random.randrange(16 ** 12):012x}"
+            try:
+                for i, chunk in enumerate(chunks):
+                    event = {"id": completion_id, "object": "chat.completion.chunk", "created": int(time.time()),
+                             "model": model, "choices": [{"index": 0, "delta": {"content": chunk},
+                                                          "finish_reason": None}]}
+                    self.wfile.write(f"data: {json.dumps(event, ensure_ascii=False)}\n\n".encode("utf-8"))
+                    self.wfile.flush()
+                    if i < len(chunks) - 1:
+                        time.sleep(total * 0.7 / len(chunks))
+                # Groq 在最後一個 chunk 的 x_groq.usage 回報用量
+                final = {"id": completion_id, "object": "chat.completion.chunk", "created": int(time.time()),
+                         "model": model, "choices": [{"index": 0, "delta": {}, "finish_reason": "stop"}],
+                         "x_groq": {"id": completion_id, "usage": {"prompt_tokens": 60, "completion_tokens": len(text),
+                                                                   "total_tokens": 60 + len(text)}}}
+                self.wfile.write(f"data: {json.dumps(final)}\n\ndata: [DONE]\n\n".encode("utf-8"))
+                self.wfile.flush()
+            except (BrokenPipeError, ConnectionResetError):
+                pass  # bot 提早結束串流（已湊滿字數或 hedge 取消）
+
+        def _read_body(self):
+            length = int(self.headers.get("Content-Length") or 0)
+            return self.rfile.read(length) if length else b""
+
+        def _base_url(self):
+            host, port = self.server.server_address[:2]
+            return f"http://{host}:{port}"
+
+        def _send_json(self, status, payload):
+            self._send(status, json.dumps(payload, ensure_ascii=False).encode("utf-8"), "application/json")
+
+        def _send(self, status, body, content_type):
+            self.send_response(status)
+            self.send_header("Content-Type", content_type)
+            self.send_header("Content-Length", str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def log_message(self, *args):
+            pass
+
+    return Handler
+
+
+# ------------------------------
+# 回應內容
+# ------------------------------
+def completion_text(model):
+    answer = random.choice(REPLY_TEXTS)
+    if "deepseek" in model.lower():
+        # 推理模型的回答前面帶有 <think> 區塊，bot 會濾掉
+        return f"<think>使用者在問問題，我要用朋友的語氣簡短回答。</think>\n{answer}"
+    return answer
+
+
+def split_chunks(text, size=4):
+    return [text[i:i + size] for i in range(0, len(text), size)] or [""]
+
+
+def chat_completion(model):
+    text = completion_text(model)
+    return {
+        "id": f"chatcmpl-{random.randrange(16 ** 12):012x}",
+        "object": "chat.completion",
+        "created": int(time.time()),
+        "model": model,
+        "choices": [{"index": 0, "message": {"role": "assistant", "content": text}, "finish_reason": "stop"}],
+        "usage": {"prompt_tokens": 60, "completion_tokens": len(text), "total_tokens": 60 + len(text)},
+    }
+
+
+def current_weather(city):
+    return {"cod": 200, "name": city,
+            "main": {"temp": round(random.uniform(12, 32), 1), "humidity": random.randint(40, 95)},
+            "weather": [{"description": random.choice(CITIES_WEATHER)}],
+            "wind": {"speed": round(random.uniform(0, 8), 1)}}
+
+
+def forecast(city):
+    now = int(time.time())
+    start = now - now % 10800
+    items = []
+    for i in range(40):  # 5 天 × 每 3 小時
+        items.append({"dt_txt": time.strftime("%Y-%m-%d %H:%M:%S", time.gmtime(start + i * 10800)),
+                      "main": {"temp": round(random.uniform(12, 32), 1), "humidity": random.randint(40, 95)},
+                      "weather": [{"description": random.choice(CITIES_WEATHER)}],
+                      "wind": {"speed": round(random.uniform(0, 8), 1)}})
+    return {"cod": "200", "city": {"name": city}, "list": items}
+
+
+def search_results(query):
+    return {"items": [{"title": f"{query} 相關新聞 {i}", "link": f"https://example.com/{i}",
+                       "snippet": f"關於 {query} 的第 {i} 筆結果"} for i in range(1, 9)]}
+
+
+def image_search_html(base_url):
+    images = "".join(f'<img src="{base_url}/_bench/image{i}.png" alt="">' for i in range(1, 6))
+    return f'<html><body><img src="/images/branding/googlelogo.png">{images}</body></html>'
+
+
+def spotify_search(query):
+    return {"tracks": {"items": [{"name": query or "晴天", "preview_url": None,
+                                  "external_urls": {"spotify": "https://open.spotify.com/track/bench"}}]}}
+
+
+# ------------------------------
+# 啟動
+# ------------------------------
+class QuietServer(ThreadingHTTPServer):
+    daemon_threads = True
+
+    def handle_error(self, request, client_address):
+        # bot 關閉 keep-alive 連線或結束時的連線重置不是錯誤
+        if isinstance(sys.exc_info()[1], ConnectionError):
+            return
+        super().handle_error(request, client_address)
+
+
+def start(host="127.0.0.1", port=0, **kwargs):
+    """在背景執行緒啟動 server，回傳 (server, upstreams)"""
+    upstreams = Upstreams(**kwargs)
+    server = QuietServer((host, port), make_handler(upstreams))
+    threading.Thread(target=server.serve_forever, name="fake-upstream", daemon=True).start()
+    return server, upstreams
+
+
+def env(base_url, channel_secret):
+    """讓 bot 把所有上游指到 base_url 的環境變數（含假的 API key）"""
+    return {
+        "LINE_API_BASE": base_url,
+        "LINE_DATA_API_BASE": base_url,
+        "GROQ_BASE_URL": base_url,
+        "OPENAI_API_BASE": f"{base_url}/v1",
+        "OPENWEATHER_API_BASE": base_url,
+        "GOOGLE_CSE_URL": f"{base_url}/customsearch/v1",
+        "GOOGLE_SEARCH_URL": f"{base_url}/search",
+        "SPOTIFY_API_BASE": f"{base_url}/spotify/v1/",
+        "SPOTIFY_TOKEN_URL": f"{base_url}/spotify/api/token",
+        "LINE_CHANNEL_SECRET": channel_secret,
+        "LINE_CHANNEL_ACCESS_TOKEN": "bench-access-token",
+        "GROQ_API_KEY": "bench", "OPENAI_API_KEY": "bench", "OPENWEATHER_API_KEY": "bench",
+        "GOOGLE_SEARCH_KEY": "bench", "GOOGLE_CX": "bench",
+        "SPOTIFY_CLIENT_ID": "bench", "SPOTIFY_CLIENT_SECRET": "bench",
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8090)
+    parser.add_argument("--latency", action="append", metavar="NAME=MEDIAN[:P99]",
+                        help=f"上游延遲（秒），可重複指定；上游: {', '.join(DEFAULT_LATENCY)}")
+    parser.add_argument("--errors", action="append", metavar="NAME=RATE[:STATUS]", help="上游錯誤率與狀態碼")
+    parser.add_argument("--reply-token-ttl", type=float, default=None, help="reply token 有效秒數")
+    parser.add_argument("--channel-secret", default="bench-secret")
+    args = parser.parse_args()
+
+    server, upstreams = start(args.host, args.port, latency=parse_spec(args.latency),
+                              errors=parse_spec(args.errors, value_type=int), reply_token_ttl=args.reply_token_ttl)
+    base_url = f"http://{args.host}:{server.server_address[1]}"
+    print(f"🧪 fake upstream: {base_url}（bot 請以下列環境變數啟動）")
+    for key, value in env(base_url, args.channel_secret).items():
+        print(f"export {key}={value}")
+    try:
+        while True:
+            time.sleep(10)
+            print(f"📊 {json.dumps(upstreams.stats(), ensure_ascii=False)}")
+    except KeyboardInterrupt:
+        server.shutdown()
+        sys.exit(0)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,570 @@
+"""
+離線壓測：對本機的 bot（main.py 或 asgi.py）送出正確簽名的合成 webhook，
+所有上游都指到 fake_upstream.py（延遲分布、錯誤率可調），量測：
+
+  - webhook 回應延遲：從排定送出的時間算起（開放迴路，不會因為 bot 變慢而少送，避免 coordinated omission）
+  - 端到端延遲：webhook 排定送出 → fake LINE 收到該事件的最終回覆
+      * reply 以 reply token 對應到事件；「處理中」訊息不算最終回覆
+      * push 對應到同一聊天室最早送出、尚未完成的事件（同一聊天室有多個未完成事件時另計為「推測」）
+  - 吞吐量、各指令完成數 / 逾時數、reply token 失效次數
+  - 過程中定期讀取 bot 的 /workers，記錄 worker 與背景工作池的最大忙碌程度
+
+事件組成由 --mix 指定（指令名稱與 command_router 相同，另外有 audio / postback / follow / chatter）。
+預設不含「狗蛋開車」系列：那幾個指令會開 Playwright 爬外部網站，無法以本機替身模擬。
+
+執行方式（在專案根目錄）：
+    python bench/load_test.py --spawn flask --rate 20 --duration 30
+    python bench/load_test.py --spawn asgi --rate 50 --mix ai_chat=6,weather=1,forecast=1 --latency groq=1.5:6
+    python bench/load_test.py --target http://127.0.0.1:5000 --upstream-port 8090 --monitoring-token $MONITORING_TOKEN
+        （bot 已另外以 fake_upstream.env() 的環境變數啟動，指到 --upstream-port；讀取 /workers 需要 bot 的 MONITORING_TOKEN）
+"""
+import os, sys, json, hmac, time, base64, random, socket, hashlib, argparse, tempfile, threading, subprocess
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import httpx
+from command_router import router
+import fake_upstream
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+CHANNEL_SECRET = "bench-secret"
+MONITORING_TOKEN = "bench-monitoring"      # --spawn 時設給 bot 的 MONITORING_TOKEN
+WORKING_ACK_MESSAGE = "⏳ 狗蛋處理中，好了再跟你說！"   # 與 main.WORKING_ACK_MESSAGE 相同
+
+QUESTIONS = ["你覺得今天會下雨嗎", "晚餐吃什麼好", "幫我翻譯 good morning", "推薦一部電影",
+             "週末要去哪裡玩", "怎麼讓貓咪不要咬電線", "咖啡喝太多會怎樣", "給我一句勵志的話"]
+CITIES = ["台北", "台中", "高雄", "東京", "大阪", "首爾"]
+TOPICS = ["台積電 股價", "颱風 動態", "總統 新聞", "NBA 比分", "比特幣"]
+PEOPLE = ["川普", "周杰倫", "黃仁勳", "大谷翔平"]
+THINGS = ["貓咪", "柴犬", "海邊 夕陽", "拉麵"]
+SONGS = ["晴天", "稻香", "小幸運"]
+CHATTER = ["哈哈哈哈哈", "好喔", "明天幾點集合？", "笑死", "我在捷運上"]
+
+# 指令名稱 -> 產生訊息文字（群組與個人都必須被 router 判斷為同一指令）
+COMMAND_TEXTS = {
+    "ai_chat": lambda rng: f"狗蛋 {rng.choice(QUESTIONS)}",
+    "weather": lambda rng: f"狗蛋氣象 {rng.choice(CITIES)}",
+    "forecast": lambda rng: f"狗蛋預報 {rng.choice(CITIES)}",
+    "search": lambda rng: f"狗蛋搜尋 {rng.choice(TOPICS)}",
+    "person_intro": lambda rng: f"狗蛋介紹 {rng.choice(PEOPLE)}",
+    "image_search": lambda rng: f"狗蛋搜圖 {rng.choice(THINGS)}",
+    "generate_image": lambda rng: f"狗蛋生成 {rng.choice(THINGS)}",
+    "sing": lambda rng: f"狗蛋唱歌 {rng.choice(SONGS)}",
+    "help": lambda rng: "狗蛋指令",
+    "guilt_trip": lambda rng: "狗蛋情勒",
+    "current_model": lambda rng: "當前模型",
+    "switch_model": lambda rng: "換模型",
+}
+OTHER_KINDS = ("audio", "postback", "follow", "chatter")
+DEFAULT_MIX = ("ai_chat=40,weather=8,forecast=6,search=8,person_intro=4,image_search=4,generate_image=3,"
+               "sing=4,help=4,switch_model=3,audio=4,postback=3,follow=2,chatter=7")
+
+
+def parse_mix(text):
+    mix = {}
+    for part in text.split(","):
+        name, _, weight = part.strip().partition("=")
+        if name not in COMMAND_TEXTS and name not in OTHER_KINDS:
+            raise SystemExit(f"❌ 不支援的事件類型: {name}（可用: {', '.join([*COMMAND_TEXTS, *OTHER_KINDS])}）")
+        mix[name] = float(weight or 1)
+    return mix
+
+
+def check_command_texts(rng):
+    """先確認產生的文字會被 router 判斷為預期的指令，避免量到錯的東西"""
+    for command, make_text in COMMAND_TEXTS.items():
+        text = make_text(rng).strip().lower()
+        for is_group in (True, False):
+            routed = router.route(text, is_group=is_group)
+            if routed != command:
+                raise SystemExit(f"❌ 「{text}」被判斷為 {routed}，預期 {command}")
+
+
+def sign(body, secret=CHANNEL_SECRET):
+    return base64.b64encode(hmac.new(secret.encode(), body.encode(), hashlib.sha256).digest()).decode()
+
+
+def new_reply_token(rng):
+    # 前 13 碼是發出時間，fake_upstream 據此判斷 reply token 是否過期
+    return f"{int(time.time() * 1000):013x}{rng.randrange(16 ** 19):019x}"
+
+
+class EventFactory:
+    """依 mix 的權重產生 webhook 事件；聊天室從固定數量的群組與使用者中挑選"""
+
+    def __init__(self, mix, users, groups, group_ratio, seed=42):
+        self.rng = random.Random(seed)
+        self.kinds = list(mix)
+        self.weights = [mix[k] for k in self.kinds]
+        self.users = [f"U{self.rng.randrange(16 ** 32):032x}" for _ in range(users)]
+        self.groups = [f"C{self.rng.randrange(16 ** 32):032x}" for _ in range(groups)]
+        self.group_ratio = group_ratio if groups else 0.0
+
+    def make(self):
+        """回傳 (事件 dict, 種類, 聊天室 id 或 None)；聊天室為 None 代表 bot 不會回覆"""
+        rng = self.rng
+        kind = rng.choices(self.kinds, self.weights)[0]
+        user_id = rng.choice(self.users)
+        in_group = kind == "chatter" or (kind != "follow" and rng.random() < self.group_ratio)
+        if in_group:
+            group_id = rng.choice(self.groups) if self.groups else f"C{rng.randrange(16 ** 32):032x}"
+            source = {"type": "group", "groupId": group_id, "userId": user_id}
+        else:
+            group_id = None
+            source = {"type": "user", "userId": user_id}
+        event = {
+            "mode": "active",
+            "timestamp": int(time.time() * 1000),
+            "source": source,
+            "webhookEventId": f"01H{rng.randrange(16 ** 23):023X}",
+            "deliveryContext": {"isRedelivery": False},
+            "replyToken": new_reply_token(rng),
+        }
+        message_id = str(rng.randrange(10 ** 15))
+        if kind == "audio":
+            event["type"] = "message"
+            event["message"] = {"type": "audio", "id": message_id, "duration": 3000,
+                                "contentProvider": {"type": "line"}}
+        elif kind == "postback":
+            event["type"] = "postback"
+            event["postback"] = {"data": rng.choice(["model_deepseek", "model_llama3", "model_gpt4o_mini"])}
+        elif kind == "follow":
+            event["type"] = "follow"
+            event["follow"] = {"isUnblocked": False}
+        else:
+            text = rng.choice(CHATTER) if kind == "chatter" else COMMAND_TEXTS[kind](rng)
+            event["type"] = "message"
+            event["message"] = {"type": "text", "id": message_id, "quoteToken": "q", "text": text}
+        chat = None if kind == "chatter" else (group_id or user_id)
+        return event, kind, chat
+
+
+# ------------------------------
+# 端到端追蹤
+# ------------------------------
+class Pending:
+    __slots__ = ("token", "kind", "chat", "scheduled", "acked", "done", "via", "guessed", "rejected")
+
+    def __init__(self, token, kind, chat, scheduled):
+        self.token = token
+        self.kind = kind
+        self.chat = chat
+        self.scheduled = scheduled
+        self.acked = None
+        self.done = None
+        self.via = None
+        self.guessed = False
+        self.rejected = False
+
+
+class DeliveryTracker:
+    """把 fake LINE 收到的 reply / push 對應回事件"""
+
+    def __init__(self, upstreams):
+        self.upstreams = upstreams
+        self._lock = threading.Lock()
+        self._by_token = {}
+        self._by_chat = {}
+        self._cursor = 0
+        self.events = []
+        self.failed_sends = {}
+        self.unmatched = 0
+
+    def expect(self, token, kind, chat, scheduled):
+        item = Pending(token, kind, chat, scheduled)
+        with self._lock:
+            self.events.append(item)
+            self._by_token[token] = item
+            self._by_chat.setdefault(chat, deque()).append(item)
+        return item
+
+    def reject(self, items):
+        """webhook 沒有收到 200（bot 拒絕或連不上），這些事件不會有回覆"""
+        with self._lock:
+            for item in items:
+                if item.done is None:
+                    item.rejected = True
+                    item.done = item.scheduled
+                    self._by_token.pop(item.token, None)
+
+    def outstanding(self):
+        with self._lock:
+            return len(self._by_token)
+
+    def poll(self):
+        deliveries = self.upstreams.deliveries_since(self._cursor)
+        self._cursor += len(deliveries)
+        with self._lock:
+            for d in deliveries:
+                if d["status"] != 200:
+                    key = f"{d['kind']}_{d['status']}"
+                    self.failed_sends[key] = self.failed_sends.get(key, 0) + 1
+                    continue
+                if d["kind"] == "reply":
+                    item = self._by_token.get(d["key"])
+                    if item is None:
+                        self.unmatched += 1
+                    elif d["texts"] == [WORKING_ACK_MESSAGE]:
+                        item.acked = d["t"]
+                    else:
+                        self._finish(item, d["t"], "reply")
+                else:
+                    queue = self._by_chat.get(d["key"])
+                    while queue and queue[0].done is not None:
+                        queue.popleft()
+                    if not queue:
+                        self.unmatched += 1
+                        continue
+                    item = queue[0]
+                    item.guessed = len(queue) > 1
+                    self._finish(item, d["t"], "push")
+
+    def _finish(self, item, t, via):
+        item.done = t
+        item.via = via
+        self._by_token.pop(item.token, None)
+
+
+class WorkerSampler:
+    """定期讀取 bot 的 /workers，保留每個數值欄位的最大值"""
+
+    def __init__(self, client, url, token=None, interval=0.5):
+        self.client = client
+        self.url = url
+        self.headers = {"Authorization": f"Bearer {token}"} if token else {}
+        self.interval = interval
+        self.peaks = {}
+        self.samples = 0
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._loop, name="worker-sampler", daemon=True)
+
+    def start(self):
+        self._thread.start()
+
+    def stop(self):
+        self._stop.set()
+        self._thread.join()
+
+    def _loop(self):
+        while not self._stop.wait(self.interval):
+            try:
+                data = self.client.get(self.url, headers=self.headers, timeout=2).json()
+            except (httpx.HTTPError, ValueError):
+                continue
+            self.samples += 1
+            for key, value in flatten(data):
+                self.peaks[key] = max(self.peaks.get(key, value), value)
+
+
+def flatten(data, prefix=""):
+    if isinstance(data, dict):
+        for key, value in data.items():
+            yield from flatten(value, f"{prefix}.{key}" if prefix else str(key))
+    elif isinstance(data, (int, float)) and not isinstance(data, bool):
+        yield prefix, data
+
+
+# ------------------------------
+# 啟動 bot
+# ------------------------------
+def free_port():
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        return s.getsockname()[1]
+
+
+def bot_env(upstream_url, workdir, extra, secret=CHANNEL_SECRET):
+    env = {
+        **fake_upstream.env(upstream_url, secret),
+        # 每次壓測使用獨立的 SQLite，不影響（也不讀到）平常的狀態
+        "JOB_DB_PATH": os.path.join(workdir, "jobs.db"),
+        "LINE_QUOTA_DB_PATH": os.path.join(workdir, "push_quota.db"),
+        "WEBHOOK_DEDUPE_DB_PATH": os.path.join(workdir, "webhook_events.db"),
+        "STATE_DB_PATH": os.path.join(workdir, "state.db"),
+        "LISTING_SNAPSHOT_PATH": os.path.join(workdir, "listing_cache.json"),
+        "SPOTIFY_CACHE_PATH": os.path.join(workdir, "spotify_token.json"),
+        "LINE_MONTHLY_PUSH_QUOTA": "0",       # 不限 push 額度
+        "MONITORING_TOKEN": MONITORING_TOKEN,
+        "LOG_LEVEL": "WARNING",
+    }
+    env.update(extra)
+    return env
+
+
+def spawn_bot(kind, port, env, log_path):
+    if kind == "asgi":
+        cmd = [sys.executable, "-m", "uvicorn", "asgi:app", "--host", "127.0.0.1", "--port", str(port),
+               "--log-level", "warning"]
+    else:
+        cmd = [sys.executable, "main.py"]
+    log = open(log_path, "w")
+    proc = subprocess.Popen(cmd, cwd=ROOT, env={**os.environ, **env, "PORT": str(port)},
+                            stdout=log, stderr=subprocess.STDOUT)
+    url = f"http://127.0.0.1:{port}"
+    deadline = time.monotonic() + 60
+    while time.monotonic() < deadline:
+        if proc.poll() is not None:
+            raise SystemExit(f"❌ bot 啟動失敗（exit {proc.returncode}），請看 {log_path}")
+        try:
+            if httpx.get(url + "/", timeout=1).status_code == 200:
+                return proc, url
+        except httpx.HTTPError:
+            pass
+        time.sleep(0.2)
+    proc.terminate()
+    raise SystemExit(f"❌ bot 60 秒內沒有啟動，請看 {log_path}")
+
+
+# ------------------------------
+# 送出 webhook
+# ------------------------------
+class WebhookSender:
+    """
+    依排定時間送出 webhook（開放迴路）：排程執行緒只負責等時間與排入，實際送出在 thread pool。
+    延遲從排定時間算起，排程本身落後時記錄最大落後時間。
+    """
+
+    def __init__(self, client, target, tracker, concurrency, secret=CHANNEL_SECRET):
+        self.client = client
+        self.url = f"{target}/callback"
+        self.tracker = tracker
+        self.secret = secret
+        self.latencies = []
+        self.statuses = {}
+        self.max_lag = 0.0
+        self._lock = threading.Lock()
+        self._pool = ThreadPoolExecutor(max_workers=concurrency)
+
+    def wait_until(self, scheduled):
+        delay = scheduled - time.time()
+        if delay > 0:
+            time.sleep(delay)
+        else:
+            self.max_lag = max(self.max_lag, -delay)
+
+    def submit(self, body, expected, scheduled):
+        """expected: tracker.expect() 回傳的事件，webhook 失敗時一併標記為拒絕"""
+        self._pool.submit(self._send, body, sign(body, self.secret), expected, scheduled)
+
+    def close(self):
+        self._pool.shutdown(wait=True)
+
+    def _send(self, body, signature, expected, scheduled):
+        try:
+            status = self.client.post(self.url, content=body.encode("utf-8"),
+                                      headers={"X-Line-Signature": signature, "Content-Type": "application/json"},
+                                      timeout=30).status_code
+        except httpx.HTTPError as e:
+            status = type(e).__name__
+        if status != 200:
+            self.tracker.reject(expected)
+        with self._lock:
+            self.latencies.append(time.time() - scheduled)
+            self.statuses[status] = self.statuses.get(status, 0) + 1
+
+
+def run_load(sender, factory, rate, duration, batch, arrival):
+    """以 rate（每秒 webhook 數）送出 duration 秒，間隔為 Poisson 或固定"""
+    rng = random.Random(7)
+    start = time.time()
+    next_at = start
+    while next_at < start + duration:
+        sender.wait_until(next_at)
+        events, expected = [], []
+        for _ in range(batch):
+            event, kind, chat = factory.make()
+            events.append(event)
+            if chat is not None:
+                expected.append(sender.tracker.expect(event["replyToken"], kind, chat, next_at))
+        sender.submit(json.dumps({"destination": "Ubench", "events": events}, ensure_ascii=False), expected, next_at)
+        next_at += rng.expovariate(rate) if arrival == "poisson" else 1.0 / rate
+
+
+# ------------------------------
+# 壓測流程（replay.py 共用）
+# ------------------------------
+def add_session_arguments(parser):
+    """bot 目標、上游替身與報告的共用參數"""
+    target = parser.add_mutually_exclusive_group(required=True)
+    target.add_argument("--spawn", choices=["flask", "asgi"], help="自行啟動 main.py（flask）或 asgi.py（uvicorn）")
+    target.add_argument("--target", help="已在執行的 bot，例如 http://127.0.0.1:5000")
+    parser.add_argument("--upstream-port", type=int, default=None, help="fake upstream 的 port（--target 時預設 8090）")
+    parser.add_argument("--secret", default=CHANNEL_SECRET, help="簽名用的 channel secret（須與 bot 的 LINE_CHANNEL_SECRET 相同）")
+    parser.add_argument("--monitoring-token", default=os.getenv("MONITORING_TOKEN"),
+                        help="--target 時讀取 /workers 用的 token（bot 的 MONITORING_TOKEN；預設讀環境變數）")
+    parser.add_argument("--latency", action="append", metavar="NAME=MEDIAN[:P99]", help="上游延遲（見 fake_upstream.py）")
+    parser.add_argument("--errors", action="append", metavar="NAME=RATE[:STATUS]", help="上游錯誤率")
+    parser.add_argument("--reply-token-ttl", type=float, default=60, help="reply token 有效秒數（0 = 不檢查）")
+    parser.add_argument("--drain", type=float, default=60, help="送完後最多再等幾秒讓事件完成")
+    parser.add_argument("--concurrency", type=int, default=64, help="同時送出中的 webhook 上限")
+    parser.add_argument("--env", action="append", default=[], metavar="KEY=VALUE", help="--spawn 時額外的環境變數")
+    parser.add_argument("--json", help="把結果另存為 JSON")
+
+
+def run_session(args, config, play):
+    """
+    啟動 fake upstream（--spawn 時一併啟動 bot），以 play(sender) 送出 webhook，
+    等事件完成（最多 --drain 秒）後印出報告。
+    """
+    upstream_port = args.upstream_port if args.upstream_port is not None else (0 if args.spawn else 8090)
+    server, upstreams = fake_upstream.start(
+        port=upstream_port, latency=fake_upstream.parse_spec(args.latency),
+        errors=fake_upstream.parse_spec(args.errors, value_type=int),
+        reply_token_ttl=args.reply_token_ttl or None)
+    upstream_url = f"http://127.0.0.1:{server.server_address[1]}"
+
+    proc = None
+    workdir = tempfile.mkdtemp(prefix="linebot-load-")
+    if args.spawn:
+        extra = dict(item.split("=", 1) for item in args.env)
+        log_path = os.path.join(workdir, "bot.log")
+        env = bot_env(upstream_url, workdir, extra, args.secret)
+        monitoring_token = env["MONITORING_TOKEN"]
+        proc, target_url = spawn_bot(args.spawn, free_port(), env, log_path)
+        print(f"🚀 已啟動 {args.spawn} bot：{target_url}（log: {log_path}）")
+    else:
+        target_url = args.target.rstrip("/")
+        monitoring_token = args.monitoring_token
+        print(f"🎯 目標 {target_url}，fake upstream {upstream_url}")
+
+    client = httpx.Client(limits=httpx.Limits(max_connections=args.concurrency + 4))
+    tracker = DeliveryTracker(upstreams)
+    sender = WebhookSender(client, target_url, tracker, args.concurrency, args.secret)
+    sampler = WorkerSampler(client, f"{target_url}/workers", monitoring_token)
+    stop_polling = threading.Event()
+
+    def poll_loop():
+        while not stop_polling.wait(0.05):
+            tracker.poll()
+
+    poller = threading.Thread(target=poll_loop, name="delivery-poller", daemon=True)
+    try:
+        sampler.start()
+        poller.start()
+        started = time.time()
+        play(sender)
+        sender.close()
+        drain_until = time.time() + args.drain
+        while tracker.outstanding() and time.time() < drain_until:
+            time.sleep(0.2)
+        elapsed = time.time() - started
+        stop_polling.set()
+        poller.join()
+        tracker.poll()
+        sampler.stop()
+    finally:
+        client.close()
+        if proc is not None:
+            proc.terminate()
+            proc.wait(10)
+        server.shutdown()
+
+    report = build_report({**config, "target": args.spawn or args.target}, sender, elapsed, tracker, sampler, upstreams)
+    print_report(report)
+    if args.json:
+        with open(args.json, "w", encoding="utf-8") as f:
+            json.dump(report, f, ensure_ascii=False, indent=2)
+        print(f"💾 已存到 {args.json}")
+    return report
+
+
+# ------------------------------
+# 報告
+# ------------------------------
+def percentile(values, p):
+    if not values:
+        return None
+    values = sorted(values)
+    return values[min(len(values) - 1, int(round(p / 100 * (len(values) - 1))))]
+
+
+def fmt_ms(seconds):
+    return "      -" if seconds is None else f"{seconds * 1000:7.0f}"
+
+
+def build_report(config, sender, elapsed, tracker, sampler, upstreams):
+    latencies = sender.latencies
+    accepted = [i for i in tracker.events if not i.rejected]
+    by_kind = {}
+    for item in accepted:
+        by_kind.setdefault(item.kind, []).append(item)
+    commands = {}
+    for kind, items in sorted(by_kind.items()):
+        done = [i.done - i.scheduled for i in items if i.done is not None]
+        commands[kind] = {
+            "sent": len(items),
+            "completed": len(done),
+            "acked": sum(1 for i in items if i.acked is not None),
+            "via_push": sum(1 for i in items if i.via == "push"),
+            "guessed": sum(1 for i in items if i.guessed),
+            "p50": percentile(done, 50), "p95": percentile(done, 95), "p99": percentile(done, 99),
+        }
+    all_done = [i.done - i.scheduled for i in accepted if i.done is not None]
+    return {
+        "config": config,
+        "webhooks": len(latencies),
+        "webhook_status": {str(k): v for k, v in sender.statuses.items()},
+        "webhook_latency": {"p50": percentile(latencies, 50), "p95": percentile(latencies, 95),
+                            "p99": percentile(latencies, 99), "max": max(latencies, default=None)},
+        "scheduler_max_lag": sender.max_lag,
+        "end_to_end": {"expected": len(accepted), "completed": len(all_done),
+                       "rejected": len(tracker.events) - len(accepted),
+                       "throughput": len(all_done) / elapsed if elapsed else 0.0,
+                       "p50": percentile(all_done, 50), "p95": percentile(all_done, 95),
+                       "p99": percentile(all_done, 99)},
+        "commands": commands,
+        "failed_sends": tracker.failed_sends,
+        "unmatched_sends": tracker.unmatched,
+        "worker_peaks": sampler.peaks if sampler else {},
+        "upstreams": upstreams.stats(),
+    }
+
+
+def print_report(report):
+    latency = report["webhook_latency"]
+    e2e = report["end_to_end"]
+    print(f"\n📨 webhook: {report['webhooks']} 個，狀態 {report['webhook_status']}，"
+          f"排程最大落後 {report['scheduler_max_lag'] * 1000:.0f} ms")
+    print(f"   回應延遲 (ms) p50 {fmt_ms(latency['p50'])}  p95 {fmt_ms(latency['p95'])}  "
+          f"p99 {fmt_ms(latency['p99'])}  max {fmt_ms(latency['max'])}")
+    print(f"🏁 端到端: {e2e['completed']}/{e2e['expected']} 完成，{e2e['throughput']:.1f} 則/秒，"
+          f"p50 {fmt_ms(e2e['p50']).strip()} / p95 {fmt_ms(e2e['p95']).strip()} / p99 {fmt_ms(e2e['p99']).strip()} ms")
+    print(f"\n{'指令':<16}{'送出':>6}{'完成':>6}{'處理中':>7}{'push':>6}{'推測':>6}{'p50':>9}{'p95':>9}{'p99':>9}")
+    for kind, c in report["commands"].items():
+        print(f"{kind:<16}{c['sent']:>6}{c['completed']:>6}{c['acked']:>7}{c['via_push']:>6}{c['guessed']:>6}"
+              f"  {fmt_ms(c['p50'])}  {fmt_ms(c['p95'])}  {fmt_ms(c['p99'])}")
+    if report["failed_sends"] or report["unmatched_sends"]:
+        print(f"\n⚠️ LINE 送出失敗: {report['failed_sends']}，無法對應的送出: {report['unmatched_sends']}")
+    if report["worker_peaks"]:
+        print("\n🔧 worker 最大值: " + ", ".join(f"{k}={v}" for k, v in sorted(report["worker_peaks"].items())))
+    print(f"🧪 上游: {json.dumps(report['upstreams'], ensure_ascii=False)}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    add_session_arguments(parser)
+    parser.add_argument("--rate", type=float, default=10, help="每秒送出的 webhook 數")
+    parser.add_argument("--duration", type=float, default=30, help="送出秒數")
+    parser.add_argument("--batch", type=int, default=1, help="每個 webhook 的事件數")
+    parser.add_argument("--arrival", choices=["poisson", "uniform"], default="poisson", help="送出間隔的分布")
+    parser.add_argument("--mix", default=DEFAULT_MIX, help="事件組成（名稱=權重，逗號分隔）")
+    parser.add_argument("--users", type=int, default=200, help="使用者數")
+    parser.add_argument("--groups", type=int, default=20, help="群組數")
+    parser.add_argument("--group-ratio", type=float, default=0.5, help="來自群組的事件比例")
+    args = parser.parse_args()
+
+    factory = EventFactory(parse_mix(args.mix), args.users, args.groups, args.group_ratio)
+    check_command_texts(random.Random(0))
+
+    def play(sender):
+        print(f"⏱️ {args.rate:g} webhook/秒 × {args.duration:g} 秒（每個 {args.batch} 個事件）")
+        run_load(sender, factory, args.rate, args.duration, args.batch, args.arrival)
+
+    config = {"rate": args.rate, "duration": args.duration, "batch": args.batch, "mix": args.mix}
+    run_session(args, config, play)
+
+
+if __name__ == "__main__":
+    main()
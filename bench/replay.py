@@ -0,0 +1,127 @@
+"""
+重播 capture.py 錄下的正式環境 webhook：以原本的時間間隔（或 --speed 倍速）重新簽名後送到本機的 bot，
+上游與報告和 load_test.py 相同（fake_upstream.py 替身、webhook 延遲、端到端延遲、/workers 最大值），
+用真實的指令組成與突發形狀比較不同版本。
+
+每個事件重送前會換上新的 replyToken、quoteToken、webhookEventId 與 timestamp
+（同一份錄製可以重播多次，不會被去重擋下；reply token 的期限從重送時起算）。
+錄製時已遮蔽的文字仍會被 router 判斷為原本的指令，雜湊後的 id 讓同一聊天室的事件仍依序處理。
+
+執行方式（在專案根目錄）：
+    python bench/replay.py /data/webhooks.jsonl --spawn flask
+    python bench/replay.py /data/webhooks.jsonl --spawn asgi --speed 4 --max-gap 5
+    python bench/replay.py /data/webhooks-*.jsonl --target http://127.0.0.1:5000 --secret $LINE_CHANNEL_SECRET
+"""
+import os, sys, json, time, random, argparse
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from capture import read_capture
+from command_router import router
+from webhook_filter import is_actionable
+from load_test import add_session_arguments, run_session, new_reply_token
+
+# 這些事件 LINE 不會附 reply token
+NO_REPLY_TOKEN_EVENTS = ("unfollow", "leave", "memberLeft", "unsend")
+QUOTABLE_MESSAGES = ("text", "image", "video", "sticker")
+
+
+def load_records(paths, skip, duration):
+    """讀出所有錄製檔並依抵達時間排序；skip / duration 以錄製時間（秒）裁切"""
+    records = sorted((record for path in paths for record in read_capture(path)), key=lambda r: r["t"])
+    if not records:
+        return []
+    begin = records[0]["t"] + skip
+    end = begin + duration if duration else float("inf")
+    return [r for r in records if begin <= r["t"] < end]
+
+
+def build_schedule(records, speed, max_gap):
+    """錄製時間 → 重播時的相對秒數：間隔除以 speed，超過 max_gap 的空檔壓縮成 max_gap"""
+    offsets = []
+    offset = 0.0
+    previous = None
+    for record in records:
+        if previous is not None:
+            gap = record["t"] - previous
+            if max_gap is not None:
+                gap = min(gap, max_gap)
+            offset += gap / speed
+        offsets.append(offset)
+        previous = record["t"]
+    return offsets
+
+
+def chat_of(raw_event):
+    source = raw_event.get("source") or {}
+    return source.get("groupId") or source.get("roomId") or source.get("userId") or "_"
+
+
+def kind_of(raw_event):
+    """報告用的分類：文字訊息為 router 的指令名稱，其餘為事件 / 訊息類型"""
+    message = raw_event.get("message") or {}
+    if raw_event.get("type") == "message" and message.get("type") == "text":
+        is_group = (raw_event.get("source") or {}).get("type") == "group"
+        return router.route((message.get("text") or "").strip().lower(), is_group=is_group) or "chatter"
+    if raw_event.get("type") == "message":
+        return message.get("type", "message")
+    return raw_event.get("type", "unknown")
+
+
+def refresh(raw_event, rng):
+    """換上新的 token / id / timestamp，回傳可送出的事件 dict"""
+    event = dict(raw_event)
+    event["timestamp"] = int(time.time() * 1000)
+    event["webhookEventId"] = f"01R{rng.randrange(16 ** 23):023X}"
+    if event.get("type") not in NO_REPLY_TOKEN_EVENTS:
+        event["replyToken"] = new_reply_token(rng)
+    message = event.get("message")
+    if isinstance(message, dict) and message.get("type") in QUOTABLE_MESSAGES:
+        event["message"] = {**message, "quoteToken": f"{rng.randrange(16 ** 16):016x}"}
+    return event
+
+
+def play_records(sender, records, offsets, rng):
+    start = time.time() + 0.5
+    for record, offset in zip(records, offsets):
+        scheduled = start + offset
+        sender.wait_until(scheduled)
+        events, expected = [], []
+        for raw_event in record["events"]:
+            event = refresh(raw_event, rng)
+            events.append(event)
+            # 會被 bot 處理的事件才等回覆（與 webhook_filter 的判斷相同）
+            if "replyToken" in event and is_actionable(event, router):
+                expected.append(sender.tracker.expect(event["replyToken"], kind_of(event), chat_of(event), scheduled))
+        body = json.dumps({"destination": "Ureplay", "events": events}, ensure_ascii=False)
+        sender.submit(body, expected, scheduled)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("paths", nargs="+", help="錄製檔（CAPTURE_PATH；輪替後的 .N.gz 會一併讀取）")
+    add_session_arguments(parser)
+    parser.add_argument("--speed", type=float, default=1.0, help="時間倍率（2 = 兩倍速）")
+    parser.add_argument("--max-gap", type=float, default=None, help="超過此秒數的空檔壓縮成此秒數（在倍率之前套用）")
+    parser.add_argument("--skip", type=float, default=0, help="略過錄製開頭的秒數")
+    parser.add_argument("--duration", type=float, default=None, help="只重播錄製中這麼多秒")
+    args = parser.parse_args()
+
+    records = load_records(args.paths, args.skip, args.duration)
+    if not records:
+        raise SystemExit("❌ 錄製檔中沒有 webhook")
+    offsets = build_schedule(records, args.speed, args.max_gap)
+    events = sum(len(r["events"]) for r in records)
+    span = records[-1]["t"] - records[0]["t"]
+
+    def play(sender):
+        print(f"⏪ 重播 {len(records)} 個 webhook（{events} 個事件，錄製 {span:.0f} 秒 → 重播 {offsets[-1]:.0f} 秒）")
+        play_records(sender, records, offsets, random.Random(11))
+
+    config = {"paths": args.paths, "speed": args.speed, "max_gap": args.max_gap, "skip": args.skip,
+              "duration": args.duration, "webhooks": len(records), "events": events}
+    run_session(args, config, play)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,306 @@
+"""
+常駐的 Chromium 連線池。
+
+每個 process 只啟動一個 Chromium，並保留少量可重複使用、已套用 stealth 的 browser context，
+每次爬蟲借用一個 context 開新分頁，用完歸還，省去每次啟動瀏覽器的 1~2 秒與數百 MB 記憶體。
+
+Playwright 的物件只能在建立它的執行緒使用，因此瀏覽器跑在專屬的 asyncio 執行緒上，
+同步程式透過 BrowserPool.run() 把「拿到 page 之後要做的事」丟過去執行：
+
+    async def scrape(page):
+        await page.goto(url)
+        return await page.title()
+
+    title = browser_pool.run(scrape)
+"""
+import os, asyncio, atexit, random, threading, time
+from playwright.async_api import async_playwright
+from playwright_stealth import stealth_async
+from metrics import metrics
+import tracing
+from app_logging import get_logger
+
+RSS_CHECK_INTERVAL = 30
+
+USER_AGENTS = [
+    "Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/110.0.0.0 Safari/537.36",
+    "Mozilla/5.0 (iPhone; CPU iPhone OS 15_2 like Mac OS X) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/97.0.4692.99 Mobile Safari/537.36",
+]
+
+logger = get_logger("browser_pool")
+
+
+class _Lease:
+    __slots__ = ("context", "pages", "generation")
+
+    def __init__(self, context, generation):
+        self.context = context
+        self.pages = 0
+        self.generation = generation
+
+
+class BrowserPool:
+    """
+    max_contexts       : 同時可借出的 context 數（也就是同時爬蟲的上限）
+    pages_per_context  : 每個 context 開過幾個分頁後重建（清掉 cookie / cache 累積）
+    pages_per_browser  : 瀏覽器開過幾個分頁後整個重啟
+    max_rss_mb         : Chromium 相關程序的 RSS 總和超過此值時重啟
+
+    需要重啟時先停止借出新的 context，等借出中的全部歸還後再重啟，避免持續有流量時永遠等不到閒置。
+    """
+
+    def __init__(self, max_contexts=2, pages_per_context=50, pages_per_browser=500, max_rss_mb=700,
+                 launch_args=("--no-sandbox", "--disable-dev-shm-usage")):
+        self.max_contexts = max_contexts
+        self.pages_per_context = pages_per_context
+        self.pages_per_browser = pages_per_browser
+        self.max_rss_mb = max_rss_mb
+        self.launch_args = list(launch_args)
+
+        self._loop = None
+        self._thread = None
+        self._start_lock = threading.Lock()
+
+        # 以下只在瀏覽器執行緒內存取
+        self._playwright = None
+        self._browser = None
+        self._generation = 0
+        self._browser_pages = 0
+        self._idle = []
+        self._leased = 0
+        self._recycle_pending = False
+        self._slot_freed = None
+        self._launch_lock = None
+        self._last_rss_check = 0.0
+
+        self.launches = 0
+        self.recycles = 0
+        self.pages_served = 0
+
+    # ------------------------------
+    # 同步 API
+    # ------------------------------
+    def run(self, page_func, timeout=60):
+        """借一個分頁執行 page_func(page)（coroutine function），回傳其結果"""
+        self._ensure_thread()
+        start = time.perf_counter()
+        future = asyncio.run_coroutine_threadsafe(self._run(page_func), self._loop)
+        try:
+            with tracing.span("playwright"):
+                result = future.result(timeout)
+        except Exception:
+            # 逾時或失敗時取消瀏覽器執行緒上的工作，分頁與 context 會在 _run 的 finally 歸還
+            future.cancel()
+            metrics.observe_upstream("playwright", "page", time.perf_counter() - start, error=True)
+            raise
+        metrics.observe_upstream("playwright", "page", time.perf_counter() - start)
+        return result
+
+    def shutdown(self, timeout=10):
+        """關閉所有 context、瀏覽器與 Playwright，並結束瀏覽器執行緒"""
+        if self._loop is None:
+            return
+        try:
+            asyncio.run_coroutine_threadsafe(self._close_all(), self._loop).result(timeout)
+        except Exception as e:
+            logger.error("關閉瀏覽器失敗", error=e)
+        self._loop.call_soon_threadsafe(self._loop.stop)
+        self._thread.join(timeout)
+        self._loop = None
+        self._thread = None
+
+    def stats(self):
+        return {
+            "connected": bool(self._browser and self._browser.is_connected()),
+            "generation": self._generation,
+            "idle_contexts": len(self._idle),
+            "leased_contexts": self._leased,
+            "recycle_pending": self._recycle_pending,
+            "pages_served": self.pages_served,
+            "launches": self.launches,
+            "recycles": self.recycles,
+            "rss_mb": round(_children_rss_mb(), 1),
+        }
+
+    # ------------------------------
+    # 瀏覽器執行緒
+    # ------------------------------
+    def _ensure_thread(self):
+        with self._start_lock:
+            if self._thread is not None:
+                return
+            ready = threading.Event()
+
+            def _loop_main():
+                self._loop = asyncio.new_event_loop()
+                asyncio.set_event_loop(self._loop)
+                self._slot_freed = asyncio.Condition()
+                self._launch_lock = asyncio.Lock()
+                ready.set()
+                self._loop.run_forever()
+
+            self._thread = threading.Thread(target=_loop_main, name="browser-pool", daemon=True)
+            self._thread.start()
+            ready.wait()
+            atexit.register(self.shutdown)
+
+    async def _run(self, page_func):
+        lease = await self._acquire()
+        page = None
+        try:
+            page = await lease.context.new_page()
+            # ✅ 避免被封鎖，使用 Stealth + 隨機 User-Agent
+            await stealth_async(page)
+            await page.set_extra_http_headers({"User-Agent": random.choice(USER_AGENTS)})
+            return await page_func(page)
+        finally:
+            if page is not None:
+                try:
+                    await page.close()
+                except Exception:
+                    pass
+            lease.pages += 1
+            self._browser_pages += 1
+            self.pages_served += 1
+            await self._release(lease)
+
+    async def _ensure_browser(self):
+        """健康檢查：瀏覽器不存在或已斷線時重新啟動"""
+        async with self._launch_lock:
+            if self._browser is not None and self._browser.is_connected():
+                return
+            if self._browser is not None:
+                logger.warning("Chromium 已斷線，重新啟動")
+                await self._close_browser()
+            if self._playwright is None:
+                self._playwright = await async_playwright().start()
+            self._browser = await self._playwright.chromium.launch(headless=True, args=self.launch_args)
+            self._generation += 1
+            self._browser_pages = 0
+            self.launches += 1
+            logger.info("Chromium 已啟動", launches=self.launches)
+
+    async def _acquire(self):
+        async with self._slot_freed:
+            while self._recycle_pending or (not self._idle and self._leased >= self.max_contexts):
+                await self._slot_freed.wait()
+            self._leased += 1
+        # 先佔住名額再檢查瀏覽器，避免剛好被閒置重啟關掉
+        try:
+            await self._ensure_browser()
+        except Exception:
+            async with self._slot_freed:
+                self._leased -= 1
+                self._slot_freed.notify()
+            raise
+        while self._idle:
+            lease = self._idle.pop()
+            if lease.generation == self._generation:
+                return lease
+            await _close_quietly(lease.context)
+        try:
+            context = await self._browser.new_context()
+        except Exception:
+            async with self._slot_freed:
+                self._leased -= 1
+                self._slot_freed.notify()
+            raise
+        return _Lease(context, self._generation)
+
+    async def _release(self, lease):
+        stale = lease.generation != self._generation or lease.pages >= self.pages_per_context
+        if stale or self._browser is None or not self._browser.is_connected():
+            await _close_quietly(lease.context)
+        else:
+            self._idle.append(lease)
+        async with self._slot_freed:
+            self._leased -= 1
+            if not self._recycle_pending and self._should_recycle_browser():
+                self._recycle_pending = True
+            drained = self._recycle_pending and self._leased == 0
+            if not drained:
+                self._slot_freed.notify()
+        if drained:
+            try:
+                await self._recycle_browser()
+            finally:
+                async with self._slot_freed:
+                    self._recycle_pending = False
+                    self._slot_freed.notify_all()
+
+    def _should_recycle_browser(self):
+        if self._browser is None:
+            return False
+        if self._browser_pages >= self.pages_per_browser:
+            return True
+        # 掃 /proc 有成本，最多每 RSS_CHECK_INTERVAL 秒檢查一次
+        now = time.monotonic()
+        if not self.max_rss_mb or now - self._last_rss_check < RSS_CHECK_INTERVAL:
+            return False
+        self._last_rss_check = now
+        return _children_rss_mb() > self.max_rss_mb
+
+    async def _recycle_browser(self):
+        async with self._launch_lock:
+            logger.info("重啟 Chromium", pages=self._browser_pages, rss_mb=round(_children_rss_mb()))
+            self.recycles += 1
+            await self._close_browser()
+
+    async def _close_browser(self):
+        for lease in self._idle:
+            await _close_quietly(lease.context)
+        self._idle = []
+        if self._browser is not None:
+            await _close_quietly(self._browser)
+            self._browser = None
+
+    async def _close_all(self):
+        await self._close_browser()
+        if self._playwright is not None:
+            await self._playwright.stop()
+            self._playwright = None
+
+
+async def _close_quietly(closable):
+    try:
+        await closable.close()
+    except Exception:
+        pass
+
+
+def _children_rss_mb():
+    """加總目前 process 所有子孫程序（Playwright driver + Chromium）的 RSS；非 Linux 回傳 0"""
+    if not os.path.isdir("/proc"):
+        return 0.0
+    parents = {}
+    rss = {}
+    for pid in os.listdir("/proc"):
+        if not pid.isdigit():
+            continue
+        try:
+            with open(f"/proc/{pid}/status") as f:
+                for line in f:
+                    if line.startswith("PPid:"):
+                        parents[int(pid)] = int(line.split()[1])
+                    elif line.startswith("VmRSS:"):
+                        rss[int(pid)] = int(line.split()[1])
+        except (OSError, ValueError):
+            continue
+
+    me = os.getpid()
+    total_kb = 0
+    for pid in parents:
+        ancestor = parents.get(pid)
+        while ancestor and ancestor != me:
+            ancestor = parents.get(ancestor)
+        if ancestor == me:
+            total_kb += rss.get(pid, 0)
+    return total_kb / 1024
+
+
+browser_pool = BrowserPool(
+    max_contexts=int(os.getenv("BROWSER_MAX_CONTEXTS", "2")),
+    pages_per_context=int(os.getenv("BROWSER_PAGES_PER_CONTEXT", "50")),
+    pages_per_browser=int(os.getenv("BROWSER_PAGES_PER_BROWSER", "500")),
+    max_rss_mb=int(os.getenv("BROWSER_MAX_RSS_MB", "700")),
+)
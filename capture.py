@@ -0,0 +1,257 @@
+"""
+Webhook 流量錄製：把實際收到的 webhook 存成壓縮、輪替的 JSON lines，供 bench/replay.py 重播。
+
+合成壓測（bench/load_test.py）的指令組成與突發形狀都是猜的；錄下正式環境的流量，
+就能用真實的流量輪廓比較不同版本。錄下的內容不含可識別使用者的資料：
+
+  - 使用者 / 群組 / 聊天室 id、訊息 id、webhookEventId 以 HMAC-SHA256（CAPTURE_SALT）雜湊，
+    保留開頭字母與長度；同一份錄製中同一個 id 仍對應到同一個值，聊天室的先後順序與並行度不變
+  - 訊息文字只保留指令關鍵字（狗蛋、搜尋、氣象 … 取自 command_router）、標點、空白與符號，
+    其餘每個字換成同類的佔位字元（中日韓文字 → 〇、英文字母 → x、數字 → 0）；
+    長度與位置不變（mention 的 index 仍然正確），重播時 router 會判斷出相同的指令
+  - reply token、quote token、位置座標、貼圖關鍵字、內容網址等欄位直接丟掉
+
+callback 只把 (抵達時間, body) 放進有界佇列，遮蔽與寫檔都在背景執行緒；佇列滿時丟棄並計數。
+檔案超過 CAPTURE_MAX_BYTES 時輪替為 <path>.1.gz、<path>.2.gz …，最多保留 CAPTURE_BACKUPS 份。
+多個 worker process 時請在路徑放 {pid}（例如 /data/webhooks-{pid}.jsonl），各自寫各自的檔案。
+
+每行一個 webhook：
+    {"t": 1718000000.123, "bytes": 812, "events": [...]}
+"""
+import os, re, gzip, hmac, json, time, queue, atexit, shutil, hashlib, secrets, threading, unicodedata
+from command_router import router
+from app_logging import get_logger
+
+CAPTURE_PATH = os.getenv("CAPTURE_PATH")                       # 未設定時不錄製
+CAPTURE_SALT = os.getenv("CAPTURE_SALT")                       # 未設定時每次啟動隨機產生（跨重啟無法對應）
+CAPTURE_MAX_BYTES = int(os.getenv("CAPTURE_MAX_BYTES", str(50 * 1024 * 1024)))
+CAPTURE_BACKUPS = int(os.getenv("CAPTURE_BACKUPS", "5"))
+CAPTURE_QUEUE_SIZE = int(os.getenv("CAPTURE_QUEUE_SIZE", "10000"))
+
+# 指令關鍵字之外，main.chat_reply_limit 也看「翻譯」決定要不要截斷回答
+PRESERVED_WORDS = (*router.matcher.keywords, "翻譯")
+
+HASH_KEYS = frozenset(("userId", "groupId", "roomId", "id", "messageId", "quotedMessageId",
+                       "webhookEventId", "destination"))
+REDACT_KEYS = frozenset(("text", "title", "address", "fileName"))
+DROP_KEYS = frozenset(("replyToken", "quoteToken", "keywords", "latitude", "longitude",
+                       "originalContentUrl", "previewImageUrl", "pictureUrl"))
+
+logger = get_logger("capture")
+
+
+def _placeholder(char):
+    category = unicodedata.category(char)
+    if category[0] in "PZS" or char.isspace():
+        return char                 # 標點、空白、符號（含 emoji）不具識別性，保留以維持斷詞
+    if category == "Nd":
+        return "0"
+    if char.isascii():
+        return "x"
+    return "〇"
+
+
+class TextRedactor:
+    """只保留 words 中的關鍵字，其餘字元換成同類佔位字元（長度不變）"""
+
+    def __init__(self, words=PRESERVED_WORDS):
+        ordered = sorted(set(words), key=len, reverse=True)
+        self._pattern = re.compile("|".join(re.escape(w) for w in ordered), re.IGNORECASE)
+
+    def redact(self, text):
+        parts = []
+        pos = 0
+        for match in self._pattern.finditer(text):
+            parts.append("".join(_placeholder(c) for c in text[pos:match.start()]))
+            parts.append(match.group())
+            pos = match.end()
+        parts.append("".join(_placeholder(c) for c in text[pos:]))
+        return "".join(parts)
+
+
+class TrafficCapture:
+    """
+    path      : 錄製檔路徑（None 代表停用，record() 不做任何事）
+    salt      : id 雜湊用的 key；同一個 salt 錄下的檔案之間 id 可以對應
+    max_bytes : 目前檔案超過此大小就輪替
+    backups   : 保留幾份輪替後的 .gz
+    """
+
+    def __init__(self, path=CAPTURE_PATH, salt=CAPTURE_SALT, max_bytes=CAPTURE_MAX_BYTES,
+                 backups=CAPTURE_BACKUPS, queue_size=CAPTURE_QUEUE_SIZE, redactor=None):
+        self.path = path.format(pid=os.getpid()) if path else None
+        self.max_bytes = max_bytes
+        self.backups = backups
+        self.redactor = redactor or TextRedactor()
+        if path and not salt:
+            logger.warning("未設定 CAPTURE_SALT，錄製的 id 雜湊在重啟後會不同")
+        self._salt = (salt or secrets.token_hex(16)).encode()
+        self._lock = threading.Lock()
+        self.captured = 0
+        self.dropped = 0
+        self.errors = 0
+        self.written_bytes = 0
+        self.rotations = 0
+        self._file = None
+        self._size = 0
+        self._queue = None
+        if self.path:
+            self._queue = queue.Queue(maxsize=queue_size)
+            threading.Thread(target=self._write_loop, name="traffic-capture", daemon=True).start()
+            atexit.register(self._flush)
+
+    @property
+    def enabled(self):
+        return self._queue is not None
+
+    def record(self, body, arrived=None):
+        """callback 驗證簽名後呼叫：只排入佇列，不阻塞"""
+        if self._queue is None:
+            return
+        try:
+            self._queue.put_nowait((time.time() if arrived is None else arrived, body))
+        except queue.Full:
+            with self._lock:
+                self.dropped += 1
+
+    # ------------------------------
+    # 遮蔽
+    # ------------------------------
+    def hash_id(self, value):
+        """保留開頭字母與長度的 HMAC；純數字 id（訊息 id）雜湊成同長度的數字"""
+        if not isinstance(value, str) or not value:
+            return value
+        digest = hmac.new(self._salt, value.encode(), hashlib.sha256).hexdigest()
+        if value.isdigit():
+            return str(int(digest, 16))[:len(value)]
+        if value[0].isalpha() and len(value) > 1:
+            return value[0] + (digest * 2)[:len(value) - 1]
+        return (digest * 2)[:len(value)]
+
+    def sanitize(self, data):
+        if isinstance(data, dict):
+            result = {}
+            for key, value in data.items():
+                if key in DROP_KEYS:
+                    continue
+                if key in HASH_KEYS and isinstance(value, str):
+                    result[key] = self.hash_id(value)
+                elif key in REDACT_KEYS and isinstance(value, str):
+                    result[key] = self.redactor.redact(value)
+                else:
+                    result[key] = self.sanitize(value)
+            return result
+        if isinstance(data, list):
+            return [self.sanitize(item) for item in data]
+        return data
+
+    def to_record(self, arrived, body):
+        payload = json.loads(body)
+        return {"t": round(arrived, 3), "bytes": len(body.encode("utf-8")),
+                "events": self.sanitize(payload.get("events", []))}
+
+    # ------------------------------
+    # 寫檔
+    # ------------------------------
+    def _write_loop(self):
+        while True:
+            item = self._queue.get()
+            try:
+                batch = [item]
+                # 佇列裡累積的一併寫出
+                while True:
+                    try:
+                        batch.append(self._queue.get_nowait())
+                    except queue.Empty:
+                        break
+                for arrived, body in batch:
+                    self._write(arrived, body)
+                if self._file is not None:
+                    self._file.flush()
+            except OSError as e:
+                with self._lock:
+                    self.errors += 1
+                logger.warning("webhook 錄製寫入失敗", path=self.path, error=e)
+            finally:
+                for _ in batch:
+                    self._queue.task_done()
+
+    def _write(self, arrived, body):
+        try:
+            line = json.dumps(self.to_record(arrived, body), ensure_ascii=False, separators=(",", ":")) + "\n"
+        except (ValueError, AttributeError) as e:
+            with self._lock:
+                self.errors += 1
+            logger.warning("無法錄製的 webhook", error=e)
+            return
+        if self._file is None:
+            self._file = open(self.path, "a", encoding="utf-8")
+            self._size = self._file.tell()
+        data = line.encode("utf-8")
+        self._file.write(line)
+        self._size += len(data)
+        with self._lock:
+            self.captured += 1
+            self.written_bytes += len(data)
+        if self._size >= self.max_bytes:
+            self._rotate()
+
+    def _rotate(self):
+        """<path> → <path>.1.gz，既有的 .N.gz 往後移一號，超過 backups 的刪掉"""
+        self._file.close()
+        self._file = None
+        for index in range(self.backups, 0, -1):
+            source = f"{self.path}.{index}.gz"
+            if not os.path.exists(source):
+                continue
+            if index == self.backups:
+                os.remove(source)
+            else:
+                os.replace(source, f"{self.path}.{index + 1}.gz")
+        if self.backups > 0:
+            with open(self.path, "rb") as src, gzip.open(f"{self.path}.1.gz", "wb") as dst:
+                shutil.copyfileobj(src, dst)
+        os.remove(self.path)
+        with self._lock:
+            self.rotations += 1
+
+    def _flush(self, timeout=1.0):
+        deadline = time.monotonic() + timeout
+        while self._queue.unfinished_tasks and time.monotonic() < deadline:
+            time.sleep(0.01)
+
+    def stats(self):
+        with self._lock:
+            return {
+                "enabled": self.enabled,
+                "path": self.path,
+                "captured": self.captured,
+                "dropped": self.dropped,
+                "errors": self.errors,
+                "queued": self._queue.qsize() if self._queue else 0,
+                "written_bytes": self.written_bytes,
+                "rotations": self.rotations,
+            }
+
+
+def read_capture(path):
+    """依時間順序讀出錄製檔（含輪替後的 .N.gz，最舊的先讀）中的每一筆 webhook"""
+    paths = []
+    index = 1
+    while os.path.exists(f"{path}.{index}.gz"):
+        paths.append(f"{path}.{index}.gz")
+        index += 1
+    paths.reverse()
+    if os.path.exists(path):
+        paths.append(path)
+    for file_path in paths:
+        opener = gzip.open if file_path.endswith(".gz") else open
+        with opener(file_path, "rt", encoding="utf-8") as f:
+            for line in f:
+                line = line.strip()
+                if line:
+                    yield json.loads(line)
+
+
+# 全 process 共用
+traffic_capture = TrafficCapture()
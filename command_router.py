@@ -0,0 +1,170 @@
+"""
+指令路由：把所有指令的觸發詞編譯成一個多關鍵字比對器，
+訊息只需掃描一次就能判斷要交給哪個指令處理。
+
+指令以宣告方式定義（COMMANDS），判斷順序即為優先順序，
+與原本 handle_message 的 if 判斷順序一致。
+"""
+import re
+
+WAKE_WORD = "狗蛋"
+_MISSING = object()
+
+
+class Command:
+    """
+    單一指令的觸發條件：
+      all_of  : 訊息中必須同時包含的關鍵字
+      prefix  : 訊息必須以此字串開頭
+      none_of : 訊息中不可包含的關鍵字
+      scope   : "group" 僅限群組、"user" 僅限個人、None 不限
+    """
+    __slots__ = ("name", "all_of", "prefix", "none_of", "scope",
+                 "required_mask", "prefix_mask", "forbidden_mask")
+
+    def __init__(self, name, all_of=(), prefix=None, none_of=(), scope=None):
+        self.name = name
+        self.all_of = tuple(all_of)
+        self.prefix = prefix
+        self.none_of = tuple(none_of)
+        self.scope = scope
+        self.required_mask = 0
+        self.prefix_mask = 0
+        self.forbidden_mask = 0
+
+    def __repr__(self):
+        return f"Command({self.name!r})"
+
+
+class KeywordMatcher:
+    """
+    多關鍵字比對：所有關鍵字編譯成單一 regex，一次掃描回傳命中的關鍵字 bitmask，
+    比對迴圈在 C 端完成。
+
+    同一位置被較長關鍵字遮住的較短關鍵字（例如「狗蛋開車」裡的「狗蛋」）
+    由預先計算的「子字串閉包」補上；若關鍵字之間有部分重疊（A 的結尾是 B 的開頭），
+    改用零寬度 lookahead 在每個位置都嘗試比對，結果與 Aho-Corasick 相同。
+    """
+
+    def __init__(self, keywords):
+        self.keywords = list(keywords)
+        ordered = "|".join(re.escape(w) for w in sorted(self.keywords, key=len, reverse=True))
+        self.overlapping = any(
+            a[-k:] == b[:k]
+            for a in self.keywords for b in self.keywords if a != b
+            for k in range(1, min(len(a), len(b)))
+        )
+        self._pattern = re.compile(f"(?=({ordered}))" if self.overlapping else ordered)
+        self._start_pattern = re.compile(ordered)
+
+        # 命中 word 時，一併視為命中所有出現在 word 內的關鍵字 / 作為 word 開頭的關鍵字
+        self._contains = {}
+        self._prefixes = {}
+        for word in self.keywords:
+            self._contains[word] = sum(1 << i for i, other in enumerate(self.keywords) if other in word)
+            self._prefixes[word] = sum(1 << i for i, other in enumerate(self.keywords) if word.startswith(other))
+
+    def scan(self, text):
+        """回傳 (命中的關鍵字 bitmask, 出現在開頭的關鍵字 bitmask)"""
+        words = self._pattern.findall(text)
+        if not words:
+            return 0, 0
+        found = 0
+        contains = self._contains
+        for word in words:
+            found |= contains[word]
+        start = self._start_pattern.match(text)
+        return found, (self._prefixes[start.group()] if start else 0)
+
+
+class CommandRouter:
+    """把 Command 清單編譯成單一比對器，route() 掃描一次即可決定指令"""
+
+    def __init__(self, commands, default="ai_chat", wake_word=WAKE_WORD):
+        self.commands = list(commands)
+        self.default = default
+        self.wake_word = wake_word
+
+        keywords = {wake_word: 0}
+        for command in self.commands:
+            for word in command.all_of + command.none_of + ((command.prefix,) if command.prefix else ()):
+                keywords.setdefault(word, len(keywords))
+        self.matcher = KeywordMatcher(keywords)
+        self._wake_mask = 1 << keywords[wake_word]
+
+        self._resolved = {}
+
+        # 群組中不需要「狗蛋」就能觸發的指令關鍵字；沒有命中任何一個就可以直接略過
+        self._group_free_mask = 0
+        for command in self.commands:
+            command.required_mask = sum(1 << keywords[w] for w in set(command.all_of))
+            command.forbidden_mask = sum(1 << keywords[w] for w in set(command.none_of))
+            command.prefix_mask = (1 << keywords[command.prefix]) if command.prefix else 0
+            trigger_mask = command.required_mask | command.prefix_mask
+            if command.scope != "user" and not trigger_mask & self._wake_mask:
+                self._group_free_mask |= trigger_mask
+
+    def route(self, text, is_group=False):
+        """
+        回傳指令名稱；群組中未呼喚「狗蛋」且不是群組指令時回傳 None（不回應）。
+        text 需為已 strip().lower() 的訊息。
+        """
+        found, at_start = self.matcher.scan(text)
+
+        # 群組快速略過：沒有「狗蛋」也沒有任何免喚醒指令的關鍵字
+        if is_group and not found & (self._wake_mask | self._group_free_mask):
+            return None
+        if not found:
+            return self.default
+
+        # 判斷結果只取決於 (found, at_start, is_group)，組合數很少，直接快取
+        key = (found, at_start, is_group)
+        name = self._resolved.get(key, _MISSING)
+        if name is _MISSING:
+            name = self._resolve(found, at_start, is_group)
+            if len(self._resolved) < 4096:
+                self._resolved[key] = name
+        return name
+
+    def _resolve(self, found, at_start, is_group):
+        for command in self.commands:
+            if command.scope == "group" and not is_group:
+                continue
+            if command.scope == "user" and is_group:
+                continue
+            if found & command.required_mask != command.required_mask:
+                continue
+            if found & command.forbidden_mask:
+                continue
+            if command.prefix_mask and not at_start & command.prefix_mask:
+                continue
+            return command.name
+
+        if is_group and not found & self._wake_mask:
+            return None
+        return self.default
+
+
+# 狗蛋的指令表（順序即優先順序）
+COMMANDS = [
+    Command("give_id", all_of=("給我", "id")),
+    Command("group_id", all_of=("群組", "id"), scope="group"),
+    Command("group_id_private", all_of=("群組", "id"), scope="user"),
+    Command("guilt_trip", all_of=("狗蛋", "情勒")),
+    Command("help", all_of=("指令", "狗蛋")),
+    Command("leave_group", all_of=("狗蛋", "出去"), scope="group"),
+    Command("generate_image", all_of=("狗蛋生成",)),
+    Command("current_model", all_of=("模型", "當前")),
+    Command("switch_model", all_of=("換", "模型")),
+    Command("search", prefix="狗蛋搜尋"),
+    Command("person_intro", prefix="狗蛋介紹"),
+    Command("image_search", prefix="狗蛋搜圖"),
+    Command("sing", prefix="狗蛋唱歌"),
+    Command("weather", all_of=("氣象", "狗蛋")),
+    Command("forecast", all_of=("狗蛋", "預報")),
+    Command("video_search", all_of=("狗蛋開車",), none_of=("最熱", "最新")),
+    Command("video_hot", all_of=("狗蛋開車", "最熱")),
+    Command("video_new", all_of=("狗蛋開車", "最新")),
+]
+
+router = CommandRouter(COMMANDS)
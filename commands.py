@@ -0,0 +1,420 @@
+"""
+指令邏輯（main.py 的 Flask 入口與 asgi.py 的 ASGI 入口共用）。
+
+每個指令只決定「要做什麼」，以動作列表回傳，實際送出由各入口的 run_actions 執行：
+
+  Reply(messages)               回覆訊息（語音事件 / 已 ack / reply token 快過期時由 send_response 改用 push）
+  Job(name, payload, priority)  排入 main.job_queue 背景執行（兩個入口共用同一個佇列與各 pool 的同時執行上限）
+  Chat(prompt, model)           問 AI，答案以文字回覆（同步入口走 Groq / OpenAI SDK，非同步入口走 AsyncGroq / acreate）
+  SelectionMenu()               回覆 AI 模型選單
+  LeaveGroup(group_id)          離開群組
+
+新增或修改指令只需要改這裡與 command_router.COMMANDS，兩個入口的行為不會再分歧。
+"""
+import random
+from types import SimpleNamespace
+from linebot.v3.messaging.models import TextMessage
+from command_router import router
+from jobs import PRIORITY_HIGH, PRIORITY_NORMAL, PRIORITY_LOW
+from deadline import set_event_attr
+from app_logging import get_logger, bind
+import tracing
+
+logger = get_logger("commands")
+
+DEFAULT_AI_MODEL = "deepseek-r1-distill-llama-70b"
+
+# 「換模型」選單 postback data 對應的模型
+POSTBACK_MODEL_MAP = {
+    "model_gpt4o": "GPT-4o",
+    "model_gpt4o_mini": "GPT_4o_Mini",
+    "model_deepseek": DEFAULT_AI_MODEL,
+    "model_llama3": "llama3-8b-8192",
+}
+
+# 指令說明（加好友 / 「狗蛋指令」）
+FOLLOW_COMMAND_LIST = (
+    "📝 支援的指令：\n"
+    "1. 換模型: 更換 AI 語言模型 \n\t\t（預設為 Deepseek-R1）\n"
+    "2. 給我id: 顯示 LINE 個人 ID\n"
+    "3. 群組id: 顯示 LINE 群組 ID\n"
+    "4. 狗蛋出去: 機器人離開群組\n"
+    "5. 當前模型: 機器人現正使用的模型\n"
+    "6. 狗蛋生成: 生成圖片\n"
+    "7. 我要翻譯: 翻譯語言\n"
+    "8. 停止翻譯: 停止翻譯\n"
+    "9. 狗蛋情勒 狗蛋的超能力"
+)
+COMMAND_LIST = (
+    "📝 支援的指令：\n"
+    "1. 換模型: 更換 AI 語言模型 \n\t\t（預設為 Deepseek-R1）\n"
+    "2. 狗蛋出去: 機器人離開群組\n"
+    "3. 當前模型: 機器人現正使用的模型\n"
+    "4. 狗蛋生成: 生成圖片\n"
+    "5. 狗蛋介紹: 人物或角色的說明\n"
+    "6. 狗蛋搜圖: 即時搜圖\n"
+    "7. 狗蛋唱歌: 串連Spotify試聽\n"
+    "8. 狗蛋氣象: 確認當前天氣\n"
+    "9. 狗蛋預報: 確認三天天氣預報\n"
+    "10. 狗蛋情勒: 狗蛋的超能力"
+)
+
+RANDOM_REPLY_MESSAGES = [
+    "😏 哇，你終於想起家裡還有我這號人物了？",
+    "🤔 小時候那麼乖，怎麼長大了反而學壞了？",
+    "🙄 這麼多親戚，怎麼只有我記得幫忙？",
+    "😎 你長大了嘛，什麼事都不用家人操心了，對吧？",
+    "🥱 家裡是你旅館嗎？回來就吃飯，吃完就走？",
+    "😂 現在會頂嘴了，長大了不起了是不是？",
+    "😌 我們這輩子就這樣吧，下輩子不欠你的了。",
+    "🤥 你說什麼都對，反正長輩講話都沒人聽啦。",
+    "😇 嗯，你的道理聽起來很棒，但還是要聽我的。",
+    "😏 這次考不好沒關係，反正你習慣了。",
+    "🙄 每次說幫忙都說在忙，那你的忙是什麼時候結束？",
+    "🥲 哦？家裡不是你的避風港嗎？怎麼一出事就消失？",
+    "😌 反正我都是最閒的，你們才是最忙的嘛。",
+    "😎 家裡的事跟你無關？行啊，以後財產分配也不關你的事。",
+    "😒 啊～小時候那麼乖，怎麼現在只會氣人？",
+    "🥱 沒事，你開心就好，家裡怎麼樣都不重要對吧？",
+    "😏 你長大了，學會自己做決定了，出事可別找家裡哦。",
+    "🙃 哇，難得見到你，你今天是客人還是家人？",
+    "😇 你還記得家裡住哪嗎？怕你迷路呢。",
+    "😌 好啦好啦，家裡的事你不用管，反正你最忙最累了。",
+    "😏 哇，你終於有空理我了？",
+    "🤔 你這麼忙，連回個訊息的時間都沒有嗎？",
+    "😂 哦，你現在開始有標準了？當初不是什麼都可以？",
+    "😇 哇，你的愛情觀好偉大喔，我配不上你呢。",
+    "🙄 又在講大道理？還是說你根本沒打算解決問題？",
+    "😎 我知道啊，你很特別，特別會讓人心累。",
+    "🥱 你的承諾比天氣預報還不準呢。",
+    "😏 你說你沒變？哦，那是我自己長大了啦。",
+    "😂 你的愛是限量供應的嗎？怎麼輪到我時就沒了？",
+    "😌 我們的關係就像天氣，時好時壞，全看你的心情。",
+    "🙃 哇，這次冷戰比上次撐得更久，進步了呢！",
+    "🥱 你每次都這樣，然後期待我當沒事？",
+    "😇 哦，所以現在是我錯了？好啦，我認錯，滿意了吧？",
+    "😏 你對別人都很好，對我特別不一樣呢，真特別。",
+    "😂 你的道歉就像廣告，重複很多次但沒什麼用。",
+    "🙄 哦，你現在才發現我是個不錯的人？晚了呢～",
+    "😎 你說你不會再這樣？好啊，這是第幾次了呢？",
+    "😌 你這麼愛自由，談什麼戀愛啊？去當風吧。",
+    "😂 你說我們之間沒問題？對啊，問題都是我的。",
+    "😇 嗯，分手後你過得很好，謝謝你讓我見識什麼叫成長。",
+    "😏 哇，你的貢獻好大喔，真的沒有你不行呢！",
+    "🤔 這麼簡單的事都搞不定，真的沒問題嗎？",
+    "🙄 哦，所以這次的問題還是我的錯？好喔～",
+    "😂 哇，你好忙啊，忙著讓別人幫你做事？",
+    "😇 這種工作強度你都撐不住，那還是別做了吧？",
+    "😏 哦，原來拖延時間也是你的專業技能之一啊？",
+    "🥱 這次又是什麼理由？等一下要不要再編一個？",
+    "😎 你的 KPI 是擺爛吧？怎麼還沒達標？",
+    "😂 我以為你是來工作的，沒想到是來度假的。",
+    "😇 你這個決定很有創意呢，特別容易出事的那種。",
+    "🙄 這麼簡單的事都要問？你的腦子是裝飾品嗎？",
+    "😏 你要的東西「剛剛」才發給你，剛剛是三天前。",
+    "🥱 你的效率真讓人感動，感動到想哭。",
+    "😌 你是來這裡解決問題的，還是來製造問題的？",
+    "😂 哇，你的「馬上」和我的「馬上」果然不是同一個時區的。",
+    "😎 你的領悟能力真的很獨特，特別慢。",
+    "🙄 哦，現在是我的問題了？好啊，我背鍋習慣了。",
+    "😏 你這麼會找藉口，不去當小說家真的可惜了。",
+    "🥱 你真的不怕工作做不完嗎？還是你根本不打算做？",
+    "😂 哇，你的職場生存技能是什麼？推卸責任嗎？"
+]
+
+# 語音訊息中「狗蛋情勒」的回覆
+AUDIO_GUILT_REPLIES = [
+    "🥱你看我有想告訴你嗎？",
+    "😏我知道你在想什麼！",
+    "🤔你確定嗎？",
+    "😎好啦，不理你了！"
+]
+
+CITY_HINT = "❌ 請輸入有效的城市名稱, 包含行政區（例如：竹北市、東勢鄉）"
+
+
+class Reply:
+    __slots__ = ("messages",)
+
+    def __init__(self, messages):
+        self.messages = messages
+
+
+class Job:
+    __slots__ = ("name", "payload", "priority")
+
+    def __init__(self, name, payload, priority=PRIORITY_NORMAL):
+        self.name = name
+        self.payload = payload
+        self.priority = priority
+
+
+class Chat:
+    __slots__ = ("prompt", "model")
+
+    def __init__(self, prompt, model):
+        self.prompt = prompt
+        self.model = model
+
+
+class SelectionMenu:
+    __slots__ = ()
+
+
+class LeaveGroup:
+    __slots__ = ("group_id",)
+
+    def __init__(self, group_id):
+        self.group_id = group_id
+
+
+def reply_text(text):
+    """以單則文字訊息回覆"""
+    return Reply([TextMessage(text=text)])
+
+
+def queued(actions):
+    """動作中是否有背景工作（耗時由 job_queue 執行時統計，不算在指令本身）"""
+    return any(isinstance(action, Job) for action in actions)
+
+
+# ----------------------------------
+# 事件 → 指令
+# ----------------------------------
+def route_message(event):
+    """
+    解析文字訊息事件並判斷指令，回傳 (command, ctx)；
+    不是文字訊息、已處理過或群組中未呼喚「狗蛋」的閒聊回傳 (None, None)。
+    """
+    # 檢查 event.message 是否存在
+    if not hasattr(event, "message"):
+        return None, None
+
+    # 判斷 message 資料型態：
+    if isinstance(event.message, dict):
+        msg_type = event.message.get("type")
+        msg_text = event.message.get("text", "")
+    elif hasattr(event.message, "type"):
+        msg_type = event.message.type
+        msg_text = getattr(event.message, "text", "")
+    else:
+        return None, None
+
+    # 若事件已經被處理過，則直接返回
+    if getattr(event, "_processed", False):
+        return None, None
+
+    # 如果是從語音轉錄而來的事件，也可以標記為已處理
+    if getattr(event, "_is_audio", False):
+        set_event_attr(event, "_processed", True)
+
+    if msg_type != "text":
+        return None, None
+
+    # 取得使用者與群組資訊（採用 snake_case）
+    user_message = (msg_text or "").strip().lower()
+    user_id = event.source.user_id
+    group_id = event.source.group_id if event.source.type == "group" else None
+
+    # 單次掃描判斷指令；群組中未呼喚「狗蛋」的閒聊直接略過
+    with tracing.span("route"):
+        command = router.route(user_message, is_group=group_id is not None)
+    if command is None:
+        return None, None
+
+    bind(command=command)
+    tracing.annotate(command=command)
+    logger.info("收到指令")
+    return command, SimpleNamespace(user_message=user_message, user_id=user_id, group_id=group_id)
+
+
+def resolve_ai_model(ai_choice, user_id, group_id=None):
+    """取得 AI 回應要使用的模型：群組以群組設定為準，個人以個人設定為準"""
+    if group_id:
+        return ai_choice.get(group_id, DEFAULT_AI_MODEL)
+    return ai_choice.get(user_id, DEFAULT_AI_MODEL)
+
+
+def plan(command, ctx, ai_choice):
+    """指令 → 動作列表（ai_choice 為使用者 / 群組的模型設定）"""
+    return COMMAND_PLANS[command](ctx, ai_choice)
+
+
+def plan_follow():
+    """加好友時送出指令說明"""
+    return [reply_text(FOLLOW_COMMAND_LIST)]
+
+
+def plan_postback(data, user_id, group_id, ai_choice):
+    """「換模型」選單的 postback：記下選擇的模型"""
+    model = POSTBACK_MODEL_MAP.get(data)
+    if model is None:
+        return [reply_text("未知選擇，請重試。")]
+    ai_choice[group_id or user_id] = model
+    logger.info("選擇模型", model=model)
+    return [reply_text(f"已選擇語言模型: {model}！\n\n🔄 輸入「換模型」可重新選擇")]
+
+
+def plan_audio(transcribed_text, ai_response, is_group):
+    """語音轉錄完成後：圖片生成排入背景工作，其餘回覆轉錄內容（與 AI 回應）"""
+    if "狗蛋生成" in transcribed_text:
+        prompt = transcribed_text.split("狗蛋生成", 1)[1].strip() or "一隻可愛的小狗"
+        logger.debug("圖片生成", prompt=prompt)
+        return [Job("generate_image", {"prompt": prompt}, PRIORITY_LOW)]
+
+    messages = [TextMessage(text=f"🎙️ 轉錄內容：{transcribed_text}")]
+    if "狗蛋" in transcribed_text and "情勒" in transcribed_text:
+        # 如果包含「狗蛋情勒」指令，回覆隨機訊息（模擬回覆）
+        messages.append(TextMessage(text=random.choice(AUDIO_GUILT_REPLIES)))
+    elif is_group and "狗蛋" not in transcribed_text:
+        logger.debug("群組語音訊息未明確呼喚狗蛋，不進行 AI 回覆")
+    else:
+        messages.append(TextMessage(text=ai_response))
+    return [Reply(messages)]
+
+
+# ----------------------------------
+# Command（對應 command_router.COMMANDS）
+# ----------------------------------
+def cmd_give_id(ctx, ai_choice):
+    """「給我id」：若訊息中同時包含「給我」和「id」"""
+    reply = f"您的 User ID 是：\n{ctx.user_id}"
+    if ctx.group_id:
+        reply += f"\n這個群組的 ID 是：\n{ctx.group_id}"
+    return [reply_text(reply)]
+
+
+def cmd_group_id(ctx, ai_choice):
+    """「群組id」：在群組中，若訊息中同時包含「群組」和「id」"""
+    return [reply_text(f"這個群組的 ID 是：\n{ctx.group_id}")]
+
+
+def cmd_group_id_private(ctx, ai_choice):
+    """若為個人訊息卻要求群組指令，回覆錯誤訊息"""
+    return [reply_text("❌ 此指令僅限群組使用")]
+
+
+def cmd_guilt_trip(ctx, ai_choice):
+    """Random response from default pool"""
+    return [reply_text(random.choice(RANDOM_REPLY_MESSAGES))]
+
+
+def cmd_help(ctx, ai_choice):
+    """「狗蛋指令」：列出所有支援指令"""
+    return [reply_text(COMMAND_LIST)]
+
+
+def cmd_leave_group(ctx, ai_choice):
+    """處理「狗蛋出去」指令（僅適用於群組）"""
+    return [reply_text("我也不想留, 掰"), LeaveGroup(ctx.group_id)]
+
+
+def cmd_generate_image(ctx, ai_choice):
+    """「狗蛋生成」指令（例如圖片生成）"""
+    prompt = ctx.user_message.split("狗蛋生成", 1)[1].strip() or "一個美麗的風景"
+    logger.debug("圖片生成", prompt=prompt)
+    return [Job("generate_image", {"prompt": prompt}, PRIORITY_LOW)]
+
+
+def cmd_current_model(ctx, ai_choice):
+    """「當前模型」指令"""
+    model = ai_choice.get(ctx.group_id) if ctx.group_id else None
+    if model is None:
+        model = ai_choice.get(ctx.user_id, "Deepseek-R1")
+    return [reply_text(f"🤖 現在使用的 AI 模型是：\n{model}")]
+
+
+def cmd_switch_model(ctx, ai_choice):
+    """「換模型」"""
+    return [SelectionMenu()]
+
+
+def cmd_search(ctx, ai_choice):
+    """「狗蛋搜尋」指令：搜尋 + AI 總結"""
+    search_query = ctx.user_message.replace("狗蛋搜尋", "").strip()
+    if not search_query:
+        return [reply_text("請輸入要搜尋的內容，例如：狗蛋搜尋 OpenAI")]
+    return [Job("search", {"query": search_query})]
+
+
+def cmd_person_intro(ctx, ai_choice):
+    """狗蛋介紹 Image + AI 總結"""
+    person_name = ctx.user_message.replace("狗蛋介紹", "").strip()
+    if not person_name:
+        return [reply_text("請提供要查詢的人物名稱，例如：狗蛋介紹 川普")]
+    return [Job("person_intro", {"name": person_name})]
+
+
+def cmd_image_search(ctx, ai_choice):
+    """狗蛋搜圖 Image search"""
+    search_query = ctx.user_message.replace("狗蛋搜圖", "").strip()
+    if not search_query:
+        return [reply_text("請提供要搜尋的內容，例如：狗蛋搜圖 日本女星")]
+    return [Job("image_search", {"query": search_query})]
+
+
+def cmd_sing(ctx, ai_choice):
+    """狗蛋唱歌 Spotify link（下載試聽 + 轉檔較慢，排入背景工作）"""
+    return [Job("sing", {"song": ctx.user_message.replace("狗蛋唱歌", "").strip()})]
+
+
+def cmd_weather(ctx, ai_choice):
+    """狗蛋氣象：如果使用者輸入 "狗蛋氣象 台北"，則查詢台北天氣"""
+    city = ctx.user_message.replace("狗蛋氣象", "").strip()
+    if not city:
+        return [reply_text(CITY_HINT)]
+    return [Job("weather", {"city": city})]
+
+
+def cmd_forecast(ctx, ai_choice):
+    """狗蛋預報"""
+    city = ctx.user_message.replace("狗蛋預報", "").strip()
+    if not city:
+        return [reply_text(CITY_HINT)]
+    return [Job("forecast", {"city": city})]
+
+
+def cmd_video_search(ctx, ai_choice):
+    """「狗蛋開車」"""
+    search_query = ctx.user_message.replace("狗蛋開車", "").strip()
+    if not search_query:
+        return [reply_text("請提供人名，例如：狗蛋開車 狗蛋")]
+    return [Job("video_search", {"query": search_query}, PRIORITY_LOW)]
+
+
+def cmd_video_hot(ctx, ai_choice):
+    """「狗蛋開車最熱」（通常直接由 listing_cache 回傳）"""
+    return [Job("video_hot", {}, PRIORITY_HIGH)]
+
+
+def cmd_video_new(ctx, ai_choice):
+    """「狗蛋開車最新」（通常直接由 listing_cache 回傳）"""
+    return [Job("video_new", {}, PRIORITY_HIGH)]
+
+
+def cmd_ai_chat(ctx, ai_choice):
+    """預設：呼叫 AI 回應"""
+    return [Chat(ctx.user_message, resolve_ai_model(ai_choice, ctx.user_id, ctx.group_id))]
+
+
+COMMAND_PLANS = {
+    "give_id": cmd_give_id,
+    "group_id": cmd_group_id,
+    "group_id_private": cmd_group_id_private,
+    "guilt_trip": cmd_guilt_trip,
+    "help": cmd_help,
+    "leave_group": cmd_leave_group,
+    "generate_image": cmd_generate_image,
+    "current_model": cmd_current_model,
+    "switch_model": cmd_switch_model,
+    "search": cmd_search,
+    "person_intro": cmd_person_intro,
+    "image_search": cmd_image_search,
+    "sing": cmd_sing,
+    "weather": cmd_weather,
+    "forecast": cmd_forecast,
+    "video_search": cmd_video_search,
+    "video_hot": cmd_video_hot,
+    "video_new": cmd_video_new,
+    "ai_chat": cmd_ai_chat,
+}
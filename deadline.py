@@ -0,0 +1,156 @@
+"""
+Reply token 期限管理。
+
+LINE 的 reply token 只在 webhook 送達後的短時間內有效，過期後 reply_message 會失敗，
+而原本的程式只在語音事件（_is_audio）時改用 push。這裡讓每個事件在 webhook 抵達時
+就帶一個 Deadline（event._deadline），送出前檢查剩餘時間：
+
+  - 預估處理時間（command_latency，依指令滾動統計）來不及時，先用 reply token
+    回一句「處理中」，最後結果改用 push 送出（event._acked）
+  - 已經過期或已 ack 的事件一律 push
+  - 快的指令照舊使用免費的 reply
+"""
+import os, time, threading
+from collections import deque
+from contextlib import contextmanager
+
+REPLY_TOKEN_BUDGET = float(os.getenv("REPLY_TOKEN_BUDGET", "50"))
+SAFETY_MARGIN = 2.0
+
+
+class Deadline:
+    __slots__ = ("start", "expires_at")
+
+    def __init__(self, budget=REPLY_TOKEN_BUDGET, start=None):
+        self.start = time.monotonic() if start is None else start
+        self.expires_at = self.start + budget
+
+    def elapsed(self):
+        return time.monotonic() - self.start
+
+    def remaining(self):
+        return self.expires_at - time.monotonic()
+
+    def expired(self, margin=SAFETY_MARGIN):
+        return self.remaining() <= margin
+
+    def can_finish(self, estimate, margin=SAFETY_MARGIN):
+        """預估還要 estimate 秒的工作能否在 token 過期前完成"""
+        return self.remaining() - margin >= estimate
+
+
+def set_event_attr(event, name, value):
+    """
+    在事件上記錄私有屬性（_deadline、_acked …）。
+    linebot v3 的事件是 pydantic v1 model，直接指定未宣告的欄位會丟 ValueError，改用 object.__setattr__。
+    """
+    object.__setattr__(event, name, value)
+
+
+def attach_deadline(event, start=None):
+    """webhook 抵達時呼叫，替事件建立 Deadline"""
+    deadline = Deadline(start=start)
+    set_event_attr(event, "_deadline", deadline)
+    return deadline
+
+
+def deadline_of(event):
+    """取得事件的 Deadline；沒有的話（例如同步模式由 SDK 解析）從現在起算"""
+    deadline = getattr(event, "_deadline", None)
+    if deadline is None:
+        deadline = attach_deadline(event)
+    return deadline
+
+
+def push_reason(event):
+    """此事件的回覆要改用 push 的原因（"audio" / "acked" / "expired"），可以用 reply 時回傳 None"""
+    if getattr(event, "_is_audio", False):
+        return "audio"
+    if getattr(event, "_acked", False):
+        return "acked"
+    if deadline_of(event).expired():
+        return "expired"
+    return None
+
+
+def should_push(event):
+    """此事件的回覆是否應改用 push（語音事件、已 ack、或 reply token 快過期）"""
+    return push_reason(event) is not None
+
+
+def mark_acked(event):
+    """已用 reply token 回過「處理中」，之後的回覆都改用 push"""
+    set_event_attr(event, "_acked", True)
+
+
+def needs_ack(event, name):
+    """依 name 的預估耗時判斷是否需要先回「處理中」"""
+    if should_push(event):
+        return False
+    return not deadline_of(event).can_finish(command_latency.estimate(name))
+
+
+def is_invalid_reply_token(error):
+    return "Invalid reply token" in str(error)
+
+
+class LatencyTracker:
+    """
+    依名稱保留最近 window 筆耗時，估計值取第 percentile 百分位。
+    樣本不足 min_samples 時使用 priors 的預設值。
+    """
+
+    def __init__(self, window=50, percentile=0.9, min_samples=3, priors=None, default=1.0):
+        self.window = window
+        self.percentile = percentile
+        self.min_samples = min_samples
+        self.priors = dict(priors or {})
+        self.default = default
+        self._lock = threading.Lock()
+        self._samples = {}
+
+    def observe(self, name, seconds):
+        with self._lock:
+            samples = self._samples.get(name)
+            if samples is None:
+                samples = self._samples[name] = deque(maxlen=self.window)
+            samples.append(seconds)
+
+    def estimate(self, name):
+        with self._lock:
+            samples = self._samples.get(name)
+            if not samples or len(samples) < self.min_samples:
+                return self.priors.get(name, self.default)
+            ordered = sorted(samples)
+        return ordered[min(len(ordered) - 1, int(len(ordered) * self.percentile))]
+
+    @contextmanager
+    def measure(self, name):
+        start = time.monotonic()
+        try:
+            yield
+        finally:
+            self.observe(name, time.monotonic() - start)
+
+    def stats(self):
+        with self._lock:
+            names = list(self._samples)
+        return {name: {"samples": len(self._samples[name]), "estimate": round(self.estimate(name), 3)}
+                for name in names}
+
+
+# 沒有樣本前的預估（秒），依平常觀察到的上游耗時設定
+command_latency = LatencyTracker(priors={
+    "generate_image": 25.0,
+    "search": 12.0,
+    "person_intro": 10.0,
+    "image_search": 6.0,
+    "video_search": 20.0,
+    "video_hot": 1.0,
+    "video_new": 1.0,
+    "weather": 5.0,
+    "forecast": 6.0,
+    "sing": 8.0,
+    "ai_chat": 5.0,
+    "audio": 10.0,
+})
@@ -0,0 +1,113 @@
+import threading
+from collections import deque
+from app_logging import get_logger
+
+logger = get_logger("dispatcher")
+
+
+class ChatOrderedDispatcher:
+    """
+    有界的背景工作池：同一個聊天室（user_id / group_id）的事件依序處理，
+    不同聊天室的事件則平行處理。
+
+    用法：
+        dispatcher = ChatOrderedDispatcher(workers=4, max_pending=200)
+        dispatcher.submit(chat_key, func, event)
+    """
+
+    def __init__(self, workers=4, max_pending=200, name="dispatch"):
+        self.workers = max(1, int(workers))
+        self.max_pending = max(1, int(max_pending))
+        self.name = name
+
+        self._lock = threading.Lock()
+        self._ready = deque()           # 等待被 worker 取走的聊天室 key
+        self._ready_cond = threading.Condition(self._lock)
+        self._chat_queues = {}          # chat_key -> deque[(func, args)]
+        self._pending = 0               # 尚未執行完畢的事件數
+        self._busy = 0                  # 正在執行中的 worker 數
+        self._threads = []
+        self._stopping = False
+
+    def start(self):
+        """啟動 worker 執行緒（可重複呼叫）"""
+        with self._lock:
+            if self._threads:
+                return
+            self._stopping = False
+            for i in range(self.workers):
+                t = threading.Thread(target=self._worker_loop, name=f"{self.name}-{i}", daemon=True)
+                t.start()
+                self._threads.append(t)
+
+    def stop(self, timeout=None):
+        """停止接受新工作，等待 worker 把佇列清空後結束"""
+        with self._lock:
+            self._stopping = True
+            self._ready_cond.notify_all()
+            threads = list(self._threads)
+        for t in threads:
+            t.join(timeout)
+        with self._lock:
+            self._threads = []
+
+    def submit(self, chat_key, func, *args):
+        """
+        將工作排入 chat_key 的佇列。
+        佇列已滿或 dispatcher 停止時回傳 False，由呼叫端自行決定如何處理。
+        """
+        with self._lock:
+            if self._stopping or self._pending >= self.max_pending:
+                return False
+            self._pending += 1
+            chat_queue = self._chat_queues.get(chat_key)
+            if chat_queue is None:
+                # 此聊天室目前沒有工作在跑，直接排入 ready
+                self._chat_queues[chat_key] = deque([(func, args)])
+                self._ready.append(chat_key)
+                self._ready_cond.notify()
+            else:
+                # 此聊天室已有工作，排在後面以維持順序
+                chat_queue.append((func, args))
+        if not self._threads:
+            self.start()
+        return True
+
+    def stats(self):
+        """目前佇列狀態（給監控使用）"""
+        with self._lock:
+            return {
+                "workers": self.workers,
+                "busy": self._busy,
+                "pending": self._pending,
+                "chats": len(self._chat_queues),
+                "max_pending": self.max_pending,
+            }
+
+    def _worker_loop(self):
+        while True:
+            with self._lock:
+                while not self._ready and not self._stopping:
+                    self._ready_cond.wait()
+                if not self._ready:
+                    return
+                chat_key = self._ready.popleft()
+                func, args = self._chat_queues[chat_key][0]
+                self._busy += 1
+
+            try:
+                func(*args)
+            except Exception as e:
+                logger.error("背景事件處理錯誤", exc_info=True, chat_id=chat_key, error=e)
+            finally:
+                with self._lock:
+                    self._busy -= 1
+                    self._pending -= 1
+                    chat_queue = self._chat_queues[chat_key]
+                    chat_queue.popleft()
+                    if chat_queue:
+                        # 同一聊天室還有後續事件，重新排回 ready 尾端（公平輪替）
+                        self._ready.append(chat_key)
+                        self._ready_cond.notify()
+                    else:
+                        del self._chat_queues[chat_key]
@@ -0,0 +1,184 @@
+"""
+Webhook 事件去重（依 webhookEventId）。
+
+處理太慢時 LINE 會重送 webhook（deliveryContext.isRedelivery = true），同一個問題會被回答、計費兩次。
+callback 在排入處理前先檢查事件 id：
+
+  - 事件 id 先登記為「處理中」，只保留 processing_ttl 秒；處理完成（done）後才改為保留 ttl 秒。
+    處理失敗（release）或 process 中途結束時，LINE 重送的事件仍會被處理，不會因為已登記而被丟掉
+  - 記憶體內保留最近 max_entries 個 id
+  - 可選 SQLite 檔案讓所有 gunicorn worker 共用：以 upsert 原子地「登記或判定重複」，
+    重送的事件落在另一個 worker 也會被擋下
+  - 統計重複次數（其中多少是 LINE 標記的重送），可看出處理過慢導致重送的頻率
+
+    if webhook_dedupe.is_duplicate(event):
+        return
+    try:
+        handle(event)
+    except Exception:
+        webhook_dedupe.release(event)
+        raise
+    webhook_dedupe.done(event)
+"""
+import time, sqlite3, threading
+from collections import OrderedDict
+from app_logging import get_logger
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS webhook_events (
+    event_id    TEXT PRIMARY KEY,
+    seen_at     REAL NOT NULL,
+    done        INTEGER NOT NULL DEFAULT 0
+);
+CREATE INDEX IF NOT EXISTS webhook_events_seen_at ON webhook_events (seen_at);
+"""
+
+# 舊版資料表沒有的欄位
+_MIGRATIONS = {
+    "done": "ALTER TABLE webhook_events ADD COLUMN done INTEGER NOT NULL DEFAULT 0",
+}
+
+logger = get_logger("event_dedupe")
+
+
+def webhook_event_id(event):
+    return getattr(event, "webhook_event_id", None)
+
+
+def is_redelivery(event):
+    context = getattr(event, "delivery_context", None)
+    return bool(getattr(context, "is_redelivery", False))
+
+
+class EventDeduper:
+    """
+    ttl            : 處理完成的事件 id 保留秒數
+    processing_ttl : 處理中的登記保留秒數；超過後視為處理已中斷，重送的事件會再處理一次
+    max_entries  : 記憶體內最多保留幾個 id
+    db_path      : SQLite 檔案路徑（None 代表只用記憶體，各 worker 各自判斷）
+    purge_every  : 每登記幾個新事件清一次 SQLite 內的過期紀錄
+    """
+
+    def __init__(self, ttl=3600, max_entries=10000, db_path=None, purge_every=500, processing_ttl=300):
+        self.ttl = ttl
+        self.processing_ttl = min(processing_ttl, ttl)
+        self.max_entries = max_entries
+        self.purge_every = purge_every
+
+        self._lock = threading.Lock()
+        self._seen = OrderedDict()      # event_id -> expires_at
+        self._db = None
+        if db_path:
+            self._db = sqlite3.connect(db_path, check_same_thread=False, isolation_level=None, timeout=5)
+            self._db.execute("PRAGMA journal_mode=WAL")
+            self._db.executescript(_SCHEMA)
+            columns = {row[1] for row in self._db.execute("PRAGMA table_info(webhook_events)")}
+            for column, statement in _MIGRATIONS.items():
+                if column not in columns:
+                    self._db.execute(statement)
+        self._inserted = 0
+
+        self.accepted = 0
+        self.duplicates = 0
+        self.redeliveries = 0
+        self.redelivery_duplicates = 0
+        self.missing_id = 0
+        self.released = 0
+
+    def is_duplicate(self, event):
+        """登記事件；已處理過（或正在處理）時回傳 True"""
+        event_id = webhook_event_id(event)
+        redelivered = is_redelivery(event)
+        with self._lock:
+            if redelivered:
+                self.redeliveries += 1
+            if not event_id:
+                self.missing_id += 1
+                return False
+
+        duplicate = not self.claim(event_id)
+        with self._lock:
+            if duplicate:
+                self.duplicates += 1
+                if redelivered:
+                    self.redelivery_duplicates += 1
+            else:
+                self.accepted += 1
+        if duplicate:
+            logger.debug("略過重複的 webhook 事件", event_id=event_id, redelivered=redelivered)
+        return duplicate
+
+    def claim(self, event_id):
+        """第一次看到 event_id（或上次的登記已過期）時登記為處理中並回傳 True"""
+        now = time.time()
+        with self._lock:
+            expires_at = self._seen.get(event_id)
+            if expires_at is not None and expires_at > now:
+                return False
+            if self._db is not None and not self._claim_db(event_id, now):
+                # 其他 worker 正在處理或已處理完；不記在本機，對方 release 後重送的事件才能被接手
+                return False
+            self._remember(event_id, now + self.processing_ttl, now)
+            return True
+
+    def done(self, event):
+        """事件處理完成：登記改為保留 ttl 秒"""
+        event_id = webhook_event_id(event)
+        if not event_id:
+            return
+        now = time.time()
+        with self._lock:
+            self._remember(event_id, now + self.ttl, now)
+            if self._db is not None:
+                self._db.execute("UPDATE webhook_events SET done = 1, seen_at = ? WHERE event_id = ?", (now, event_id))
+
+    def release(self, event):
+        """事件處理失敗：撤銷處理中的登記，讓 LINE 重送的事件可以再處理"""
+        event_id = webhook_event_id(event)
+        if not event_id:
+            return
+        with self._lock:
+            self._seen.pop(event_id, None)
+            if self._db is not None:
+                self._db.execute("DELETE FROM webhook_events WHERE event_id = ? AND done = 0", (event_id,))
+            self.released += 1
+
+    def stats(self):
+        with self._lock:
+            return {
+                "entries": len(self._seen),
+                "shared": self._db is not None,
+                "accepted": self.accepted,
+                "duplicates": self.duplicates,
+                "redeliveries": self.redeliveries,
+                "redelivery_duplicates": self.redelivery_duplicates,
+                "missing_id": self.missing_id,
+                "released": self.released,
+            }
+
+    def _remember(self, event_id, expires_at, now):
+        """呼叫前需持有 _lock"""
+        self._seen[event_id] = expires_at
+        self._seen.move_to_end(event_id)
+        while len(self._seen) > self.max_entries:
+            self._seen.popitem(last=False)
+        # 大致依過期時間排序（處理中的登記較短，可能晚一點才清掉；查詢時仍會檢查過期時間），從頭清掉
+        while self._seen:
+            oldest, expires_at = next(iter(self._seen.items()))
+            if expires_at > now:
+                break
+            del self._seen[oldest]
+
+    def _claim_db(self, event_id, now):
+        """呼叫前需持有 _lock；新登記或覆蓋過期紀錄（已完成超過 ttl、處理中超過 processing_ttl）時回傳 True"""
+        cursor = self._db.execute(
+            "INSERT INTO webhook_events (event_id, seen_at, done) VALUES (?, ?, 0) "
+            "ON CONFLICT(event_id) DO UPDATE SET seen_at = excluded.seen_at, done = 0 "
+            "WHERE webhook_events.seen_at < CASE WHEN webhook_events.done THEN ? ELSE ? END",
+            (event_id, now, now - self.ttl, now - self.processing_ttl))
+        claimed = cursor.rowcount == 1
+        if claimed:
+            self._inserted += 1
+            if self._inserted % self.purge_every == 0:
+                self._db.execute("DELETE FROM webhook_events WHERE seen_at < ?", (now - self.ttl,))
+        return claimed
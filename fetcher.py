@@ -0,0 +1,132 @@
+"""
+分層抓取：先用一般 HTTP（共用的 http_client 連線池），被 Cloudflare 擋下才改用 cloudscraper，
+最後才動用 Chromium。每個 host 會記住上次成功的層級，下次直接從那一層開始，
+並在 RELEARN_AFTER 秒後重新從最便宜的層級嘗試。
+"""
+import time, threading
+from urllib.parse import urlsplit
+import httpx
+import cloudscraper
+from browser_pool import browser_pool
+from http_client import http_client
+from metrics import metrics
+import tracing
+from app_logging import get_logger
+
+TIER_HTTP = "http"
+TIER_CLOUDSCRAPER = "cloudscraper"
+TIER_BROWSER = "browser"
+TIERS = (TIER_HTTP, TIER_CLOUDSCRAPER, TIER_BROWSER)
+
+CHALLENGE_MARKERS = ("Just a moment...", "challenge-error-text")
+BLOCKED_STATUS = {403, 429, 503}
+
+logger = get_logger("fetcher")
+
+
+def is_challenge(status, html):
+    """判斷回應是否為 Cloudflare 防護頁（或被擋下的狀態碼）"""
+    if any(marker in html for marker in CHALLENGE_MARKERS):
+        return True
+    return status in BLOCKED_STATUS
+
+
+class FetchResult:
+    __slots__ = ("url", "status", "text", "tier", "elapsed")
+
+    def __init__(self, url, status, text, tier, elapsed):
+        self.url = url
+        self.status = status
+        self.text = text
+        self.tier = tier
+        self.elapsed = elapsed
+
+
+class TieredFetcher:
+    def __init__(self, timeout=(3.05, 8), relearn_after=600):
+        self.timeout = timeout
+        self.relearn_after = relearn_after
+
+        self._scraper = None
+        self._lock = threading.Lock()
+        self._host_tier = {}    # host -> (tier index, 記錄時間)
+        self.tier_counts = {tier: 0 for tier in TIERS}
+
+    def fetch(self, url, headers=None, browser=True):
+        """
+        依序嘗試各層級，回傳第一個不是防護頁的 FetchResult；全部失敗回傳 None。
+        browser=False 時不會啟動 Chromium（呼叫端自己用瀏覽器處理），
+        若此 host 已知只能用瀏覽器，直接回傳 None。
+        """
+        host = urlsplit(url).hostname
+        for tier in TIERS[self.start_tier(host):]:
+            if tier == TIER_BROWSER and not browser:
+                return None
+            start = time.perf_counter()
+            try:
+                status, text = self._fetch_tier(tier, url, headers or {})
+            except Exception as e:
+                logger.warning("抓取失敗", tier=tier, host=host, error=e)
+                continue
+            if is_challenge(status, text):
+                logger.warning("被防護頁擋下", tier=tier, host=host, status=status)
+                continue
+            self.remember(host, tier)
+            return FetchResult(url, status, text, tier, time.perf_counter() - start)
+        return None
+
+    def start_tier(self, host):
+        """此 host 應該從哪一層開始嘗試"""
+        with self._lock:
+            learned = self._host_tier.get(host)
+        if learned is None or time.monotonic() - learned[1] > self.relearn_after:
+            return 0
+        return learned[0]
+
+    def remember(self, host, tier):
+        """記錄此 host 最近一次成功的層級"""
+        with self._lock:
+            self._host_tier[host] = (TIERS.index(tier), time.monotonic())
+            self.tier_counts[tier] += 1
+
+    def stats(self):
+        with self._lock:
+            return {
+                "hosts": {host: TIERS[index] for host, (index, _) in self._host_tier.items()},
+                "tier_counts": dict(self.tier_counts),
+            }
+
+    def _fetch_tier(self, tier, url, headers):
+        if tier == TIER_BROWSER:
+            # 瀏覽器分頁的耗時由 browser_pool 記錄（playwright）
+            return browser_pool.run(lambda page: _browser_fetch(page, url, headers))
+        start = time.perf_counter()
+        try:
+            with tracing.span("scrape", tier=tier, host=urlsplit(url).hostname):
+                if tier == TIER_HTTP:
+                    response = http_client.get(url, headers=headers,
+                                               timeout=httpx.Timeout(self.timeout[1], connect=self.timeout[0]))
+                else:
+                    response = self._cloudscraper().get(url, headers=headers, timeout=self.timeout)
+        except Exception:
+            metrics.observe_upstream("scrape", tier, time.perf_counter() - start, error=True)
+            raise
+        metrics.observe_upstream("scrape", tier, time.perf_counter() - start, result=response,
+                                 error=response.status_code >= 500)
+        return response.status_code, response.text
+
+    def _cloudscraper(self):
+        with self._lock:
+            if self._scraper is None:
+                self._scraper = cloudscraper.create_scraper()
+            return self._scraper
+
+
+async def _browser_fetch(page, url, headers):
+    if headers:
+        await page.set_extra_http_headers(headers)
+    response = await page.goto(url, timeout=20000)
+    return (response.status if response else 0), await page.content()
+
+
+fetcher = TieredFetcher()
@@ -0,0 +1,134 @@
+"""
+共用的對外 HTTP client。
+
+所有對外呼叫（Google、OpenWeather、LINE 內容下載、Whisper、Spotify 試聽檔…）共用同一個
+httpx.Client：每個 host 各自維持 keep-alive 連線池，支援的 host 走 HTTP/2，
+預設有 connect / read timeout（原本 requests.get 沒帶 timeout，上游卡住時 worker 也跟著卡住）。
+
+另外依 host 統計請求數、錯誤數、上下行位元組與延遲，供監控使用：
+
+    response = http_client.get(url, params={"q": "台北"})
+    http_client.stats()["api.openweathermap.org"]
+"""
+import os, time, threading
+from contextlib import contextmanager
+from urllib.parse import urlsplit
+import httpx
+
+DEFAULT_TIMEOUT = httpx.Timeout(float(os.getenv("HTTP_READ_TIMEOUT", "10")),
+                                connect=float(os.getenv("HTTP_CONNECT_TIMEOUT", "3.05")))
+DOWNLOAD_CHUNK_SIZE = 64 * 1024
+
+
+class _HostStats:
+    __slots__ = ("requests", "errors", "bytes_in", "bytes_out", "total_ms", "max_ms")
+
+    def __init__(self):
+        self.requests = 0
+        self.errors = 0
+        self.bytes_in = 0
+        self.bytes_out = 0
+        self.total_ms = 0.0
+        self.max_ms = 0.0
+
+    def to_dict(self):
+        return {
+            "requests": self.requests,
+            "errors": self.errors,
+            "bytes_in": self.bytes_in,
+            "bytes_out": self.bytes_out,
+            "avg_ms": round(self.total_ms / self.requests, 1) if self.requests else 0.0,
+            "max_ms": round(self.max_ms, 1),
+        }
+
+
+class HttpClient:
+    """
+    timeout          : 預設 httpx.Timeout，個別呼叫可用 timeout= 覆寫
+    max_connections  : 全部 host 合計的連線上限
+    max_keepalive    : 保留的閒置連線數
+    keepalive_expiry : 閒置連線保留秒數
+    """
+
+    def __init__(self, timeout=DEFAULT_TIMEOUT, max_connections=50, max_keepalive=20,
+                 keepalive_expiry=60, http2=True):
+        self._client = httpx.Client(
+            http2=http2,
+            timeout=timeout,
+            follow_redirects=True,  # 與 requests 預設行為一致
+            limits=httpx.Limits(max_connections=max_connections,
+                                max_keepalive_connections=max_keepalive,
+                                keepalive_expiry=keepalive_expiry),
+        )
+        self._lock = threading.Lock()
+        self._hosts = {}
+
+    def request(self, method, url, **kwargs):
+        start = time.perf_counter()
+        try:
+            response = self._client.request(method, url, **kwargs)
+        except httpx.HTTPError:
+            self._record(url, start, error=True)
+            raise
+        self._record(url, start, response=response)
+        return response
+
+    def get(self, url, **kwargs):
+        return self.request("GET", url, **kwargs)
+
+    def post(self, url, **kwargs):
+        return self.request("POST", url, **kwargs)
+
+    @contextmanager
+    def stream(self, method, url, **kwargs):
+        """串流下載；離開 with 區塊時才記錄統計（包含讀取 body 的時間）"""
+        start = time.perf_counter()
+        try:
+            with self._client.stream(method, url, **kwargs) as response:
+                try:
+                    yield response
+                finally:
+                    self._record(url, start, response=response)
+        except httpx.HTTPError:
+            self._record(url, start, error=True)
+            raise
+
+    def download(self, url, path, **kwargs):
+        """將 url 內容串流寫入 path，回傳 HTTP 狀態碼（非 200 時不寫檔）"""
+        with self.stream("GET", url, **kwargs) as response:
+            if response.status_code == 200:
+                with open(path, "wb") as f:
+                    for chunk in response.iter_bytes(DOWNLOAD_CHUNK_SIZE):
+                        f.write(chunk)
+            return response.status_code
+
+    def stats(self):
+        with self._lock:
+            return {host: s.to_dict() for host, s in self._hosts.items()}
+
+    def close(self):
+        self._client.close()
+
+    def _record(self, url, start, response=None, error=False):
+        elapsed_ms = (time.perf_counter() - start) * 1000
+        host = urlsplit(str(url)).hostname or "unknown"
+        bytes_out = 0
+        bytes_in = 0
+        if response is not None:
+            bytes_out = int(response.request.headers.get("content-length", 0) or 0)
+            bytes_in = response.num_bytes_downloaded
+            error = response.status_code >= 500
+        with self._lock:
+            s = self._hosts.get(host)
+            if s is None:
+                s = self._hosts[host] = _HostStats()
+            s.requests += 1
+            s.errors += int(error)
+            s.bytes_in += bytes_in
+            s.bytes_out += bytes_out
+            s.total_ms += elapsed_ms
+            s.max_ms = max(s.max_ms, elapsed_ms)
+
+
+# 全 process 共用
+http_client = HttpClient()
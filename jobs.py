@@ -0,0 +1,329 @@
+"""
+慢指令的背景工作佇列（圖片生成、爬蟲、天氣預報、搜尋摘要）。
+
+指令處理只負責把工作排進佇列（帶優先序與目標聊天室）就返回，
+由 worker 執行後透過 deliver() 把結果送回 LINE，便宜的指令不必排在 20 秒的爬蟲後面。
+
+  - 每個工作類型屬於一個 pool，pool 有各自的同時執行上限（例如 browser: 2、image: 1），
+    依機器記憶體限制同時開的 Chromium / 圖片生成數
+  - 同一個 pool 內 priority 數字小的先做，同優先序依排入順序
+  - 工作寫入 SQLite（多個 gunicorn worker 共用同一個檔案），每筆工作記錄 owner 與 lease 期限：
+    排入的 process 定期延長自己工作的 lease；worker 執行前以
+    UPDATE ... WHERE status = 'queued' AND owner = 自己 原子地認領，同一個工作只會執行一次
+  - 各 process 定期接手 lease 已過期（原本的 process 已結束或卡住）的未完成工作，
+    超過 max_attempts 次則放棄
+
+    job_queue = JobQueue("/tmp/jobs.db", deliver=deliver_job_result)
+    job_queue.register("generate_image", job_generate_image, pool="image")
+    job_queue.submit("generate_image", {"prompt": "小狗"}, target=user_id, event=event)
+"""
+import os, json, time, heapq, sqlite3, secrets, itertools, threading
+from metrics import metrics
+import tracing
+from app_logging import get_logger
+
+PRIORITY_HIGH = 0
+PRIORITY_NORMAL = 5
+PRIORITY_LOW = 9
+
+STATUS_QUEUED = "queued"
+STATUS_RUNNING = "running"
+STATUS_DONE = "done"
+STATUS_FAILED = "failed"
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS jobs (
+    id          INTEGER PRIMARY KEY AUTOINCREMENT,
+    name        TEXT NOT NULL,
+    priority    INTEGER NOT NULL,
+    target      TEXT,
+    payload     TEXT NOT NULL,
+    status      TEXT NOT NULL,
+    attempts    INTEGER NOT NULL DEFAULT 0,
+    error       TEXT,
+    created_at  REAL NOT NULL,
+    updated_at  REAL NOT NULL,
+    owner       TEXT,
+    lease_until REAL
+);
+CREATE INDEX IF NOT EXISTS jobs_status ON jobs (status);
+"""
+# 舊版資料表沒有 owner / lease_until 欄位（lease_until 為 NULL 視為已過期）
+_MIGRATIONS = {"owner": "ALTER TABLE jobs ADD COLUMN owner TEXT",
+               "lease_until": "ALTER TABLE jobs ADD COLUMN lease_until REAL"}
+
+logger = get_logger("jobs")
+
+
+class Job:
+    __slots__ = ("id", "name", "priority", "target", "payload", "attempts", "created_at")
+
+    def __init__(self, id, name, priority, target, payload, attempts=0, created_at=None):
+        self.id = id
+        self.name = name
+        self.priority = priority
+        self.target = target
+        self.payload = payload
+        self.attempts = attempts
+        self.created_at = created_at or time.time()
+
+
+class JobQueue:
+    """
+    db_path      : SQLite 檔案路徑（None 代表只放在記憶體，不保存）
+    deliver      : deliver(job, messages, event) — 把結果送回聊天室；messages 為 None 代表工作失敗
+    workers      : worker 執行緒數
+    pool_limits  : {pool: 同時執行上限}，未列出的 pool 使用 default_limit
+    latency      : 可選的 deadline.LatencyTracker，記錄每種工作的實際耗時
+    keep_done    : 完成的工作在資料表保留多久（秒）
+    lease        : 工作的 lease 秒數；每 lease / 3 秒延長一次並檢查其他 process 留下的過期工作
+    """
+
+    def __init__(self, db_path, deliver, workers=4, pool_limits=None, default_limit=2,
+                 max_attempts=2, latency=None, keep_done=86400, lease=30):
+        self.db_path = db_path
+        self.deliver = deliver
+        self.workers = max(1, int(workers))
+        self.pool_limits = dict(pool_limits or {})
+        self.default_limit = default_limit
+        self.max_attempts = max_attempts
+        self.latency = latency
+        self.keep_done = keep_done
+        self.lease = lease
+        # 同一台機器上 pid 可能重複使用（容器內常是 1），加上隨機字串區分每次啟動
+        self.owner = f"{os.getpid()}-{secrets.token_hex(4)}"
+
+        self._handlers = {}              # name -> (func, pool)
+        self._cond = threading.Condition()
+        self._queues = {}                # pool -> heap[(priority, seq, Job)]
+        self._running = {}               # pool -> 執行中數量
+        self._events = {}                # job id -> LINE event（只存在記憶體，重啟後改用 push）
+        self._seq = itertools.count()
+        self._threads = []
+        self._stopping = False
+
+        self._db_lock = threading.Lock()
+        self._db = sqlite3.connect(db_path or ":memory:", check_same_thread=False, isolation_level=None, timeout=5)
+        if db_path:
+            self._db.execute("PRAGMA journal_mode=WAL")
+        self._db.executescript(_SCHEMA)
+        columns = {row[1] for row in self._db.execute("PRAGMA table_info(jobs)")}
+        for column, statement in _MIGRATIONS.items():
+            if column not in columns:
+                self._db.execute(statement)
+
+        self.completed = 0
+        self.failed = 0
+        self.recovered = 0
+        self.lost = 0
+
+    def register(self, name, func, pool="default"):
+        """登記工作類型：func(payload) 回傳要送出的 LINE 訊息列表"""
+        self._handlers[name] = (func, pool)
+
+    def __contains__(self, name):
+        return name in self._handlers
+
+    def submit(self, name, payload, target=None, event=None, priority=PRIORITY_NORMAL):
+        """排入一個工作，回傳 job id"""
+        if name not in self._handlers:
+            raise KeyError(f"未登記的工作類型: {name}")
+        if not self._threads:
+            self.start()
+        now = time.time()
+        with self._db_lock:
+            cursor = self._db.execute(
+                "INSERT INTO jobs (name, priority, target, payload, status, created_at, updated_at, owner, lease_until) "
+                "VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)",
+                (name, priority, target, json.dumps(payload, ensure_ascii=False), STATUS_QUEUED, now, now,
+                 self.owner, now + self.lease))
+        job = Job(cursor.lastrowid, name, priority, target, payload, created_at=now)
+        # 事件的 trace 要等工作執行完才算完成
+        trace = tracing.trace_of(event)
+        if trace is not None:
+            trace.hold()
+        self._enqueue(job, event)
+        return job.id
+
+    def start(self):
+        """接手 lease 已過期的未完成工作並啟動 worker 與 lease 執行緒（可重複呼叫）"""
+        with self._cond:
+            if self._threads:
+                return
+            self._stopping = False
+            self._recover()
+            for i in range(self.workers):
+                t = threading.Thread(target=self._worker_loop, name=f"job-{i}", daemon=True)
+                t.start()
+                self._threads.append(t)
+            t = threading.Thread(target=self._lease_loop, name="job-lease", daemon=True)
+            t.start()
+            self._threads.append(t)
+
+    def stop(self, timeout=None):
+        with self._cond:
+            self._stopping = True
+            self._cond.notify_all()
+            threads = list(self._threads)
+        for t in threads:
+            t.join(timeout)
+        with self._cond:
+            self._threads = []
+
+    def stats(self):
+        with self._cond:
+            pools = {pool: {"queued": len(self._queues.get(pool, ())),
+                            "running": self._running.get(pool, 0),
+                            "limit": self._limit(pool)}
+                     for pool in set(self._queues) | set(self._running)}
+        return {"pools": pools, "completed": self.completed, "failed": self.failed,
+                "recovered": self.recovered, "lost": self.lost}
+
+    # ------------------------------
+    # 排程
+    # ------------------------------
+    def _limit(self, pool):
+        return self.pool_limits.get(pool, self.default_limit)
+
+    def _enqueue(self, job, event=None):
+        pool = self._handlers[job.name][1]
+        with self._cond:
+            if event is not None:
+                self._events[job.id] = event
+            heapq.heappush(self._queues.setdefault(pool, []), (job.priority, next(self._seq), job))
+            # lease 執行緒也在等同一個 condition，notify() 可能只叫醒它而沒有 worker 接手
+            self._cond.notify_all()
+
+    def _next_job(self):
+        """挑出「還有名額的 pool」中優先序最高的工作；呼叫前需持有 _cond"""
+        best = None
+        for pool, heap in self._queues.items():
+            if heap and self._running.get(pool, 0) < self._limit(pool):
+                if best is None or heap[0][:2] < self._queues[best][0][:2]:
+                    best = pool
+        if best is None:
+            return None, None
+        _, _, job = heapq.heappop(self._queues[best])
+        self._running[best] = self._running.get(best, 0) + 1
+        return best, job
+
+    def _worker_loop(self):
+        while True:
+            with self._cond:
+                while True:
+                    if self._stopping:
+                        return
+                    pool, job = self._next_job()
+                    if job is not None:
+                        break
+                    self._cond.wait()
+                event = self._events.pop(job.id, None)
+            try:
+                with tracing.activate(tracing.trace_of(event), held=True):
+                    tracing.record("job_wait", time.perf_counter() - (time.time() - job.created_at), job=job.name)
+                    self._run(job, event)
+            finally:
+                with self._cond:
+                    self._running[pool] -= 1
+                    self._cond.notify_all()
+
+    def _run(self, job, event):
+        if not self._claim(job):
+            # lease 過期後已被其他 process 接手
+            self.lost += 1
+            logger.warning("工作已被其他 process 接手，略過", job=job.name, job_id=job.id)
+            return
+        func = self._handlers[job.name][0]
+        job.attempts += 1
+        start = time.monotonic()
+        try:
+            with metrics.time_command(job.name), tracing.span("job", job=job.name, attempt=job.attempts):
+                messages = func(job.payload)
+        except Exception as e:
+            logger.error("背景工作失敗", exc_info=True, job=job.name, job_id=job.id, error=e)
+            self.failed += 1
+            self._update(job.id, STATUS_FAILED, error=str(e))
+            self._deliver(job, None, event)
+            return
+        finally:
+            if self.latency is not None:
+                self.latency.observe(job.name, time.monotonic() - start)
+        self.completed += 1
+        self._update(job.id, STATUS_DONE)
+        self._deliver(job, messages, event)
+
+    def _deliver(self, job, messages, event):
+        try:
+            self.deliver(job, messages, event)
+        except Exception as e:
+            logger.error("背景工作結果送出失敗", job=job.name, job_id=job.id, error=e)
+
+    # ------------------------------
+    # SQLite
+    # ------------------------------
+    def _update(self, job_id, status, error=None):
+        with self._db_lock:
+            self._db.execute("UPDATE jobs SET status = ?, error = ?, updated_at = ?, lease_until = NULL WHERE id = ?",
+                             (status, error, time.time(), job_id))
+
+    def _claim(self, job):
+        """queued → running；只有仍由自己持有的工作才會成功（UPDATE 為原子操作）"""
+        now = time.time()
+        with self._db_lock:
+            cursor = self._db.execute(
+                "UPDATE jobs SET status = ?, attempts = attempts + 1, lease_until = ?, updated_at = ? "
+                "WHERE id = ? AND status = ? AND owner = ?",
+                (STATUS_RUNNING, now + self.lease, now, job.id, STATUS_QUEUED, self.owner))
+        return cursor.rowcount == 1
+
+    def _renew(self):
+        """延長自己所有未完成工作（排隊中與執行中）的 lease"""
+        now = time.time()
+        with self._db_lock:
+            self._db.execute("UPDATE jobs SET lease_until = ? WHERE owner = ? AND status IN (?, ?)",
+                             (now + self.lease, self.owner, STATUS_QUEUED, STATUS_RUNNING))
+
+    def _lease_loop(self):
+        while True:
+            with self._cond:
+                if self._cond.wait_for(lambda: self._stopping, timeout=self.lease / 3):
+                    return
+            try:
+                self._renew()
+                self._recover()
+            except sqlite3.Error as e:
+                logger.warning("工作 lease 更新失敗", error=e)
+
+    def _recover(self):
+        """
+        接手 lease 已過期的未完成工作（原本的 process 已結束或卡住，執行中被中斷的也算），並清掉過舊的完成紀錄。
+        以帶著「lease 已過期」條件的 UPDATE 搶下，多個 process 同時檢查時每個工作只會被一個接手。
+        """
+        now = time.time()
+        expired = "status IN (?, ?) AND (lease_until IS NULL OR lease_until < ?)"
+        with self._db_lock:
+            self._db.execute("DELETE FROM jobs WHERE status IN (?, ?) AND updated_at < ?",
+                             (STATUS_DONE, STATUS_FAILED, now - self.keep_done))
+            rows = self._db.execute(
+                f"SELECT id, name, priority, target, payload, attempts, created_at FROM jobs WHERE {expired} ORDER BY id",
+                (STATUS_QUEUED, STATUS_RUNNING, now)).fetchall()
+
+        recovered = 0
+        for job_id, name, priority, target, payload, attempts, created_at in rows:
+            give_up = name not in self._handlers or attempts >= self.max_attempts
+            with self._db_lock:
+                if give_up:
+                    self._db.execute(f"UPDATE jobs SET status = ?, error = ?, updated_at = ? WHERE id = ? AND {expired}",
+                                     (STATUS_FAILED, "放棄：未登記或重試次數已滿", now, job_id,
+                                      STATUS_QUEUED, STATUS_RUNNING, now))
+                    continue
+                taken = self._db.execute(
+                    f"UPDATE jobs SET status = ?, owner = ?, lease_until = ?, updated_at = ? WHERE id = ? AND {expired}",
+                    (STATUS_QUEUED, self.owner, now + self.lease, now, job_id,
+                     STATUS_QUEUED, STATUS_RUNNING, now)).rowcount
+            if taken:
+                self._enqueue(Job(job_id, name, priority, target, json.loads(payload), attempts, created_at))
+                recovered += 1
+        if recovered:
+            self.recovered += recovered
+            logger.info("接手未完成的工作", count=recovered)
@@ -0,0 +1,372 @@
+"""
+LINE 訊息送出排程：reply / push 各自的 token bucket、跨聊天室公平輪流的佇列、每月 push 額度計算。
+
+原本每個 request thread 直接呼叫 LINE，流量一集中就整批收到 429，再一起重試（又花掉 push 額度）。
+改為所有送出都經過 DeliveryScheduler：
+
+  - 每個 API（reply / push）一個 token bucket，以固定速率送出，不再忽快忽慢
+  - 每個 API 的佇列依聊天室分開、輪流取出：一個聊天室大量的工作結果不會擋住其他聊天室；
+    同一聊天室同時只送一則，維持順序
+  - 收到 429（非月額度）時 bucket 暫停一小段時間
+  - push 額度記在 SQLite（多個 gunicorn worker 共用，UPDATE 為原子操作），
+    並定期以 LINE 的 quota API 校正（群組 push 會依成員數計費，本機只能以 1 則估算）
+  - 剩餘額度低於 reserve 時進入「只用 reply」的降級模式，push 直接丟 QuotaExceededError
+
+    line_delivery = DeliveryScheduler({KIND_REPLY: send_reply_now, KIND_PUSH: send_push_now},
+                                      rates={KIND_REPLY: (50, 50), KIND_PUSH: (20, 20)}, quota=push_quota)
+    line_delivery.deliver(KIND_PUSH, group_id, push_request)
+"""
+import time, sqlite3, datetime, threading, contextvars
+from collections import OrderedDict, deque
+from concurrent.futures import Future
+from resilience import error_status
+import tracing
+from app_logging import get_logger
+
+KIND_REPLY = "reply"
+KIND_PUSH = "push"
+JST = datetime.timezone(datetime.timedelta(hours=9))
+
+_QUOTA_SCHEMA = """
+CREATE TABLE IF NOT EXISTS push_quota (
+    month       TEXT PRIMARY KEY,
+    used        INTEGER NOT NULL DEFAULT 0,
+    quota       INTEGER,
+    exhausted   INTEGER NOT NULL DEFAULT 0,
+    synced_at   REAL
+);
+"""
+
+logger = get_logger("line_delivery")
+
+
+class QuotaExceededError(Exception):
+    """push 額度不足（或已降級為只用 reply），請求未送出"""
+
+
+class TokenBucket:
+    def __init__(self, rate, burst=None):
+        self.rate = float(rate)
+        self.burst = float(burst if burst is not None else rate)
+        self._lock = threading.Lock()
+        self._tokens = self.burst
+        self._updated = time.monotonic()
+        self.throttled = 0
+
+    def reserve(self):
+        """預約一個 token，回傳送出前需要等待的秒數（0 代表可立即送出）"""
+        with self._lock:
+            now = time.monotonic()
+            self._tokens = min(self.burst, self._tokens + (now - self._updated) * self.rate)
+            self._updated = now
+            self._tokens -= 1
+            if self._tokens >= 0:
+                return 0.0
+            self.throttled += 1
+            return -self._tokens / self.rate
+
+    def penalize(self, seconds):
+        """收到 429 時把 token 扣成負的，接下來約 seconds 秒不再送出"""
+        with self._lock:
+            self._tokens = min(self._tokens, 0.0) - seconds * self.rate
+
+    def stats(self):
+        with self._lock:
+            return {"rate": self.rate, "burst": self.burst,
+                    "tokens": round(self._tokens, 2), "throttled": self.throttled}
+
+
+class PushQuota:
+    """
+    每月 push 用量（以月份為 key，換月自動歸零）。
+    monthly_limit    : 方案的每月額度（None 代表不限；sync 時以 LINE 回報的額度為準）
+    reserve          : 剩餘額度 <= reserve 時降級為只用 reply
+    refresh_interval : 本月的列快取在記憶體，最多每幾秒重讀一次 DB（取得其他 worker 的用量）
+
+    remaining / degraded / allow 只讀記憶體；只有 record / sync / mark_exhausted 會寫 DB，
+    每月第一次使用時才 INSERT 當月的列。
+    """
+
+    def __init__(self, db_path, monthly_limit=None, reserve=10, refresh_interval=5):
+        self.monthly_limit = monthly_limit
+        self.reserve = reserve
+        self.refresh_interval = refresh_interval
+        self._lock = threading.Lock()
+        self._db = sqlite3.connect(db_path or ":memory:", check_same_thread=False, isolation_level=None, timeout=5)
+        if db_path:
+            self._db.execute("PRAGMA journal_mode=WAL")
+        self._db.executescript(_QUOTA_SCHEMA)
+        self._month_key = None
+        self._cached = None         # (used, quota, exhausted, synced_at)
+        self._loaded_at = 0.0
+        self.rejected = 0
+
+    @staticmethod
+    def _month():
+        # LINE 的月額度以日本時間（UTC+9）換月
+        return datetime.datetime.now(JST).strftime("%Y-%m")
+
+    def _row(self):
+        """回傳 (month, (used, quota, exhausted, synced_at))；呼叫前需持有 self._lock"""
+        month = self._month()
+        now = time.monotonic()
+        if month != self._month_key:
+            self._db.execute("INSERT OR IGNORE INTO push_quota (month, quota) VALUES (?, ?)",
+                             (month, self.monthly_limit))
+            self._month_key = month
+            self._cached = None
+        if self._cached is None or now - self._loaded_at >= self.refresh_interval:
+            self._cached = self._db.execute(
+                "SELECT used, quota, exhausted, synced_at FROM push_quota WHERE month = ?", (month,)).fetchone()
+            self._loaded_at = now
+        return month, self._cached
+
+    def remaining(self):
+        """本月剩餘 push 數；不限額度時回傳 None"""
+        with self._lock:
+            _, (used, quota, exhausted, _) = self._row()
+        if exhausted:
+            return 0
+        if quota is None:
+            return None
+        return max(0, quota - used)
+
+    @property
+    def degraded(self):
+        remaining = self.remaining()
+        return remaining is not None and remaining <= self.reserve
+
+    def allow(self, cost=1):
+        """剩餘額度扣掉 cost 後不低於 reserve 才允許 push"""
+        remaining = self.remaining()
+        if remaining is None or remaining - cost >= self.reserve:
+            return True
+        with self._lock:
+            self.rejected += 1
+        return False
+
+    def record(self, cost=1):
+        with self._lock:
+            month, (used, quota, exhausted, synced_at) = self._row()
+            self._db.execute("UPDATE push_quota SET used = used + ? WHERE month = ?", (cost, month))
+            self._cached = (used + cost, quota, exhausted, synced_at)
+
+    def mark_exhausted(self):
+        """LINE 回報月額度已用完（monthly limit）"""
+        with self._lock:
+            month, (used, quota, _, synced_at) = self._row()
+            self._db.execute("UPDATE push_quota SET exhausted = 1 WHERE month = ?", (month,))
+            self._cached = (used, quota, 1, synced_at)
+        logger.warning("LINE push 月額度已用完，改為只用 reply")
+
+    def sync(self, used, quota):
+        """以 LINE quota API 的實際用量校正本機計數"""
+        exhausted = 1 if quota is not None and used >= quota else 0
+        synced_at = time.time()
+        with self._lock:
+            month, _ = self._row()
+            self._db.execute("UPDATE push_quota SET used = ?, quota = ?, synced_at = ?, exhausted = ? WHERE month = ?",
+                             (used, quota, synced_at, exhausted, month))
+            self._cached = (used, quota, exhausted, synced_at)
+
+    def stats(self):
+        with self._lock:
+            month, (used, quota, exhausted, synced_at) = self._row()
+        return {"month": month, "used": used, "quota": quota, "reserve": self.reserve,
+                "remaining": self.remaining(), "degraded": self.degraded, "exhausted": bool(exhausted),
+                "synced_at": synced_at, "rejected": self.rejected}
+
+
+class _Item:
+    __slots__ = ("chat_key", "request", "cost", "future", "context", "enqueued")
+
+    def __init__(self, chat_key, request, cost):
+        self.chat_key = chat_key
+        self.request = request
+        self.cost = cost
+        self.future = Future()
+        # 送出執行緒在呼叫端的 contextvars 下執行，trace / log 欄位才會接續
+        self.context = contextvars.copy_context()
+        self.enqueued = time.perf_counter()
+
+
+class _Lane:
+    """單一 API 的公平佇列：聊天室輪流，同一聊天室同時只送一則"""
+
+    def __init__(self, kind, sender, bucket):
+        self.kind = kind
+        self.sender = sender
+        self.bucket = bucket
+        self.chats = OrderedDict()      # chat_key -> deque[_Item]
+        self.in_flight = set()
+        self.queued = 0
+        self.sent = 0
+        self.failed = 0
+        self.rate_limited = 0
+
+    def pop(self):
+        """依輪流順序取出下一則；呼叫前需持有 scheduler 的 lock"""
+        for chat_key, items in self.chats.items():
+            if chat_key in self.in_flight:
+                continue
+            item = items.popleft()
+            if items:
+                self.chats.move_to_end(chat_key)
+            else:
+                del self.chats[chat_key]
+            self.in_flight.add(chat_key)
+            self.queued -= 1
+            return item
+        return None
+
+
+class DeliveryScheduler:
+    """
+    senders     : {kind: sender(request)}，實際呼叫 LINE API 的函式
+    rates       : {kind: (每秒請求數, burst)}
+    quota       : PushQuota；KIND_PUSH 送出前檢查、成功後記帳
+    quota_sync  : 可選，回傳 (本月已用, 額度或 None)，每 sync_interval 秒校正一次
+    workers     : 每個 API 的送出執行緒數
+    """
+
+    def __init__(self, senders, rates, quota=None, quota_sync=None, sync_interval=600, workers=4):
+        self.quota = quota
+        self.quota_sync = quota_sync
+        self.sync_interval = sync_interval
+        self.workers = max(1, int(workers))
+        self._lanes = {kind: _Lane(kind, sender, TokenBucket(*rates[kind])) for kind, sender in senders.items()}
+        self._cond = threading.Condition()
+        self._threads = []
+        self._stopping = False
+
+    def bucket(self, kind):
+        return self._lanes[kind].bucket
+
+    def submit(self, kind, chat_key, request, cost=1):
+        """排入一則送出請求，回傳 Future（結果為 sender 的回傳值）"""
+        if kind == KIND_PUSH and self.quota is not None and not self.quota.allow(cost):
+            future = Future()
+            future.set_exception(QuotaExceededError("push 額度不足，已降級為只用 reply"))
+            return future
+        if not self._threads:
+            self.start()
+        item = _Item(chat_key, request, cost)
+        lane = self._lanes[kind]
+        with self._cond:
+            lane.chats.setdefault(chat_key, deque()).append(item)
+            lane.queued += 1
+            self._cond.notify_all()
+        return item.future
+
+    def deliver(self, kind, chat_key, request, cost=1, timeout=None):
+        """submit 並等待送出完成；送出失敗時丟出原本的例外，逾時則取消尚未送出的請求並丟出 TimeoutError"""
+        future = self.submit(kind, chat_key, request, cost)
+        try:
+            return future.result(timeout)
+        except Exception:
+            # 已經在送的無法取消；還在排隊的不會再送出
+            future.cancel()
+            raise
+
+    def start(self):
+        with self._cond:
+            if self._threads:
+                return
+            self._stopping = False
+            for kind in self._lanes:
+                for i in range(self.workers):
+                    t = threading.Thread(target=self._worker_loop, args=(self._lanes[kind],),
+                                         name=f"line-{kind}-{i}", daemon=True)
+                    t.start()
+                    self._threads.append(t)
+            if self.quota is not None and self.quota_sync is not None:
+                t = threading.Thread(target=self._sync_loop, name="line-quota-sync", daemon=True)
+                t.start()
+                self._threads.append(t)
+
+    def stop(self, timeout=None):
+        with self._cond:
+            self._stopping = True
+            self._cond.notify_all()
+            threads = list(self._threads)
+        for t in threads:
+            t.join(timeout)
+        with self._cond:
+            self._threads = []
+
+    def stats(self):
+        with self._cond:
+            lanes = {kind: {"queued": lane.queued, "chats": len(lane.chats), "in_flight": len(lane.in_flight),
+                            "sent": lane.sent, "failed": lane.failed, "rate_limited": lane.rate_limited,
+                            "bucket": lane.bucket.stats()}
+                     for kind, lane in self._lanes.items()}
+        return {"lanes": lanes, "quota": self.quota.stats() if self.quota is not None else None}
+
+    # ------------------------------
+    # 送出
+    # ------------------------------
+    def _worker_loop(self, lane):
+        while True:
+            with self._cond:
+                while True:
+                    if self._stopping and not lane.queued:
+                        return
+                    item = lane.pop()
+                    if item is not None:
+                        break
+                    self._cond.wait()
+            try:
+                self._send(lane, item)
+            finally:
+                with self._cond:
+                    lane.in_flight.discard(item.chat_key)
+                    self._cond.notify_all()
+
+    def _send(self, lane, item):
+        if not item.future.set_running_or_notify_cancel():
+            return
+        wait = lane.bucket.reserve()
+        if wait > 0:
+            time.sleep(wait)
+        # 排隊 + 限速等待的時間
+        item.context.run(tracing.record, f"{lane.kind}_wait", item.enqueued)
+        if lane.kind == KIND_PUSH and self.quota is not None and not self.quota.allow(item.cost):
+            item.future.set_exception(QuotaExceededError("push 額度不足，已降級為只用 reply"))
+            return
+        try:
+            result = item.context.run(lane.sender, item.request)
+        except Exception as e:
+            self.record_failure(lane.kind, e)
+            item.future.set_exception(e)
+            return
+        self.record_sent(lane.kind, item.cost)
+        item.future.set_result(result)
+
+    # 不經佇列直接送出的呼叫端（asgi.py 的 AsyncMessagingApi）也以這兩個函式記帳，共用限速與額度
+    def record_sent(self, kind, cost=1):
+        self._lanes[kind].sent += 1
+        if kind == KIND_PUSH and self.quota is not None:
+            self.quota.record(cost)
+
+    def record_failure(self, kind, error):
+        """429：月額度用完時標記 quota，其他情況讓 bucket 暫停一小段時間"""
+        lane = self._lanes[kind]
+        lane.failed += 1
+        if error_status(error) == 429 or "429" in str(error):
+            if "monthly limit" in str(error) and self.quota is not None:
+                self.quota.mark_exhausted()
+            else:
+                lane.rate_limited += 1
+                lane.bucket.penalize(1.0)
+
+    def _sync_loop(self):
+        while True:
+            try:
+                used, quota = self.quota_sync()
+                self.quota.sync(used, quota)
+                logger.debug("LINE push 額度校正", used=used, quota=quota)
+            except Exception as e:
+                logger.warning("LINE push 額度校正失敗", error=e)
+            with self._cond:
+                if self._cond.wait_for(lambda: self._stopping, timeout=self.sync_interval):
+                    return
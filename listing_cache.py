@@ -0,0 +1,193 @@
+"""
+列表快取（stale-while-revalidate）。
+
+「最熱」「最新」這類全站列表變化很慢，不需要每次都即時爬：
+  - get() 一律立刻回傳最後一次成功的結果；過期（stale_after）時在背景觸發更新
+  - 背景執行緒每 refresh_interval 秒主動更新一次
+  - 更新失敗或被 Cloudflare 擋下（回傳空列表）時保留舊資料
+  - 每次更新成功後寫入 JSON snapshot（先寫暫存檔再 os.replace），worker 重啟後直接載入
+
+只有完全沒有資料（冷啟動且沒有 snapshot）時，get() 才會同步等待爬取；
+同時進來的其他呼叫者等待同一次爬取（最多 cold_wait 秒），不會拿到空結果。
+"""
+import os, json, time, tempfile, threading
+from app_logging import get_logger
+
+TICK_SECONDS = 30
+
+logger = get_logger("listing_cache")
+
+
+class _Entry:
+    __slots__ = ("loader", "value", "fetched_at", "refreshing", "failures")
+
+    def __init__(self, loader):
+        self.loader = loader
+        self.value = None
+        self.fetched_at = 0.0      # time.time()，需要跨 process 保存所以不用 monotonic
+        self.refreshing = None      # 更新進行中時為 threading.Event，完成後 set
+        self.failures = 0
+
+
+class ListingCache:
+    def __init__(self, refresh_interval=900, stale_after=300, snapshot_path=None, cold_wait=60):
+        self.refresh_interval = refresh_interval
+        self.cold_wait = cold_wait
+        self.stale_after = stale_after
+        self.snapshot_path = snapshot_path
+
+        self._lock = threading.Lock()
+        self._save_lock = threading.Lock()
+        self._entries = {}
+        self._snapshot = self._load_snapshot()
+        self._thread = None
+        self._stop = threading.Event()
+
+        self.hits = 0
+        self.stale_hits = 0
+        self.cold_loads = 0
+        self.cold_waits = 0
+        self.refreshes = 0
+        self.refresh_failures = 0
+
+    def register(self, name, loader):
+        """登記一個列表；loader() 回傳 list，空列表視為失敗"""
+        entry = _Entry(loader)
+        saved = self._snapshot.get(name)
+        if saved and saved.get("value"):
+            entry.value = saved["value"]
+            entry.fetched_at = saved.get("fetched_at", 0.0)
+        with self._lock:
+            self._entries[name] = entry
+
+    def get(self, name):
+        """回傳最後一次成功的結果；沒有任何資料時同步爬取一次"""
+        self.start()
+        entry = self._entries[name]
+        with self._lock:
+            value = entry.value
+            stale = time.time() - entry.fetched_at > self.stale_after
+            if value is not None:
+                self.hits += 1
+                if stale:
+                    self.stale_hits += 1
+        if value is None:
+            self.cold_loads += 1
+            return self._refresh(name, entry) or []
+        if stale:
+            self._refresh_in_background(name, entry)
+        return value
+
+    def start(self):
+        """啟動背景更新執行緒（可重複呼叫）"""
+        with self._lock:
+            if self._thread is not None:
+                return
+            self._thread = threading.Thread(target=self._refresh_loop, name="listing-refresh", daemon=True)
+            self._thread.start()
+
+    def stop(self):
+        self._stop.set()
+
+    def stats(self):
+        now = time.time()
+        with self._lock:
+            return {
+                "hits": self.hits,
+                "stale_hits": self.stale_hits,
+                "cold_loads": self.cold_loads,
+                "cold_waits": self.cold_waits,
+                "refreshes": self.refreshes,
+                "refresh_failures": self.refresh_failures,
+                "age_seconds": {name: round(now - e.fetched_at, 1) if e.value is not None else None
+                                for name, e in self._entries.items()},
+            }
+
+    # ------------------------------
+    # 更新
+    # ------------------------------
+    def _refresh_loop(self):
+        while not self._stop.wait(TICK_SECONDS):
+            now = time.time()
+            with self._lock:
+                due = [(name, e) for name, e in self._entries.items()
+                       if now - e.fetched_at >= self.refresh_interval]
+            for name, entry in due:
+                self._refresh(name, entry)
+
+    def _refresh_in_background(self, name, entry):
+        with self._lock:
+            if entry.refreshing is not None:
+                return
+        threading.Thread(target=self._refresh, args=(name, entry), name=f"listing-refresh-{name}",
+                         daemon=True).start()
+
+    def _refresh(self, name, entry):
+        with self._lock:
+            in_flight = entry.refreshing
+            if in_flight is None:
+                entry.refreshing = threading.Event()
+            elif entry.value is None:
+                self.cold_waits += 1
+        if in_flight is not None:
+            # 已有更新在跑：有舊資料就回舊資料；冷啟動時等同一次爬取完成
+            if entry.value is None:
+                in_flight.wait(self.cold_wait)
+            return entry.value
+
+        try:
+            try:
+                value = entry.loader()
+            except Exception as e:
+                logger.error("更新列表失敗", listing=name, error=e)
+                value = None
+
+            with self._lock:
+                if not value:
+                    # 被擋下或爬不到：保留舊資料，等下一輪再試
+                    entry.failures += 1
+                    self.refresh_failures += 1
+                    logger.warning("列表更新失敗，沿用舊資料", listing=name, failures=entry.failures)
+                    return entry.value
+                entry.value = value
+                entry.fetched_at = time.time()
+                entry.failures = 0
+                self.refreshes += 1
+            self._save_snapshot()
+            return value
+        finally:
+            with self._lock:
+                done, entry.refreshing = entry.refreshing, None
+            done.set()
+
+    # ------------------------------
+    # Snapshot
+    # ------------------------------
+    def _load_snapshot(self):
+        if not self.snapshot_path or not os.path.exists(self.snapshot_path):
+            return {}
+        try:
+            with open(self.snapshot_path, encoding="utf-8") as f:
+                return json.load(f).get("entries", {})
+        except (OSError, ValueError) as e:
+            logger.warning("讀取列表 snapshot 失敗", error=e)
+            return {}
+
+    def _save_snapshot(self):
+        if not self.snapshot_path:
+            return
+        with self._lock:
+            entries = {name: {"value": e.value, "fetched_at": e.fetched_at}
+                       for name, e in self._entries.items() if e.value is not None}
+        directory = os.path.dirname(os.path.abspath(self.snapshot_path))
+        with self._save_lock:
+            tmp_path = None
+            try:
+                fd, tmp_path = tempfile.mkstemp(dir=directory, prefix=".listing-", suffix=".tmp")
+                with os.fdopen(fd, "w", encoding="utf-8") as f:
+                    json.dump({"version": 1, "entries": entries}, f, ensure_ascii=False)
+                os.replace(tmp_path, self.snapshot_path)
+            except OSError as e:
+                logger.warning("寫入列表 snapshot 失敗", error=e)
+                if tmp_path and os.path.exists(tmp_path):
+                    os.remove(tmp_path)
@@ -1,7 +1,7 @@
-import os, re, json, openai, random, time, requests, shutil, datetime
+import os, re, json, hmac, uuid, openai, time, shutil, datetime
 from pydub import AudioSegment
 from flask import Flask, request, jsonify
-from linebot.exceptions import InvalidSignatureError
+from linebot.v3.exceptions import InvalidSignatureError
 from linebot.v3.messaging import MessagingApi, Configuration, ApiClient
 from linebot.v3.webhooks import MessageEvent, PostbackEvent, FollowEvent
 from linebot.v3.messaging.models import ReplyMessageRequest, TextMessage, FlexMessage, FlexContainer, ImageMessage, PushMessageRequest
@@ -11,13 +11,38 @@ from linebot.v3.webhook import WebhookHandler
 from groq import Groq
 from dotenv import load_dotenv
 from flask import send_from_directory
-from types import SimpleNamespace
 from bs4 import BeautifulSoup
 import spotipy
 from spotipy.oauth2 import SpotifyClientCredentials
-from playwright.sync_api import sync_playwright
-from playwright_stealth import stealth_sync
+from spotipy.cache_handler import CacheFileHandler
 import cloudscraper
+from dispatcher import ChatOrderedDispatcher
+from command_router import router
+import commands
+from commands import DEFAULT_AI_MODEL, Reply, Job, Chat, SelectionMenu, LeaveGroup
+from response_cache import ResponseCache, normalize_prompt
+from listing_cache import ListingCache
+import singleflight
+from singleflight import coalesce
+from scraper import scrape_listing, JABLE_SEARCH, JABLE_HOT, JABLE_NEW
+from fetcher import fetcher
+from browser_pool import browser_pool
+from http_client import http_client
+from jobs import JobQueue, PRIORITY_NORMAL
+from streaming import stream_chat, stream_stats
+from provider_router import ProviderRouter
+from resilience import resilience, CircuitOpenError, http_failure
+from event_dedupe import EventDeduper
+from webhook_filter import WebhookFilter
+from state_store import StateStore
+from line_delivery import DeliveryScheduler, PushQuota, QuotaExceededError, KIND_REPLY, KIND_PUSH
+from deadline import attach_deadline, deadline_of, push_reason, needs_ack, mark_acked, is_invalid_reply_token, command_latency
+from metrics import metrics, CONTENT_TYPE as METRICS_CONTENT_TYPE
+import tracing
+from tracing import tracer, attach_trace, trace_of
+from app_logging import get_logger, log_context, log_stats
+from capture import traffic_capture
+import httpx
 
 # Load Environment Arguments
 load_dotenv()
@@ -39,11 +64,80 @@ CWB_API_URL = "https://opendata.cwb.gov.tw/api/v1/rest/datastore/F-D0047-091"
 OPENWEATHER_API_KEY = os.getenv("OPENWEATHER_API_KEY")
 OPENWEATHER_URL = "https://api.openweathermap.org/data/2.5/weather"
 BASE_URL = "https://render-linebot-masp.onrender.com"
+# 監控端點（MONITORING_ENDPOINTS 與 /metrics）的存取 token；未設定時這些端點一律回 404
+MONITORING_TOKEN = os.getenv("MONITORING_TOKEN")
+
+# 上游 API 位址（壓測時全部指到 bench/fake_upstream.py，見 bench/load_test.py）
+LINE_API_BASE = os.getenv("LINE_API_BASE", "https://api.line.me")
+LINE_DATA_API_BASE = os.getenv("LINE_DATA_API_BASE", "https://api-data.line.me")
+GROQ_BASE_URL = os.getenv("GROQ_BASE_URL")  # 未設定時使用 SDK 預設
+OPENAI_API_BASE = os.getenv("OPENAI_API_BASE", "https://api.openai.com/v1")
+OPENWEATHER_API_BASE = os.getenv("OPENWEATHER_API_BASE", "https://api.openweathermap.org")
+GOOGLE_CSE_URL = os.getenv("GOOGLE_CSE_URL", "https://www.googleapis.com/customsearch/v1")
+GOOGLE_SEARCH_URL = os.getenv("GOOGLE_SEARCH_URL", "https://www.google.com/search")
+SPOTIFY_API_BASE = os.getenv("SPOTIFY_API_BASE")      # 例如 http://127.0.0.1:8090/spotify/v1/
+SPOTIFY_TOKEN_URL = os.getenv("SPOTIFY_TOKEN_URL")    # 例如 http://127.0.0.1:8090/spotify/api/token
+
+# Webhook 處理模式："queue" = 先回 200 再由背景 worker 處理；"inline" = 在 request 內同步處理
+DISPATCH_MODE = os.getenv("DISPATCH_MODE", "queue").lower()
+DISPATCH_WORKERS = int(os.getenv("DISPATCH_WORKERS", "4"))
+DISPATCH_MAX_PENDING = int(os.getenv("DISPATCH_MAX_PENDING", "200"))
+# Groq 回應改用串流：邊收邊濾掉 <think>，可見回答達到 prompt 的字數上限就停止
+STREAM_COMPLETIONS = os.getenv("STREAM_COMPLETIONS", "1") == "1"
+CHAT_REPLY_MAX_CHARS = int(os.getenv("CHAT_REPLY_MAX_CHARS", "80"))
+WEATHER_REPLY_MAX_CHARS = int(os.getenv("WEATHER_REPLY_MAX_CHARS", "50"))
+# Groq 卡住時 hedge 到等價的備援模型；HEDGE_MAX_RATIO 為額外呼叫的比例上限
+HEDGE_MAX_RATIO = float(os.getenv("HEDGE_MAX_RATIO", "0.1"))
+HEDGE_BACKUPS = {
+    "deepseek-r1-distill-llama-70b": "openai:gpt-4o-mini",
+    "llama3-8b-8192": "openai:gpt-4o-mini",
+}
+# 慢指令背景工作：worker 數與各 pool 同時執行上限
+JOB_DB_PATH = os.getenv("JOB_DB_PATH", "/tmp/linebot_jobs.db")
+JOB_WORKERS = int(os.getenv("JOB_WORKERS", "4"))
+# 工作的 lease 秒數：其他 gunicorn worker 只接手 lease 已過期（原 worker 已結束）的工作
+JOB_LEASE_SECONDS = int(os.getenv("JOB_LEASE_SECONDS", "30"))
+JOB_POOL_LIMITS = {
+    "image": int(os.getenv("JOB_IMAGE_CONCURRENCY", "1")),
+    "browser": int(os.getenv("JOB_BROWSER_CONCURRENCY", os.getenv("BROWSER_MAX_CONTEXTS", "2"))),
+    "search": int(os.getenv("JOB_SEARCH_CONCURRENCY", "2")),
+    "weather": int(os.getenv("JOB_WEATHER_CONCURRENCY", "2")),
+    "media": int(os.getenv("JOB_MEDIA_CONCURRENCY", "2")),
+}
+# LINE 送出速率（每秒請求數，依方案的 rate limit 設定）與每月 push 額度；剩餘額度 <= LINE_QUOTA_RESERVE 時只用 reply
+LINE_REPLY_RATE = float(os.getenv("LINE_REPLY_RATE", "50"))
+LINE_PUSH_RATE = float(os.getenv("LINE_PUSH_RATE", "20"))
+LINE_SENDER_WORKERS = int(os.getenv("LINE_SENDER_WORKERS", "4"))
+# 等待單則訊息送出（排隊 + 限速 + 呼叫 LINE）的上限秒數
+LINE_SEND_TIMEOUT = float(os.getenv("LINE_SEND_TIMEOUT", "30"))
+LINE_MONTHLY_PUSH_QUOTA = int(os.getenv("LINE_MONTHLY_PUSH_QUOTA", "200")) or None
+LINE_QUOTA_RESERVE = int(os.getenv("LINE_QUOTA_RESERVE", "10"))
+LINE_QUOTA_DB_PATH = os.getenv("LINE_QUOTA_DB_PATH", "/tmp/linebot_push_quota.db")
+LINE_QUOTA_SYNC_INTERVAL = int(os.getenv("LINE_QUOTA_SYNC_INTERVAL", "600"))
+# Webhook 事件去重：保留 webhookEventId 的秒數與筆數；DB 路徑留空則只在各 worker 記憶體內去重
+# 處理中的事件只擋 WEBHOOK_DEDUPE_PROCESSING_TTL 秒，處理中斷時重送的事件仍會被處理
+WEBHOOK_DEDUPE_TTL = int(os.getenv("WEBHOOK_DEDUPE_TTL", "3600"))
+WEBHOOK_DEDUPE_PROCESSING_TTL = int(os.getenv("WEBHOOK_DEDUPE_PROCESSING_TTL", "300"))
+WEBHOOK_DEDUPE_MAX_ENTRIES = int(os.getenv("WEBHOOK_DEDUPE_MAX_ENTRIES", "10000"))
+WEBHOOK_DEDUPE_DB_PATH = os.getenv("WEBHOOK_DEDUPE_DB_PATH", "/tmp/linebot_webhook_events.db")
+# 使用者設定（模型選擇、翻譯設定）存在 SQLite，所有 worker 共用；要跨部署保存請指到 persistent disk
+STATE_DB_PATH = os.getenv("STATE_DB_PATH", "/tmp/linebot_state.db")
+STATE_CACHE_TTL = float(os.getenv("STATE_CACHE_TTL", "5"))
+# Spotify access token 的快取檔（spotipy 預設為目前目錄的 .cache）
+SPOTIFY_CACHE_PATH = os.getenv("SPOTIFY_CACHE_PATH", ".cache")
 
 # 初始化 Spotipy
-spotify_auth = SpotifyClientCredentials(client_id=SPOTIFY_CLIENT_ID, client_secret=SPOTIFY_CLIENT_SECRET)
+spotify_auth = SpotifyClientCredentials(client_id=SPOTIFY_CLIENT_ID, client_secret=SPOTIFY_CLIENT_SECRET,
+                                        cache_handler=CacheFileHandler(cache_path=SPOTIFY_CACHE_PATH))
 spotify_api = spotipy.Spotify(auth_manager=spotify_auth)
-sp = spotipy.Spotify(auth_manager=SpotifyClientCredentials(client_id=SPOTIFY_CLIENT_ID, client_secret=SPOTIFY_CLIENT_SECRET))
+sp = spotipy.Spotify(auth_manager=SpotifyClientCredentials(client_id=SPOTIFY_CLIENT_ID, client_secret=SPOTIFY_CLIENT_SECRET,
+                                                           cache_handler=CacheFileHandler(cache_path=SPOTIFY_CACHE_PATH)))
+for _spotify in (spotify_api, sp):
+    if SPOTIFY_API_BASE:
+        _spotify.prefix = SPOTIFY_API_BASE
+    if SPOTIFY_TOKEN_URL:
+        _spotify.auth_manager.OAUTH_TOKEN_URL = SPOTIFY_TOKEN_URL
+openai.api_base = OPENAI_API_BASE
 
 # Grab Allowed Users and Group ID from .env
 allowed_users_str = os.getenv("ALLOWED_USERS", "")
@@ -52,14 +146,48 @@ allowed_groups_str = os.getenv("ALLOWED_GROUPS", "")
 ALLOWED_GROUPS = {gid.strip() for gid in allowed_groups_str.split(",") if gid.strip()}
 
 # Initailize LINE API (v3)
-config = Configuration(access_token=LINE_CHANNEL_ACCESS_TOKEN)
+config = Configuration(host=LINE_API_BASE, access_token=LINE_CHANNEL_ACCESS_TOKEN)
 messaging_api = MessagingApi(ApiClient(config))
 handler = WebhookHandler(LINE_CHANNEL_SECRET)
-client = Groq(api_key=GROQ_API_KEY)
+# 驗證簽名後先看原始 JSON，只替會處理的事件建立 SDK model
+webhook_filter = WebhookFilter(handler.parser, router)
+client = Groq(api_key=GROQ_API_KEY, base_url=GROQ_BASE_URL)
 
 # Initialize Flask 
 app = Flask(__name__)
 
+# 結構化 log（非阻塞寫出，DEBUG 抽樣）
+logger = get_logger("main")
+
+# 背景事件 worker pool（同聊天室依序、不同聊天室平行）
+event_dispatcher = ChatOrderedDispatcher(workers=DISPATCH_WORKERS, max_pending=DISPATCH_MAX_PENDING)
+
+# 重送的 webhook 在排入處理前就丟掉
+webhook_dedupe = EventDeduper(ttl=WEBHOOK_DEDUPE_TTL, max_entries=WEBHOOK_DEDUPE_MAX_ENTRIES,
+                              db_path=WEBHOOK_DEDUPE_DB_PATH or None,
+                              processing_ttl=WEBHOOK_DEDUPE_PROCESSING_TTL)
+
+# AI 供應商路由（p50 / p95 / 錯誤率統計 + hedged request）
+provider_router = ProviderRouter(max_hedge_ratio=HEDGE_MAX_RATIO)
+
+# ask_groq 回應快取（翻譯結果不會變，保留較久）
+ask_cache = ResponseCache(
+    max_entries=int(os.getenv("ASK_CACHE_MAX_ENTRIES", "512")),
+    max_bytes=int(os.getenv("ASK_CACHE_MAX_BYTES", str(2 * 1024 * 1024))),
+    default_ttl=int(os.getenv("ASK_CACHE_TTL", "180")),
+    ttl_overrides={"gpt-translation": 3600},
+)
+
+# 影片列表快取：最熱 / 最新先回舊資料、背景更新；關鍵字搜尋用較短 TTL
+listing_cache = ListingCache(
+    refresh_interval=int(os.getenv("LISTING_REFRESH_INTERVAL", "900")),
+    stale_after=int(os.getenv("LISTING_STALE_AFTER", "300")),
+    snapshot_path=os.getenv("LISTING_SNAPSHOT_PATH", "/tmp/linebot_listing_cache.json"),
+    cold_wait=int(os.getenv("LISTING_COLD_WAIT", "60")),
+)
+video_search_cache = ResponseCache(max_entries=64, max_bytes=256 * 1024,
+                                   default_ttl=int(os.getenv("VIDEO_SEARCH_TTL", "600")))
+
 # 城市對應表（避免輸入錯誤）
 CITY_MAPPING = {
     # 台灣縣市
@@ -127,80 +255,246 @@ CITY_MAPPING = {
     "莫斯科": "Moscow"
 }
 
-# Record AI model choosen by User
-user_ai_choice = {}
+# Record AI model choosen by User（跨 worker 共用，讀取走 process 內快取）
+state_store = StateStore(STATE_DB_PATH or None, cache_ttl=STATE_CACHE_TTL)
+user_ai_choice = state_store.namespace("ai_choice")
 
 # Global dictionary for translation
-user_translation_config = {}    
+user_translation_config = state_store.namespace("translation")
+
+# AI 提示詞（同步與非同步路徑共用）
+OPENAI_CHAT_PROMPT = "你是一個名叫狗蛋的助手，盡量只使用繁體中文精簡跟朋友的語氣回答, 約莫50字內，限制不超過80字，除非當請求為翻譯時, 全部內容都需要完成翻譯不殘留原語言。"
+TRANSLATION_PROMPT = "你是一位專業翻譯專家，請根據使用者的需求精準且自然地翻譯以下內容。當請求為翻譯時, 全部內容一定都要完成翻譯不殘留原語言"
+GROQ_CHAT_PROMPT = "你是一個名叫狗蛋的助手，跟使用者是朋友關係, 盡量只使用繁體中文方式進行回答, 約莫50字內，限制不超過80字, 除非當請求為翻譯時, 全部內容都需要完成翻譯不殘留原語言。"
+WEATHER_SYSTEM_PROMPT = "你是一個名叫狗蛋的助手，跟使用者是朋友關係, 盡量只使用繁體中文方式進行幽默回答, 約莫20字內，限制不超過50字"
+AUDIO_CHAT_PROMPT = "你是一個名叫狗蛋的智能助手，請使用繁體中文回答。"
+SUMMARY_SYSTEM_PROMPT = "你是一個智慧助理，依照這些資料, 條列總結跟附上連結。"
+WORKING_ACK_MESSAGE = "⏳ 狗蛋處理中，好了再跟你說！"
+NO_REPLY_MESSAGE = "❌ 狗蛋無法回應，請稍後再試。"
+WEATHER_UNAVAILABLE_MESSAGE = "❌ 天氣服務暫時無法使用，請稍後再試"
+IMAGE_PROMPT_SUFFIX = " 請根據上述描述生成圖片。如果描述涉及人物，以可愛卡通風格呈現, 要求面部比例正確，不出現扭曲、畸形或額外肢體，且圖像需高解析度且細節豐富；如果描述涉及事件且未指定風格，請以可愛卡通風格呈現；如果描述涉及物品，請生成清晰且精美的物品圖像，同時避免出現讓人覺得噁心或反胃的效果。"
 
 @app.route("/", methods=["GET"])
 def home():
     return "狗蛋 啟動！"
 
+def query_int(query, name):
+    """query string 中的整數參數；沒有或格式錯誤時回傳 None"""
+    try:
+        return int(query[name]) if query.get(name) else None
+    except ValueError:
+        return None
+
+# 監控用 JSON 端點（asgi.py 共用同一張表）：路徑 → 以 query string（dict）取得統計的函式
+MONITORING_ENDPOINTS = {
+    # 各上游熔斷器狀態與重試額度
+    "/breakers": lambda query: resilience.stats(),
+    # LINE 送出佇列、限速與 push 額度
+    "/delivery": lambda query: line_delivery.stats(),
+    # 使用者設定快取命中率
+    "/state": lambda query: state_store.stats(),
+    # 前置過濾丟掉的 webhook 事件比例
+    "/webhook_filter": lambda query: webhook_filter.stats(),
+    # 最慢的幾筆事件 trace（除錯用，?limit=N）
+    "/traces": lambda query: {"stats": tracer.stats(), "traces": tracer.slowest(query_int(query, "limit"))},
+    # log 佇列長度與丟棄數
+    "/logging": lambda query: log_stats(),
+    # 事件 worker 與背景工作池的忙碌程度（壓測也會用到）
+    "/workers": lambda query: {"dispatcher": event_dispatcher.stats(), "jobs": job_queue.stats()},
+    # webhook 錄製的筆數、丟棄數與檔案輪替
+    "/capture": lambda query: traffic_capture.stats(),
+    # 重複 / 重送的 webhook 事件統計
+    "/dedupe": lambda query: webhook_dedupe.stats(),
+    # AI 回覆、影片搜尋與影片列表快取的命中率
+    "/cache": lambda query: {"ask": ask_cache.stats(), "video_search": video_search_cache.stats(),
+                             "listings": listing_cache.stats()},
+    # 相同請求合併（singleflight）的次數
+    "/singleflight": lambda query: singleflight.group.stats(),
+    # 爬蟲：分層抓取的各層命中與 Chromium 連線池
+    "/scraper": lambda query: {"fetcher": fetcher.stats(), "browser_pool": browser_pool.stats()},
+    # 共用 HTTP 連線池
+    "/http": lambda query: http_client.stats(),
+    # LLM 串流（第一個可見字元延遲、截斷數）與供應商路由（p50 / p95、hedge、failover）
+    "/llm": lambda query: {"streaming": stream_stats(), "providers": provider_router.stats()},
+}
+
+def monitoring_status(authorization, query):
+    """
+    監控端點的存取檢查（asgi.py 共用），回傳 HTTP 狀態碼：
+    未設定 MONITORING_TOKEN 時 404；token（Authorization: Bearer <token> 或 ?token=）不符時 401；通過時 200
+    """
+    if not MONITORING_TOKEN:
+        return 404
+    supplied = query.get("token") or ""
+    if authorization and authorization.startswith("Bearer "):
+        supplied = authorization[len("Bearer "):]
+    if not hmac.compare_digest(supplied.encode(), MONITORING_TOKEN.encode()):
+        return 401
+    return 200
+
+def monitoring_denied():
+    status = monitoring_status(request.headers.get("Authorization"), request.args)
+    if status == 404:
+        return "Not Found", 404
+    if status == 401:
+        return "Unauthorized", 401
+    return None
+
+def add_monitoring_route(path, snapshot):
+    def view():
+        return monitoring_denied() or jsonify(snapshot(request.args.to_dict()))
+    app.add_url_rule(path, endpoint=path.strip("/"), view_func=view, methods=["GET"])
+
+for _path, _snapshot in MONITORING_ENDPOINTS.items():
+    add_monitoring_route(_path, _snapshot)
+
+@app.route("/metrics", methods=["GET"])
+def metrics_endpoint():
+    """Prometheus 格式的指令 / 上游耗時與計數"""
+    return monitoring_denied() or (metrics.render(), 200, {"Content-Type": METRICS_CONTENT_TYPE})
+
 @app.route('/static/<path:filename>')
 def serve_static(filename):
     return send_from_directory("static", filename)
 
 @app.route("/callback", methods=["POST"])
 def callback():
+    arrived = time.time()
     signature = request.headers.get("X-Line-Signature", "未收到簽名")
     body = request.get_data(as_text=True)
 
-    # 🔍 Log Webhook Data
-    print(f"📢 [DEBUG] Webhook Received: {body}")
-
+    # 只記錄大小與事件數，不記錄 webhook 內容（使用者訊息）
+    webhook_trace = tracer.begin("webhook", bytes=len(body))
     try:
-        handler.handle(body, signature)
+        with tracing.scope(webhook_trace):
+            events = webhook_filter.parse(body, signature)
+        # CAPTURE_PATH 有設定時錄下（遮蔽後的）webhook 供 bench/replay.py 重播
+        traffic_capture.record(body, arrived)
+        logger.debug("Webhook Received", bytes=len(body), events=len(events))
+        for event in events:
+            # LINE 重送的事件（或其他 worker 已處理的事件）在呼叫任何上游之前丟掉
+            if webhook_dedupe.is_duplicate(event):
+                continue
+            attach_deadline(event)  # reply token 從 webhook 抵達時開始計時
+            if webhook_trace is not None:
+                # 每個事件各自一個 trace，帶著這個 webhook 的驗證 / 解析 span
+                attach_trace(event, webhook_trace.fork("event", event_id=getattr(event, "webhook_event_id", None),
+                                                       chat_id=get_chat_key(event), event_type=event.__class__.__name__))
+            if DISPATCH_MODE == "queue":
+                # 實際處理交給背景 worker，立即回 200 給 LINE
+                if not event_dispatcher.submit(get_chat_key(event), dispatch_event, event):
+                    logger.warning("事件佇列已滿，改為同步處理", chat_id=get_chat_key(event))
+                    dispatch_inline(event)
+            else:
+                dispatch_inline(event)
     except InvalidSignatureError:
-        print("❌ [ERROR] Webhook Signature 驗證失敗")
+        logger.warning("Webhook Signature 驗證失敗")
         return "Invalid signature", 400
     except Exception as e:
-        print(f"❌ [ERROR] Webhook 處理錯誤: {e}")
+        logger.error("Webhook 處理錯誤", exc_info=True, error=e)
 
     return "OK", 200
 
+def dispatch_inline(event):
+    """在 request thread 直接處理事件；單一事件失敗不影響同一 webhook 的其他事件（與 event_dispatcher 的 worker 相同）"""
+    try:
+        dispatch_event(event)
+    except Exception as e:
+        logger.error("事件處理錯誤", exc_info=True, chat_id=get_chat_key(event), error=e)
+
+def get_chat_key(event):
+    """取得事件所屬聊天室（群組 / 多人聊天室 / 個人），作為依序處理的 key"""
+    source = getattr(event, "source", None)
+    if source is None:
+        return "_"
+    return (getattr(source, "group_id", None)
+            or getattr(source, "room_id", None)
+            or getattr(source, "user_id", None)
+            or "_")
+
+def dispatch_event(event):
+    """依照 handler.add() 註冊的對應關係處理單一事件（與 WebhookHandler.handle 相同規則）"""
+    func = None
+    if isinstance(event, MessageEvent):
+        func = handler._handlers.get(f"{event.__class__.__name__}_{event.message.__class__.__name__}")
+    if func is None:
+        func = handler._handlers.get(event.__class__.__name__)
+    if func is None:
+        func = handler._default
+    if func is None:
+        logger.debug("沒有對應的 handler", event_type=event.__class__.__name__)
+        return
+    # 同一事件內的 log 都帶上 event_id / chat_id（handle_message 會再補上 command）
+    with log_context(event_id=getattr(event, "webhook_event_id", None), chat_id=get_chat_key(event)), \
+            tracing.activate(trace_of(event)) as trace:
+        if trace is not None:
+            tracing.record("queue_wait", trace.queued_at)
+        started = time.monotonic()
+        try:
+            func(event)
+        except Exception:
+            # 處理失敗：撤銷去重登記，LINE 重送時再處理一次
+            webhook_dedupe.release(event)
+            raise
+        webhook_dedupe.done(event)
+        logger.info("事件處理完成", event_type=event.__class__.__name__,
+                    latency_ms=round((time.monotonic() - started) * 1000, 1))
+
 @handler.add(FollowEvent)
 def handle_follow(event):
     """當用戶加好友時，立即發送選單"""
-    command_list = (
-            "📝 支援的指令：\n"
-            "1. 換模型: 更換 AI 語言模型 \n\t\t（預設為 Deepseek-R1）\n"
-            "2. 給我id: 顯示 LINE 個人 ID\n"
-            "3. 群組id: 顯示 LINE 群組 ID\n"
-            "4. 狗蛋出去: 機器人離開群組\n"
-            "5. 當前模型: 機器人現正使用的模型\n"
-            "6. 狗蛋生成: 生成圖片\n"
-            "7. 我要翻譯: 翻譯語言\n"
-            "8. 停止翻譯: 停止翻譯\n"
-            "9. 狗蛋情勒 狗蛋的超能力"
-        )
-    reply_request = ReplyMessageRequest(
-        replyToken=event.reply_token,
-        messages=[TextMessage(text=command_list)]
-    )
-    send_response(event, reply_request)
+    run_actions(event, commands.plan_follow())
 
 # ----------------------------------
 # Support Function
 # ----------------------------------
-def safe_api_call(api_func, request_obj, retries=3, backoff_factor=1.0):
-    for i in range(retries):
-        try:
-            return api_func(request_obj)
-        except Exception as e:
-            if "429" in str(e):
-                wait_time = backoff_factor * (2 ** i)
-                print(f"🔄 Rate limit: {wait_time} 秒後重試...")
-                time.sleep(wait_time)
-            else:
-                print(f"❌ API call error: {e}")
-                raise
-    raise Exception("API call failed after retries")
+def safe_api_call(api_func, request_obj, upstream="line_reply", retries=1):
+    """經過熔斷器呼叫 api_func；失敗時在全 process 的重試額度內重試，不再長時間 sleep"""
+    return resilience.call(upstream, api_func, request_obj, retries=retries)
+
+def send_reply_now(reply_request):
+    """reply token 只能用一次，失敗不重試"""
+    return safe_api_call(messaging_api.reply_message, reply_request, "line_reply", retries=0)
+
+def send_push_now(push_request):
+    """push 帶 X-Line-Retry-Key，重試時 LINE 不會重複送出"""
+    retry_key = str(uuid.uuid4())
+    return safe_api_call(lambda req: messaging_api.push_message(req, x_line_retry_key=retry_key),
+                         push_request, "line_push", retries=1)
+
+def fetch_push_quota():
+    """LINE 回報的本月 push 用量與額度（額度不限時為 None）"""
+    quota = messaging_api.get_message_quota()
+    used = messaging_api.get_message_quota_consumption().total_usage
+    return used, (quota.value if quota.type == "limited" else None)
+
+# LINE 送出排程：reply / push 各自限速、聊天室之間輪流送出、push 額度記帳
+push_quota = PushQuota(LINE_QUOTA_DB_PATH, monthly_limit=LINE_MONTHLY_PUSH_QUOTA, reserve=LINE_QUOTA_RESERVE)
+line_delivery = DeliveryScheduler(
+    {KIND_REPLY: send_reply_now, KIND_PUSH: send_push_now},
+    rates={KIND_REPLY: (LINE_REPLY_RATE, LINE_REPLY_RATE), KIND_PUSH: (LINE_PUSH_RATE, LINE_PUSH_RATE)},
+    quota=push_quota, quota_sync=fetch_push_quota, sync_interval=LINE_QUOTA_SYNC_INTERVAL,
+    workers=LINE_SENDER_WORKERS,
+)
+
+def line_reply(reply_request, chat_key=None):
+    """經排程送出 reply；chat_key 用於聊天室之間的公平輪流"""
+    return line_delivery.deliver(KIND_REPLY, chat_key or reply_request.reply_token, reply_request,
+                                 timeout=LINE_SEND_TIMEOUT)
+
+def line_push(push_request):
+    """經排程送出 push（額度不足時丟 QuotaExceededError）"""
+    return line_delivery.deliver(KIND_PUSH, push_request.to, push_request, timeout=LINE_SEND_TIMEOUT)
+
+def can_reply_instead(event):
+    """降級為只用 reply 時：reply token 尚未用過也還沒過期，就改用 reply 送出"""
+    return (push_quota.degraded and not getattr(event, "_acked", False)
+            and deadline_of(event).remaining() > 0)
 
 def send_limit_message(event):
     """
-    嘗試使用 push_message 發送「很抱歉，使用已達上限」訊息，
-    並採用指數退避機制重試若遇到 429 錯誤。
+    嘗試使用 push_message 發送「很抱歉，使用已達上限」訊息。
+    月額度用完或 LINE 熔斷中時直接放棄，不再阻塞重試。
     """
     target_id = event.source.group_id if event.source.type == "group" else event.source.user_id
     limit_msg = TextMessage(text="很抱歉，使用已達上限")
@@ -208,23 +502,11 @@ def send_limit_message(event):
         to=target_id,
         messages=[limit_msg]
     )
-    retries = 3
-    backoff_factor = 1.0
-    for i in range(retries):
-        try:
-            messaging_api.push_message(push_req)
-            print("成功發送使用已達上限訊息給使用者")
-            return
-        except Exception as err:
-            err_str = str(err)
-            if "429" in err_str or "monthly limit" in err_str:
-                wait_time = backoff_factor * (2 ** i)
-                print(f"push_message 發送失敗 (429)，{wait_time} 秒後重試...")
-                time.sleep(wait_time)
-            else:
-                print(f"push_message 發送失敗: {err}")
-                break
-    print("最終無法發送使用已達上限訊息給使用者")
+    try:
+        line_push(push_req)
+        logger.info("成功發送使用已達上限訊息給使用者")
+    except Exception as err:
+        logger.warning("最終無法發送使用已達上限訊息給使用者", error=err)
 
 # ----------------------------------
 # Main Function
@@ -232,126 +514,95 @@ def send_limit_message(event):
 # Response Function - Sort by event "reply_message" or "push_message"
 def send_response(event, reply_request):
     """
-    發送回覆訊息：如果發送失敗且捕捉到 429（超過使用量限制），
-    嘗試改用 send_limit_message() 來告知使用者。
+    發送回覆訊息：語音事件、已先回過「處理中」或 reply token 快過期時改用 push_message；
+    reply token 已失效時也改用 push 重送。push 額度快用完時（降級）reply token 還能用就改用 reply。
+    如果發送失敗且捕捉到 429（超過使用量限制），嘗試改用 send_limit_message() 來告知使用者。
     """
     try:
-        if getattr(event, "_is_audio", False):
-            to = event.source.group_id if event.source.type == "group" else event.source.user_id
-            push_req = PushMessageRequest(
-                to=to,
-                messages=reply_request.messages
-            )
-            messaging_api.push_message(push_req)
-        else:
-            messaging_api.reply_message(reply_request)
+        with tracing.span("send_response") as s:
+            if use_push(event, s):
+                push_messages(event, reply_request.messages)
+            else:
+                try:
+                    line_reply(reply_request, get_chat_key(event))
+                except Exception as e:
+                    if not reply_token_rejected(e, s):
+                        raise
+                    push_messages(event, reply_request.messages)
     except Exception as e:
-        err_str = str(e)
-        if "429" in err_str or "monthly limit" in err_str:
-            print("❌ 捕捉到 429 錯誤，表示使用已達上限")
+        if send_failed(e):
             send_limit_message(event)
-        else:
-            print(f"❌ LINE Reply Error: {e}")
-
-# TextMessage Handler
-@handler.add(MessageEvent)  # 預設處理 MessageEvent
-def handle_message(event):
-    """處理 LINE 文字訊息，根據指令回覆或提供 AI 服務"""
-    # 檢查 event.message 是否存在
-    if not hasattr(event, "message"):
-        return
-
-    # 判斷 message 資料型態：
-    if isinstance(event.message, dict):
-        msg_type = event.message.get("type")
-        msg_text = event.message.get("text", "")
-    elif hasattr(event.message, "type"):
-        msg_type = event.message.type
-        msg_text = getattr(event.message, "text", "")
-    else:
-        return
-    
-    # 若事件已經被處理過，則直接返回
-    if getattr(event, "_processed", False):
-        return
-
-    # 如果是從語音轉錄而來的事件，也可以標記為已處理
-    if getattr(event, "_is_audio", False):
-        event._processed = True
 
-    if msg_type != "text":
-        return
-
-    # 取得使用者與群組資訊（採用 snake_case）
-    user_message = msg_text.strip().lower()
-    user_id = event.source.user_id
-    group_id = event.source.group_id if event.source.type == "group" else None
-
-    # 檢查目前選用的 AI 模型
-    if group_id and group_id in user_ai_choice:
-        ai_model = user_ai_choice[group_id]
-    else:
-        ai_model = user_ai_choice.get(user_id, "deepseek-r1-distill-llama-70b")
-
-    print(f"📢 [DEBUG] {user_id if not group_id else group_id} 當前模型: {ai_model}")
-
-    # (1) 「給我id」：若訊息中同時包含「給我」和「id」
-    if "給我" in user_message and "id" in user_message:
-        reply_text = f"您的 User ID 是：\n{user_id}"
-        if group_id:
-            reply_text += f"\n這個群組的 ID 是：\n{group_id}"
-        reply_request = ReplyMessageRequest(
-            replyToken=event.reply_token,
-            messages=[TextMessage(text=reply_text)]
-        )
-        send_response(event, reply_request)
-        return
-
-    # (2) 「群組id」：在群組中，若訊息中同時包含「群組」和「id」
-    if group_id and "群組" in user_message and "id" in user_message:
-        reply_text = f"這個群組的 ID 是：\n{group_id}"
-        reply_request = ReplyMessageRequest(
-            replyToken=event.reply_token,
-            messages=[TextMessage(text=reply_text)]
-        )
-        send_response(event, reply_request)
+# 以下判斷 send_response 與 asgi.send_response 共用
+def use_push(event, span=None):
+    """這次送出是否改用 push（同時記錄 reply token 沒用上的原因）"""
+    reason = push_reason(event)
+    if reason and not can_reply_instead(event):
+        if reason != "audio":
+            metrics.reply_token_miss(reason)
+        if span is not None:
+            span.set(mode="push", reason=reason)
+        return True
+    if span is not None:
+        span.set(mode="reply")
+    return False
+
+def reply_token_rejected(error, span=None):
+    """reply 失敗是否因為 reply token 已失效（是的話呼叫端改用 push 重送）"""
+    if not is_invalid_reply_token(error):
+        return False
+    logger.warning("reply token 已失效，改用 push_message")
+    metrics.reply_token_miss("invalid_token")
+    if span is not None:
+        span.set(mode="push", reason="invalid_token")
+    return True
+
+def send_failed(error):
+    """記錄送出失敗；回傳 True 代表已達使用上限，呼叫端應改送 send_limit_message"""
+    if isinstance(error, CircuitOpenError):
+        logger.warning("LINE 熔斷中，略過回覆", error=error)
+        return False
+    if isinstance(error, QuotaExceededError):
+        logger.warning("push 額度不足，略過 push", error=error)
+        return False
+    err_str = str(error)
+    if "429" in err_str or "monthly limit" in err_str:
+        logger.warning("捕捉到 429 錯誤，表示使用已達上限")
+        return True
+    logger.error("LINE Reply Error", error=error)
+    return False
+
+def should_ack(event, name):
+    """預估 name 會超過 reply token 的剩餘時間，且不是只用 reply 的降級模式（保留 reply token 給最後的結果）"""
+    return needs_ack(event, name) and not push_quota.degraded
+
+def push_messages(event, messages):
+    to = event.source.group_id if event.source.type == "group" else event.source.user_id
+    line_push(PushMessageRequest(to=to, messages=messages))
+
+def ack_if_slow(event, name):
+    """
+    預估 name 會超過 reply token 的剩餘時間時，先用 reply token 回「處理中」，
+    之後的 send_response 都會改用 push。
+    """
+    if not should_ack(event, name):
         return
-
-    # (2-2) 若為個人訊息卻要求群組指令，回覆錯誤訊息
-    if group_id is None and "群組" in user_message and "id" in user_message:
-        reply_request = ReplyMessageRequest(
+    try:
+        line_reply(ReplyMessageRequest(
             replyToken=event.reply_token,
-            messages=[TextMessage(text="❌ 此指令僅限群組使用")]
-        )
-        send_response(event, reply_request)
-        return
-    
-    # (2-3) Random response from default pool
-    if "狗蛋" in user_message and "情勒" in user_message:
-        target_id = group_id if group_id is not None else user_id
-        random_reply(event.reply_token, target_id, messaging_api)
-        return
+            messages=[TextMessage(text=WORKING_ACK_MESSAGE)]
+        ), get_chat_key(event))
+        logger.info("預估耗時超過 reply token 期限，先回覆處理中", command=name, estimate_s=round(command_latency.estimate(name), 1))
+    except Exception as e:
+        logger.warning("處理中訊息發送失敗", error=e)
+    mark_acked(event)
 
-    # (3) 「狗蛋指令」：列出所有支援指令
-    if "指令" in user_message and "狗蛋" in user_message:
-        command_list = (
-            "📝 支援的指令：\n"
-            "1. 換模型: 更換 AI 語言模型 \n\t\t（預設為 Deepseek-R1）\n"
-            "2. 狗蛋出去: 機器人離開群組\n"
-            "3. 當前模型: 機器人現正使用的模型\n"
-            "4. 狗蛋生成: 生成圖片\n"
-            "5. 狗蛋介紹: 人物或角色的說明\n"
-            "6. 狗蛋搜圖: 即時搜圖\n"
-            "7. 狗蛋唱歌: 串連Spotify試聽\n"
-            "8. 狗蛋氣象: 確認當前天氣\n"
-            "9. 狗蛋預報: 確認三天天氣預報\n"
-            "10. 狗蛋情勒: 狗蛋的超能力"
-        )
-        reply_request = ReplyMessageRequest(
-            replyToken=event.reply_token,
-            messages=[TextMessage(text=command_list)]
-        )
-        send_response(event, reply_request)
+# TextMessage Handler
+@handler.add(MessageEvent)  # 預設處理 MessageEvent
+def handle_message(event):
+    """處理 LINE 文字訊息，根據指令回覆或提供 AI 服務（指令內容見 commands.py）"""
+    command, ctx = commands.route_message(event)
+    if command is None:
         return
 
     # # (4) AI 服務指令：檢查使用權限
@@ -392,342 +643,172 @@ def handle_message(event):
     #             print(f"❌ 無法離開群組: {e}")
     #         return
 
-
-    # (4) AI Group Command
-    if event.source.type == "group":
-        # 處理「狗蛋出去」指令（僅適用於群組）
-        if "狗蛋" in user_message and "出去" in user_message and group_id:
+    ack_if_slow(event, command)
+    actions = commands.plan(command, ctx, user_ai_choice)
+    if commands.queued(actions):
+        # 只負責排入背景工作，耗時由 job_queue 執行時統計
+        with tracing.span("command", command=command, queued=True):
+            run_actions(event, actions)
+        return
+    with command_latency.measure(command), metrics.time_command(command), tracing.span("command", command=command):
+        run_actions(event, actions)
+
+def run_actions(event, actions):
+    """執行 commands 回傳的動作（asgi.run_actions 為非同步版本）"""
+    for action in actions:
+        if isinstance(action, Reply):
+            reply_messages(event, action.messages)
+        elif isinstance(action, Job):
+            submit_job(event, action.name, action.payload, action.priority)
+        elif isinstance(action, Chat):
+            logger.debug("AI 對話", model=action.model)
+            reply_text(event, ask_groq(action.prompt, action.model))
+        elif isinstance(action, SelectionMenu):
             try:
-                reply_request = ReplyMessageRequest(
-                replyToken=event.reply_token,
-                messages=[TextMessage(text="我也不想留, 掰")]
-                )
-                send_response(event, reply_request)
-                messaging_api.leave_group(group_id)
-                print(f"🐶 狗蛋已離開群組 {group_id}")
+                reply_messages(event, build_ai_selection_messages())
             except Exception as e:
-                print(f"❌ 無法離開群組: {e}")
-            return
-
-    # (4-a) 「狗蛋生成」指令（例如圖片生成）
-    if "狗蛋生成" in user_message:
-        prompt = user_message.split("狗蛋生成", 1)[1].strip()
-        if not prompt:
-            prompt = "一個美麗的風景"
-        print(f"📢 [DEBUG] 圖片生成 prompt: {prompt}")
-        # 直接傳入 event.reply_token，而不是 user id
-        handle_generate_image_command(event.reply_token, prompt, messaging_api)
-        return
+                logger.error("FlexMessage Error", error=e)
+        elif isinstance(action, LeaveGroup):
+            try:
+                messaging_api.leave_group(action.group_id)
+                logger.info("狗蛋已離開群組")
+            except Exception as e:
+                logger.error("無法離開群組", error=e)
 
-    # (4-b) 「當前模型」指令
-    if "模型" in user_message and "當前" in user_message:
-        if group_id and group_id in user_ai_choice:
-            model = user_ai_choice[group_id]
-        else:
-            model = user_ai_choice.get(user_id, "Deepseek-R1")
-        reply_text = f"🤖 現在使用的 AI 模型是：\n{model}"
-        reply_request = ReplyMessageRequest(
-            replyToken=event.reply_token,
-            messages=[TextMessage(text=reply_text)]
-        )
-        send_response(event, reply_request)
-        return
+def reply_text(event, text):
+    """以單則文字訊息回覆"""
+    reply_messages(event, [TextMessage(text=text)])
 
-    # (4-c) 「換模型」
-    if "換" in user_message and "模型" in user_message:
-        # 若此事件來自語音，則改用 push_message
-        if getattr(event, "_is_audio", False):
-            target = event.source.group_id if event.source.type == "group" else event.source.user_id
-            send_ai_selection_menu(event.reply_token, target, use_push=True)
-        else:
-            send_ai_selection_menu(event.reply_token)
-        return
-    
-    # (4-e)「狗蛋搜尋」指令：搜尋 + AI 總結
-    if user_message.startswith("狗蛋搜尋"):
-        search_query = user_message.replace("狗蛋搜尋", "").strip()
-        
-        if not search_query:
-            reply_text = "請輸入要搜尋的內容，例如：狗蛋搜尋 OpenAI"
-        else:
-            print(f"📢 [DEBUG] 進行 Google 搜尋: {search_query}")
-            search_results = google_search(search_query)
+def reply_messages(event, messages):
+    """以多則訊息回覆（語音事件會由 send_response 改用 push）"""
+    reply_request = ReplyMessageRequest(
+        replyToken=event.reply_token,
+        messages=messages
+    )
+    send_response(event, reply_request)
 
-            if not search_results:
-                reply_text = "❌ 找不到相關資料。"
-            else:
-                reply_text = summarize_with_openai(search_results, search_query)
+def video_messages(videos):
+    """將爬取結果轉成 FlexMessage；沒有結果時回傳純文字"""
+    if not videos:
+        logger.info("爬取結果為空，回傳純文字訊息")
+        return [TextMessage(text="找不到相關影片。")]
 
-        reply_request = ReplyMessageRequest(
-            replyToken=event.reply_token,
-            messages=[TextMessage(text=reply_text)]
-        )
-        send_response(event, reply_request)
-        return
-    
-    # (4-f)狗蛋介紹 Image + AI 總結
-    if user_message.startswith("狗蛋介紹"):
-        # 解析人物名稱
-        messages = []
-        person_name = user_message.replace("狗蛋介紹", "").strip()
-        if not person_name:
-            reply_request = ReplyMessageRequest(
-                replyToken=event.reply_token,
-                messages=[TextMessage(text="請提供要查詢的人物名稱，例如：狗蛋介紹 川普")]
-            )
-            send_response(event, reply_request)
-            return
-        # 取得 AI 回應 + 圖片
-        response_text, image_url = search_person_info(person_name)
-        if image_url:
-            messages.append(create_flex_message(response_text, image_url))  # 附加圖片
+    flex_message = create_flex_jable_message(videos)  # ✅ 生成 FlexMessage
+    if flex_message is None:  # **確保 flex_message 不為 None**
+        logger.warning("FlexMessage 生成失敗，回傳純文字")
+        return [TextMessage(text="找不到相關影片。")]
+    return [flex_message]
 
-        reply_request = ReplyMessageRequest(
-            replyToken=event.reply_token,
-            messages=messages
-        )
-        send_response(event, reply_request)
-        return
+# ----------------------------------
+# Background Job（慢指令改由 job_queue 執行，結果再送回聊天室）
+# ----------------------------------
+def submit_job(event, name, payload, priority=PRIORITY_NORMAL):
+    target = event.source.group_id if event.source.type == "group" else event.source.user_id
+    job_queue.submit(name, payload, target=target, event=event, priority=priority)
 
-    # (4-g)狗蛋搜圖 Image search
-    if user_message.startswith("狗蛋搜圖"):
-        search_query = user_message.replace("狗蛋搜圖", "").strip()
+def deliver_job_result(job, messages, event):
+    """
+    工作完成後送出結果：原事件還在（同一個 process）時走 send_response，
+    reply token 仍有效就免費 reply，否則 push；重啟後才執行的工作直接 push 給 job.target。
+    """
+    if messages is None:
+        messages = [TextMessage(text="❌ 狗蛋處理失敗，請稍後再試！")]
+    if event is not None:
+        reply_messages(event, messages)
+    else:
+        line_push(PushMessageRequest(to=job.target, messages=messages))
 
-        if not search_query:
-            reply_text = "請提供要搜尋的內容，例如：狗蛋搜圖 日本女星"
-            messages = [TextMessage(text=reply_text)]
-        else:
-            image_url = search_google_image(search_query)
+def job_generate_image(payload):
+    return generate_image_messages(payload["prompt"])
 
-            if image_url:
-                messages = [create_flex_message(f"「{search_query}」的圖片 🔍", image_url)]
-            else:
-                messages = [TextMessage(text=f"找不到 {search_query} 的相關圖片 😢")]
+def job_search(payload):
+    query = payload["query"]
+    logger.debug("進行 Google 搜尋", query=query)
+    search_results = google_search(query)
+    if not search_results:
+        return [TextMessage(text="❌ 找不到相關資料。")]
+    return [TextMessage(text=summarize_with_openai(search_results, query))]
 
-        reply_request = ReplyMessageRequest(
-            replyToken=event.reply_token,
-            messages=messages
-        )
-        send_response(event, reply_request)
-        return
-    
-    # (4-h)狗蛋唱歌 Spotify link
-    if user_message.startswith("狗蛋唱歌"):
-        song_name = user_message.replace("狗蛋唱歌", "").strip()
-        song_data = search_spotify_song(song_name)
+def job_person_intro(payload):
+    # 取得 AI 回應 + 圖片
+    messages = []
+    response_text, image_url = search_person_info(payload["name"])
+    if image_url:
+        messages.append(create_flex_message(response_text, image_url))  # 附加圖片
+    return messages
 
-        if not song_data:
-            reply_request = ReplyMessageRequest(
-                replyToken=event.reply_token,
-                messages=[TextMessage(text="❌ 沒找到這首歌，請試試別的！")]
-            )
-        else:
-            mp3_url = song_data.get("preview_url")
-            if mp3_url:
-                hosted_m4a_url = download_and_host_audio(mp3_url)  # 轉換為 m4a
-
-                if hosted_m4a_url:
-                    reply_request = ReplyMessageRequest(
-                        replyToken=event.reply_token,
-                        messages=[
-                            TextMessage(text=f"🎶 這是 {song_data['name']} 的預覽音頻 🎵"),
-                            AudioMessageContent(original_content_url=hosted_m4a_url, duration=30000)
-                        ]
-                    )
-                else:
-                    reply_request = ReplyMessageRequest(
-                        replyToken=event.reply_token,
-                        messages=[TextMessage(text="❌ 轉換歌曲失敗，請稍後再試！")]
-                    )
-            else:
-                reply_request = ReplyMessageRequest(
-                    replyToken=event.reply_token,
-                    messages=[TextMessage(text=f"🎵 {song_data['name']} 的歌曲連結：{song_data['song_url']} ）")]
-                )
+def job_image_search(payload):
+    query = payload["query"]
+    image_url = search_google_image(query)
+    if image_url:
+        return [create_flex_message(f"「{query}」的圖片 🔍", image_url)]
+    return [TextMessage(text=f"找不到 {query} 的相關圖片 😢")]
+
+def job_sing(payload):
+    song_data = search_spotify_song(payload["song"])
+    if not song_data:
+        return [TextMessage(text="❌ 沒找到這首歌，請試試別的！")]
+    if not song_data.get("preview_url"):
+        return [TextMessage(text=f"🎵 {song_data['name']} 的歌曲連結：{song_data['song_url']} ）")]
+    hosted_m4a_url = download_and_host_audio(song_data["preview_url"])  # 轉換為 m4a
+    if not hosted_m4a_url:
+        return [TextMessage(text="❌ 轉換歌曲失敗，請稍後再試！")]
+    return [
+        TextMessage(text=f"🎶 這是 {song_data['name']} 的預覽音頻 🎵"),
+        AudioMessageContent(original_content_url=hosted_m4a_url, duration=30000)
+    ]
 
-        send_response(event, reply_request)
-        return
+def job_weather(payload):
+    return [TextMessage(text=f"{get_weather_weatherapi(payload['city'])}")]
 
-    # (4-i)狗蛋氣象
-    # 如果使用者輸入 "台北天氣"，則查詢台北天氣
-    if "氣象" in user_message and "狗蛋" in user_message:
-        city = user_message.replace("狗蛋氣象", "").strip()
-        
-        if city:
-            weather_info = get_weather_weatherapi(city)
-        else:
-            weather_info = "❌ 請輸入有效的城市名稱, 包含行政區（例如：竹北市、東勢鄉）"
+def job_forecast(payload):
+    return [TextMessage(text=f"{get_weather_forecast(payload['city'])}")]
 
-        reply_request = ReplyMessageRequest(
-            replyToken=event.reply_token,
-            messages=[TextMessage(text=f"{weather_info}")]
-        )
-        send_response(event, reply_request)
-        return
-    
-    # (4-j)狗蛋預報
-    if "狗蛋" in user_message and "預報" in user_message:
-        city = user_message.replace("狗蛋預報", "").strip()
-        
-        if city:
-            weather_info = get_weather_forecast(city)
-        else:
-            weather_info = "❌ 請輸入有效的城市名稱, 包含行政區（例如：竹北市、東勢鄉）"
+def job_video_search(payload):
+    return video_messages(get_video_data(payload["query"]))
 
-        reply_request = ReplyMessageRequest(
-            replyToken=event.reply_token,
-            messages=[TextMessage(text=f"{weather_info}")]
-        )
-        send_response(event, reply_request)
-        return
+def job_video_hot(payload):
+    return video_messages(get_video_data_hotest())
 
-    # (4-j)「狗蛋開車」
-    if ("狗蛋開車") in user_message and ("最熱") not in user_message and ("最新") not in user_message:
-        search_query = user_message.replace("狗蛋開車", "").strip()
-        
-        if not search_query:
-            response_text = "請提供人名，例如：狗蛋開車 狗蛋"
-            reply_request = ReplyMessageRequest(
-                reply_token=event.reply_token,
-                messages=[TextMessage(text=response_text)]
-            )
-        else:
-            videos = get_video_data(search_query)  # ✅ 爬取影片
-            # print(f"✅ [DEBUG] 爬取結果: {videos}")  # Debugging
-            
-            if not videos:
-                print("❌ [DEBUG] 爬取結果為空，回傳純文字訊息")
-                response_text = "找不到相關影片。"
-                reply_request = ReplyMessageRequest(
-                    reply_token=event.reply_token,
-                    messages=[TextMessage(text=response_text)]
-                )
-            else:
-                flex_message = create_flex_jable_message(videos)  # ✅ 生成 FlexMessage
-                
-                if flex_message is None:  # **確保 flex_message 不為 None**
-                    print("❌ [DEBUG] FlexMessage 生成失敗，回傳純文字")
-                    response_text = "找不到相關影片。"
-                    reply_request = ReplyMessageRequest(
-                        reply_token=event.reply_token,
-                        messages=[TextMessage(text=response_text)]
-                    )
-                else:
-                    # print(f"✅ [DEBUG] 生成的 FlexMessage: {flex_message}")
-                    reply_request = ReplyMessageRequest(
-                        reply_token=event.reply_token,
-                        messages=[flex_message]
-                    )
-        send_response(event, reply_request)  
-        return  
-
-    # (4-k)「狗蛋開車最熱」
-    if ("狗蛋開車") in user_message and ("最熱") in user_message:
-        videos = get_video_data_hotest()  # ✅ 爬取影片
-        print(f"✅ [DEBUG] 爬取結果: {videos}")  # Debugging
-            
-        if not videos:
-            print("❌ [DEBUG] 爬取結果為空，回傳純文字訊息")
-            response_text = "找不到相關影片。"
-            reply_request = ReplyMessageRequest(
-                reply_token=event.reply_token,
-                messages=[TextMessage(text=response_text)]
-            )
-        else:
-            flex_message = create_flex_jable_message(videos)  # ✅ 生成 FlexMessage
-                
-            if flex_message is None:  # **確保 flex_message 不為 None**
-                print("❌ [DEBUG] FlexMessage 生成失敗，回傳純文字")
-                response_text = "找不到相關影片。"
-                reply_request = ReplyMessageRequest(
-                    reply_token=event.reply_token,
-                    messages=[TextMessage(text=response_text)]
-                )
-            else:
-                # print(f"✅ [DEBUG] 生成的 FlexMessage: {flex_message}")
-                reply_request = ReplyMessageRequest(
-                    reply_token=event.reply_token,
-                    messages=[flex_message]
-                )
-        send_response(event, reply_request)  
-        return  
-    
-    # (4-m)「狗蛋開車最新」
-    if ("狗蛋開車") in user_message and ("最新") in user_message:
-        videos = get_video_data_newest()  # ✅ 爬取影片
-        print(f"✅ [DEBUG] 爬取結果: {videos}")  # Debugging
-            
-        if not videos:
-            print("❌ [DEBUG] 爬取結果為空，回傳純文字訊息")
-            response_text = "找不到相關影片。"
-            reply_request = ReplyMessageRequest(
-                reply_token=event.reply_token,
-                messages=[TextMessage(text=response_text)]
-            )
-        else:
-            flex_message = create_flex_jable_message(videos)  # ✅ 生成 FlexMessage
-                
-            if flex_message is None:  # **確保 flex_message 不為 None**
-                print("❌ [DEBUG] FlexMessage 生成失敗，回傳純文字")
-                response_text = "找不到相關影片。"
-                reply_request = ReplyMessageRequest(
-                    reply_token=event.reply_token,
-                    messages=[TextMessage(text=response_text)]
-                )
-            else:
-                # print(f"✅ [DEBUG] 生成的 FlexMessage: {flex_message}")
-                reply_request = ReplyMessageRequest(
-                    reply_token=event.reply_token,
-                    messages=[flex_message]
-                )
-        send_response(event, reply_request)  
-        return 
-
-
-    # (5) 若在群組中且訊息中不包含「狗蛋」，則不觸發 AI 回應
-    if event.source.type == "group" and "狗蛋" not in user_message:
-        return
+def job_video_new(payload):
+    return video_messages(get_video_data_newest())
 
-    # (6) 預設：呼叫 AI 回應函式
-    if event.source.type == "group":
-        if group_id and group_id in user_ai_choice:
-            ai_model = user_ai_choice[group_id]
-        else:
-            ai_model = "deepseek-r1-distill-llama-70b"
-    else:
-        ai_model = user_ai_choice.get(user_id, "deepseek-r1-distill-llama-70b")
-    
-    gpt_reply = ask_groq(user_message, ai_model)
-    try:
-        reply_request = ReplyMessageRequest(
-            replyToken=event.reply_token,
-            messages=[TextMessage(text=gpt_reply)]
-        )
-        send_response(event, reply_request)
-    except Exception as e:
-        print(f"❌ LINE Reply Error: {e}")
+job_queue = JobQueue(JOB_DB_PATH, deliver=deliver_job_result, workers=JOB_WORKERS,
+                     pool_limits=JOB_POOL_LIMITS, latency=command_latency, lease=JOB_LEASE_SECONDS)
+job_queue.register("generate_image", job_generate_image, pool="image")
+job_queue.register("search", job_search, pool="search")
+job_queue.register("person_intro", job_person_intro, pool="search")
+job_queue.register("image_search", job_image_search, pool="search")
+job_queue.register("sing", job_sing, pool="media")
+job_queue.register("weather", job_weather, pool="weather")
+job_queue.register("forecast", job_forecast, pool="weather")
+job_queue.register("video_search", job_video_search, pool="browser")
+job_queue.register("video_hot", job_video_hot, pool="browser")
+job_queue.register("video_new", job_video_new, pool="browser")
+# 啟動時就接手其他 worker 留下的過期工作，不必等到第一個慢指令
+job_queue.start()
 
 # AudioMessage Handler
 @handler.add(MessageEvent, message=AudioMessageContent)
 def handle_audio_message(event):
-    user_id = event.source.user_id
     group_id = event.source.group_id if event.source.type == "group" else None
     reply_token = event.reply_token
     audio_id = event.message.id
 
-    print(f"📢 [DEBUG] 收到語音訊息, ID: {audio_id}")
-    audio_url = f"https://api-data.line.me/v2/bot/message/{audio_id}/content"
+    logger.info("收到語音訊息", audio_id=audio_id)
+    audio_url = f"{LINE_DATA_API_BASE}/v2/bot/message/{audio_id}/content"
     headers = {"Authorization": f"Bearer {LINE_CHANNEL_ACCESS_TOKEN}"}
 
+    # 下載 + 轉錄 + AI 回覆可能超過 reply token 期限，必要時先回「處理中」
+    ack_if_slow(event, "audio")
+    audio_start = time.monotonic()
+
     try:
         # 下載語音檔案
-        response = requests.get(audio_url, headers=headers, stream=True)
-        if response.status_code == 200:
-            audio_path = f"/tmp/{audio_id}.m4a"
-            with open(audio_path, "wb") as f:
-                for chunk in response.iter_content(chunk_size=1024):
-                    f.write(chunk)
-            print(f"📢 [DEBUG] 語音檔案已儲存: {audio_path}")
+        audio_path = f"/tmp/{audio_id}.m4a"
+        status_code = http_client.download(audio_url, audio_path, headers=headers)
+        if status_code == 200:
+            logger.debug("語音檔案已儲存", path=audio_path)
 
             # 呼叫轉錄及後續回覆（同步完成）
             transcribed_text, ai_response = transcribe_and_respond_with_gpt(audio_path)
@@ -737,144 +818,86 @@ def handle_audio_message(event):
                     replyToken=reply_token,
                     messages=[TextMessage(text="❌ 語音辨識失敗，請再試一次！")]
                 )
-                messaging_api.reply_message(reply_request)
-                return
-
-            print(f"📢 [DEBUG] Whisper 轉錄結果: {transcribed_text}")
-
-            # 準備回覆訊息列表（全部用 reply_message 一次性回覆）
-            messages = []
-
-            # 回覆轉錄內容
-            messages.append(TextMessage(text=f"🎙️ 轉錄內容：{transcribed_text}"))
-
-            # 檢查是否有特殊指令
-            if "狗蛋生成" in transcribed_text:
-                prompt = transcribed_text.split("狗蛋生成", 1)[1].strip()
-                if not prompt:
-                    prompt = "一隻可愛的小狗"
-                print(f"📢 [DEBUG] 圖片生成 prompt: {prompt}")
-                # 傳入 reply_token 而非 target_id
-                handle_generate_image_command(event.reply_token, prompt, messaging_api)
+                send_response(event, reply_request)
                 return
 
+            logger.debug("Whisper 轉錄完成", chars=len(transcribed_text))
 
-            if "狗蛋" in transcribed_text and "情勒" in transcribed_text:
-                # 如果包含「狗蛋情勒」指令，回覆隨機訊息（模擬回覆）
-                random_msg = random.choice([
-                    "🥱你看我有想告訴你嗎？",
-                    "😏我知道你在想什麼！",
-                    "🤔你確定嗎？",
-                    "😎好啦，不理你了！"
-                ])
-                messages.append(TextMessage(text=random_msg))
-            elif event.source.type == "group" and "狗蛋" not in transcribed_text:
-                print("群組語音訊息未明確呼喚 '狗蛋'，不進行ai回覆。")
-                reply_request = ReplyMessageRequest(
-                    replyToken=reply_token,
-                    messages=messages
-                )
-                messaging_api.reply_message(reply_request)
-                return
+            # 圖片生成排入背景工作，其餘一次回覆轉錄內容與 AI 回應（token 已用掉或快過期時由 send_response 改用 push）
+            actions = commands.plan_audio(transcribed_text, ai_response, group_id is not None)
+            if commands.queued(actions):
+                ack_if_slow(event, "generate_image")
             else:
-                # 預設情況下回覆 AI 回應
-                messages.append(TextMessage(text=ai_response))
-
-            # 使用 reply_message 一次性回覆所有訊息
-            reply_request = ReplyMessageRequest(
-                replyToken=reply_token,
-                messages=messages
-            )
-            messaging_api.reply_message(reply_request)
+                command_latency.observe("audio", time.monotonic() - audio_start)
+                metrics.command_total.inc("audio")
+                metrics.command_seconds.observe(time.monotonic() - audio_start, "audio")
+            run_actions(event, actions)
         else:
-            print(f"❌ [ERROR] 無法下載語音訊息, API 狀態碼: {response.status_code}")
+            logger.error("無法下載語音訊息", status=status_code)
             reply_request = ReplyMessageRequest(
                 replyToken=reply_token,
                 messages=[TextMessage(text="❌ 下載語音檔案失敗")]
             )
-            messaging_api.reply_message(reply_request)
+            send_response(event, reply_request)
     except Exception as e:
-        print(f"❌ [ERROR] 處理語音時發生錯誤: {e}")
+        logger.error("處理語音時發生錯誤", exc_info=True, error=e)
         reply_request = ReplyMessageRequest(
             replyToken=reply_token,
             messages=[TextMessage(text="❌ 語音處理發生錯誤，請稍後再試！")]
         )
-        messaging_api.reply_message(reply_request)
+        send_response(event, reply_request)
 
 # Transcribe Function
 def transcribe_and_respond_with_gpt(audio_path):
     """使用 GPT-4o Mini 進行語音轉文字並生成回應"""
     headers = {"Authorization": f"Bearer {OPENAI_API_KEY}"}
     with open(audio_path, "rb") as audio_file:
-        files = {
-            "file": (audio_path, audio_file, "audio/m4a"),
-            "model": (None, "whisper-1"),
-            "language": (None, "zh")
-        }
+        files = {"file": (audio_path, audio_file, "audio/m4a")}
+        data = {"model": "whisper-1", "language": "zh"}
         try:
-            response = requests.post(
-                "https://api.openai.com/v1/audio/transcriptions",
+            # 檔案已被讀取，不重試
+            response = resilience.call(
+                "openai", http_client.post,
+                f"{OPENAI_API_BASE}/audio/transcriptions",
                 headers=headers,
-                files=files
+                files=files,
+                data=data,
+                timeout=httpx.Timeout(60, connect=3.05),  # 轉錄較慢，read timeout 放寬
+                is_failure_result=http_failure, retries=0, op="whisper",
             )
             if response.status_code == 200:
                 result = response.json()
                 transcribed_text = result.get("text", "").strip()
-                print(f"📢 [DEBUG] Whisper 轉錄結果: {transcribed_text}")
+                logger.debug("Whisper 轉錄完成", chars=len(transcribed_text))
                 if not transcribed_text:
                     return None, "❌ 語音內容過短，無法辨識"
 
-                # 直接使用 openai.ChatCompletion.create() 來呼叫 API
-                completion = openai.ChatCompletion.create(
+                # 經過 openai 熔斷器呼叫 openai.ChatCompletion.create()
+                completion = resilience.call(
+                    "openai", openai.ChatCompletion.create, op="whisper_chat",
                     model="gpt-4o",  # 此處請確認您有權限使用該模型，若有需要可改為其他模型（例如 "gpt-3.5-turbo"）
                     messages=[
-                        {"role": "system", "content": "你是一個名叫狗蛋的智能助手，請使用繁體中文回答。"},
+                        {"role": "system", "content": AUDIO_CHAT_PROMPT},
                         {"role": "user", "content": transcribed_text}
                     ]
                 )
                 ai_response = completion.choices[0].message.content.strip()
                 return transcribed_text, ai_response
             else:
-                print(f"❌ [ERROR] Whisper API 回應錯誤: {response.text}")
+                logger.error("Whisper API 回應錯誤", status=response.status_code, body=response.text)
                 return None, "❌ 語音辨識失敗，請稍後再試"
         except Exception as e:
-            print(f"❌ [ERROR] 語音轉文字 API 失敗: {e}")
+            logger.error("語音轉文字 API 失敗", error=e)
             return None, "❌ 伺服器錯誤，請稍後再試"
 
 # Post Handler
 @handler.add(PostbackEvent)
 def handle_postback(event):
-    user_id = event.source.user_id
     group_id = event.source.group_id if event.source.type == "group" else None
-    data = event.postback.data
-
-    model_map = {
-        "model_gpt4o": "GPT-4o",
-        "model_gpt4o_mini": "GPT_4o_Mini",
-        "model_deepseek": "deepseek-r1-distill-llama-70b",
-        "model_llama3": "llama3-8b-8192",
-    }
-    if data in model_map:
-        if group_id:
-            user_ai_choice[group_id] = model_map[data]
-        else:
-            user_ai_choice[user_id] = model_map[data]
-        print(f"📢 [DEBUG] {user_id if not group_id else group_id} 選擇模型: {model_map[data]}")
-        reply_req = ReplyMessageRequest(
-            replyToken=event.reply_token,
-            messages=[TextMessage(text=f"已選擇語言模型: {model_map[data]}！\n\n🔄 輸入「換模型」可重新選擇")]
-        )
-        messaging_api.reply_message(reply_req)
-        return
+    run_actions(event, commands.plan_postback(event.postback.data, event.source.user_id, group_id, user_ai_choice))
 
-    reply_req = ReplyMessageRequest(
-        replyToken=event.reply_token,
-        messages=[TextMessage(text="未知選擇，請重試。")]
-    )
-    messaging_api.reply_message(reply_req)
-
-def send_ai_selection_menu(reply_token, target=None, use_push=False):
-    """發送 AI 選擇選單"""
+def build_ai_selection_messages():
+    """建立 AI 選擇選單訊息（文字 + Flex carousel）"""
     flex_contents_json = {
         "type": "carousel",
         "contents": [
@@ -951,171 +974,132 @@ def send_ai_selection_menu(reply_token, target=None, use_push=False):
         ]
     }
 
+    # 將 flex JSON 轉為字串，再解析成 FlexContainer
+    flex_json_str = json.dumps(flex_contents_json)
+    flex_contents = FlexContainer.from_json(flex_json_str)
+    flex_message = FlexMessage(
+        alt_text="請選擇 AI 模型",
+        contents=flex_contents
+    )
+    return [
+        TextMessage(text="你好，我是狗蛋🐶 ！\n請選擇 AI 模型後發問。"),
+        flex_message
+    ]
+
+def system_prompt_for(model):
+    """ask_groq 依模型使用的 system prompt（同時作為快取 key 的一部分）"""
+    if model.lower() in ["gpt-4o", "gpt_4o_mini"]:
+        return OPENAI_CHAT_PROMPT
+    if model.lower() == "gpt-translation":
+        return TRANSLATION_PROMPT
+    return GROQ_CHAT_PROMPT
+
+def ask_groq(user_message, model, retries=1):
+    """
+    先查詢回應快取（model + system prompt + 正規化後的訊息），沒有才呼叫上游 AI。
+    以「❌」開頭的錯誤訊息不會被快取；上游失敗或熔斷時若有過期的舊答案則改回舊答案。
+    """
+    cache_key, cached = ask_cache_lookup(user_message, model)
+    if cached is not None:
+        return cached
+
+    with tracing.span("ask_groq", model=model):
+        reply = ask_groq_upstream(user_message, model, retries)
+    return ask_cache_store(cache_key, model, reply)
+
+# ask_groq 的快取與模型分流（asgi.ask_groq 共用）
+def ask_cache_lookup(user_message, model):
+    """回傳 (cache_key, 快取的答案或 None)"""
+    cache_key = ask_cache.make_key(model, system_prompt_for(model), user_message)
+    cached = ask_cache.get(cache_key)
+    if cached is not None:
+        logger.debug("ask_groq 快取命中", model=model)
+        tracing.record("ask_cache_hit", time.perf_counter(), model=model)
+    return cache_key, cached
+
+def ask_cache_store(cache_key, model, reply):
+    """成功的答案寫入快取；上游失敗時若有過期的舊答案則改回舊答案"""
+    if reply and not reply.startswith("❌"):
+        ask_cache.set(cache_key, reply, ask_cache.ttl_for(model))
+        return reply
+    stale = ask_cache.get_stale(cache_key)
+    if stale is not None:
+        logger.warning("ask_groq 上游失敗，改用過期快取", model=model)
+        return stale
+    return reply
+
+def chat_route(user_message, model):
+    """
+    根據選擇的模型決定上游，回傳 (backend, backup, messages, op)：
+      - 如果 model 為 "gpt-4o" 或 "gpt_4o_mini"，則呼叫 OpenAI gpt-4o-mini（原有邏輯）
+      - 如果 model 為 "gpt-translation"，則使用翻譯模式，轉換為有效模型（"gpt-3.5-turbo"）並使用翻譯 prompt
+      - 否則使用 Groq API（backup 為 provider_router 慢或失敗時改走的備援模型）
+    """
+    name = model.lower()
+    if name in ["gpt-4o", "gpt_4o_mini"]:
+        return "openai:gpt-4o-mini", None, [
+            {"role": "user", "content": OPENAI_CHAT_PROMPT},
+            {"role": "user", "content": user_message}
+        ], "chat"
+    if name == "gpt-translation":
+        return "openai:gpt-3.5-turbo", None, [
+            {"role": "system", "content": TRANSLATION_PROMPT},
+            {"role": "user", "content": user_message}
+        ], "translate"
+    return f"groq:{name}", HEDGE_BACKUPS.get(name), [
+        {"role": "system", "content": GROQ_CHAT_PROMPT},
+        {"role": "user", "content": user_message},
+    ], name
+
+def chat_error_reply(error):
+    """AI 呼叫失敗時回給使用者的訊息"""
+    if isinstance(error, CircuitOpenError):
+        logger.warning("AI 服務熔斷中", error=error)
+        return "❌ AI 服務暫時無法使用，請稍後再試。"
+    logger.error("AI API 呼叫錯誤", error=error)
+    return "❌ 狗蛋伺服器錯誤，請稍後再試。"
+
+def ask_groq_upstream(user_message, model, retries=1):
+    """
+    依 chat_route 呼叫上游：OpenAI 直接呼叫，Groq 經 provider_router（慢或失敗時改走備援模型）。
+    上游呼叫都經過熔斷器：熔斷中直接回覆預設訊息，重試受全 process 的重試額度限制，不再 sleep 數秒。
+    """
+    logger.debug("ask_groq", model=model)
     try:
-        # 將 flex JSON 轉為字串，再解析成 FlexContainer
-        flex_json_str = json.dumps(flex_contents_json)
-        flex_contents = FlexContainer.from_json(flex_json_str)
-        flex_message = FlexMessage(
-            alt_text="請選擇 AI 模型",
-            contents=flex_contents
-        )
-        reply_request = ReplyMessageRequest(
-            replyToken=reply_token,
-            messages=[
-                TextMessage(text="你好，我是狗蛋🐶 ！\n請選擇 AI 模型後發問。"),
-                flex_message
-            ]
-        )
-        if use_push and target:
-            push_request = PushMessageRequest(
-                to=target,
-                messages=reply_request.messages
-            )
-            messaging_api.push_message(push_request)
-        else:
-            messaging_api.reply_message(reply_request)
+        backend, backup, messages, op = chat_route(user_message, model)
+        if backend.startswith("openai:"):
+            return call_chat_backend(backend, messages, retries=retries, op=op)
+        max_chars = chat_reply_limit(user_message)
+        reply = provider_router.complete(
+            backend, backup, lambda b, cancel: call_chat_backend(b, messages, max_chars, cancel))
+        return reply or NO_REPLY_MESSAGE
     except Exception as e:
-        print(f"❌ FlexMessage Error: {e}")
+        return chat_error_reply(e)
 
-def ask_groq(user_message, model, retries=3, backoff_factor=1.0):
+def call_chat_backend(backend, messages, max_chars=None, cancel=None, retries=0, op="chat"):
     """
-    根據選擇的模型執行不同的 API：
-      - 如果 model 為 "gpt-4o" 或 "gpt_4o_mini"，則呼叫 OpenAI API（原有邏輯）
-      - 如果 model 為 "gpt-translation"，則使用翻譯模式，轉換為有效模型（例如 "gpt-3.5-turbo"）並使用翻譯 prompt
-      - 否則使用 Groq API，並加入重試機制避免連線錯誤。
+    呼叫單一 backend（"provider:model"）並回傳可見回答。
+    Groq 走串流（可被 cancel 中止）；OpenAI 0.28 SDK 無法中途取消，只能等它完成後丟棄。
+    hedge / failover 本身就是重試，經 provider_router 呼叫時不再重試（retries=0）。
     """
-    print(f"[ask_groq] 模型參數: {model}")
-
-    for i in range(retries):
-        try:
-            if model.lower() in ["gpt-4o", "gpt_4o_mini"]:
-                # OpenAI GPT-4o Mini
-                openai_client = openai.ChatCompletion.create(
-                    model="gpt-4o-mini",
-                    messages=[
-                        {"role": "user", "content": "你是一個名叫狗蛋的助手，盡量只使用繁體中文精簡跟朋友的語氣回答, 約莫50字內，限制不超過80字，除非當請求為翻譯時, 全部內容都需要完成翻譯不殘留原語言。"},
-                        {"role": "user", "content": user_message}
-                    ]
-                )
-                print(f"📢 [DEBUG] OpenAI API 回應: {openai_client}")
-                return openai_client.choices[0].message.content.strip()
-
-            elif model.lower() == "gpt-translation":
-                # OpenAI 翻譯模式
-                effective_model = "gpt-3.5-turbo"
-                print(f"📢 [DEBUG] 呼叫 OpenAI API (翻譯模式)，使用模型: {effective_model}")
-                response = openai.ChatCompletion.create(
-                    model=effective_model,
-                    messages=[
-                        {"role": "system", "content": "你是一位專業翻譯專家，請根據使用者的需求精準且自然地翻譯以下內容。當請求為翻譯時, 全部內容一定都要完成翻譯不殘留原語言"},
-                        {"role": "user", "content": user_message}
-                    ]
-                )
-                return response.choices[0].message.content.strip()
-
-            else:
-                # Groq API，加入重試機制
-                chat_completion = client.chat.completions.create(
-                    messages=[
-                        {"role": "system", "content": "你是一個名叫狗蛋的助手，跟使用者是朋友關係, 盡量只使用繁體中文方式進行回答, 約莫50字內，限制不超過80字, 除非當請求為翻譯時, 全部內容都需要完成翻譯不殘留原語言。"},
-                        {"role": "user", "content": user_message},
-                    ],
-                    model=model.lower(),
-                )
-                if not chat_completion.choices:
-                    return "❌ 狗蛋無法回應，請稍後再試。"
-
-                content = chat_completion.choices[0].message.content.strip()
-                content = re.sub(r"<think>.*?</think>", "", content, flags=re.DOTALL).strip()
-                return content
+    provider, model = backend.split(":", 1)
+    if provider == "openai":
+        response = resilience.call("openai", openai.ChatCompletion.create, model=model, messages=messages,
+                                   retries=retries, op=op)
+        return response.choices[0].message.content.strip()
+
+    if STREAM_COMPLETIONS:
+        return resilience.call("groq", stream_chat, client, messages, model,
+                               max_chars=max_chars, cancel=cancel, retries=retries, op=model)
+    chat_completion = resilience.call("groq", client.chat.completions.create, messages=messages, model=model,
+                                      retries=retries, op=model)
+    if not chat_completion.choices:
+        return ""
+    return strip_think(chat_completion.choices[0].message.content)
 
-        except requests.exceptions.RequestException as e:
-            print(f"❌ API 連線失敗 (第 {i+1} 次)：{e}")
-            time.sleep(backoff_factor * (2 ** i))  # 指數退避 (1s, 2s, 4s)
-
-        except Exception as e:
-            print(f"❌ AI API 呼叫錯誤: {e}")
-            return "❌ 狗蛋伺服器錯誤，請稍後再試。"
-
-    return "❌ 無法連線至 AI 服務，請稍後再試。"
-
-def random_reply(reply_token, target, messaging_api):
-
-    reply_messages = [
-    "😏 哇，你終於想起家裡還有我這號人物了？",
-    "🤔 小時候那麼乖，怎麼長大了反而學壞了？",
-    "🙄 這麼多親戚，怎麼只有我記得幫忙？",
-    "😎 你長大了嘛，什麼事都不用家人操心了，對吧？",
-    "🥱 家裡是你旅館嗎？回來就吃飯，吃完就走？",
-    "😂 現在會頂嘴了，長大了不起了是不是？",
-    "😌 我們這輩子就這樣吧，下輩子不欠你的了。",
-    "🤥 你說什麼都對，反正長輩講話都沒人聽啦。",
-    "😇 嗯，你的道理聽起來很棒，但還是要聽我的。",
-    "😏 這次考不好沒關係，反正你習慣了。",
-    "🙄 每次說幫忙都說在忙，那你的忙是什麼時候結束？",
-    "🥲 哦？家裡不是你的避風港嗎？怎麼一出事就消失？",
-    "😌 反正我都是最閒的，你們才是最忙的嘛。",
-    "😎 家裡的事跟你無關？行啊，以後財產分配也不關你的事。",
-    "😒 啊～小時候那麼乖，怎麼現在只會氣人？",
-    "🥱 沒事，你開心就好，家裡怎麼樣都不重要對吧？",
-    "😏 你長大了，學會自己做決定了，出事可別找家裡哦。",
-    "🙃 哇，難得見到你，你今天是客人還是家人？",
-    "😇 你還記得家裡住哪嗎？怕你迷路呢。",
-    "😌 好啦好啦，家裡的事你不用管，反正你最忙最累了。",
-    "😏 哇，你終於有空理我了？",
-    "🤔 你這麼忙，連回個訊息的時間都沒有嗎？",
-    "😂 哦，你現在開始有標準了？當初不是什麼都可以？",
-    "😇 哇，你的愛情觀好偉大喔，我配不上你呢。",
-    "🙄 又在講大道理？還是說你根本沒打算解決問題？",
-    "😎 我知道啊，你很特別，特別會讓人心累。",
-    "🥱 你的承諾比天氣預報還不準呢。",
-    "😏 你說你沒變？哦，那是我自己長大了啦。",
-    "😂 你的愛是限量供應的嗎？怎麼輪到我時就沒了？",
-    "😌 我們的關係就像天氣，時好時壞，全看你的心情。",
-    "🙃 哇，這次冷戰比上次撐得更久，進步了呢！",
-    "🥱 你每次都這樣，然後期待我當沒事？",
-    "😇 哦，所以現在是我錯了？好啦，我認錯，滿意了吧？",
-    "😏 你對別人都很好，對我特別不一樣呢，真特別。",
-    "😂 你的道歉就像廣告，重複很多次但沒什麼用。",
-    "🙄 哦，你現在才發現我是個不錯的人？晚了呢～",
-    "😎 你說你不會再這樣？好啊，這是第幾次了呢？",
-    "😌 你這麼愛自由，談什麼戀愛啊？去當風吧。",
-    "😂 你說我們之間沒問題？對啊，問題都是我的。",
-    "😇 嗯，分手後你過得很好，謝謝你讓我見識什麼叫成長。",
-    "😏 哇，你的貢獻好大喔，真的沒有你不行呢！",
-    "🤔 這麼簡單的事都搞不定，真的沒問題嗎？",
-    "🙄 哦，所以這次的問題還是我的錯？好喔～",
-    "😂 哇，你好忙啊，忙著讓別人幫你做事？",
-    "😇 這種工作強度你都撐不住，那還是別做了吧？",
-    "😏 哦，原來拖延時間也是你的專業技能之一啊？",
-    "🥱 這次又是什麼理由？等一下要不要再編一個？",
-    "😎 你的 KPI 是擺爛吧？怎麼還沒達標？",
-    "😂 我以為你是來工作的，沒想到是來度假的。",
-    "😇 你這個決定很有創意呢，特別容易出事的那種。",
-    "🙄 這麼簡單的事都要問？你的腦子是裝飾品嗎？",
-    "😏 你要的東西「剛剛」才發給你，剛剛是三天前。",
-    "🥱 你的效率真讓人感動，感動到想哭。",
-    "😌 你是來這裡解決問題的，還是來製造問題的？",
-    "😂 哇，你的「馬上」和我的「馬上」果然不是同一個時區的。",
-    "😎 你的領悟能力真的很獨特，特別慢。",
-    "🙄 哦，現在是我的問題了？好啊，我背鍋習慣了。",
-    "😏 你這麼會找藉口，不去當小說家真的可惜了。",
-    "🥱 你真的不怕工作做不完嗎？還是你根本不打算做？",
-    "😂 哇，你的職場生存技能是什麼？推卸責任嗎？"
-    ]
-    chosen_message = random.choice(reply_messages)
-    reply_request = ReplyMessageRequest(
-        replyToken=reply_token,
-        messages=[TextMessage(text=chosen_message)]
-    )
-    if reply_token == "DUMMY":
-        push_request = PushMessageRequest(
-            to=target,
-            messages=[TextMessage(text=chosen_message)]
-        )
-        messaging_api.push_message(push_request)
-    else:
-        messaging_api.reply_message(reply_request)
+def chat_reply_limit(user_message):
+    """GROQ_CHAT_PROMPT 限制 80 字內，但翻譯需要完整內容，不截斷"""
+    return None if "翻譯" in user_message else CHAT_REPLY_MAX_CHARS
 
 def generate_image_with_openai(prompt):
     """
@@ -1124,42 +1108,27 @@ def generate_image_with_openai(prompt):
       prompt: 圖像生成提示文字
     """
     try:
-        response = openai.Image.create(
-            prompt=f"{prompt} 請根據上述描述生成圖片。如果描述涉及人物，以可愛卡通風格呈現, 要求面部比例正確，不出現扭曲、畸形或額外肢體，且圖像需高解析度且細節豐富；如果描述涉及事件且未指定風格，請以可愛卡通風格呈現；如果描述涉及物品，請生成清晰且精美的物品圖像，同時避免出現讓人覺得噁心或反胃的效果。",
+        # 圖片生成昂貴且慢，不重試
+        response = resilience.call(
+            "openai", openai.Image.create, op="image",
+            prompt=f"{prompt}{IMAGE_PROMPT_SUFFIX}",
             n=1,
-            size="512x512"
+            size="512x512",
+            retries=0,
         )
         data = response.get("data", [])
         if not data or len(data) == 0:
-            print("❌ 生成圖片時沒有回傳任何資料")
+            logger.warning("生成圖片時沒有回傳任何資料")
             return None
         image_url = data[0].get("url")
-        print(f"生成的圖片 URL：{image_url}")
+        logger.debug("圖片生成完成", url=image_url)
         return image_url
     except Exception as e:
-        print(f"❌ 生成圖像錯誤: {e}")
+        logger.error("生成圖像錯誤", error=e)
         return None
 
-def async_generate_and_send_image(target_id, prompt, messaging_api):
-    image_url = generate_image_with_openai(prompt)
-    if image_url:
-        push_request = PushMessageRequest(
-            to=target_id,
-            messages=[ImageMessage(original_content_url=image_url, preview_image_url=image_url)]
-        )
-        messaging_api.push_message(push_request)
-    else:
-        push_request = PushMessageRequest(
-            to=target_id,
-            messages=[TextMessage(text="❌ 圖片生成失敗，請稍後再試！")]
-        )
-        messaging_api.push_message(push_request)
-
-def handle_generate_image_command(reply_token, prompt, messaging_api):
-    """
-    呼叫圖片生成 API 並使用 reply_message 一次性回覆所有訊息。
-    注意：此流程必須在 reply token 有效期限內完成（約 60 秒）。
-    """
+def generate_image_messages(prompt):
+    """呼叫圖片生成 API，回傳要送出的訊息"""
     messages = []
 
     # 同步呼叫 OpenAI 圖像生成 API
@@ -1169,29 +1138,35 @@ def handle_generate_image_command(reply_token, prompt, messaging_api):
         messages.append(TextMessage(text="生成完成, 你瞧瞧🐧"))
     else:
         messages.append(TextMessage(text="❌ 圖片生成失敗，請稍後再試！"))
-
-    # 建立並發送 ReplyMessageRequest（只使用 reply_message）
-    reply_request = ReplyMessageRequest(
-        replyToken=reply_token,  # 這裡一定要傳入正確的 reply token
-        messages=messages
-    )
-    try:
-        messaging_api.reply_message(reply_request)
-        print("成功使用 reply_message 回覆圖片生成結果")
-    except Exception as e:
-        print(f"❌ 發送圖片回覆時出錯: {e}")
+    return messages
 
 def summarize_with_openai(search_results, query):
     """使用 OpenAI API 進行摘要"""
     if not search_results:
-        print("❌ [DEBUG] 沒有搜尋結果，無法摘要！")
+        logger.info("沒有搜尋結果，無法摘要")
         return "找不到相關資料。"
 
+    prompt = build_summary_prompt(search_results, query)
+
+    response = resilience.call(
+        "openai", openai.ChatCompletion.create, op="summarize",
+        model="gpt-4o-mini",
+        messages=[{"role": "system", "content": SUMMARY_SYSTEM_PROMPT},
+                  {"role": "user", "content": prompt}]
+    )
+
+    reply_text = response["choices"][0]["message"]["content"].strip()
+
+    logger.debug("搜尋摘要完成", chars=len(reply_text))
+
+    return reply_text
+
+def build_summary_prompt(search_results, query):
+    """組合搜尋摘要的提示詞"""
     formatted_results = "\n".join(search_results)
 
-    print(f"📢 [DEBUG] 傳送給 OpenAI 的內容:\n{formatted_results}")
 
-    prompt = f"""
+    return f"""
     使用者查詢: {query}
 
     以下是 Google 搜尋結果的標題與連結：
@@ -1204,60 +1179,77 @@ def summarize_with_openai(search_results, query):
     **若資料多娛樂八卦內容, 請簡述在這些資料內可以猜測有什麼事情發生了**
     """
 
-    response = openai.ChatCompletion.create(
-        model="gpt-4o-mini",
-        messages=[{"role": "system", "content": "你是一個智慧助理，依照這些資料, 條列總結跟附上連結。"},
-                  {"role": "user", "content": prompt}]
-    )
-
-    reply_text = response["choices"][0]["message"]["content"].strip()
-
-    print(f"📢 [DEBUG] OpenAI 回應: {reply_text}")
-
-    return reply_text
-
+@coalesce("google_search")
 def google_search(query):
     """使用 Google Custom Search API 進行搜尋"""
-    url = f"https://www.googleapis.com/customsearch/v1?q={query}&key={GOOGLE_SEARCH_KEY}&cx={GOOGLE_CX}"
-    response = requests.get(url)
+    url = GOOGLE_CSE_URL
+    try:
+        response = resilience.call("google_cse", http_client.get, url, op="search",
+                                   params={"q": query, "key": GOOGLE_SEARCH_KEY, "cx": GOOGLE_CX},
+                                   is_failure_result=http_failure)
+    except CircuitOpenError as e:
+        logger.warning("Google 搜尋熔斷中", error=e)
+        return None
 
-    print(f"📢 [DEBUG] Google 搜尋 API 回應: {response.status_code}")
-    print(f"📢 [DEBUG] Google API 回應內容: {response.text}")
+    logger.debug("Google 搜尋 API 回應", status=response.status_code, bytes=len(response.content))
 
     if response.status_code != 200:
         return None
 
-    results = response.json()
+    return parse_google_results(response.json())
+
+def parse_google_results(results):
+    """整理 Google Custom Search 回傳的 JSON 為「標題 - 連結」列表"""
     search_results = []
     
     if "items" in results:
         for item in results["items"][:5]:  # 取前 5 筆搜尋結果
             search_results.append(f"{item['title']} - {item['link']}")
 
-    print(f"📢 [DEBUG] Google 搜尋結果: {search_results}")
+    logger.debug("Google 搜尋結果", results=len(search_results))
 
     return search_results if search_results else None
 
 def search_person_info(name):
     """使用 AI 生成人物簡介，並搭配 Google 圖片搜尋"""
     # 透過 AI 生成簡單描述
-    prompt = f"請用簡單的方式介紹 {name} 是誰，並以 3-4 句話概述。"
-    response_text = ask_groq(prompt, "deepseek-r1-distill-llama-70b")  # 調用 AI 來回答
+    prompt = build_person_prompt(name)
+    response_text = ask_groq(prompt, DEFAULT_AI_MODEL)  # 調用 AI 來回答
 
     # 進行 Google 圖片搜尋
-    google_url = f"https://www.google.com/search?q={name}&tbm=isch"
+    google_url = f"{GOOGLE_SEARCH_URL}?q={name}&tbm=isch"
     headers = {"User-Agent": "Mozilla/5.0"}
-    google_response = requests.get(google_url, headers=headers)
+    with tracing.span("image_scrape"):
+        google_response = fetcher.fetch(google_url, headers=headers)  # HTTP → cloudscraper → 瀏覽器
 
-    if google_response.status_code == 200:
-        soup = BeautifulSoup(google_response.text, "html.parser")
-        images = soup.find_all("img")
-        image_url = images[1]["src"] if len(images) > 1 else None  # 選擇第一張圖片
+    if google_response and google_response.status == 200:
+        image_url = pick_person_image(google_response.text)
     else:
         image_url = None
 
     return response_text, image_url
 
+def build_person_prompt(name):
+    """人物簡介的提示詞"""
+    return f"請用簡單的方式介紹 {name} 是誰，並以 3-4 句話概述。"
+
+def pick_person_image(html):
+    """人物介紹使用：取 Google 圖片頁面的第一張圖片（跳過 Google 標誌）"""
+    soup = BeautifulSoup(html, "html.parser")
+    images = soup.find_all("img")
+    return images[1]["src"] if len(images) > 1 else None  # 選擇第一張圖片
+
+def pick_first_http_image(html):
+    """搜圖使用：回傳 Google 圖片頁面中第一張有效的 HTTP(S) 圖片"""
+    soup = BeautifulSoup(html, "html.parser")
+    images = soup.find_all("img")
+
+    for img in images[1:]:  # 跳過第一張（通常是 Google 標誌）
+        image_url = img.get("src", "")
+        if image_url.startswith("http"):  # 只回傳有效的 HTTP(S) 圖片
+            return image_url
+    return None
+
 def create_flex_message(text, image_url):
     if not image_url or not image_url.startswith("http"):
         return TextMessage(text="找不到適合的圖片，請嘗試其他關鍵字。")
@@ -1296,28 +1288,23 @@ def create_flex_message(text, image_url):
 
 def search_google_image(query):
     """搜尋 Google 圖片並返回第一張有效的圖片 URL"""
-    google_url = f"https://www.google.com/search?q={query}&tbm=isch"
+    google_url = f"{GOOGLE_SEARCH_URL}?q={query}&tbm=isch"
     headers = {"User-Agent": "Mozilla/5.0"}
 
     try:
-        response = requests.get(google_url, headers=headers)
-        if response.status_code == 200:
-            soup = BeautifulSoup(response.text, "html.parser")
-            images = soup.find_all("img")
-
-            for img in images[1:]:  # 跳過第一張（通常是 Google 標誌）
-                image_url = img.get("src", "")
-                if image_url.startswith("http"):  # 只回傳有效的 HTTP(S) 圖片
-                    return image_url
+        response = fetcher.fetch(google_url, headers=headers)  # HTTP → cloudscraper → 瀏覽器
+        if response and response.status == 200:
+            return pick_first_http_image(response.text)
     except Exception as e:
-        print(f"❌ Google 搜圖錯誤: {e}")
+        logger.error("Google 搜圖錯誤", error=e)
 
     return None  # 找不到圖片時回傳 None
 
+@coalesce("spotify_search")
 def search_spotify_song(song_name):
     """ 透過 Spotify API 搜尋歌曲並回傳預覽 URL 與歌曲連結 """
     try:
-        results = sp.search(q=song_name, limit=1, type='track')
+        results = resilience.call("spotify", sp.search, q=song_name, limit=1, type='track', op="search")
         if not results["tracks"]["items"]:
             return None  # 沒找到歌曲
         
@@ -1328,7 +1315,7 @@ def search_spotify_song(song_name):
             "song_url": track["external_urls"]["spotify"]  # Spotify 播放連結
         }
     except Exception as e:
-        print(f"❌ [ERROR] Spotify API 呼叫失敗: {e}")
+        logger.error("Spotify API 呼叫失敗", error=e)
         return None
 
 def download_and_host_audio(preview_url, filename="song_preview"):
@@ -1339,13 +1326,9 @@ def download_and_host_audio(preview_url, filename="song_preview"):
     hosted_url = f"{BASE_URL}/static/{filename}.m4a"  # 你的 Flask 伺服器網址
 
     try:
-        response = requests.get(preview_url, stream=True)
-        if response.status_code == 200:
-            # 下載 mp3
-            with open(tmp_mp3, "wb") as f:
-                for chunk in response.iter_content(chunk_size=1024):
-                    f.write(chunk)
-
+        # 下載 mp3
+        status_code = http_client.download(preview_url, tmp_mp3)
+        if status_code == 200:
             # 轉換為 m4a
             audio = AudioSegment.from_mp3(tmp_mp3)
             audio.export(tmp_m4a, format="ipod")  # "ipod" 會輸出 .m4a 格式
@@ -1353,15 +1336,16 @@ def download_and_host_audio(preview_url, filename="song_preview"):
             # 移動檔案到 Flask 的 /static/ 目錄
             shutil.move(tmp_m4a, static_m4a)
 
-            print(f"✅ 音檔轉換成功: {static_m4a}")
+            logger.debug("音檔轉換成功", path=static_m4a)
             return hosted_url
         else:
-            print("❌ 下載失敗，狀態碼:", response.status_code)
+            logger.error("音檔下載失敗", status=status_code)
             return None
     except Exception as e:
-        print(f"❌ 下載或轉換失敗: {e}")
+        logger.error("音檔下載或轉換失敗", error=e)
         return None
 
+@coalesce("weather_current")
 def get_weather_weatherapi(city):
     """ 使用 OpenWeather API 查詢天氣 """
     API_KEY = OPENWEATHER_API_KEY
@@ -1369,109 +1353,142 @@ def get_weather_weatherapi(city):
         # 確保 city 是 OpenWeather 可接受的名稱
         city = CITY_MAPPING.get(city, city)
 
-        url = f"https://api.openweathermap.org/data/2.5/weather?q={city}&appid={API_KEY}&units=metric&lang=zh_tw"
-        print(f"📢 [DEBUG] 呼叫 API: {url}")  # 確保 city 轉換正確
+        url = f"{OPENWEATHER_API_BASE}/data/2.5/weather?q={city}&appid={API_KEY}&units=metric&lang=zh_tw"
+        logger.debug("呼叫 OpenWeather 即時天氣", city=city)  # 不記錄 URL（含 API key）
         
-        response = requests.get(url)
+        response = resilience.call("openweather", http_client.get, url, is_failure_result=http_failure, op="current")
         data = response.json()
 
         if data.get("cod") != 200:
-            print(f"❌ OpenWeather API 錯誤: {data}")  # Debug API 回應
+            logger.warning("OpenWeather API 錯誤", cod=data.get("cod"), detail=data.get("message"))
             return "❌ 無法取得天氣資訊，請確認城市名稱是否正確"
 
-        # 提取需要的天氣資訊
-        temp = data["main"]["temp"]
-        weather_desc = data["weather"][0]["description"]
-        wind_speed = data["wind"]["speed"]
-        humidity = data["main"]["humidity"]
-        # 建立天氣描述
-        weather_text = (
-                f"🌡 溫度：{temp}°C\n"
-                f"💧 濕度：{humidity}%\n"
-                f"💨 風速：{wind_speed} m/s\n"
-                f"🌤 天氣狀況：{weather_desc}"
-        )
+        weather_text, conditions = format_current_weather(data)
         # 讓 AI 進行天氣分析
-        ai_analysis = analyze_weather_with_ai(city, temp, humidity, weather_desc, wind_speed)
+        ai_analysis = analyze_weather_with_ai(city, *conditions)
 
         return f"🌍 {city} 即時天氣預報：\n{weather_text}\n\n🧑‍🔬 狗蛋關心您：\n{ai_analysis}"
 
 
-    except requests.exceptions.RequestException as e:
+    except CircuitOpenError:
+        return WEATHER_UNAVAILABLE_MESSAGE
+    except httpx.HTTPError as e:
         return f"❌ 取得天氣資料失敗: {e}"
 
+def format_current_weather(data):
+    """ 將即時天氣 JSON 轉成文字，並回傳 (temp, humidity, weather_desc, wind_speed) 供 AI 分析 """
+    # 提取需要的天氣資訊
+    temp = data["main"]["temp"]
+    weather_desc = data["weather"][0]["description"]
+    wind_speed = data["wind"]["speed"]
+    humidity = data["main"]["humidity"]
+    # 建立天氣描述
+    weather_text = (
+            f"🌡 溫度：{temp}°C\n"
+            f"💧 濕度：{humidity}%\n"
+            f"💨 風速：{wind_speed} m/s\n"
+            f"🌤 天氣狀況：{weather_desc}"
+    )
+    return weather_text, (temp, humidity, weather_desc, wind_speed)
+
+@coalesce("weather_forecast")
 def get_weather_forecast(city):
     """ 使用 OpenWeather API 查詢未來 3 天天氣趨勢 """
     # 確保 city 是 OpenWeather 可接受的名稱
     city = CITY_MAPPING.get(city, city)
-    url = f"https://api.openweathermap.org/data/2.5/forecast?q={city}&appid={OPENWEATHER_API_KEY}&units=metric&lang=zh_tw"
+    url = f"{OPENWEATHER_API_BASE}/data/2.5/forecast?q={city}&appid={OPENWEATHER_API_KEY}&units=metric&lang=zh_tw"
     
 
     try:
-        response = requests.get(url)
+        response = resilience.call("openweather", http_client.get, url, is_failure_result=http_failure, op="forecast")
         data = response.json()
-        print("🔍 狀態碼:", response.status_code)
-        print("🔍 回應內容:", response.text)
+        logger.debug("OpenWeather 預報回應", city=city, status=response.status_code, bytes=len(response.content))
 
         if data.get("cod") != "200":
-            print(f"❌ OpenWeather API 錯誤: {data}")
+            logger.warning("OpenWeather API 錯誤", cod=data.get("cod"), detail=data.get("message"))
             return "❌ 無法取得天氣預報，請確認城市名稱是否正確"
 
-        daily_forecast = {}
-
-        # 解析 5 天的 3 小時預測，整理成每日的天氣趨勢
-        for forecast in data["list"]:
-            date = forecast["dt_txt"].split(" ")[0]  # 只取日期
-            temp = forecast["main"]["temp"]
-            weather_desc = forecast["weather"][0]["description"]
-            wind_speed = forecast["wind"]["speed"]
-            humidity = forecast["main"]["humidity"]
-
-            if date not in daily_forecast:
-                daily_forecast[date] = {
-                    "temp_min": temp,
-                    "temp_max": temp,
-                    "humidity": [],
-                    "wind_speed": [],
-                    "weather_desc": weather_desc
-                }
-            else:
-                daily_forecast[date]["temp_min"] = min(daily_forecast[date]["temp_min"], temp)
-                daily_forecast[date]["temp_max"] = max(daily_forecast[date]["temp_max"], temp)
-                daily_forecast[date]["humidity"].append(humidity)
-                daily_forecast[date]["wind_speed"].append(wind_speed)
-
-        # 格式化輸出未來 3 天預測
-        forecast_text = f"🌍 {city} 未來 3 天天氣趨勢：\n"
-        today = datetime.date.today()
-        count = 0
-
-        for date, info in daily_forecast.items():
-            if count >= 3:
-                break
-            avg_humidity = sum(info["humidity"]) // len(info["humidity"]) if info["humidity"] else 0
-            avg_wind_speed = sum(info["wind_speed"]) / len(info["wind_speed"]) if info["wind_speed"] else 0
-            forecast_text += (
-                f"\n📅 {date}:\n"
-                f"🌡 溫度: {info['temp_min']}°C ~ {info['temp_max']}°C\n"
-                f"💧 濕度: {avg_humidity}%\n"
-                f"💨 風速: {avg_wind_speed:.1f} m/s\n"
-                f"🌤 天氣: {info['weather_desc']}\n"
-            )
-            count += 1
+        forecast_text, conditions = format_forecast(city, data)
 
         # 讓 AI 進行天氣分析
-        ai_analysis = analyze_weather_with_ai(city, temp, humidity, weather_desc, wind_speed)
+        ai_analysis = analyze_weather_with_ai(city, *conditions)
 
         return f"{forecast_text}\n\n🧑‍🔬 狗蛋關心您：\n{ai_analysis}"
 
-    except requests.exceptions.RequestException as e:
+    except CircuitOpenError:
+        return WEATHER_UNAVAILABLE_MESSAGE
+    except httpx.HTTPError as e:
         return f"❌ 取得天氣資料失敗: {e}"
 
+def format_forecast(city, data):
+    """ 將 5 天 / 3 小時預報整理成未來 3 天的文字，並回傳最後一筆資料 (temp, humidity, weather_desc, wind_speed) 供 AI 分析 """
+    daily_forecast = {}
+
+    # 解析 5 天的 3 小時預測，整理成每日的天氣趨勢
+    for forecast in data["list"]:
+        date = forecast["dt_txt"].split(" ")[0]  # 只取日期
+        temp = forecast["main"]["temp"]
+        weather_desc = forecast["weather"][0]["description"]
+        wind_speed = forecast["wind"]["speed"]
+        humidity = forecast["main"]["humidity"]
+
+        if date not in daily_forecast:
+            daily_forecast[date] = {
+                "temp_min": temp,
+                "temp_max": temp,
+                "humidity": [],
+                "wind_speed": [],
+                "weather_desc": weather_desc
+            }
+        else:
+            daily_forecast[date]["temp_min"] = min(daily_forecast[date]["temp_min"], temp)
+            daily_forecast[date]["temp_max"] = max(daily_forecast[date]["temp_max"], temp)
+            daily_forecast[date]["humidity"].append(humidity)
+            daily_forecast[date]["wind_speed"].append(wind_speed)
+
+    # 格式化輸出未來 3 天預測
+    forecast_text = f"🌍 {city} 未來 3 天天氣趨勢：\n"
+    today = datetime.date.today()
+    count = 0
+
+    for date, info in daily_forecast.items():
+        if count >= 3:
+            break
+        avg_humidity = sum(info["humidity"]) // len(info["humidity"]) if info["humidity"] else 0
+        avg_wind_speed = sum(info["wind_speed"]) / len(info["wind_speed"]) if info["wind_speed"] else 0
+        forecast_text += (
+            f"\n📅 {date}:\n"
+            f"🌡 溫度: {info['temp_min']}°C ~ {info['temp_max']}°C\n"
+            f"💧 濕度: {avg_humidity}%\n"
+            f"💨 風速: {avg_wind_speed:.1f} m/s\n"
+            f"🌤 天氣: {info['weather_desc']}\n"
+        )
+        count += 1
+
+    return forecast_text, (temp, humidity, weather_desc, wind_speed)
+
 def analyze_weather_with_ai(city, temp, humidity, weather_desc, wind_speed):
     """ 使用 OpenAI 進行天氣分析，提供穿搭 & 注意事項 """
 
-    prompt = f"""
+    prompt = build_weather_prompt(city, temp, humidity, weather_desc, wind_speed)
+
+    messages = [
+        {"role": "system", "content": WEATHER_SYSTEM_PROMPT},
+        {"role": "user", "content": prompt},
+    ]
+    try:
+        reply = provider_router.complete(
+            f"groq:{DEFAULT_AI_MODEL}", HEDGE_BACKUPS.get(DEFAULT_AI_MODEL),
+            lambda backend, cancel: call_chat_backend(backend, messages, WEATHER_REPLY_MAX_CHARS, cancel))
+    except CircuitOpenError as e:
+        # AI 熔斷時仍回傳天氣數據，只省略分析
+        logger.warning("天氣分析略過", error=e)
+        return "狗蛋的 AI 暫時休息中，請自行留意天氣變化～"
+    return reply or NO_REPLY_MESSAGE
+
+def build_weather_prompt(city, temp, humidity, weather_desc, wind_speed):
+    """ 組合天氣分析的提示詞 """
+    return f"""
     目前 {city} 的天氣條件如下：
     - 溫度：{temp}°C
     - 濕度：{humidity}%
@@ -1484,151 +1501,44 @@ def analyze_weather_with_ai(city, temp, humidity, weather_desc, wind_speed):
     3. 回應時請使用繁體中文，字數控制在 50 字內，並用口語化的方式回答。
     """
 
-    # Groq API 邏輯 (保持不變)
-    chat_completion = client.chat.completions.create(
-        messages=[
-                    {"role": "system", "content": "你是一個名叫狗蛋的助手，跟使用者是朋友關係, 盡量只使用繁體中文方式進行幽默回答, 約莫20字內，限制不超過50字"},
-                    {"role": "user", "content": prompt},
-                ],
-        model="deepseek-r1-distill-llama-70b",)
-    if not chat_completion.choices:
-        return "❌ 狗蛋無法回應，請稍後再試。"
-    content = chat_completion.choices[0].message.content.strip()
-    content = re.sub(r"<think>.*?</think>", "", content, flags=re.DOTALL).strip()
-    return content
+def strip_think(content):
+    """ 移除推理模型輸出的 <think>...</think> 區塊 """
+    content = (content or "").strip()
+    return re.sub(r"<think>.*?</think>", "", content, flags=re.DOTALL).strip()
 
 def get_video_data(search_query):
-    url = f"https://jable.tv/search/{search_query}/?sort_by=post_date"
-
-    with sync_playwright() as p:
-        browser = p.chromium.launch(
-            headless=True,  # ✅ 關閉 headless=False，提升速度
-            args=["--no-sandbox", "--disable-dev-shm-usage"]
-        )
-        context = browser.new_context()
-        page = context.new_page()
-
-        # ✅ 避免被封鎖，使用 Stealth
-        stealth_sync(page)
-
-        # ✅ 隨機 User-Agent
-        user_agents = [
-            "Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/110.0.0.0 Safari/537.36",
-            "Mozilla/5.0 (iPhone; CPU iPhone OS 15_2 like Mac OS X) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/97.0.4692.99 Mobile Safari/537.36",
-        ]
-        page.set_extra_http_headers({"User-Agent": random.choice(user_agents)})
-
-        # ✅ **減少 `timeout` 時間，提升速度**
-        page.goto(url, timeout=10000)  # **減少超時時間**
-        page.wait_for_selector(".video-img-box", timeout=3000)  # **減少等待時間**
-        
-        # ✅ **直接解析 HTML，不用 `set_content()`**
-        html = page.content()
-
-        # **確保 HTML 內容不是 Cloudflare 防護頁**
-        if "Just a moment..." in html or "challenge-error-text" in html:
-            print("❌ Cloudflare 防護阻擋，無法獲取內容")
-            browser.close()
-            return []
-
-        # ✅ **直接解析 HTML**
-        videos = page.query_selector_all('.video-img-box')
-        video_list = []
-
-        for video in videos[:2]:  # **只取前 2 部影片**
-            title_elem, img_elem = video.query_selector('.title a'), video.query_selector('.img-box img')
-
-            title = title_elem.text_content().strip() if title_elem else "N/A"
-            link = title_elem.get_attribute('href') if title_elem else "N/A"
-            thumbnail = img_elem.get_attribute('data-src') or img_elem.get_attribute('src') if img_elem else "N/A"
-
-            video_list.append({"title": title, "link": link, "thumbnail": thumbnail})
-
-        # ✅ **確保瀏覽器完全關閉**
-        browser.close()
-        return video_list
+    """搜尋影片（取前 2 部），結果快取 VIDEO_SEARCH_TTL 秒"""
+    key = ("video_search", normalize_prompt(search_query))
+    videos = video_search_cache.get(key)
+    if videos is not None:
+        return videos
+    videos = scrape_video_search(search_query)
+    if videos:  # 被擋下的空結果不快取
+        video_search_cache.set(key, videos, video_search_cache.default_ttl)
+    return videos
 
 def get_video_data_hotest():
-    url = "https://jable.tv/hot/"
-    with sync_playwright() as p:
-        browser = p.chromium.launch(
-            headless=True,
-            args=["--no-sandbox", "--disable-dev-shm-usage"]
-        )
-        context = browser.new_context()
-        page = context.new_page()
-
-        # ✅ 避免被封鎖，使用 Stealth
-        stealth_sync(page)
-
-        # ✅ 隨機 User-Agent
-        user_agents = [
-            "Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/110.0.0.0 Safari/537.36",
-            "Mozilla/5.0 (iPhone; CPU iPhone OS 15_2 like Mac OS X) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/97.0.4692.99 Mobile Safari/537.36",
-        ]
-        page.set_extra_http_headers({"User-Agent": random.choice(user_agents)})
-
-        # ✅ **降低等待時間**
-        page.goto(url, timeout=20000)  # **減少超時時間**
-        page.wait_for_selector(".video-img-box", timeout=5000)  # **減少 selector 等待時間**
-
-        # ✅ **直接解析 HTML，不用 set_content()**
-        videos = page.query_selector_all('.video-img-box')
-
-        video_list = []
-        for video in videos[:3]:  # **取前三個影片**
-            title_elem, img_elem = video.query_selector('.title a'), video.query_selector('.img-box img')
-
-            title = title_elem.text_content().strip() if title_elem else "N/A"
-            link = title_elem.get_attribute('href') if title_elem else "N/A"
-            thumbnail = img_elem.get_attribute('data-src') or img_elem.get_attribute('src') if img_elem else "N/A"
-
-            video_list.append({"title": title, "link": link, "thumbnail": thumbnail})
-
-        # ✅ **減少記憶體佔用**
-        browser.close()
-        return video_list
+    """最熱門影片（取前 3 部），由 listing_cache 提供"""
+    return listing_cache.get("video_hot")
 
 def get_video_data_newest():
-    url = "https://jable.tv/latest-updates/"
-    with sync_playwright() as p:
-        browser = p.chromium.launch(
-            headless=True,
-            args=["--no-sandbox", "--disable-dev-shm-usage"]
-        )
-        context = browser.new_context()
-        page = context.new_page()
-
-        # ✅ 避免被封鎖，使用 Stealth
-        stealth_sync(page)
-
-        # ✅ 隨機 User-Agent
-        user_agents = [
-            "Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/110.0.0.0 Safari/537.36",
-            "Mozilla/5.0 (iPhone; CPU iPhone OS 15_2 like Mac OS X) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/97.0.4692.99 Mobile Safari/537.36",
-        ]
-        page.set_extra_http_headers({"User-Agent": random.choice(user_agents)})
-
-        # ✅ **降低等待時間**
-        page.goto(url, timeout=20000)  # **減少超時時間**
-        page.wait_for_selector(".video-img-box", timeout=5000)  # **減少 selector 等待時間**
-
-        # ✅ **直接解析 HTML，不用 set_content()**
-        videos = page.query_selector_all('.video-img-box')
+    """最新影片（取前 3 部），由 listing_cache 提供"""
+    return listing_cache.get("video_new")
 
-        video_list = []
-        for video in videos[:3]:  # **取前三個影片**
-            title_elem, img_elem = video.query_selector('.title a'), video.query_selector('.img-box img')
+@coalesce("video_search")
+def scrape_video_search(search_query):
+    return scrape_listing(JABLE_SEARCH, query=search_query)
 
-            title = title_elem.text_content().strip() if title_elem else "N/A"
-            link = title_elem.get_attribute('href') if title_elem else "N/A"
-            thumbnail = img_elem.get_attribute('data-src') or img_elem.get_attribute('src') if img_elem else "N/A"
+@coalesce("video_hot")
+def scrape_video_hot():
+    return scrape_listing(JABLE_HOT)
 
-            video_list.append({"title": title, "link": link, "thumbnail": thumbnail})
+@coalesce("video_new")
+def scrape_video_new():
+    return scrape_listing(JABLE_NEW)
 
-        # ✅ **減少記憶體佔用**
-        browser.close()
-        return video_list
+listing_cache.register("video_hot", scrape_video_hot)
+listing_cache.register("video_new", scrape_video_new)
 
 
 def create_flex_jable_message(videos):
@@ -1637,7 +1547,7 @@ def create_flex_jable_message(videos):
 
     contents = []
     for video in videos:
-        print(f"✅ [DEBUG] 準備加入影片: {video}")  # Debug 確認資料格式
+        logger.debug("準備加入影片", title=video.get("title"))
 
         bubble = {
             "type": "bubble",
@@ -0,0 +1,197 @@
+"""
+Prometheus 格式的 /metrics。
+
+每則訊息都會經過，所以只做最便宜的事：計數器是 dict 加法，直方圖用 bisect 找 bucket，
+各自一把鎖；累加成 Prometheus 的累積 bucket 與輸出文字都留到 /metrics 被抓取時才做。
+
+  - linebot_command_*        : handle_message 每個指令（router 的指令名稱）的次數、失敗數與耗時
+  - linebot_upstream_*       : 每個上游（resilience 的名稱）× op（Groq 為模型、OpenAI 為 chat / image / whisper …）
+                               的請求數、錯誤數、被熔斷擋下的次數、耗時與回應大小（能取得時）
+  - linebot_llm_tokens_total : completion 回應裡的 usage（prompt / completion）
+  - linebot_reply_token_misses_total : reply token 來不及使用而改用 push 的次數（依原因）
+
+    with metrics.time_command("search"):
+        ...
+    metrics.observe_upstream("groq", "llama3-8b-8192", 0.8, result=completion)
+"""
+import time, threading
+from bisect import bisect_left
+from contextlib import contextmanager
+
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 20.0, 30.0, 60.0)
+
+
+def _escape(value):
+    return str(value).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+def _labels(names, values, extra=None):
+    pairs = [f'{name}="{_escape(value)}"' for name, value in zip(names, values)]
+    if extra:
+        pairs.append(extra)
+    return "{" + ",".join(pairs) + "}" if pairs else ""
+
+
+def _number(value):
+    return str(int(value)) if float(value).is_integer() else repr(float(value))
+
+
+class Counter:
+    def __init__(self, name, help_text, labelnames=()):
+        self.name = name
+        self.help = help_text
+        self.labelnames = tuple(labelnames)
+        self._lock = threading.Lock()
+        self._values = {}
+
+    def inc(self, *labels, amount=1):
+        with self._lock:
+            self._values[labels] = self._values.get(labels, 0) + amount
+
+    def value(self, *labels):
+        with self._lock:
+            return self._values.get(labels, 0)
+
+    def render(self):
+        with self._lock:
+            values = dict(self._values)
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} counter"]
+        for labels, value in sorted(values.items()):
+            lines.append(f"{self.name}{_labels(self.labelnames, labels)} {_number(value)}")
+        return lines
+
+
+class Histogram:
+    def __init__(self, name, help_text, labelnames=(), buckets=LATENCY_BUCKETS):
+        self.name = name
+        self.help = help_text
+        self.labelnames = tuple(labelnames)
+        self.buckets = tuple(buckets)
+        self._lock = threading.Lock()
+        self._series = {}               # labels -> [各 bucket 的個別計數（最後一格為 +Inf）, sum, count]
+
+    def observe(self, value, *labels):
+        index = bisect_left(self.buckets, value)
+        with self._lock:
+            series = self._series.get(labels)
+            if series is None:
+                series = self._series[labels] = [[0] * (len(self.buckets) + 1), 0.0, 0]
+            series[0][index] += 1
+            series[1] += value
+            series[2] += 1
+
+    def render(self):
+        with self._lock:
+            snapshot = {labels: (list(counts), total, count) for labels, (counts, total, count) in self._series.items()}
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} histogram"]
+        for labels, (counts, total, count) in sorted(snapshot.items()):
+            cumulative = 0
+            for bound, bucket_count in zip(self.buckets + (float("inf"),), counts):
+                cumulative += bucket_count
+                le = 'le="+Inf"' if bound == float("inf") else f'le="{bound!r}"'
+                lines.append(f"{self.name}_bucket{_labels(self.labelnames, labels, le)} {cumulative}")
+            lines.append(f"{self.name}_sum{_labels(self.labelnames, labels)} {_number(round(total, 6))}")
+            lines.append(f"{self.name}_count{_labels(self.labelnames, labels)} {count}")
+        return lines
+
+
+def payload_bytes(result):
+    """上游回應的大小（bytes）；取不到時回傳 None"""
+    if isinstance(result, (bytes, bytearray)):
+        return len(result)
+    if isinstance(result, str):
+        return len(result.encode("utf-8"))
+    if isinstance(result, tuple) and len(result) == 2 and isinstance(result[1], (str, bytes)):
+        return payload_bytes(result[1])        # asgi 的 fetch_text: (status, body)
+    try:
+        content = getattr(result, "content", None)  # requests / httpx Response
+    except Exception:
+        return None                                 # httpx 串流回應尚未讀取
+    if isinstance(content, (bytes, bytearray)):
+        return len(content)
+    return None
+
+
+def token_usage(result):
+    """completion 回應的 (prompt_tokens, completion_tokens)；沒有 usage 時回傳 None"""
+    usage = getattr(result, "usage", None)
+    if usage is None and isinstance(result, dict):
+        usage = result.get("usage")
+    return usage_counts(usage)
+
+
+def usage_counts(usage):
+    """usage 物件（或 dict）的 (prompt_tokens, completion_tokens)；沒有 usage 時回傳 None"""
+    if usage is None:
+        return None
+    if isinstance(usage, dict):
+        return usage.get("prompt_tokens") or 0, usage.get("completion_tokens") or 0
+    return getattr(usage, "prompt_tokens", 0) or 0, getattr(usage, "completion_tokens", 0) or 0
+
+
+class Metrics:
+    def __init__(self):
+        self.command_total = Counter("linebot_command_total", "handle_message 處理的指令數", ("command",))
+        self.command_errors = Counter("linebot_command_errors_total", "處理時丟出例外的指令數", ("command",))
+        self.command_seconds = Histogram("linebot_command_seconds", "指令處理耗時（秒）", ("command",))
+        self.upstream_total = Counter("linebot_upstream_requests_total", "上游請求數（含重試）", ("upstream", "op"))
+        self.upstream_errors = Counter("linebot_upstream_errors_total", "上游錯誤數（例外或 5xx / 429）", ("upstream", "op"))
+        self.upstream_rejected = Counter("linebot_upstream_rejected_total", "熔斷中直接擋下的請求數", ("upstream", "op"))
+        self.upstream_seconds = Histogram("linebot_upstream_seconds", "上游請求耗時（秒）", ("upstream", "op"))
+        self.upstream_bytes = Counter("linebot_upstream_response_bytes_total", "上游回應大小（bytes）", ("upstream", "op"))
+        self.tokens = Counter("linebot_llm_tokens_total", "LLM 使用的 token 數", ("upstream", "op", "kind"))
+        self.reply_token_misses = Counter("linebot_reply_token_misses_total",
+                                          "reply token 來不及使用而改用 push 的次數", ("reason",))
+        self._metrics = [self.command_total, self.command_errors, self.command_seconds,
+                         self.upstream_total, self.upstream_errors, self.upstream_rejected,
+                         self.upstream_seconds, self.upstream_bytes, self.tokens, self.reply_token_misses]
+
+    @contextmanager
+    def time_command(self, command):
+        start = time.perf_counter()
+        try:
+            yield
+        except Exception:
+            self.command_errors.inc(command)
+            raise
+        finally:
+            self.command_total.inc(command)
+            self.command_seconds.observe(time.perf_counter() - start, command)
+
+    def observe_upstream(self, upstream, op, seconds, result=None, error=False):
+        op = op or upstream
+        self.upstream_total.inc(upstream, op)
+        self.upstream_seconds.observe(seconds, upstream, op)
+        if error:
+            self.upstream_errors.inc(upstream, op)
+        if result is None:
+            return
+        size = payload_bytes(result)
+        if size:
+            self.upstream_bytes.inc(upstream, op, amount=size)
+        self.observe_tokens(upstream, op, token_usage(result))
+
+    def observe_tokens(self, upstream, op, usage):
+        """usage 為 (prompt_tokens, completion_tokens)；串流回應不經 observe_upstream，由 streaming.py 直接記錄"""
+        if usage:
+            op = op or upstream
+            self.tokens.inc(upstream, op, "prompt", amount=usage[0])
+            self.tokens.inc(upstream, op, "completion", amount=usage[1])
+
+    def upstream_rejected_call(self, upstream, op):
+        self.upstream_rejected.inc(upstream, op or upstream)
+
+    def reply_token_miss(self, reason):
+        self.reply_token_misses.inc(reason)
+
+    def render(self):
+        lines = []
+        for metric in self._metrics:
+            lines.extend(metric.render())
+        return "\n".join(lines) + "\n"
+
+
+CONTENT_TYPE = "text/plain; version=0.0.4; charset=utf-8"
+
+# 全 process 共用
+metrics = Metrics()
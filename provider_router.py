@@ -0,0 +1,270 @@
+"""
+多供應商的 hedged request 路由。
+
+每個 backend（"provider:model"，例如 "groq:deepseek-r1-distill-llama-70b"）保留最近的延遲與成敗紀錄，
+計算 p50 / p95 與錯誤率：
+
+  - 主要 backend 超過自己最近的 p95 還沒回應時，對等價的備援 backend 再發一次（hedge），
+    取先回來的答案，並通知較慢的一方停止（串流會關閉連線；asyncio 版直接 cancel task）
+  - hedge 會多花一次呼叫費用，以 token bucket 限制比例：每個請求累積 max_hedge_ratio 個 token，
+    hedge 一次花 1 個，最多累積 burst 個
+  - 主要 backend 直接失敗時改用備援（failover，不佔 hedge 額度）；沒有 hedge token 而主要 backend
+    最後仍失敗時同樣改用備援
+  - 主要 backend 近期錯誤率過高而備援正常時，直接對調
+
+    text = provider_router.complete("groq:llama3-8b-8192", "openai:gpt-4o-mini",
+                                    lambda backend, cancel: call_backend(backend, messages, cancel))
+"""
+import time, asyncio, threading, contextvars
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
+
+from app_logging import get_logger
+
+logger = get_logger("provider_router")
+
+
+class BackendStats:
+    def __init__(self, window=100):
+        self.latencies = deque(maxlen=window)
+        self.outcomes = deque(maxlen=window)
+
+    def observe(self, seconds, ok):
+        if ok:
+            self.latencies.append(seconds)
+        self.outcomes.append(ok)
+
+    def percentile(self, p):
+        if not self.latencies:
+            return None
+        ordered = sorted(self.latencies)
+        return ordered[min(len(ordered) - 1, int(len(ordered) * p))]
+
+    def error_rate(self):
+        if not self.outcomes:
+            return 0.0
+        return 1 - sum(self.outcomes) / len(self.outcomes)
+
+    def samples(self):
+        return len(self.outcomes)
+
+
+class ProviderRouter:
+    """
+    max_hedge_ratio     : 長期來看最多多少比例的請求會被 hedge（額外花費上限）
+    burst               : hedge token 最多累積幾個
+    min_samples         : 樣本數不足時使用 default_hedge_delay
+    min_hedge_delay     : hedge 等待時間下限（秒），避免 p95 很小時過度 hedge
+    max_error_rate      : 主要 backend 錯誤率超過此值且備援較健康時對調
+    """
+
+    def __init__(self, max_hedge_ratio=0.1, burst=3.0, window=100, min_samples=10,
+                 min_hedge_delay=0.5, default_hedge_delay=4.0, max_error_rate=0.5, max_workers=16):
+        self.max_hedge_ratio = max_hedge_ratio
+        self.burst = burst
+        self.window = window
+        self.min_samples = min_samples
+        self.min_hedge_delay = min_hedge_delay
+        self.default_hedge_delay = default_hedge_delay
+        self.max_error_rate = max_error_rate
+
+        self._lock = threading.Lock()
+        self._stats = {}
+        self._tokens = burst
+        self._executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="hedge")
+
+        self.requests = 0
+        self.hedges = 0
+        self.hedge_wins = 0
+        self.failovers = 0
+        self.swaps = 0
+
+    # ------------------------------
+    # 同步版（Flask / worker 執行緒）
+    # ------------------------------
+    def complete(self, primary, backup, call):
+        """call(backend, cancel_event) 回傳答案；cancel_event 被設定時應盡快結束"""
+        primary, backup = self._order(primary, backup)
+        primary_cancel = threading.Event()
+        # hedge 執行緒沿用呼叫端的 contextvars（trace 的 span 掛回同一個事件）
+        primary_future = self._executor.submit(contextvars.copy_context().run, self._timed, primary, call, primary_cancel)
+        if backup is None:
+            return primary_future.result()
+
+        done, _ = wait([primary_future], timeout=self.hedge_delay(primary))
+        if done:
+            if primary_future.exception() is None:
+                return primary_future.result()
+            return self._failover(primary, backup, primary_future.exception(), call)
+
+        if not self._take_hedge_token():
+            # 沒有 hedge 額度：繼續等主要 backend，失敗時仍改用備援
+            try:
+                return primary_future.result()
+            except Exception as e:
+                return self._failover(primary, backup, e, call)
+
+        logger.debug("主要 backend 超過 p95 仍未回應，hedge", primary=primary, backup=backup)
+        backup_cancel = threading.Event()
+        backup_future = self._executor.submit(contextvars.copy_context().run, self._timed, backup, call, backup_cancel)
+        cancels = {primary_future: primary_cancel, backup_future: backup_cancel}
+        pending = set(cancels)
+        error = None
+        while pending:
+            done, pending = wait(pending, return_when=FIRST_COMPLETED)
+            for future in done:
+                if future.exception() is None:
+                    for loser in pending:
+                        cancels[loser].set()
+                    if future is backup_future:
+                        self._count("hedge_wins")
+                    return future.result()
+                error = error or future.exception()
+        raise error
+
+    def _failover(self, primary, backup, error, call):
+        self._log_failover(primary, backup, error)
+        return self._timed(backup, call, threading.Event())
+
+    def _timed(self, backend, call, cancel):
+        start = time.monotonic()
+        try:
+            result = call(backend, cancel)
+        except Exception:
+            self._observe(backend, time.monotonic() - start, ok=False)
+            raise
+        # 被取消的一方只拿到部分結果，延遲不具代表性
+        if not cancel.is_set():
+            self._observe(backend, time.monotonic() - start, ok=True)
+        return result
+
+    # ------------------------------
+    # asyncio 版（ASGI 入口）
+    # ------------------------------
+    async def acomplete(self, primary, backup, call):
+        """call(backend) 回傳 coroutine；輸掉的一方直接 cancel"""
+        primary, backup = self._order(primary, backup)
+        primary_task = asyncio.ensure_future(self._atimed(primary, call))
+        if backup is None:
+            return await primary_task
+
+        done, _ = await asyncio.wait([primary_task], timeout=self.hedge_delay(primary))
+        if done:
+            if primary_task.exception() is None:
+                return primary_task.result()
+            return await self._afailover(primary, backup, primary_task.exception(), call)
+
+        if not self._take_hedge_token():
+            try:
+                return await primary_task
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                return await self._afailover(primary, backup, e, call)
+
+        logger.debug("主要 backend 超過 p95 仍未回應，hedge", primary=primary, backup=backup)
+        backup_task = asyncio.ensure_future(self._atimed(backup, call))
+        pending = {primary_task, backup_task}
+        error = None
+        while pending:
+            done, pending = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+            for task in done:
+                if task.exception() is None:
+                    for loser in pending:
+                        loser.cancel()
+                    if task is backup_task:
+                        self._count("hedge_wins")
+                    return task.result()
+                error = error or task.exception()
+        raise error
+
+    async def _afailover(self, primary, backup, error, call):
+        self._log_failover(primary, backup, error)
+        return await self._atimed(backup, call)
+
+    async def _atimed(self, backend, call):
+        start = time.monotonic()
+        try:
+            result = await call(backend)
+        except asyncio.CancelledError:
+            raise
+        except Exception:
+            self._observe(backend, time.monotonic() - start, ok=False)
+            raise
+        self._observe(backend, time.monotonic() - start, ok=True)
+        return result
+
+    # ------------------------------
+    # 統計與決策
+    # ------------------------------
+    def hedge_delay(self, backend):
+        """等待主要 backend 多久後才 hedge：近期 p95（樣本不足時用預設值）"""
+        with self._lock:
+            stats = self._stats.get(backend)
+            p95 = stats.percentile(0.95) if stats and stats.samples() >= self.min_samples else None
+        if p95 is None:
+            return self.default_hedge_delay
+        return max(self.min_hedge_delay, p95)
+
+    def stats(self):
+        with self._lock:
+            backends = {
+                name: {
+                    "samples": s.samples(),
+                    "p50": _round(s.percentile(0.5)),
+                    "p95": _round(s.percentile(0.95)),
+                    "error_rate": round(s.error_rate(), 3),
+                }
+                for name, s in self._stats.items()
+            }
+            return {
+                "backends": backends,
+                "requests": self.requests,
+                "hedges": self.hedges,
+                "hedge_wins": self.hedge_wins,
+                "failovers": self.failovers,
+                "swaps": self.swaps,
+                "hedge_tokens": round(self._tokens, 2),
+            }
+
+    def _order(self, primary, backup):
+        """主要 backend 錯誤率過高而備援較健康時對調；同時替這次請求累積 hedge token"""
+        with self._lock:
+            self.requests += 1
+            self._tokens = min(self.burst, self._tokens + self.max_hedge_ratio)
+            if backup is None:
+                return primary, backup
+            p = self._stats.get(primary)
+            b = self._stats.get(backup)
+            if (p is not None and p.samples() >= self.min_samples and p.error_rate() > self.max_error_rate
+                    and (b is None or b.error_rate() < p.error_rate())):
+                self.swaps += 1
+                return backup, primary
+        return primary, backup
+
+    def _take_hedge_token(self):
+        with self._lock:
+            if self._tokens < 1:
+                return False
+            self._tokens -= 1
+            self.hedges += 1
+            return True
+
+    def _observe(self, backend, seconds, ok):
+        with self._lock:
+            stats = self._stats.get(backend)
+            if stats is None:
+                stats = self._stats[backend] = BackendStats(self.window)
+            stats.observe(seconds, ok)
+
+    def _log_failover(self, primary, backup, error):
+        self._count("failovers")
+        logger.warning("主要 backend 失敗，改用備援", primary=primary, backup=backup, error=str(error))
+
+    def _count(self, name):
+        with self._lock:
+            setattr(self, name, getattr(self, name) + 1)
+
+
+def _round(value):
+    return None if value is None else round(value, 3)
@@ -0,0 +1,298 @@
+"""
+上游呼叫的熔斷器（circuit breaker）與全 process 共用的重試額度（retry budget）。
+
+原本各處以 time.sleep(backoff_factor * 2**i) 重試，上游故障時每個 worker 都會睡上好幾秒，
+整個 worker pool 被拖垮。改為：
+
+  - 每個上游一個 CircuitBreaker：連續失敗 failure_threshold 次就「打開」，
+    recovery_timeout 秒內直接丟 CircuitOpenError（呼叫端改回快取或預設訊息），
+    之後放一個探測請求（half-open），成功才關閉
+  - 重試要先從 RetryBudget 取額度：每個請求存入 ratio 個 token，重試一次花 1 個，
+    故障時重試量最多只佔正常流量的一小部分；重試前的等待也限制在 1 秒內
+  - 4xx（429 除外）代表請求本身有問題，不重試；對熔斷器是中性的：不算故障，也不會重置連續失敗次數或關閉熔斷
+  - 每次嘗試的耗時、錯誤、回應大小與 token 用量記到 metrics（依上游與 op），並在 trace 中記一個 span
+
+    reply = resilience.call("groq", client.chat.completions.create, model=..., messages=..., op=model)
+"""
+import time, random, asyncio, threading
+from metrics import metrics
+import tracing
+from app_logging import get_logger
+
+STATE_CLOSED = "closed"
+STATE_OPEN = "open"
+STATE_HALF_OPEN = "half_open"
+
+UPSTREAMS = ("line_push", "line_reply", "groq", "openai", "openweather", "google_cse", "spotify")
+
+logger = get_logger("resilience")
+
+
+class CircuitOpenError(Exception):
+    """熔斷器打開中，呼叫未送出"""
+
+    def __init__(self, name, retry_after):
+        super().__init__(f"{name} 熔斷中，{retry_after:.0f} 秒後重試")
+        self.name = name
+        self.retry_after = retry_after
+
+
+class CircuitBreaker:
+    def __init__(self, name, failure_threshold=5, recovery_timeout=30.0):
+        self.name = name
+        self.failure_threshold = failure_threshold
+        self.recovery_timeout = recovery_timeout
+
+        self._lock = threading.Lock()
+        self._state = STATE_CLOSED
+        self._failures = 0
+        self._opened_at = 0.0
+        self._probe_in_flight = False
+
+        self.calls = 0
+        self.failures_total = 0
+        self.rejected = 0
+        self.opened = 0
+
+    def before_call(self):
+        """允許呼叫時回傳 None，否則丟 CircuitOpenError"""
+        with self._lock:
+            self.calls += 1
+            if self._state == STATE_OPEN:
+                waited = time.monotonic() - self._opened_at
+                if waited < self.recovery_timeout:
+                    self.rejected += 1
+                    raise CircuitOpenError(self.name, self.recovery_timeout - waited)
+                self._state = STATE_HALF_OPEN
+                self._probe_in_flight = False
+            if self._state == STATE_HALF_OPEN:
+                if self._probe_in_flight:
+                    self.rejected += 1
+                    raise CircuitOpenError(self.name, 1.0)
+                self._probe_in_flight = True
+
+    def record_success(self):
+        with self._lock:
+            if self._state != STATE_CLOSED:
+                logger.info("上游恢復正常，關閉熔斷", upstream=self.name)
+            self._state = STATE_CLOSED
+            self._failures = 0
+            self._probe_in_flight = False
+
+    def record_neutral(self):
+        """請求本身的問題（4xx）：不影響熔斷狀態，只釋放 half-open 的探測名額"""
+        with self._lock:
+            self._probe_in_flight = False
+
+    def record_failure(self):
+        with self._lock:
+            self.failures_total += 1
+            self._failures += 1
+            self._probe_in_flight = False
+            if self._state == STATE_HALF_OPEN or self._failures >= self.failure_threshold:
+                if self._state != STATE_OPEN:
+                    self.opened += 1
+                    logger.warning("上游連續失敗，熔斷", upstream=self.name, failures=self._failures,
+                                   open_s=round(self.recovery_timeout))
+                self._state = STATE_OPEN
+                self._opened_at = time.monotonic()
+
+    @property
+    def state(self):
+        with self._lock:
+            if self._state == STATE_OPEN and time.monotonic() - self._opened_at >= self.recovery_timeout:
+                return STATE_HALF_OPEN
+            return self._state
+
+    def stats(self):
+        state = self.state
+        with self._lock:
+            return {
+                "state": state,
+                "consecutive_failures": self._failures,
+                "calls": self.calls,
+                "failures": self.failures_total,
+                "rejected": self.rejected,
+                "opened": self.opened,
+            }
+
+
+class RetryBudget:
+    """每個請求存入 ratio 個 token（最多 max_tokens），重試一次花 1 個"""
+
+    def __init__(self, ratio=0.2, max_tokens=10.0):
+        self.ratio = ratio
+        self.max_tokens = max_tokens
+        self._lock = threading.Lock()
+        self._tokens = max_tokens
+        self.retries = 0
+        self.exhausted = 0
+
+    def deposit(self):
+        with self._lock:
+            self._tokens = min(self.max_tokens, self._tokens + self.ratio)
+
+    def withdraw(self):
+        with self._lock:
+            if self._tokens < 1:
+                self.exhausted += 1
+                return False
+            self._tokens -= 1
+            self.retries += 1
+            return True
+
+    def stats(self):
+        with self._lock:
+            return {"tokens": round(self._tokens, 2), "retries": self.retries, "exhausted": self.exhausted}
+
+
+def error_status(error):
+    """從 SDK / HTTP 例外取出 HTTP 狀態碼（LINE ApiException.status、httpx / requests response）"""
+    status = getattr(error, "status", None) or getattr(error, "status_code", None)
+    if status is None:
+        response = getattr(error, "response", None)
+        status = getattr(response, "status_code", None) or getattr(response, "status", None)
+    try:
+        return int(status) if status is not None else None
+    except (TypeError, ValueError):
+        return None
+
+
+def is_upstream_failure(error):
+    """上游故障（5xx、429、連線錯誤）才計入熔斷；其餘 4xx 是請求本身的問題"""
+    if isinstance(error, CircuitOpenError):
+        return False
+    status = error_status(error)
+    if status is not None and 400 <= status < 500 and status != 429:
+        return False
+    return True
+
+
+def is_retryable(error):
+    # 月額度用完重試也沒用
+    return is_upstream_failure(error) and "monthly limit" not in str(error)
+
+
+class Resilience:
+    def __init__(self, upstreams=UPSTREAMS, failure_threshold=5, recovery_timeout=30.0,
+                 retry_ratio=0.2, max_retry_delay=1.0):
+        self.failure_threshold = failure_threshold
+        self.recovery_timeout = recovery_timeout
+        self.max_retry_delay = max_retry_delay
+        self.budget = RetryBudget(ratio=retry_ratio)
+        self._lock = threading.Lock()
+        self._breakers = {name: CircuitBreaker(name, failure_threshold, recovery_timeout) for name in upstreams}
+
+    def breaker(self, name):
+        with self._lock:
+            breaker = self._breakers.get(name)
+            if breaker is None:
+                breaker = self._breakers[name] = CircuitBreaker(name, self.failure_threshold, self.recovery_timeout)
+            return breaker
+
+    def is_open(self, name):
+        return self.breaker(name).state == STATE_OPEN
+
+    def call(self, name, func, *args, retries=1, is_failure_result=None, op=None, **kwargs):
+        """
+        經過 name 的熔斷器呼叫 func；失敗時在額度內重試 retries 次。
+        is_failure_result(result) 為 True 時（例如 HTTP 5xx 回應）也算失敗，但會照常回傳結果。
+        op 為 metrics 的細分標籤（例如 Groq 的模型、OpenAI 的 chat / image / whisper）。
+        """
+        breaker = self.breaker(name)
+        self.budget.deposit()
+        attempt = 0
+        while True:
+            self._before_call(breaker, name, op)
+            start = time.perf_counter()
+            try:
+                with tracing.span(name, op=op, attempt=attempt):
+                    result = func(*args, **kwargs)
+            except Exception as e:
+                metrics.observe_upstream(name, op, time.perf_counter() - start, error=True)
+                if not is_upstream_failure(e):
+                    breaker.record_neutral()
+                    raise
+                breaker.record_failure()
+                # 已熔斷就不再重試，直接把原本的錯誤交給呼叫端
+                if (attempt >= retries or not is_retryable(e) or breaker.state != STATE_CLOSED
+                        or not self.budget.withdraw()):
+                    raise
+                attempt += 1
+                logger.info("上游呼叫失敗，重試", upstream=name, op=op, attempt=attempt, error=e)
+                time.sleep(self.retry_delay(attempt))
+                continue
+            failed = is_failure_result is not None and is_failure_result(result)
+            metrics.observe_upstream(name, op, time.perf_counter() - start, result=result, error=failed)
+            if failed:
+                breaker.record_failure()
+            else:
+                breaker.record_success()
+            return result
+
+    async def acall(self, name, coro_func, *args, retries=1, is_failure_result=None, op=None, **kwargs):
+        """call 的 coroutine 版本"""
+        breaker = self.breaker(name)
+        self.budget.deposit()
+        attempt = 0
+        while True:
+            self._before_call(breaker, name, op)
+            start = time.perf_counter()
+            try:
+                with tracing.span(name, op=op, attempt=attempt):
+                    result = await coro_func(*args, **kwargs)
+            except asyncio.CancelledError:
+                # 被取消（例如 hedge 輸掉的一方）不代表上游好壞；若是 half-open 的探測請求，要釋放探測名額
+                breaker.record_neutral()
+                raise
+            except Exception as e:
+                metrics.observe_upstream(name, op, time.perf_counter() - start, error=True)
+                if not is_upstream_failure(e):
+                    breaker.record_neutral()
+                    raise
+                breaker.record_failure()
+                # 已熔斷就不再重試，直接把原本的錯誤交給呼叫端
+                if (attempt >= retries or not is_retryable(e) or breaker.state != STATE_CLOSED
+                        or not self.budget.withdraw()):
+                    raise
+                attempt += 1
+                logger.info("上游呼叫失敗，重試", upstream=name, op=op, attempt=attempt, error=e)
+                await asyncio.sleep(self.retry_delay(attempt))
+                continue
+            failed = is_failure_result is not None and is_failure_result(result)
+            metrics.observe_upstream(name, op, time.perf_counter() - start, result=result, error=failed)
+            if failed:
+                breaker.record_failure()
+            else:
+                breaker.record_success()
+            return result
+
+    @staticmethod
+    def _before_call(breaker, name, op):
+        try:
+            breaker.before_call()
+        except CircuitOpenError:
+            metrics.upstream_rejected_call(name, op)
+            raise
+
+    def retry_delay(self, attempt):
+        """指數退避加抖動，但最多 max_retry_delay 秒，不讓 worker 長時間卡住"""
+        return min(self.max_retry_delay, 0.1 * (2 ** attempt)) * random.uniform(0.5, 1.0)
+
+    def stats(self):
+        with self._lock:
+            breakers = dict(self._breakers)
+        return {
+            "breakers": {name: b.stats() for name, b in breakers.items()},
+            "retry_budget": self.budget.stats(),
+        }
+
+
+def http_failure(response):
+    """HTTP 回應是否代表上游故障（5xx 或 429）"""
+    status = getattr(response, "status_code", None) or getattr(response, "status", 0)
+    return status >= 500 or status == 429
+
+
+# 全 process 共用
+resilience = Resilience()
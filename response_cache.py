@@ -0,0 +1,107 @@
+import re, time, threading
+from collections import OrderedDict
+
+_WHITESPACE = re.compile(r"\s+")
+
+
+def normalize_prompt(text):
+    """正規化使用者訊息：去頭尾空白、合併連續空白、轉小寫"""
+    return _WHITESPACE.sub(" ", (text or "").strip()).lower()
+
+
+class ResponseCache:
+    """
+    有 TTL 的 LRU 快取（執行緒安全）。
+    - 依筆數 (max_entries) 與總大小 (max_bytes) 淘汰最久未使用的項目
+    - TTL 可依模型設定（ttl_overrides），其餘使用 default_ttl
+    - 過期項目留到被 LRU 淘汰為止，上游故障時可用 get_stale() 取回舊答案
+    - 記錄 hit / miss / eviction 次數供監控
+    """
+
+    def __init__(self, max_entries=512, max_bytes=2 * 1024 * 1024, default_ttl=180, ttl_overrides=None):
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self.default_ttl = default_ttl
+        self.ttl_overrides = {k.lower(): v for k, v in (ttl_overrides or {}).items()}
+
+        self._lock = threading.Lock()
+        self._entries = OrderedDict()   # key -> (expires_at, value, size)
+        self._bytes = 0
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.expirations = 0
+        self.stale_hits = 0
+
+    @staticmethod
+    def make_key(model, system_prompt, user_message):
+        return (model.lower(), system_prompt, normalize_prompt(user_message))
+
+    def ttl_for(self, model):
+        return self.ttl_overrides.get(model.lower(), self.default_ttl)
+
+    def get(self, key):
+        now = time.monotonic()
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                self.misses += 1
+                return None
+            expires_at, value, size = entry
+            if expires_at <= now:
+                self.expirations += 1
+                self.misses += 1
+                return None
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return value
+
+    def get_stale(self, key):
+        """不論是否過期都回傳舊值（上游熔斷時的備用答案）"""
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                return None
+            self.stale_hits += 1
+            return entry[1]
+
+    def set(self, key, value, ttl):
+        if ttl <= 0:
+            return
+        size = _sizeof(key, value)
+        if size > self.max_bytes:
+            return
+        with self._lock:
+            old = self._entries.pop(key, None)
+            if old is not None:
+                self._bytes -= old[2]
+            self._entries[key] = (time.monotonic() + ttl, value, size)
+            self._bytes += size
+            while len(self._entries) > self.max_entries or self._bytes > self.max_bytes:
+                old_key, (_, _, old_size) = self._entries.popitem(last=False)
+                self._bytes -= old_size
+                self.evictions += 1
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self._bytes = 0
+
+    def stats(self):
+        with self._lock:
+            total = self.hits + self.misses
+            return {
+                "entries": len(self._entries),
+                "bytes": self._bytes,
+                "hits": self.hits,
+                "misses": self.misses,
+                "evictions": self.evictions,
+                "expirations": self.expirations,
+                "stale_hits": self.stale_hits,
+                "hit_rate": round(self.hits / total, 4) if total else 0.0,
+            }
+
+
+def _sizeof(key, value):
+    """以 UTF-8 長度估算項目大小"""
+    return sum(len(str(part).encode("utf-8")) for part in key) + len(str(value).encode("utf-8"))
@@ -0,0 +1,188 @@
+"""
+通用的列表頁爬蟲引擎。
+
+每個列表頁以 ListingSpec 描述（網址樣板、卡片 selector、欄位取法、筆數、逾時），
+scrape_listing() 只做 goto → 等待卡片 → 一次 page.evaluate 取出所有卡片的所有欄位，
+不再對每張卡片各自 query_selector / text_content / get_attribute（每次都是一趟 CDP 來回）。
+
+載入列表時會在網路層擋掉圖片、字型、影音與第三方 script，只留下 HTML 與同站資源。
+若一般 HTTP 就拿得到 HTML（沒有被 Cloudflare 擋），則完全不開瀏覽器，直接解析 HTML。
+"""
+import random
+from urllib.parse import quote, urlsplit
+from bs4 import BeautifulSoup
+from browser_pool import browser_pool, USER_AGENTS
+from fetcher import fetcher, TIER_BROWSER
+from app_logging import get_logger
+
+BLOCKED_RESOURCE_TYPES = {"image", "media", "font"}
+
+logger = get_logger("scraper")
+
+
+class Field:
+    """
+    卡片內的單一欄位：
+      selector : 相對於卡片的 CSS selector（空字串代表卡片本身）
+      attrs    : 依序嘗試的屬性，取第一個非空值；None 代表取 textContent
+      default  : 找不到元素時的值
+    """
+    __slots__ = ("selector", "attrs", "default", "strip")
+
+    def __init__(self, selector, attrs=None, default="N/A", strip=True):
+        self.selector = selector
+        self.attrs = tuple(attrs) if attrs else ()
+        self.default = default
+        self.strip = strip
+
+    def to_js(self):
+        return {"selector": self.selector, "attrs": list(self.attrs), "default": self.default, "strip": self.strip}
+
+
+class ListingSpec:
+    def __init__(self, name, url_template, card_selector, fields, limit,
+                 goto_timeout=20000, selector_timeout=5000, wait_until="domcontentloaded"):
+        self.name = name
+        self.url_template = url_template
+        self.card_selector = card_selector
+        self.fields = fields
+        self.limit = limit
+        self.goto_timeout = goto_timeout
+        self.selector_timeout = selector_timeout
+        self.wait_until = wait_until
+
+    def url(self, **params):
+        return self.url_template.format(**{k: quote(str(v)) for k, v in params.items()})
+
+
+# 在頁面內一次取出所有卡片的所有欄位，順便判斷是否為 Cloudflare 防護頁
+_EXTRACT_JS = """
+([cardSelector, fields, limit]) => {
+    if (document.title.includes("Just a moment...") || document.getElementById("challenge-error-text")) {
+        return {challenge: true, items: []};
+    }
+    const cards = Array.from(document.querySelectorAll(cardSelector)).slice(0, limit);
+    const items = cards.map(card => {
+        const record = {};
+        for (const [name, f] of Object.entries(fields)) {
+            const el = f.selector ? card.querySelector(f.selector) : card;
+            let value = null;
+            if (el) {
+                if (f.attrs.length) {
+                    for (const attr of f.attrs) {
+                        const v = el.getAttribute(attr);
+                        if (v) { value = v; break; }
+                    }
+                } else {
+                    value = el.textContent;
+                }
+            }
+            if (value === null) {
+                record[name] = el ? null : f.default;
+            } else {
+                record[name] = f.strip ? value.trim() : value;
+            }
+        }
+        return record;
+    });
+    return {challenge: false, items: items};
+}
+"""
+
+
+def scrape_listing(spec, **params):
+    """
+    依 spec 爬取列表頁，回傳 [{欄位: 值}, ...]；被 Cloudflare 擋下或找不到卡片時回傳 []。
+    先用 HTTP / cloudscraper 抓 HTML 直接解析，兩者都被擋下才開 Chromium。
+    """
+    url = spec.url(**params)
+    result = fetcher.fetch(url, headers={"User-Agent": random.choice(USER_AGENTS)}, browser=False)
+    if result is not None:
+        items = parse_listing_html(spec, result.text)
+        if items:
+            return items
+        logger.warning("HTML 沒有卡片，改用瀏覽器", listing=spec.name, tier=result.tier)
+
+    items = browser_pool.run(lambda page: scrape_listing_page(page, spec, url))
+    if items:
+        fetcher.remember(urlsplit(url).hostname, TIER_BROWSER)
+    return items
+
+
+def parse_listing_html(spec, html):
+    """以 BeautifulSoup 依 spec 解析 HTML（規則與 _EXTRACT_JS 相同）"""
+    soup = BeautifulSoup(html, "html.parser")
+    items = []
+    for card in soup.select(spec.card_selector)[:spec.limit]:
+        record = {}
+        for name, field in spec.fields.items():
+            el = card.select_one(field.selector) if field.selector else card
+            value = None
+            if el is not None:
+                if field.attrs:
+                    value = next((el.get(attr) for attr in field.attrs if el.get(attr)), None)
+                else:
+                    value = el.get_text()
+            if value is None:
+                record[name] = None if el is not None else field.default
+            else:
+                record[name] = value.strip() if field.strip else value
+        items.append(record)
+    return items
+
+
+async def scrape_listing_page(page, spec, url):
+    """在給定的 page 上執行一次列表爬取（benchmark 也直接使用）"""
+    await page.route("**/*", _resource_blocker(urlsplit(url).hostname))
+    await page.goto(url, timeout=spec.goto_timeout, wait_until=spec.wait_until)
+    try:
+        await page.wait_for_selector(spec.card_selector, timeout=spec.selector_timeout)
+    except Exception as e:
+        # 逾時不直接丟錯：可能是防護頁，交給下面的判斷
+        logger.warning("等待卡片逾時", listing=spec.name, selector=spec.card_selector, error=e)
+
+    fields = {name: field.to_js() for name, field in spec.fields.items()}
+    result = await page.evaluate(_EXTRACT_JS, [spec.card_selector, fields, spec.limit])
+    if result["challenge"]:
+        logger.warning("Cloudflare 防護阻擋，無法獲取內容", listing=spec.name)
+        return []
+    return result["items"]
+
+
+def _resource_blocker(site_host):
+    """擋掉圖片 / 字型 / 影音，以及非同站的 script"""
+    site = _registrable_domain(site_host)
+
+    async def handle(route):
+        request = route.request
+        resource_type = request.resource_type
+        if resource_type in BLOCKED_RESOURCE_TYPES:
+            await route.abort()
+        elif resource_type == "script" and _registrable_domain(urlsplit(request.url).hostname) != site:
+            await route.abort()
+        else:
+            await route.continue_()
+    return handle
+
+
+def _registrable_domain(host):
+    """粗略取得主網域（jable.tv、assets.jable.tv → jable.tv）；IP 直接回傳"""
+    host = host or ""
+    parts = host.split(".")
+    if len(parts) <= 2 or host.replace(".", "").isdigit():
+        return host
+    return ".".join(parts[-2:])
+
+
+# Jable 列表頁
+_JABLE_CARD_FIELDS = {
+    "title": Field(".title a"),
+    "link": Field(".title a", attrs=("href",)),
+    "thumbnail": Field(".img-box img", attrs=("data-src", "src")),
+}
+
+JABLE_SEARCH = ListingSpec("jable_search", "https://jable.tv/search/{query}/?sort_by=post_date",
+                           ".video-img-box", _JABLE_CARD_FIELDS, limit=2,
+                           goto_timeout=10000, selector_timeout=3000)
+JABLE_HOT = ListingSpec("jable_hot", "https://jable.tv/hot/", ".video-img-box", _JABLE_CARD_FIELDS, limit=3)
+JABLE_NEW = ListingSpec("jable_new", "https://jable.tv/latest-updates/", ".video-img-box", _JABLE_CARD_FIELDS, limit=3)
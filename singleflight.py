@@ -0,0 +1,126 @@
+"""
+Singleflight：相同 key 的並發呼叫只打一次上游，其餘呼叫者等待並共用同一個結果（或例外）。
+
+    @coalesce("weather")
+    def get_weather(city): ...
+
+多個執行緒同時呼叫 get_weather("台北") 時，只有第一個會真的發出請求。
+"""
+import asyncio, functools, threading
+
+
+class _Call:
+    __slots__ = ("done", "result", "error", "waiters")
+
+    def __init__(self):
+        self.done = threading.Event()
+        self.result = None
+        self.error = None
+        self.waiters = 0
+
+
+class Group:
+    """執行緒版 singleflight"""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._calls = {}
+        self.leaders = 0
+        self.shared = 0
+
+    def do(self, key, func, *args, **kwargs):
+        with self._lock:
+            call = self._calls.get(key)
+            if call is not None:
+                call.waiters += 1
+                self.shared += 1
+                leader = False
+            else:
+                call = _Call()
+                self._calls[key] = call
+                self.leaders += 1
+                leader = True
+
+        if not leader:
+            call.done.wait()
+            if call.error is not None:
+                raise call.error
+            return call.result
+
+        try:
+            call.result = func(*args, **kwargs)
+        except BaseException as e:
+            call.error = e
+            raise
+        finally:
+            with self._lock:
+                del self._calls[key]
+            call.done.set()
+        return call.result
+
+    def stats(self):
+        with self._lock:
+            return {"in_flight": len(self._calls), "leaders": self.leaders, "shared": self.shared}
+
+
+class AsyncGroup:
+    """asyncio 版 singleflight（同一個 event loop 內使用）"""
+
+    def __init__(self):
+        self._calls = {}
+        self.leaders = 0
+        self.shared = 0
+
+    async def do(self, key, coro_func, *args, **kwargs):
+        future = self._calls.get(key)
+        if future is not None:
+            self.shared += 1
+            return await asyncio.shield(future)
+
+        future = asyncio.get_running_loop().create_future()
+        self._calls[key] = future
+        self.leaders += 1
+        try:
+            result = await coro_func(*args, **kwargs)
+        except BaseException as e:
+            future.set_exception(e)
+            # 沒有其他等待者時避免 "exception was never retrieved" 警告
+            future.exception()
+            raise
+        else:
+            future.set_result(result)
+            return result
+        finally:
+            del self._calls[key]
+
+    def stats(self):
+        return {"in_flight": len(self._calls), "leaders": self.leaders, "shared": self.shared}
+
+
+# 全 process 共用
+group = Group()
+async_group = AsyncGroup()
+
+
+def _make_key(name, args, kwargs):
+    return (name, args, tuple(sorted(kwargs.items())))
+
+
+def coalesce(name, flight_group=None):
+    """裝飾器：以 (name, 參數) 為 key 合併相同的並發呼叫"""
+    def decorator(func):
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            return (flight_group or group).do(_make_key(name, args, kwargs), func, *args, **kwargs)
+        return wrapper
+    return decorator
+
+
+def coalesce_async(name, flight_group=None):
+    """coalesce 的 coroutine 版本"""
+    def decorator(coro_func):
+        @functools.wraps(coro_func)
+        async def wrapper(*args, **kwargs):
+            return await (flight_group or async_group).do(_make_key(name, args, kwargs), coro_func, *args, **kwargs)
+        return wrapper
+    return decorator
@@ -0,0 +1,135 @@
+"""
+跨 worker / 跨重啟共用的使用者設定（AI 模型選擇、翻譯設定）。
+
+原本 user_ai_choice、user_translation_config 是 module 層的 dict：多個 gunicorn worker 之間不同步
+（「換模型」落在 A worker、下一則訊息落在 B worker 就用回預設模型），重新部署也會全部遺失。
+
+  - 資料寫入本機 SQLite（STATE_DB_PATH，可指到 Render 的 persistent disk）
+  - 讀取先查 process 內快取，cache_ttl 秒內是單純的 dict 查詢（查不到的 key 也會快取）；
+    本 process 寫入時立即更新快取，其他 worker 最多 cache_ttl 秒後看到新值
+  - namespace() 回傳類似 dict 的 StateMap，原本 dict 的寫法（[]、get、in）不用改
+
+    user_ai_choice = state_store.namespace("ai_choice")
+    user_ai_choice[group_id] = "GPT-4o"
+"""
+import json, time, sqlite3, threading
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS state (
+    namespace   TEXT NOT NULL,
+    key         TEXT NOT NULL,
+    value       TEXT NOT NULL,
+    updated_at  REAL NOT NULL,
+    PRIMARY KEY (namespace, key)
+);
+"""
+
+_MISSING = object()
+
+
+class StateStore:
+    """
+    db_path    : SQLite 檔案路徑（None 代表只放在記憶體，不跨 worker、不保存）
+    cache_ttl  : process 內快取的秒數
+    """
+
+    def __init__(self, db_path=None, cache_ttl=5.0):
+        self.db_path = db_path
+        self.cache_ttl = cache_ttl
+        self._lock = threading.Lock()
+        self._cache = {}                # (namespace, key) -> (expires_at, value 或 _MISSING)
+        self._db = sqlite3.connect(db_path or ":memory:", check_same_thread=False, isolation_level=None, timeout=5)
+        if db_path:
+            self._db.execute("PRAGMA journal_mode=WAL")
+        self._db.executescript(_SCHEMA)
+
+        self.hits = 0
+        self.misses = 0
+        self.writes = 0
+
+    def namespace(self, name):
+        return StateMap(self, name)
+
+    def get(self, namespace, key, default=None):
+        cache_key = (namespace, key)
+        now = time.monotonic()
+        with self._lock:
+            entry = self._cache.get(cache_key)
+            if entry is not None and entry[0] > now:
+                self.hits += 1
+                value = entry[1]
+                return default if value is _MISSING else value
+            self.misses += 1
+            row = self._db.execute("SELECT value FROM state WHERE namespace = ? AND key = ?",
+                                   (namespace, key)).fetchone()
+            value = json.loads(row[0]) if row else _MISSING
+            self._cache[cache_key] = (now + self.cache_ttl, value)
+        return default if value is _MISSING else value
+
+    def set(self, namespace, key, value):
+        with self._lock:
+            self._db.execute(
+                "INSERT INTO state (namespace, key, value, updated_at) VALUES (?, ?, ?, ?) "
+                "ON CONFLICT(namespace, key) DO UPDATE SET value = excluded.value, updated_at = excluded.updated_at",
+                (namespace, key, json.dumps(value, ensure_ascii=False), time.time()))
+            self._cache[(namespace, key)] = (time.monotonic() + self.cache_ttl, value)
+            self.writes += 1
+
+    def delete(self, namespace, key):
+        with self._lock:
+            self._db.execute("DELETE FROM state WHERE namespace = ? AND key = ?", (namespace, key))
+            self._cache[(namespace, key)] = (time.monotonic() + self.cache_ttl, _MISSING)
+            self.writes += 1
+
+    def invalidate(self, namespace=None):
+        """清掉 process 內快取（namespace 為 None 時全部清除）"""
+        with self._lock:
+            if namespace is None:
+                self._cache.clear()
+            else:
+                for cache_key in [k for k in self._cache if k[0] == namespace]:
+                    del self._cache[cache_key]
+
+    def stats(self):
+        with self._lock:
+            total = self.hits + self.misses
+            return {
+                "cached": len(self._cache),
+                "hits": self.hits,
+                "misses": self.misses,
+                "writes": self.writes,
+                "hit_rate": round(self.hits / total, 4) if total else 0.0,
+            }
+
+
+class StateMap:
+    """StateStore 單一 namespace 的 dict 介面"""
+
+    def __init__(self, store, namespace):
+        self.store = store
+        self.namespace = namespace
+
+    def get(self, key, default=None):
+        return self.store.get(self.namespace, key, default)
+
+    def __getitem__(self, key):
+        value = self.store.get(self.namespace, key, _MISSING)
+        if value is _MISSING:
+            raise KeyError(key)
+        return value
+
+    def __setitem__(self, key, value):
+        self.store.set(self.namespace, key, value)
+
+    def __delitem__(self, key):
+        self.store.delete(self.namespace, key)
+
+    def __contains__(self, key):
+        return self.store.get(self.namespace, key, _MISSING) is not _MISSING
+
+    def pop(self, key, default=None):
+        value = self.get(key, _MISSING)
+        if value is _MISSING:
+            return default
+        self.store.delete(self.namespace, key)
+        return value
@@ -0,0 +1,191 @@
+"""
+串流 LLM 回應：邊收邊濾掉 <think>...</think> 推理區塊，可見回答達到字數上限就停止讀取。
+
+推理模型（deepseek-r1-distill-llama-70b）會先輸出一大段使用者看不到的推理內容，
+原本要等整段 completion 完成後才用 regex 移除。改用串流後：
+  - ThinkFilter 逐塊過濾推理區塊（標籤被切在兩個 chunk 之間也能處理）
+  - 可見回答達到 max_chars 就關閉串流，不再等待（也不再付費）後面的 token
+  - 記錄「第一個可見字元」的延遲（first_visible_latency，依模型統計）
+  - 串流的回傳值只是文字，token 用量改從最後一個 chunk（Groq 的 x_groq.usage）取得並直接記到 metrics；
+    提早關閉的串流收不到最後一個 chunk，不會記錄
+
+    text = stream_chat(client, messages, model, max_chars=80)
+"""
+import time, threading
+from deadline import LatencyTracker
+from metrics import metrics, usage_counts
+
+THINK_OPEN = "<think>"
+THINK_CLOSE = "</think>"
+SENTENCE_ENDINGS = "。！？!?～~\n"
+
+# 依模型統計第一個可見字元的延遲（中位數）
+first_visible_latency = LatencyTracker(window=100, percentile=0.5, min_samples=1)
+
+_counter_lock = threading.Lock()
+stream_counters = {"streams": 0, "truncated": 0}
+
+
+def _partial_suffix(text, tag):
+    """text 結尾與 tag 開頭重疊的長度（標籤可能被切在兩個 chunk 之間）"""
+    for k in range(min(len(text), len(tag) - 1), 0, -1):
+        if text.endswith(tag[:k]):
+            return k
+    return 0
+
+
+class ThinkFilter:
+    """逐塊移除 <think>...</think>；feed() 回傳可以立即顯示的文字"""
+
+    def __init__(self):
+        self._buffer = ""
+        self._in_think = False
+
+    def feed(self, text):
+        self._buffer += text
+        visible = []
+        while self._buffer:
+            if self._in_think:
+                idx = self._buffer.find(THINK_CLOSE)
+                if idx == -1:
+                    keep = _partial_suffix(self._buffer, THINK_CLOSE)
+                    self._buffer = self._buffer[len(self._buffer) - keep:]
+                    break
+                self._buffer = self._buffer[idx + len(THINK_CLOSE):]
+                self._in_think = False
+            else:
+                idx = self._buffer.find(THINK_OPEN)
+                if idx == -1:
+                    keep = _partial_suffix(self._buffer, THINK_OPEN)
+                    visible.append(self._buffer[:len(self._buffer) - keep])
+                    self._buffer = self._buffer[len(self._buffer) - keep:]
+                    break
+                visible.append(self._buffer[:idx])
+                self._buffer = self._buffer[idx + len(THINK_OPEN):]
+                self._in_think = True
+        return "".join(visible)
+
+    def flush(self):
+        """串流結束：未閉合的推理區塊丟棄，殘留的半個標籤視為一般文字"""
+        rest = "" if self._in_think else self._buffer
+        self._buffer = ""
+        return rest
+
+
+def cut_at_sentence(text, max_chars):
+    """截到 max_chars 以內；盡量停在句尾標點（至少保留一半長度），否則硬切並加上「…」"""
+    if len(text) <= max_chars:
+        return text
+    head = text[:max_chars]
+    cut = max(head.rfind(ch) for ch in SENTENCE_ENDINGS)
+    if cut >= max_chars // 2:
+        return head[:cut + 1].strip()
+    return head.rstrip() + "…"
+
+
+class VisibleCollector:
+    """收集串流中的可見文字，達到 max_chars 時 done 變成 True"""
+
+    def __init__(self, max_chars=None, started=None):
+        self.max_chars = max_chars
+        self.started = time.monotonic() if started is None else started
+        self.first_visible = None
+        self.truncated = False
+        self.usage = None
+        self._filter = ThinkFilter()
+        self._parts = []
+        self._length = 0
+
+    @property
+    def done(self):
+        return self.truncated
+
+    def feed(self, delta):
+        if not delta:
+            return
+        visible = self._filter.feed(delta)
+        if not self._length:
+            visible = visible.lstrip()
+        if not visible:
+            return
+        if self.first_visible is None:
+            self.first_visible = time.monotonic() - self.started
+        self._parts.append(visible)
+        self._length += len(visible)
+        if self.max_chars and self._length >= self.max_chars:
+            self.truncated = True
+
+    def text(self):
+        if not self.truncated:
+            self._parts.append(self._filter.flush())
+        text = "".join(self._parts).strip()
+        if self.truncated:
+            text = cut_at_sentence(text, self.max_chars)
+        return text
+
+    def feed_chunk(self, chunk):
+        """串流的一個 chunk：收集可見文字，最後一個 chunk 帶有 token 用量"""
+        self.usage = _usage(chunk) or self.usage
+        self.feed(_delta(chunk))
+
+    def record(self, model, upstream="groq"):
+        metrics.observe_tokens(upstream, model, usage_counts(self.usage))
+        if self.first_visible is not None:
+            first_visible_latency.observe(model, self.first_visible)
+        with _counter_lock:
+            stream_counters["streams"] += 1
+            stream_counters["truncated"] += int(self.truncated)
+
+
+def _delta(chunk):
+    if not chunk.choices:
+        return None
+    return chunk.choices[0].delta.content
+
+
+def _usage(chunk):
+    """Groq 把用量放在最後一個 chunk 的 x_groq.usage；OpenAI 相容的 include_usage 則是 chunk.usage"""
+    x_groq = getattr(chunk, "x_groq", None)
+    usage = x_groq.get("usage") if isinstance(x_groq, dict) else getattr(x_groq, "usage", None)
+    return usage or getattr(chunk, "usage", None)
+
+
+def stream_chat(client, messages, model, max_chars=None, cancel=None):
+    """
+    以串流呼叫 Groq（OpenAI 相容）chat completion，回傳過濾後的可見回答。
+    cancel（threading.Event）被設定時提早結束，例如 hedge 時另一個 backend 已先回應。
+    """
+    collector = VisibleCollector(max_chars)
+    stream = client.chat.completions.create(messages=messages, model=model, stream=True)
+    try:
+        for chunk in stream:
+            collector.feed_chunk(chunk)
+            if collector.done or (cancel is not None and cancel.is_set()):
+                break
+    finally:
+        # 提早結束時關閉連線，不再接收後面的 token
+        stream.close()
+    collector.record(model)
+    return collector.text()
+
+
+async def astream_chat(client, messages, model, max_chars=None):
+    """stream_chat 的 AsyncGroq 版本"""
+    collector = VisibleCollector(max_chars)
+    stream = await client.chat.completions.create(messages=messages, model=model, stream=True)
+    try:
+        async for chunk in stream:
+            collector.feed_chunk(chunk)
+            if collector.done:
+                break
+    finally:
+        await stream.close()
+    collector.record(model)
+    return collector.text()
+
+
+def stream_stats():
+    with _counter_lock:
+        counters = dict(stream_counters)
+    counters["first_visible_latency"] = first_visible_latency.stats()
+    return counters
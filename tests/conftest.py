@@ -0,0 +1,4 @@
+import os, sys
+
+# 模組都放在專案根目錄（與 main.py 相同的匯入方式）
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
@@ -0,0 +1,48 @@
+import itertools
+import os
+import random
+import sys
+
+import pytest
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "bench"))
+
+from bench_router import CHATTER, COMMAND_MESSAGES, build_corpus, legacy_route
+from command_router import router
+
+# 原本 if 判斷鏈用到的所有關鍵字，加上一些無關的片段
+FRAGMENTS = ["給我", "id", "群組", "狗蛋", "情勒", "指令", "出去", "狗蛋生成", "模型", "當前", "換",
+             "狗蛋搜尋", "狗蛋介紹", "狗蛋搜圖", "狗蛋唱歌", "氣象", "預報", "狗蛋開車", "最熱", "最新",
+             "狗", "蛋", "開車", " ", "哈哈", "台北", "！"]
+
+
+def normalize(text):
+    # handle_message 路由前的處理
+    return text.strip().lower()
+
+
+@pytest.mark.parametrize("is_group", [True, False])
+@pytest.mark.parametrize("text", COMMAND_MESSAGES + CHATTER)
+def test_known_messages_match_legacy(text, is_group):
+    text = normalize(text)
+    assert router.route(text, is_group) == legacy_route(text, is_group)
+
+
+def test_bench_corpus_matches_legacy():
+    for text, is_group in build_corpus(2000, command_ratio=0.5, seed=7):
+        assert router.route(text, is_group) == legacy_route(text, is_group), text
+
+
+def test_keyword_pairs_match_legacy():
+    for a, b in itertools.product(FRAGMENTS, repeat=2):
+        for is_group in (True, False):
+            text = normalize(a + b)
+            assert router.route(text, is_group) == legacy_route(text, is_group), (text, is_group)
+
+
+def test_random_keyword_mixes_match_legacy():
+    rng = random.Random(20240601)
+    for _ in range(20000):
+        text = normalize("".join(rng.choice(FRAGMENTS) for _ in range(rng.randint(1, 5))))
+        is_group = rng.random() < 0.5
+        assert router.route(text, is_group) == legacy_route(text, is_group), (text, is_group)
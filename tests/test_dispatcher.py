@@ -0,0 +1,93 @@
+import random
+import threading
+import time
+from collections import defaultdict
+
+from dispatcher import ChatOrderedDispatcher
+
+
+def test_events_of_one_chat_run_in_order_and_never_overlap():
+    dispatcher = ChatOrderedDispatcher(workers=8, max_pending=1000)
+    seen = defaultdict(list)
+    running = set()
+    overlaps = []
+    lock = threading.Lock()
+
+    def handle(chat, seq):
+        with lock:
+            if chat in running:
+                overlaps.append(chat)
+            running.add(chat)
+        time.sleep(random.uniform(0, 0.002))
+        with lock:
+            running.discard(chat)
+            seen[chat].append(seq)
+
+    expected = defaultdict(list)
+    for seq in range(300):
+        chat = f"C{random.randrange(10)}"
+        expected[chat].append(seq)
+        assert dispatcher.submit(chat, handle, chat, seq)
+    dispatcher.stop(timeout=10)
+
+    assert overlaps == []
+    assert dict(seen) == dict(expected)
+
+
+def test_different_chats_run_in_parallel():
+    dispatcher = ChatOrderedDispatcher(workers=2)
+    barrier = threading.Barrier(2, timeout=2)
+    done = []
+
+    def handle(chat):
+        barrier.wait()      # 兩個聊天室必須同時在跑才會通過
+        done.append(chat)
+
+    dispatcher.submit("A", handle, "A")
+    dispatcher.submit("B", handle, "B")
+    dispatcher.stop(timeout=5)
+    assert sorted(done) == ["A", "B"]
+
+
+def test_slow_chat_does_not_block_others():
+    dispatcher = ChatOrderedDispatcher(workers=2)
+    release = threading.Event()
+    finished = []
+
+    dispatcher.submit("slow", release.wait, 5)
+    dispatcher.submit("slow", finished.append, "slow")
+    for i in range(5):
+        dispatcher.submit("fast", finished.append, f"fast-{i}")
+    deadline = time.monotonic() + 2
+    while len(finished) < 5 and time.monotonic() < deadline:
+        time.sleep(0.01)
+    assert finished == [f"fast-{i}" for i in range(5)]
+    release.set()
+    dispatcher.stop(timeout=5)
+    assert finished[-1] == "slow"
+
+
+def test_failure_does_not_stall_the_chat():
+    dispatcher = ChatOrderedDispatcher(workers=1)
+    results = []
+
+    def boom():
+        raise RuntimeError("boom")
+
+    dispatcher.submit("A", results.append, 1)
+    dispatcher.submit("A", boom)
+    dispatcher.submit("A", results.append, 2)
+    dispatcher.stop(timeout=5)
+    assert results == [1, 2]
+    assert dispatcher.stats()["pending"] == 0
+
+
+def test_rejects_when_full():
+    dispatcher = ChatOrderedDispatcher(workers=1, max_pending=2)
+    release = threading.Event()
+    assert dispatcher.submit("A", release.wait, 5)
+    assert dispatcher.submit("A", release.wait, 5)
+    assert not dispatcher.submit("B", release.wait, 5)
+    release.set()
+    dispatcher.stop(timeout=5)
+    assert not dispatcher.submit("B", release.wait, 5)
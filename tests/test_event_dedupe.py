@@ -0,0 +1,121 @@
+import sqlite3
+from types import SimpleNamespace
+
+import pytest
+
+import event_dedupe
+from event_dedupe import EventDeduper
+
+
+def make_event(event_id, redelivery=False):
+    return SimpleNamespace(webhook_event_id=event_id,
+                           delivery_context=SimpleNamespace(is_redelivery=redelivery))
+
+
+class Clock:
+    def __init__(self, now=1_000_000.0):
+        self.now = now
+
+    def time(self):
+        return self.now
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    clock = Clock()
+    monkeypatch.setattr(event_dedupe.time, "time", clock.time)
+    return clock
+
+
+@pytest.fixture(params=["memory", "sqlite"])
+def make_deduper(request, tmp_path):
+    db_path = str(tmp_path / "events.db") if request.param == "sqlite" else None
+
+    def make(**kwargs):
+        kwargs.setdefault("ttl", 3600)
+        kwargs.setdefault("processing_ttl", 60)
+        return EventDeduper(db_path=db_path, **kwargs)
+
+    return make
+
+
+def test_redelivery_of_done_event_is_dropped(make_deduper, clock):
+    deduper = make_deduper()
+    event = make_event("E1")
+    assert not deduper.is_duplicate(event)
+    deduper.done(event)
+    clock.now += 600
+    assert deduper.is_duplicate(make_event("E1", redelivery=True))
+    stats = deduper.stats()
+    assert (stats["accepted"], stats["duplicates"], stats["redelivery_duplicates"]) == (1, 1, 1)
+
+
+def test_redelivery_while_processing_is_dropped(make_deduper, clock):
+    deduper = make_deduper()
+    assert not deduper.is_duplicate(make_event("E1"))
+    clock.now += 30
+    assert deduper.is_duplicate(make_event("E1", redelivery=True))
+
+
+def test_redelivery_after_failure_is_processed(make_deduper, clock):
+    deduper = make_deduper()
+    event = make_event("E1")
+    assert not deduper.is_duplicate(event)
+    deduper.release(event)
+    assert not deduper.is_duplicate(make_event("E1", redelivery=True))
+    assert deduper.stats()["released"] == 1
+
+
+def test_unfinished_claim_expires(make_deduper, clock):
+    deduper = make_deduper()
+    assert not deduper.is_duplicate(make_event("E1"))
+    # 處理中斷（沒有 done 也沒有 release），processing_ttl 後重送的事件可再處理
+    clock.now += 61
+    assert not deduper.is_duplicate(make_event("E1", redelivery=True))
+
+
+def test_done_event_expires_after_ttl(make_deduper, clock):
+    deduper = make_deduper()
+    event = make_event("E1")
+    deduper.is_duplicate(event)
+    deduper.done(event)
+    clock.now += 3601
+    assert not deduper.is_duplicate(event)
+
+
+def test_missing_id_is_never_duplicate(make_deduper, clock):
+    deduper = make_deduper()
+    event = make_event(None)
+    assert not deduper.is_duplicate(event)
+    deduper.done(event)
+    assert not deduper.is_duplicate(event)
+    assert deduper.stats()["missing_id"] == 2
+
+
+def test_shared_between_workers(tmp_path, clock):
+    db_path = str(tmp_path / "events.db")
+    a = EventDeduper(db_path=db_path, processing_ttl=60)
+    b = EventDeduper(db_path=db_path, processing_ttl=60)
+    event = make_event("E1")
+    assert not a.is_duplicate(event)
+    assert b.is_duplicate(make_event("E1", redelivery=True))
+    # a 處理失敗後，重送落在 b 也會被處理
+    a.release(event)
+    assert not b.is_duplicate(make_event("E1", redelivery=True))
+    b.done(event)
+    clock.now += 600
+    assert a.is_duplicate(make_event("E1", redelivery=True))
+
+
+def test_old_schema_is_migrated(tmp_path, clock):
+    db_path = str(tmp_path / "events.db")
+    db = sqlite3.connect(db_path)
+    db.execute("CREATE TABLE webhook_events (event_id TEXT PRIMARY KEY, seen_at REAL NOT NULL)")
+    db.execute("INSERT INTO webhook_events VALUES ('E1', ?)", (clock.now,))
+    db.commit()
+    db.close()
+    deduper = EventDeduper(db_path=db_path, processing_ttl=60)
+    assert deduper.is_duplicate(make_event("E1"))
+    # 舊紀錄視為處理中，processing_ttl 後可再處理
+    clock.now += 61
+    assert not deduper.is_duplicate(make_event("E1"))
@@ -0,0 +1,178 @@
+import json, time, sqlite3, threading
+import pytest
+from jobs import Job, JobQueue, STATUS_QUEUED, STATUS_RUNNING, STATUS_DONE, STATUS_FAILED
+
+
+class Collector:
+    """deliver callback：記下送出的結果"""
+
+    def __init__(self):
+        self.results = []
+        self.done = threading.Event()
+
+    def __call__(self, job, messages, event):
+        self.results.append((job.id, job.name, messages))
+        self.done.set()
+
+
+def make_queue(db_path, deliver=None, **kwargs):
+    queue = JobQueue(str(db_path), deliver=deliver or Collector(), workers=2, **kwargs)
+    queue.register("echo", lambda payload: [payload["text"]], pool="default")
+    return queue
+
+
+def insert_row(db_path, status, lease_until, attempts=0, owner="dead-worker", name="echo"):
+    """模擬其他 process 留下的工作"""
+    db = sqlite3.connect(str(db_path), isolation_level=None)
+    now = time.time()
+    cursor = db.execute(
+        "INSERT INTO jobs (name, priority, target, payload, status, attempts, created_at, updated_at, owner, lease_until) "
+        "VALUES (?, 5, 'U1', ?, ?, ?, ?, ?, ?, ?)",
+        (name, json.dumps({"text": "hi"}), status, attempts, now, now, owner, lease_until))
+    db.close()
+    return cursor.lastrowid
+
+
+def row(db_path, job_id):
+    db = sqlite3.connect(str(db_path))
+    try:
+        return db.execute("SELECT status, owner, attempts FROM jobs WHERE id = ?", (job_id,)).fetchone()
+    finally:
+        db.close()
+
+
+def stop_all(*queues):
+    for queue in queues:
+        queue.stop(timeout=2)
+
+
+def test_submit_runs_and_marks_done(tmp_path):
+    collector = Collector()
+    queue = make_queue(tmp_path / "jobs.db", collector)
+    try:
+        job_id = queue.submit("echo", {"text": "hello"}, target="U1")
+        assert collector.done.wait(2)
+        assert collector.results == [(job_id, "echo", ["hello"])]
+        deadline = time.time() + 2
+        while row(tmp_path / "jobs.db", job_id)[0] != STATUS_DONE and time.time() < deadline:
+            time.sleep(0.01)
+        status, owner, attempts = row(tmp_path / "jobs.db", job_id)
+        assert (status, owner, attempts) == (STATUS_DONE, queue.owner, 1)
+    finally:
+        stop_all(queue)
+
+
+def test_start_does_not_take_jobs_with_live_lease(tmp_path):
+    """其他 worker 還在處理（lease 未過期）的工作不會被重新排入"""
+    db_path = tmp_path / "jobs.db"
+    make_queue(db_path)  # 建立資料表
+    running = insert_row(db_path, STATUS_RUNNING, time.time() + 60, attempts=1, owner="other")
+    queued = insert_row(db_path, STATUS_QUEUED, time.time() + 60, owner="other")
+
+    collector = Collector()
+    queue = make_queue(db_path, collector)
+    try:
+        queue.start()
+        assert not collector.done.wait(0.3)
+        assert row(db_path, running)[:2] == (STATUS_RUNNING, "other")
+        assert row(db_path, queued)[:2] == (STATUS_QUEUED, "other")
+        assert queue.stats()["recovered"] == 0
+    finally:
+        stop_all(queue)
+
+
+@pytest.mark.parametrize("status", [STATUS_QUEUED, STATUS_RUNNING])
+def test_start_recovers_expired_lease(tmp_path, status):
+    """原本的 worker 已結束（lease 過期或舊版資料沒有 lease）時接手執行，結果直接 push（沒有 event）"""
+    db_path = tmp_path / "jobs.db"
+    make_queue(db_path)
+    expired = insert_row(db_path, status, time.time() - 1, attempts=1 if status == STATUS_RUNNING else 0)
+    legacy = insert_row(db_path, status, None)
+
+    collector = Collector()
+    queue = make_queue(db_path, collector)
+    try:
+        queue.start()
+        deadline = time.time() + 2
+        while len(collector.results) < 2 and time.time() < deadline:
+            time.sleep(0.01)
+        assert sorted(job_id for job_id, _, _ in collector.results) == [expired, legacy]
+        assert queue.stats()["recovered"] == 2
+    finally:
+        stop_all(queue)
+
+
+def test_recover_gives_up_after_max_attempts(tmp_path):
+    db_path = tmp_path / "jobs.db"
+    make_queue(db_path)
+    job_id = insert_row(db_path, STATUS_RUNNING, time.time() - 1, attempts=2)
+    unknown = insert_row(db_path, STATUS_QUEUED, None, name="removed_job")
+
+    queue = make_queue(db_path, max_attempts=2)
+    try:
+        queue.start()
+        assert row(db_path, job_id)[0] == STATUS_FAILED
+        assert row(db_path, unknown)[0] == STATUS_FAILED
+    finally:
+        stop_all(queue)
+
+
+def test_expired_job_is_taken_by_exactly_one_worker(tmp_path):
+    """多個 worker 同時檢查過期工作時，同一個工作只會被一個接手"""
+    db_path = tmp_path / "jobs.db"
+    queues = [make_queue(db_path) for _ in range(4)]
+    job_ids = [insert_row(db_path, STATUS_RUNNING, time.time() - 1, attempts=1) for _ in range(10)]
+
+    barrier = threading.Barrier(len(queues))
+
+    def recover(queue):
+        barrier.wait()
+        queue._recover()
+
+    threads = [threading.Thread(target=recover, args=(queue,)) for queue in queues]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+
+    taken = [job.id for queue in queues for heap in queue._queues.values() for _, _, job in heap]
+    assert sorted(taken) == job_ids
+    owners = {row(db_path, job_id)[1] for job_id in job_ids}
+    assert owners <= {queue.owner for queue in queues}
+
+
+def test_claim_fails_once_another_worker_took_over(tmp_path):
+    """lease 過期被接手後，原本排在記憶體裡的工作不會再執行"""
+    db_path = tmp_path / "jobs.db"
+    original = make_queue(db_path, lease=30)
+    job_id = insert_row(db_path, STATUS_QUEUED, time.time() + 30, owner=original.owner)
+    original._recover()  # lease 未過期：不會重複排入
+    assert not original._queues
+
+    db = sqlite3.connect(str(db_path), isolation_level=None)
+    db.execute("UPDATE jobs SET owner = 'other', lease_until = ? WHERE id = ?", (time.time() + 30, job_id))
+    db.close()
+
+    assert not original._claim(Job(job_id, "echo", 5, "U1", {"text": "hi"}))
+    assert row(db_path, job_id)[:2] == (STATUS_QUEUED, "other")
+
+
+def test_old_schema_is_migrated(tmp_path):
+    db_path = tmp_path / "jobs.db"
+    db = sqlite3.connect(str(db_path), isolation_level=None)
+    db.execute("CREATE TABLE jobs (id INTEGER PRIMARY KEY AUTOINCREMENT, name TEXT NOT NULL, priority INTEGER NOT NULL, "
+               "target TEXT, payload TEXT NOT NULL, status TEXT NOT NULL, attempts INTEGER NOT NULL DEFAULT 0, "
+               "error TEXT, created_at REAL NOT NULL, updated_at REAL NOT NULL)")
+    now = time.time()
+    db.execute("INSERT INTO jobs (name, priority, target, payload, status, created_at, updated_at) "
+               "VALUES ('echo', 5, 'U1', ?, ?, ?, ?)", (json.dumps({"text": "old"}), STATUS_QUEUED, now, now))
+    db.close()
+
+    collector = Collector()
+    queue = make_queue(db_path, collector)
+    try:
+        queue.start()
+        assert collector.done.wait(2)
+        assert collector.results[0][2] == ["old"]
+    finally:
+        stop_all(queue)
@@ -0,0 +1,171 @@
+import threading
+import time
+
+import pytest
+
+from line_delivery import (DeliveryScheduler, PushQuota, QuotaExceededError, TokenBucket,
+                           KIND_PUSH, KIND_REPLY)
+
+
+# ------------------------------
+# TokenBucket
+# ------------------------------
+def test_bucket_allows_burst_then_paces():
+    bucket = TokenBucket(rate=10, burst=3)
+    assert [bucket.reserve() for _ in range(3)] == [0.0, 0.0, 0.0]
+    wait = bucket.reserve()
+    assert 0.05 < wait <= 0.1
+    # 預約是累加的：下一則要再多等一個間隔
+    assert bucket.reserve() == pytest.approx(wait + 0.1, abs=0.02)
+    assert bucket.stats()["throttled"] == 2
+
+
+def test_bucket_refills_over_time():
+    bucket = TokenBucket(rate=100, burst=1)
+    assert bucket.reserve() == 0.0
+    time.sleep(0.03)
+    assert bucket.reserve() == 0.0
+
+
+def test_bucket_penalize_pauses():
+    bucket = TokenBucket(rate=10, burst=10)
+    bucket.penalize(1.0)
+    assert bucket.reserve() == pytest.approx(1.1, abs=0.02)
+
+
+# ------------------------------
+# PushQuota
+# ------------------------------
+@pytest.fixture
+def quota_db(tmp_path):
+    return str(tmp_path / "quota.db")
+
+
+def test_quota_accounting(quota_db):
+    quota = PushQuota(quota_db, monthly_limit=20, reserve=5)
+    assert quota.remaining() == 20
+    quota.record(3)
+    quota.record()
+    assert quota.remaining() == 16
+    assert quota.allow(11)
+    assert not quota.allow(12)
+    assert quota.rejected == 1
+    assert not quota.degraded
+    quota.record(11)
+    assert quota.degraded
+    assert quota.stats()["used"] == 15
+
+
+def test_quota_unlimited(quota_db):
+    quota = PushQuota(quota_db, monthly_limit=None)
+    quota.record(1000)
+    assert quota.remaining() is None
+    assert quota.allow(10 ** 6)
+    assert not quota.degraded
+
+
+def test_quota_sync_and_exhausted(quota_db):
+    quota = PushQuota(quota_db, monthly_limit=200, reserve=10)
+    quota.sync(used=50, quota=500)
+    assert quota.remaining() == 450
+    quota.sync(used=500, quota=500)
+    assert quota.remaining() == 0
+    quota.sync(used=10, quota=500)
+    quota.mark_exhausted()
+    assert quota.remaining() == 0
+    assert quota.stats()["exhausted"]
+
+
+def test_quota_shared_between_workers(quota_db):
+    a = PushQuota(quota_db, monthly_limit=100, refresh_interval=0)
+    b = PushQuota(quota_db, monthly_limit=100, refresh_interval=0)
+    a.record(30)
+    b.record(20)
+    assert a.remaining() == 50
+    assert b.remaining() == 50
+
+
+def test_quota_reads_are_cached(quota_db):
+    quota = PushQuota(quota_db, monthly_limit=100, refresh_interval=60)
+    statements = []
+    quota._db.set_trace_callback(statements.append)
+    for _ in range(50):
+        quota.remaining()
+        quota.degraded
+        quota.allow()
+    assert sum(s.startswith("INSERT") for s in statements) == 1
+    assert sum(s.startswith("SELECT") for s in statements) == 1
+    quota.record(2)
+    assert [s for s in statements if s.startswith("UPDATE")] == [
+        "UPDATE push_quota SET used = used + 2 WHERE month = '%s'" % quota._month()]
+    assert quota.remaining() == 98
+
+
+def test_quota_rolls_over_monthly(quota_db, monkeypatch):
+    month = ["2026-01"]
+    monkeypatch.setattr(PushQuota, "_month", staticmethod(lambda: month[0]))
+    quota = PushQuota(quota_db, monthly_limit=100)
+    quota.record(40)
+    assert quota.remaining() == 60
+    month[0] = "2026-02"
+    assert quota.remaining() == 100
+    assert quota.stats()["month"] == "2026-02"
+
+
+# ------------------------------
+# DeliveryScheduler
+# ------------------------------
+def test_push_records_quota_and_rejects_when_low(quota_db):
+    quota = PushQuota(quota_db, monthly_limit=5, reserve=2)
+    sent = []
+    scheduler = DeliveryScheduler({KIND_REPLY: sent.append, KIND_PUSH: sent.append},
+                                  rates={KIND_REPLY: (100, 100), KIND_PUSH: (100, 100)}, quota=quota, workers=1)
+    try:
+        for i in range(3):
+            scheduler.deliver(KIND_PUSH, "chat", i, timeout=2)
+        with pytest.raises(QuotaExceededError):
+            scheduler.deliver(KIND_PUSH, "chat", 3, timeout=2)
+        # reply 不受 push 額度限制
+        scheduler.deliver(KIND_REPLY, "chat", "r", timeout=2)
+    finally:
+        scheduler.stop(timeout=2)
+    assert sent == [0, 1, 2, "r"]
+    assert quota.remaining() == 2
+
+
+def test_deliver_timeout_cancels_queued_request():
+    release = threading.Event()
+    sent = []
+
+    def sender(request):
+        release.wait(2)
+        sent.append(request)
+
+    scheduler = DeliveryScheduler({KIND_REPLY: sender}, rates={KIND_REPLY: (100, 100)}, workers=1)
+    try:
+        first = scheduler.submit(KIND_REPLY, "chat", "first")
+        with pytest.raises(TimeoutError):
+            scheduler.deliver(KIND_REPLY, "chat", "second", timeout=0.05)
+        release.set()
+        first.result(2)
+    finally:
+        scheduler.stop(timeout=2)
+    assert sent == ["first"]
+
+
+def test_rate_limit_penalizes_bucket():
+    class RateLimited(Exception):
+        status = 429
+
+    def sender(request):
+        raise RateLimited("429 too many requests")
+
+    scheduler = DeliveryScheduler({KIND_REPLY: sender}, rates={KIND_REPLY: (10, 10)}, workers=1)
+    try:
+        with pytest.raises(RateLimited):
+            scheduler.deliver(KIND_REPLY, "chat", "x", timeout=2)
+    finally:
+        scheduler.stop(timeout=2)
+    lane = scheduler.stats()["lanes"][KIND_REPLY]
+    assert lane["rate_limited"] == 1
+    assert lane["bucket"]["tokens"] < 0
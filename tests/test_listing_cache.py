@@ -0,0 +1,91 @@
+import json
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import pytest
+
+from listing_cache import ListingCache
+
+
+class SlowLoader:
+    def __init__(self, value, delay=0.2):
+        self.value = value
+        self.delay = delay
+        self.calls = 0
+        self.started = threading.Event()
+
+    def __call__(self):
+        self.calls += 1
+        self.started.set()
+        time.sleep(self.delay)
+        return self.value
+
+
+@pytest.fixture
+def cache(tmp_path):
+    cache = ListingCache(stale_after=300, snapshot_path=str(tmp_path / "listing.json"), cold_wait=5)
+    yield cache
+    cache.stop()
+
+
+def test_concurrent_cold_gets_wait_for_one_scrape(cache):
+    loader = SlowLoader(["a", "b"])
+    cache.register("hot", loader)
+    with ThreadPoolExecutor(8) as pool:
+        results = list(pool.map(lambda _: cache.get("hot"), range(8)))
+    assert results == [["a", "b"]] * 8
+    assert loader.calls == 1
+    assert cache.stats()["cold_waits"] >= 1
+
+
+def test_cold_wait_is_bounded():
+    cache = ListingCache(cold_wait=0.05)
+    loader = SlowLoader(["late"], delay=0.5)
+    cache.register("hot", loader)
+    first = threading.Thread(target=cache.get, args=("hot",))
+    first.start()
+    assert loader.started.wait(1)
+    started = time.monotonic()
+    assert cache.get("hot") == []
+    assert time.monotonic() - started < 0.4
+    first.join()
+    cache.stop()
+
+
+def test_failed_cold_scrape_returns_empty(cache):
+    cache.register("hot", SlowLoader([], delay=0))
+    assert cache.get("hot") == []
+    assert cache.stats()["refresh_failures"] == 1
+
+
+def test_warm_caller_gets_stale_value_during_refresh(cache):
+    loader = SlowLoader(["old"], delay=0)
+    cache.register("hot", loader)
+    assert cache.get("hot") == ["old"]
+
+    loader.value, loader.delay = ["new"], 0.3
+    cache._entries["hot"].fetched_at -= 600
+    started = time.monotonic()
+    assert cache.get("hot") == ["old"]          # 觸發背景更新，不等待
+    assert time.monotonic() - started < 0.1
+    deadline = time.monotonic() + 2
+    while cache.get("hot") != ["new"] and time.monotonic() < deadline:
+        time.sleep(0.02)
+    assert cache.get("hot") == ["new"]
+
+
+def test_snapshot_survives_restart(tmp_path):
+    path = str(tmp_path / "listing.json")
+    first = ListingCache(snapshot_path=path)
+    first.register("hot", SlowLoader(["a"], delay=0))
+    assert first.get("hot") == ["a"]
+    first.stop()
+    assert json.load(open(path))["entries"]["hot"]["value"] == ["a"]
+
+    second = ListingCache(snapshot_path=path)
+    loader = SlowLoader(["b"], delay=0)
+    second.register("hot", loader)
+    assert second.get("hot") == ["a"]
+    assert loader.calls == 0
+    second.stop()
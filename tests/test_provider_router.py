@@ -0,0 +1,113 @@
+import asyncio
+import threading
+
+import pytest
+
+from provider_router import ProviderRouter
+
+
+def make_router(**kwargs):
+    kwargs.setdefault("default_hedge_delay", 0.05)
+    kwargs.setdefault("max_workers", 4)
+    return ProviderRouter(**kwargs)
+
+
+def scripted(behaviour):
+    """behaviour[backend] = (延遲秒數, 回傳值或 Exception)"""
+    calls = []
+
+    def call(backend, cancel):
+        calls.append(backend)
+        delay, outcome = behaviour[backend]
+        cancel.wait(delay)
+        if isinstance(outcome, Exception):
+            raise outcome
+        return outcome
+
+    return call, calls
+
+
+def test_primary_failure_fails_over():
+    router = make_router()
+    call, calls = scripted({"a": (0, RuntimeError("boom")), "b": (0, "backup")})
+    assert router.complete("a", "b", call) == "backup"
+    assert calls == ["a", "b"]
+    assert router.stats()["failovers"] == 1
+    assert router.stats()["hedges"] == 0
+
+
+def test_slow_primary_is_hedged():
+    router = make_router()
+    call, _ = scripted({"a": (1.0, "primary"), "b": (0, "backup")})
+    assert router.complete("a", "b", call) == "backup"
+    stats = router.stats()
+    assert stats["hedges"] == 1
+    assert stats["hedge_wins"] == 1
+
+
+def test_no_hedge_token_still_fails_over():
+    router = make_router(burst=0.0, max_hedge_ratio=0.0)
+    call, calls = scripted({"a": (0.15, RuntimeError("late")), "b": (0, "backup")})
+    assert router.complete("a", "b", call) == "backup"
+    assert calls == ["a", "b"]
+    stats = router.stats()
+    assert stats["hedges"] == 0
+    assert stats["failovers"] == 1
+
+
+def test_no_hedge_token_waits_for_primary():
+    router = make_router(burst=0.0, max_hedge_ratio=0.0)
+    call, calls = scripted({"a": (0.15, "primary"), "b": (0, "backup")})
+    assert router.complete("a", "b", call) == "primary"
+    assert calls == ["a"]
+
+
+def test_both_fail_raises():
+    router = make_router()
+    call, _ = scripted({"a": (0, RuntimeError("a down")), "b": (0, RuntimeError("b down"))})
+    with pytest.raises(RuntimeError, match="b down"):
+        router.complete("a", "b", call)
+
+
+def test_loser_is_cancelled():
+    router = make_router()
+    cancelled = threading.Event()
+
+    def call(backend, cancel):
+        if backend == "a":
+            if cancel.wait(2):
+                cancelled.set()
+            return "primary"
+        return "backup"
+
+    assert router.complete("a", "b", call) == "backup"
+    assert cancelled.wait(1)
+
+
+def ascripted(behaviour):
+    calls = []
+
+    async def call(backend):
+        calls.append(backend)
+        delay, outcome = behaviour[backend]
+        await asyncio.sleep(delay)
+        if isinstance(outcome, Exception):
+            raise outcome
+        return outcome
+
+    return call, calls
+
+
+def test_async_no_hedge_token_still_fails_over():
+    router = make_router(burst=0.0, max_hedge_ratio=0.0)
+    call, calls = ascripted({"a": (0.15, RuntimeError("late")), "b": (0, "backup")})
+    assert asyncio.run(router.acomplete("a", "b", call)) == "backup"
+    assert calls == ["a", "b"]
+    assert router.stats()["failovers"] == 1
+
+
+def test_async_slow_primary_is_hedged():
+    router = make_router()
+    call, _ = ascripted({"a": (1.0, "primary"), "b": (0, "backup")})
+    assert asyncio.run(router.acomplete("a", "b", call)) == "backup"
+    assert router.stats()["hedge_wins"] == 1
@@ -0,0 +1,91 @@
+import asyncio
+
+import pytest
+
+from resilience import CircuitOpenError, Resilience, STATE_CLOSED, STATE_HALF_OPEN, STATE_OPEN
+
+
+class HTTPError(Exception):
+    def __init__(self, status):
+        super().__init__(f"HTTP {status}")
+        self.status = status
+
+
+def raiser(status):
+    def func():
+        raise HTTPError(status)
+    return func
+
+
+def make_resilience():
+    return Resilience(upstreams=("up",), failure_threshold=3, recovery_timeout=0.05, retry_ratio=0)
+
+
+def test_client_errors_do_not_reset_failures():
+    r = make_resilience()
+    for status in (500, 500, 400, 404, 500):
+        with pytest.raises(HTTPError):
+            r.call("up", raiser(status), retries=0)
+    assert r.breaker("up").state == STATE_OPEN
+    with pytest.raises(CircuitOpenError):
+        r.call("up", lambda: "ok")
+
+
+def test_client_error_during_probe_keeps_breaker_half_open(monkeypatch):
+    r = make_resilience()
+    for _ in range(3):
+        with pytest.raises(HTTPError):
+            r.call("up", raiser(503), retries=0)
+    breaker = r.breaker("up")
+    monkeypatch.setattr(breaker, "recovery_timeout", 0)
+    # 探測請求回 4xx：不關閉熔斷，但下一個請求仍可探測
+    with pytest.raises(HTTPError):
+        r.call("up", raiser(400), retries=0)
+    assert breaker.state == STATE_HALF_OPEN
+    assert r.call("up", lambda: "ok") == "ok"
+    assert breaker.state == STATE_CLOSED
+
+
+def test_async_client_error_is_neutral():
+    async def fail(status):
+        raise HTTPError(status)
+
+    r = make_resilience()
+
+    async def scenario():
+        for status in (500, 500, 422, 500):
+            with pytest.raises(HTTPError):
+                await r.acall("up", fail, status, retries=0)
+
+    asyncio.run(scenario())
+    assert r.breaker("up").state == STATE_OPEN
+
+
+def test_cancelled_probe_releases_half_open_slot(monkeypatch):
+    async def fail():
+        raise HTTPError(503)
+
+    async def hang():
+        await asyncio.sleep(10)
+
+    async def ok():
+        return "ok"
+
+    r = make_resilience()
+    breaker = r.breaker("up")
+
+    async def scenario():
+        for _ in range(3):
+            with pytest.raises(HTTPError):
+                await r.acall("up", fail, retries=0)
+        monkeypatch.setattr(breaker, "recovery_timeout", 0)
+        probe = asyncio.ensure_future(r.acall("up", hang, retries=0))
+        await asyncio.sleep(0.01)
+        probe.cancel()
+        with pytest.raises(asyncio.CancelledError):
+            await probe
+        assert breaker.state == STATE_HALF_OPEN
+        return await r.acall("up", ok)
+
+    assert asyncio.run(scenario()) == "ok"
+    assert breaker.state == STATE_CLOSED
@@ -0,0 +1,108 @@
+import os
+from types import SimpleNamespace
+
+import streaming
+from metrics import metrics
+
+FIXTURE = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))),
+                       "bench", "fixtures", "deepseek_reply.txt")
+
+
+def chunk(content=None, usage=None, x_groq=None):
+    choices = [SimpleNamespace(delta=SimpleNamespace(content=content))] if content is not None else []
+    return SimpleNamespace(choices=choices, usage=usage, x_groq=x_groq)
+
+
+class FakeStream:
+    def __init__(self, chunks):
+        self.chunks = chunks
+        self.closed = False
+
+    def __iter__(self):
+        return iter(self.chunks)
+
+    def close(self):
+        self.closed = True
+
+
+def fake_client(chunks):
+    stream = FakeStream(chunks)
+    create = lambda **kwargs: stream
+    return SimpleNamespace(chat=SimpleNamespace(completions=SimpleNamespace(create=create))), stream
+
+
+def token_count(model, kind):
+    return metrics.tokens.value("groq", model, kind)
+
+
+def test_stream_records_groq_usage_from_final_chunk():
+    usage = SimpleNamespace(prompt_tokens=60, completion_tokens=12)
+    client, stream = fake_client([chunk("你好"), chunk("！"), chunk(x_groq=SimpleNamespace(id="x", usage=usage))])
+    before = token_count("usage-model", "prompt"), token_count("usage-model", "completion")
+    assert streaming.stream_chat(client, [], "usage-model") == "你好！"
+    assert stream.closed
+    assert token_count("usage-model", "prompt") - before[0] == 60
+    assert token_count("usage-model", "completion") - before[1] == 12
+
+
+def test_collector_reads_openai_style_usage():
+    collector = streaming.VisibleCollector()
+    collector.feed_chunk(chunk("hi"))
+    collector.feed_chunk(chunk(usage={"prompt_tokens": 3, "completion_tokens": 1}))
+    assert collector.usage == {"prompt_tokens": 3, "completion_tokens": 1}
+    assert collector.text() == "hi"
+
+
+def feed_all(parts):
+    think = streaming.ThinkFilter()
+    return "".join(think.feed(part) for part in parts) + think.flush()
+
+
+def test_think_block_removed_in_one_chunk():
+    assert feed_all(["<think>推理</think>答案"]) == "答案"
+
+
+def test_tags_split_across_chunks():
+    assert feed_all(["前言<th", "ink>推理</thi", "nk>答案"]) == "前言答案"
+    assert feed_all(["<", "t", "h", "i", "n", "k", ">", "x", "<", "/", "think", ">", "ok"]) == "ok"
+
+
+def test_think_block_across_many_chunks():
+    with open(FIXTURE, encoding="utf-8") as f:
+        reply = f.read()
+    parts = [reply[i:i + 7] for i in range(0, len(reply), 7)]
+    visible = feed_all(parts)
+    assert "<think>" not in visible and "象山步道" in visible
+    assert visible.strip().startswith("今天如果沒下雨很適合喔")
+
+
+def test_unclosed_think_is_dropped_at_flush():
+    assert feed_all(["答案<think>還在想"]) == "答案"
+
+
+def test_partial_tag_at_flush_is_text():
+    assert feed_all(["a < b <thi"]) == "a < b <thi"
+
+
+def test_cut_keeps_text_of_exact_length():
+    assert streaming.cut_at_sentence("一二三四五", 5) == "一二三四五"
+    assert streaming.cut_at_sentence("一二三四", 5) == "一二三四"
+
+
+def test_cut_at_sentence_end():
+    text = "第一句話。第二句話比較長一點！第三句"
+    assert streaming.cut_at_sentence(text, 16) == "第一句話。第二句話比較長一點！"
+    assert streaming.cut_at_sentence(text, 9) == "第一句話。"
+
+
+def test_cut_without_sentence_end_adds_ellipsis():
+    assert streaming.cut_at_sentence("一二三四五六七八九十", 6) == "一二三四五六…"
+    # 句尾太前面（不到一半）時也硬切
+    assert streaming.cut_at_sentence("好。一二三四五六七八", 8) == "好。一二三四五六…"
+
+
+def test_collector_truncates_at_max_chars():
+    client, stream = fake_client([chunk("<think>想一想</think>"), chunk("第一句話說完了。"), chunk("第二句話很長很長很長"),
+                                  chunk("不該讀到")])
+    assert streaming.stream_chat(client, [], "truncate-model", max_chars=10) == "第一句話說完了。"
+    assert stream.closed
@@ -0,0 +1,20 @@
+import capture
+import tracing
+
+
+def test_chat_id_is_hashed_in_output():
+    trace = tracing.Trace("event", chat_id="U" + "a" * 32, event_type="MessageEvent")
+    attrs = trace.to_dict()["attrs"]
+    assert attrs["chat_id"] != "U" + "a" * 32
+    assert attrs["chat_id"].startswith("U") and len(attrs["chat_id"]) == 33
+    assert attrs["event_type"] == "MessageEvent"
+    # 原始 id 只留在記憶體
+    assert trace.attrs["chat_id"] == "U" + "a" * 32
+
+
+def test_hash_matches_capture_with_same_salt(monkeypatch):
+    monkeypatch.setattr(tracing, "_salt", b"shared-salt")
+    recorder = capture.TrafficCapture(path=None, salt="shared-salt")
+    for value in ("Cdeadbeef", "1234567890", "_"):
+        assert tracing.hash_id(value) == recorder.hash_id(value)
+    assert tracing.hash_id(None) is None
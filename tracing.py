@@ -0,0 +1,337 @@
+"""
+每個事件從 webhook 抵達到送出 LINE 回覆的追蹤（trace / span）。
+
+/metrics 只有彙總數字；使用者抱怨「狗蛋 40 秒才回」時要看的是那一次卡在哪一段。
+每個事件一個 Trace，依序記錄：
+
+  - verify_signature / parse : callback 驗證簽名、解析 webhook（同一 webhook 的事件共用）
+  - queue_wait               : 排在 event_dispatcher（或 asyncio runner）等待的時間
+  - route / command          : handle_message 判斷指令、執行指令
+  - 上游呼叫                  : resilience 的每次嘗試（groq、openai、google_cse …）、playwright、scrape
+  - job                      : 排入 job_queue 的慢指令在背景 worker 執行的時間
+  - send_response            : 送出回覆（reply / push）
+
+Trace 跟著事件走（event._trace，與 event._deadline 相同），dispatch_event / job worker 取出後啟用；
+LINE 送出執行緒、hedge 執行緒則在排入時複製 contextvars，span 會掛回同一個 Trace。
+所有持有者都結束後 Trace 才算完成，最慢的 TRACE_KEEP 筆保留在記憶體（/traces），
+可選擇另外寫到 TRACE_EXPORT_PATH（JSON lines，由背景執行緒寫出，佇列滿時丟棄）。
+輸出（/traces 與匯出檔）中的聊天室 id 以 HMAC-SHA256 雜湊，與 capture.py 相同的格式；
+TRACE_SALT 未設定時沿用 CAPTURE_SALT，兩者相同時 trace 與錄製檔的 id 可以互相對應。
+
+    with tracing.span("google_search", query=query):
+        ...
+"""
+import os, hmac, json, time, uuid, heapq, queue, atexit, hashlib, secrets, itertools, threading, contextvars
+from contextlib import contextmanager
+from app_logging import get_logger
+
+TRACE_ENABLED = os.getenv("TRACE_ENABLED", "1") == "1"
+TRACE_KEEP = int(os.getenv("TRACE_KEEP", "50"))
+TRACE_EXPORT_PATH = os.getenv("TRACE_EXPORT_PATH")                 # 未設定時不寫檔
+TRACE_EXPORT_MIN_MS = float(os.getenv("TRACE_EXPORT_MIN_MS", "0"))  # 只匯出超過此耗時的 trace
+TRACE_MAX_SPANS = 200
+TRACE_SALT = os.getenv("TRACE_SALT") or os.getenv("CAPTURE_SALT")  # 未設定時每次啟動隨機產生
+HASHED_ATTRS = frozenset(("chat_id",))
+
+logger = get_logger("tracing")
+
+_salt = (TRACE_SALT or secrets.token_hex(16)).encode()
+
+# (Trace, 目前 span 的 id)
+_current = contextvars.ContextVar("trace", default=None)
+_span_ids = itertools.count(1)
+
+
+class Span:
+    __slots__ = ("id", "parent", "name", "start", "end", "attrs", "thread")
+
+    def __init__(self, name, parent, start, attrs):
+        self.id = next(_span_ids)
+        self.parent = parent
+        self.name = name
+        self.start = start
+        self.end = None
+        self.attrs = attrs
+        self.thread = threading.current_thread().name
+
+    def set(self, **attrs):
+        self.attrs.update(attrs)
+
+
+class Trace:
+    """
+    name  : trace 名稱（webhook 的事件為 "event"）
+    start : time.perf_counter() 的起點（預設為現在）
+    """
+
+    def __init__(self, name, start=None, tracer=None, **attrs):
+        self.id = uuid.uuid4().hex[:16]
+        self.name = name
+        self.start = time.perf_counter() if start is None else start
+        self.wall_start = time.time() - (time.perf_counter() - self.start)
+        self.attrs = attrs
+        self.spans = []
+        self.dropped_spans = 0
+        self.queued_at = None
+        self.end = None
+        self.tracer = tracer
+        self._lock = threading.Lock()
+        self._holders = 0
+
+    def fork(self, name, **attrs):
+        """以相同起點與已完成的 span 建立新的 trace（同一 webhook 的每個事件各自一個）"""
+        child = Trace(name, start=self.start, tracer=self.tracer, **{**self.attrs, **attrs})
+        with self._lock:
+            child.spans = list(self.spans)
+        child.queued_at = time.perf_counter()
+        return child
+
+    def add(self, span):
+        with self._lock:
+            if len(self.spans) >= TRACE_MAX_SPANS:
+                self.dropped_spans += 1
+                return
+            self.spans.append(span)
+
+    def hold(self):
+        with self._lock:
+            self._holders += 1
+
+    def release(self):
+        with self._lock:
+            self._holders -= 1
+            if self._holders > 0 or self.end is not None:
+                return
+            self.end = time.perf_counter()
+        if self.tracer is not None:
+            self.tracer.finish(self)
+
+    @property
+    def duration(self):
+        return (self.end or time.perf_counter()) - self.start
+
+    def to_dict(self):
+        with self._lock:
+            spans = sorted(self.spans, key=lambda s: s.start)
+        return {
+            "trace_id": self.id,
+            "name": self.name,
+            "start": round(self.wall_start, 3),
+            "duration_ms": _ms(self.duration),
+            "attrs": {key: hash_id(value) if key in HASHED_ATTRS else value for key, value in self.attrs.items()},
+            "dropped_spans": self.dropped_spans,
+            "spans": [{
+                "id": s.id,
+                "parent": s.parent,
+                "name": s.name,
+                "offset_ms": _ms(s.start - self.start),
+                "duration_ms": _ms((s.end or time.perf_counter()) - s.start),
+                "thread": s.thread,
+                **({"attrs": s.attrs} if s.attrs else {}),
+            } for s in spans],
+        }
+
+
+def _ms(seconds):
+    return round(seconds * 1000, 2)
+
+
+def hash_id(value):
+    """保留開頭字母與長度的 HMAC（與 capture.TrafficCapture.hash_id 相同）"""
+    if not isinstance(value, str) or not value:
+        return value
+    digest = hmac.new(_salt, value.encode(), hashlib.sha256).hexdigest()
+    if value.isdigit():
+        return str(int(digest, 16))[:len(value)]
+    if value[0].isalpha() and len(value) > 1:
+        return value[0] + (digest * 2)[:len(value) - 1]
+    return (digest * 2)[:len(value)]
+
+
+class Tracer:
+    """
+    keep         : 保留最慢的幾筆 trace
+    export_path  : 完成的 trace 以 JSON lines 附加寫入此檔（None 代表不寫檔）
+    export_min_ms: 只匯出超過此耗時的 trace
+    """
+
+    def __init__(self, keep=TRACE_KEEP, export_path=TRACE_EXPORT_PATH, export_min_ms=TRACE_EXPORT_MIN_MS,
+                 enabled=TRACE_ENABLED, queue_size=1000):
+        self.keep = keep
+        self.enabled = enabled
+        self.export_path = export_path
+        self.export_min_ms = export_min_ms
+        self._lock = threading.Lock()
+        self._slowest = []              # min-heap: (duration, seq, trace dict)
+        self._seq = itertools.count()
+        self.finished = 0
+        self.exported = 0
+        self.export_dropped = 0
+        self._export_queue = None
+        if export_path:
+            self._export_queue = queue.Queue(maxsize=queue_size)
+            threading.Thread(target=self._export_loop, name="trace-export", daemon=True).start()
+            atexit.register(self._flush)
+
+    def begin(self, name, **attrs):
+        """建立 trace；停用時回傳 None（之後的 span 都是 no-op）"""
+        if not self.enabled:
+            return None
+        return Trace(name, tracer=self, **attrs)
+
+    def finish(self, trace):
+        duration = trace.duration
+        entry = None
+        with self._lock:
+            self.finished += 1
+            if len(self._slowest) < self.keep or duration > self._slowest[0][0]:
+                entry = trace.to_dict()
+                item = (duration, next(self._seq), entry)
+                if len(self._slowest) < self.keep:
+                    heapq.heappush(self._slowest, item)
+                else:
+                    heapq.heapreplace(self._slowest, item)
+        if self._export_queue is not None and duration * 1000 >= self.export_min_ms:
+            try:
+                self._export_queue.put_nowait(entry or trace.to_dict())
+            except queue.Full:
+                with self._lock:
+                    self.export_dropped += 1
+
+    def slowest(self, limit=None):
+        with self._lock:
+            items = sorted(self._slowest, key=lambda item: item[0], reverse=True)
+        return [entry for _, _, entry in items[:limit]]
+
+    def reset(self):
+        with self._lock:
+            self._slowest = []
+
+    def stats(self):
+        with self._lock:
+            return {
+                "enabled": self.enabled,
+                "finished": self.finished,
+                "kept": len(self._slowest),
+                "slowest_ms": _ms(max(self._slowest)[0]) if self._slowest else None,
+                "export_path": self.export_path,
+                "exported": self.exported,
+                "export_dropped": self.export_dropped,
+            }
+
+    def _export_loop(self):
+        while True:
+            entry = self._export_queue.get()
+            try:
+                with open(self.export_path, "a", encoding="utf-8") as f:
+                    f.write(json.dumps(entry, ensure_ascii=False, default=str) + "\n")
+                    # 佇列裡累積的一併寫出，少開幾次檔
+                    while True:
+                        try:
+                            f.write(json.dumps(self._export_queue.get_nowait(), ensure_ascii=False, default=str) + "\n")
+                            self.exported += 1
+                        except queue.Empty:
+                            break
+                self.exported += 1
+            except OSError as e:
+                logger.warning("trace 匯出失敗", path=self.export_path, error=e)
+
+    def _flush(self, timeout=1.0):
+        deadline = time.monotonic() + timeout
+        while not self._export_queue.empty() and time.monotonic() < deadline:
+            time.sleep(0.01)
+
+
+# ------------------------------
+# context
+# ------------------------------
+def current_trace():
+    current = _current.get()
+    return current[0] if current else None
+
+
+@contextmanager
+def scope(trace):
+    """在 with 區塊內把 trace 設為目前的 trace（不影響 trace 何時完成）"""
+    if trace is None:
+        yield None
+        return
+    token = _current.set((trace, None))
+    try:
+        yield trace
+    finally:
+        _current.reset(token)
+
+
+@contextmanager
+def activate(trace, held=False):
+    """
+    在 with 區塊內啟用 trace，結束時釋放；所有持有者都釋放後 trace 完成。
+    held=True 代表呼叫端已先 hold()（例如排入 job_queue 時）。
+    """
+    if trace is None:
+        yield None
+        return
+    if not held:
+        trace.hold()
+    try:
+        with scope(trace):
+            yield trace
+    finally:
+        trace.release()
+
+
+@contextmanager
+def span(name, **attrs):
+    """記錄一段耗時；沒有啟用中的 trace 時不做任何事"""
+    current = _current.get()
+    if current is None:
+        yield None
+        return
+    trace, parent = current
+    s = Span(name, parent, time.perf_counter(), attrs)
+    token = _current.set((trace, s.id))
+    try:
+        yield s
+    except BaseException as e:
+        s.attrs["error"] = type(e).__name__
+        raise
+    finally:
+        s.end = time.perf_counter()
+        _current.reset(token)
+        trace.add(s)
+
+
+def record(name, start, end=None, **attrs):
+    """補記一段已經發生的耗時（例如排隊時間）"""
+    current = _current.get()
+    if current is None:
+        return
+    trace, parent = current
+    s = Span(name, parent, start, attrs)
+    s.end = time.perf_counter() if end is None else end
+    trace.add(s)
+
+
+def annotate(**attrs):
+    """在目前的 trace 加上屬性（例如 handle_message 判斷出的 command）"""
+    trace = current_trace()
+    if trace is not None:
+        trace.attrs.update(attrs)
+
+
+# ------------------------------
+# 事件
+# ------------------------------
+def attach_trace(event, trace):
+    # SDK 的事件是 pydantic v1 model，不能直接指定未宣告的欄位（同 deadline.set_event_attr）
+    object.__setattr__(event, "_trace", trace)
+    return trace
+
+
+def trace_of(event):
+    return getattr(event, "_trace", None)
+
+
+# 全 process 共用
+tracer = Tracer()
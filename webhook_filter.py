@@ -0,0 +1,93 @@
+"""
+Webhook 前置過濾：驗證簽名後先看原始 JSON，只替會處理的事件建立 linebot v3 的 pydantic model。
+
+忙碌的群組裡大部分訊息是不含「狗蛋」的閒聊，原本每則都完整解析成 SDK model，
+最後才在 handle_message 深處被丟掉。這裡依事件類型、來源與文字（CommandRouter.route）先判斷：
+
+  - message / text   : route() 回傳 None（群組閒聊）就丟掉
+  - message / audio  : 保留（語音轉文字）
+  - 其他 message     : handle_message 只處理文字，丟掉
+  - postback / follow: 保留；其餘事件類型沒有 handler，丟掉
+
+判斷規則與 handle_message 相同（is_group 只看 source.type == "group"）。
+
+    events = webhook_filter.parse(body, signature)
+"""
+import json, threading
+from linebot.v3.exceptions import InvalidSignatureError
+from linebot.v3.webhooks import Event
+import tracing
+from app_logging import get_logger
+
+HANDLED_EVENT_TYPES = ("message", "postback", "follow")
+HANDLED_MESSAGE_TYPES = ("text", "audio")
+
+logger = get_logger("webhook_filter")
+
+
+def is_actionable(raw_event, router):
+    """原始事件（dict）是否會被 bot 處理"""
+    event_type = raw_event.get("type")
+    if event_type not in HANDLED_EVENT_TYPES:
+        return False
+    if event_type != "message":
+        return True
+    message = raw_event.get("message") or {}
+    message_type = message.get("type")
+    if message_type not in HANDLED_MESSAGE_TYPES:
+        return False
+    if message_type == "audio":
+        return True
+    is_group = (raw_event.get("source") or {}).get("type") == "group"
+    text = (message.get("text") or "").strip().lower()
+    return router.route(text, is_group=is_group) is not None
+
+
+class WebhookFilter:
+    """
+    parser : linebot.v3 WebhookParser（使用它的簽名驗證）
+    router : command_router.CommandRouter
+    """
+
+    def __init__(self, parser, router):
+        self.parser = parser
+        self.router = router
+        self._lock = threading.Lock()
+        self.webhooks = 0
+        self.events = 0
+        self.dropped = 0
+
+    def parse(self, body, signature):
+        """驗證簽名並回傳需要處理的事件（SDK model）；簽名錯誤時丟 InvalidSignatureError"""
+        with tracing.span("verify_signature"):
+            valid = self.parser.signature_validator.validate(body, signature)
+        if not valid:
+            raise InvalidSignatureError("Invalid signature. signature=" + signature)
+
+        with tracing.span("parse") as s:
+            raw_events = json.loads(body).get("events", [])
+            events = []
+            for raw_event in raw_events:
+                if not is_actionable(raw_event, self.router):
+                    continue
+                try:
+                    events.append(Event.from_dict(raw_event))
+                except ValueError as e:
+                    logger.warning("無法解析的 webhook 事件", event_type=raw_event.get("type"), error=e)
+            if s is not None:
+                s.set(events=len(raw_events), kept=len(events))
+
+        with self._lock:
+            self.webhooks += 1
+            self.events += len(raw_events)
+            self.dropped += len(raw_events) - len(events)
+        return events
+
+    def stats(self):
+        with self._lock:
+            return {
+                "webhooks": self.webhooks,
+                "events": self.events,
+                "dropped": self.dropped,
+                "drop_rate": round(self.dropped / self.events, 4) if self.events else 0.0,
+            }